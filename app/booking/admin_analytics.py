@@ -0,0 +1,378 @@
+"""
+Queries behind the admin dashboard's analytics endpoints: /api/admin/stats,
+/reservas, /clients, /analytics/funnel and /analytics/activity.
+
+One statement per endpoint, written so the planner can use the index pack
+from migration 0107_analytics_indexes:
+
+  • dates are half-open ranges on the bare column (fecha, recorded_at,
+    first_seen_at), never EXTRACT(...) or another function of it;
+  • the year stats are a single GROUPING SETS aggregate (month, status,
+    source and the grand total) over the covering fecha index, with the
+    "active booking" figures as FILTER clauses instead of separate queries;
+  • name / phone / email search stays ILIKE '%term%', which the pg_trgm GIN
+    indexes answer with a bitmap OR instead of a sequential scan;
+  • /reservas pages on the keyset (fecha, hora, id) rather than one big
+    LIMIT, and selects only the columns asked for with fields=;
+  • the funnel counts sessions from booking_visitor_session_state (kept by
+    a trigger, migration 0105) rather than grouping every visitor event;
+  • the activity feed takes its newest `limit` events off the recorded_at
+    index before joining the tracked links.
+
+The endpoints keep their response shapes; formatting that depends on the
+router (pagos normalisation) stays there.
+"""
+import base64
+import json
+from datetime import MAXYEAR, MINYEAR, date, time
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.db.connection import get_connection
+
+TABLE = "all_appointments"
+
+# Rows per query when a /reservas export is streamed.
+EXPORT_PAGE_SIZE = 1000
+
+# A booking that counts towards revenue in the stats: anything not
+# cancelled or rejected, including rows without a status.
+ACTIVE_BOOKING = "(status IS NULL OR status NOT IN ('cancelled','rejected','cancelada','rechazada'))"
+
+# GROUPING(mes, status, source) for each grouping set (bit set = not grouped).
+_BY_MONTH, _BY_STATUS, _BY_SOURCE, _TOTAL = 0b011, 0b101, 0b110, 0b111
+
+# Columns GET /reservas can return, in response order, with the SQL for
+# each. fields= picks a subset; the JSONB ones (extras_json, pagos,
+# descuentos) are most of a row's size, so list views that don't show them
+# leave them to GET /reservas/{id}.
+RESERVA_FIELDS = {
+    "id": "id", "source": "source", "source_id": "source_id", "appointment_id": "appointment_id",
+    "fecha": "fecha", "hora": "hora", "nombre_cliente": "nombre_cliente", "email": "email",
+    "telefono": "telefono", "servicio": "servicio", "num_personas": "num_personas",
+    "num_adultos": "num_adultos", "num_ninos": "num_ninos",
+    "nombre_adultos": "nombre_adultos", "nombre_ninos": "nombre_ninos",
+    "ingreso_reserva": "ingreso_reserva", "ingreso_extras": "ingreso_extras",
+    "ingreso_total": "ingreso_total",
+    "has_flex": "has_flex", "flex_amount": "COALESCE(flex_amount,0) AS flex_amount",
+    "costo_operativo_fijo": "costo_operativo_fijo",
+    "costo_operativo_variable": "costo_operativo_variable",
+    "costo_operativo_total": "costo_operativo_total",
+    "ciudad_origen": "ciudad_origen", "como_supieron": "como_supieron",
+    "clima_del_dia": "clima_del_dia", "categoria_clientes": "categoria_clientes",
+    "tipo_clientes": "tipo_clientes", "quien_atendio": "quien_atendio",
+    "status": "status", "tiene_cruce": "tiene_cruce", "extras_json": "extras_json",
+    "observaciones": "observaciones", "payment_id": "payment_id", "payment_status": "payment_status",
+    "pagos": "COALESCE(pagos, '[]'::jsonb) AS pagos",
+    "descuentos": "COALESCE(descuentos, '[]'::jsonb) AS descuentos",
+    "created_at": "created_at", "updated_at": "updated_at",
+}
+# The keyset: always returned, whatever fields= asks for.
+RESERVA_KEY_FIELDS = ("id", "fecha", "hora")
+RESERVA_ORDER = "fecha DESC, hora DESC NULLS LAST, id DESC"
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """fields= ("id,fecha,pagos") → column names in response order, or None
+    for all of them. Raises ValueError naming any unknown field."""
+    if not fields:
+        return None
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = sorted(wanted - RESERVA_FIELDS.keys())
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    wanted.update(RESERVA_KEY_FIELDS)
+    return [f for f in RESERVA_FIELDS if f in wanted]
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Opaque page cursor for the row a page ended on."""
+    key = [row["fecha"].isoformat(), row["hora"].isoformat() if row["hora"] else None, row["id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """(fecha, hora, id) from encode_cursor(); ValueError if it isn't one."""
+    try:
+        fecha, hora, rid = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return date.fromisoformat(fecha), time.fromisoformat(hora) if hora else None, int(rid)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+def _after_clause(fecha: date, hora: Optional[time], rid: int) -> tuple:
+    """Rows after (fecha, hora, id) in RESERVA_ORDER, where NULL hora sorts
+    last within a day."""
+    if hora is None:
+        return "(fecha < %s OR (fecha = %s AND hora IS NULL AND id < %s))", [fecha, fecha, rid]
+    return ("(fecha < %s OR (fecha = %s AND (hora < %s OR hora IS NULL OR (hora = %s AND id < %s))))",
+            [fecha, fecha, hora, hora, rid])
+
+
+def _search_clause(search: str) -> tuple:
+    """ILIKE on name, phone and email — each served by its trigram index."""
+    s = f"%{search}%"
+    return "(nombre_cliente ILIKE %s OR telefono ILIKE %s OR email ILIKE %s)", [s, s, s]
+
+
+# ── Stats ─────────────────────────────────────────────────────────────────────
+
+STATS_QUERY = f"""
+    SELECT GROUPING(mes, status, source) AS grp, mes, status, source,
+           COUNT(*)                                            AS n_all,
+           COUNT(*) FILTER (WHERE active)                      AS n_reservas,
+           SUM(ingreso_total) FILTER (WHERE active)            AS ingresos,
+           SUM(ingreso_extras) FILTER (WHERE active)           AS extras,
+           SUM(costo_operativo_total) FILTER (WHERE active)    AS costos,
+           SUM(ingreso_total - COALESCE(costo_operativo_total,0))
+               FILTER (WHERE active)                           AS margen,
+           AVG(ingreso_total) FILTER (WHERE active)            AS avg_reserva,
+           AVG(num_personas::float) FILTER (WHERE active)      AS avg_personas
+    FROM (
+        SELECT EXTRACT(MONTH FROM fecha)::int AS mes, status, source,
+               ingreso_total, ingreso_extras, costo_operativo_total, num_personas,
+               {ACTIVE_BOOKING} AS active
+        FROM {TABLE}
+        WHERE fecha >= %s AND fecha < %s
+    ) y
+    GROUP BY GROUPING SETS ((mes), (status), (source), ())
+    ORDER BY grp, mes, status, source
+"""
+
+
+def year_stats(year: int) -> Dict[str, Any]:
+    """Monthly revenue, status / source breakdown and totals for one year."""
+    rows = []
+    if MINYEAR <= year < MAXYEAR:  # otherwise there are no such dates to count
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(STATS_QUERY, (date(year, 1, 1), date(year + 1, 1, 1)))
+                rows = cur.fetchall()
+
+    monthly, by_status, by_source = [], {}, {}
+    totals = {"total_reservas": 0, "total_ingresos": 0.0, "avg_reserva": 0.0, "avg_personas": 0}
+    for grp, mes, status, source, n_all, n, ingresos, extras, costos, margen, avg_res, avg_pers in rows:
+        if grp == _BY_MONTH:
+            # Months whose bookings were all cancelled don't get a row.
+            if n:
+                monthly.append({"mes": int(mes), "n_reservas": int(n),
+                                "ingresos": float(ingresos or 0), "extras": float(extras or 0),
+                                "costos": float(costos or 0), "margen": float(margen or 0)})
+        elif grp == _BY_STATUS:
+            by_status[status or "sin estado"] = int(n_all)
+        elif grp == _BY_SOURCE:
+            by_source[source or "desconocido"] = int(n_all)
+        elif grp == _TOTAL:
+            totals = {
+                "total_reservas": int(n or 0),
+                "total_ingresos": float(ingresos or 0),
+                "avg_reserva": float(avg_res or 0),
+                "avg_personas": float(avg_pers or 0) if avg_pers else 0,
+            }
+    return {"monthly": monthly, "by_status": by_status, "by_source": by_source, **totals}
+
+
+# ── Reservations list ─────────────────────────────────────────────────────────
+
+def reservas_query(
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    status: Optional[str] = None,
+    source: Optional[str] = None,
+    search: Optional[str] = None,
+    columns: Optional[List[str]] = None,
+    after: Optional[str] = None,
+) -> tuple:
+    """SQL and params (without the LIMIT value) for the filtered list:
+    `columns` from parse_fields() (None = all), starting after the `after`
+    cursor. The keyset predicate is a range on fecha, so every page is an
+    index range scan, not an OFFSET past the earlier ones."""
+    wheres, params = [], []
+    if desde:
+        wheres.append("fecha >= %s"); params.append(desde)
+    if hasta:
+        wheres.append("fecha <= %s"); params.append(hasta)
+    if status and status != "all":
+        wheres.append("status = %s"); params.append(status)
+    if source and source != "all":
+        wheres.append("source = %s"); params.append(source)
+    if search:
+        clause, search_params = _search_clause(search)
+        wheres.append(clause); params += search_params
+    if after:
+        clause, after_params = _after_clause(*decode_cursor(after))
+        wheres.append(clause); params += after_params
+    where_sql = ("WHERE " + " AND ".join(wheres)) if wheres else ""
+    select = ", ".join(RESERVA_FIELDS[c] for c in (columns or RESERVA_FIELDS))
+    return f"""
+        SELECT {select}
+        FROM {TABLE}
+        {where_sql}
+        ORDER BY {RESERVA_ORDER}
+        LIMIT %s
+    """, params
+
+
+def list_reservas(limit: int, **filters: Any) -> tuple:
+    """One page of raw row dicts, newest first, and the cursor of the next
+    page (None on the last one). Filters are reservas_query()'s."""
+    sql, params = reservas_query(**filters)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params + [limit + 1])
+            cols = [d[0] for d in cur.description]
+            rows = [dict(zip(cols, row)) for row in cur.fetchall()]
+    if len(rows) > limit:
+        del rows[limit:]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def iter_reservas(page_size: int = EXPORT_PAGE_SIZE, **filters: Any) -> Iterator[List[Dict[str, Any]]]:
+    """Every matching row, a page at a time, for streamed exports. Each page
+    is its own short query (keyset, not a cursor held open), so a slow
+    client never pins a pool connection or a snapshot."""
+    after = filters.pop("after", None)
+    while True:
+        rows, after = list_reservas(page_size, after=after, **filters)
+        if rows:
+            yield rows
+        if not after:
+            return
+
+
+# ── Clients ───────────────────────────────────────────────────────────────────
+
+def clients_query(search: Optional[str] = None) -> tuple:
+    """One row per phone number. Without a search every phone is still
+    grouped, but from the covering telefono index: an index-only scan in
+    phone order feeding a streaming group, when the planner finds that
+    cheaper than hashing the table. With a search, only the trigram
+    matches are grouped."""
+    where, params = "", []
+    if search:
+        clause, params = _search_clause(search)
+        where = f"WHERE {clause}"
+    return f"""
+        SELECT telefono,
+               MAX(nombre_cliente) AS nombre,
+               MAX(email) AS email,
+               COUNT(*) AS total_reservas,
+               SUM(ingreso_total) AS total_gastado,
+               MAX(fecha) AS ultima_reserva,
+               MIN(fecha) AS primera_reserva
+        FROM {TABLE}
+        {where}
+        GROUP BY telefono
+        ORDER BY total_reservas DESC, ultima_reserva DESC
+        LIMIT %s
+    """, params
+
+
+def list_clients(search: Optional[str], limit: int) -> List[Dict[str, Any]]:
+    sql, params = clients_query(search)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params + [limit])
+            cols = [d[0] for d in cur.description]
+            clients = []
+            for row in cur.fetchall():
+                c = dict(zip(cols, row))
+                for k in ("ultima_reserva", "primera_reserva"):
+                    if c.get(k): c[k] = c[k].isoformat()
+                if c.get("total_gastado"): c["total_gastado"] = float(c["total_gastado"])
+                clients.append(c)
+    return clients
+
+
+# ── Booking-site funnel and activity ──────────────────────────────────────────
+
+FUNNEL_COLUMNS = [
+    "total_sessions", "viewed_prices", "entered_booking_flow",
+    "selected_date", "completed_booking", "from_tracked_link",
+]
+
+# Sessions that started in the window: a range scan on first_seen_at. Only
+# the tracked-link flag needs the events, and only those of the window's
+# partitions that carry a link token.
+FUNNEL_QUERY = """
+    WITH since AS (SELECT NOW() - make_interval(days => %s) AS t),
+    linked AS (
+        SELECT DISTINCT e.session_id
+        FROM booking_visitor_events e, since
+        WHERE e.recorded_at >= since.t AND e.link_token IS NOT NULL
+    )
+    SELECT
+        COUNT(*)                                                        AS total_sessions,
+        COUNT(*) FILTER (WHERE 'view_prices' = ANY(s.event_types))       AS viewed_prices,
+        COUNT(*) FILTER (WHERE 'view_reservar' = ANY(s.event_types))     AS entered_booking_flow,
+        COUNT(*) FILTER (WHERE 'date_selected' = ANY(s.event_types))     AS selected_date,
+        COUNT(*) FILTER (WHERE 'booking_completed' = ANY(s.event_types)) AS completed_booking,
+        COUNT(l.session_id)                                             AS from_tracked_link
+    FROM booking_visitor_session_state s
+    CROSS JOIN since
+    LEFT JOIN linked l ON l.session_id = s.session_id
+    WHERE s.first_seen_at >= since.t
+"""
+
+
+def conversion_funnel(days: int) -> Dict[str, Any]:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(FUNNEL_QUERY, (days,))
+            row = cur.fetchone()
+    return {"days": days, **dict(zip(FUNNEL_COLUMNS, row))}
+
+
+ACTIVITY_COLUMNS = [
+    "id", "session_id", "event_type", "extra_date", "time_label",
+    "recorded_at", "lang", "referrer", "is_returning", "link_token",
+    "phone", "customer_name",
+]
+
+
+def activity_query(phone: Optional[str] = None, session_id: Optional[str] = None) -> tuple:
+    """The booking_visitor_activity view with the LIMIT moved below the
+    tracked-link join. Against the view, the LEFT JOIN came first, so the
+    whole window of events was hashed and top-N sorted. Here the newest
+    events come straight off the recorded_at indexes (a backward merge of
+    the partitions), and only `limit` rows get joined. The phone filter
+    becomes a semi-join on the link's tokens (token is unique), which
+    keeps it below the LIMIT as well. Params start with the day count."""
+    wheres = ["recorded_at >= NOW() - make_interval(days => %s)"]
+    params: list = []
+    if phone:
+        wheres.append("link_token IN (SELECT token FROM tracked_quote_links WHERE phone = %s)")
+        params.append("".join(ch for ch in phone if ch.isdigit()))
+    if session_id:
+        wheres.append("session_id = %s")
+        params.append(session_id)
+    return f"""
+        SELECT bve.id, bve.session_id, bve.event_type, bve.extra_date, bve.time_label,
+               bve.recorded_at, bve.lang, bve.referrer, bve.is_returning, bve.link_token,
+               tql.phone, tql.customer_name
+        FROM (
+            SELECT id, session_id, event_type, extra_date, time_label,
+                   recorded_at, lang, referrer, is_returning, link_token
+            FROM booking_visitor_events
+            WHERE {' AND '.join(wheres)}
+            ORDER BY recorded_at DESC
+            LIMIT %s
+        ) bve
+        LEFT JOIN tracked_quote_links tql ON tql.token = bve.link_token
+        ORDER BY bve.recorded_at DESC
+    """, params
+
+
+def visitor_activity(phone: Optional[str], session_id: Optional[str], days: int,
+                     limit: int) -> List[Dict[str, Any]]:
+    sql, params = activity_query(phone, session_id)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, [days] + params + [limit])
+            rows = []
+            for r in cur.fetchall():
+                d = dict(zip(ACTIVITY_COLUMNS, r))
+                if d.get("recorded_at"):
+                    d["recorded_at"] = str(d["recorded_at"])
+                rows.append(d)
+    return rows
@@ -11,11 +11,13 @@ from typing import List, Optional
 from zoneinfo import ZoneInfo
 
 from fastapi import APIRouter, HTTPException, Query, Header, Request, UploadFile, File, Form
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
+from app.db import statements
 from app.db.connection import get_connection
 
+from app.booking import admin_analytics
 from app.booking.extras_calendar_sync import (
     sync_aloj_addons_from_appointment_cursor,
     update_synced_aloj_calendar_status,
@@ -182,6 +184,54 @@ async def admin_page():
 
 # ── List reservations ─────────────────────────────────────────────────────────
 
+def _isoformat(value):
+    return value.isoformat()
+
+
+def _pagos_json(pagos):
+    return _normalize_pagos_for_db(pagos) if isinstance(pagos, list) else pagos
+
+
+# How each /reservas column is made JSON-ready (None stays None).
+_RESERVA_JSON = {
+    "fecha": _isoformat, "created_at": _isoformat, "updated_at": _isoformat,
+    "hora": str,
+    **dict.fromkeys(("ingreso_reserva", "ingreso_extras", "ingreso_total", "flex_amount",
+                     "costo_operativo_fijo", "costo_operativo_variable", "costo_operativo_total"), float),
+    "pagos": _pagos_json,
+}
+
+
+def _reservas_json(rows: list) -> list:
+    """Convert a page of list rows in place. Only the projected columns
+    that need it are touched."""
+    if rows:
+        convert = [(k, fn) for k, fn in _RESERVA_JSON.items() if k in rows[0]]
+        for r in rows:
+            for k, fn in convert:
+                if r[k] is not None:
+                    r[k] = fn(r[k])
+    return rows
+
+
+def _stream_reservas(filters: dict):
+    """Body of a streamed /reservas export: the usual {"reservas", "total"}
+    object, written one page at a time."""
+    yield '{"reservas":['
+    n = 0
+    try:
+        for page in admin_analytics.iter_reservas(**filters):
+            chunk = ",".join(json.dumps(r, ensure_ascii=False, separators=(",", ":"), default=str)
+                             for r in _reservas_json(page))
+            yield ("," if n else "") + chunk
+            n += len(page)
+    except Exception:
+        # The 200 is already on the wire; stop with a body that won't parse.
+        logger.exception("Error streaming reservas export")
+        return
+    yield f'],"total":{n},"next_cursor":null}}'
+
+
 @admin_router.get("/api/admin/reservas")
 async def list_reservas(
     desde: Optional[str] = Query(None),
@@ -190,63 +240,28 @@ async def list_reservas(
     search: Optional[str] = Query(None),
     source: Optional[str] = Query(None),
     limit: int = Query(500, ge=1, le=2000),
+    fields: Optional[str] = Query(None, description="Columnas separadas por coma (id, fecha y hora siempre van); vacío = todas"),
+    cursor: Optional[str] = Query(None, description="next_cursor de la página anterior"),
+    stream: bool = Query(False, description="Exportar todo lo que coincide (sin limit), en streaming"),
     x_admin_key: str = Header(""),
 ):
+    """Reservations newest first (fecha, hora, id), a page at a time:
+    pass the response's next_cursor back as cursor= for the next one.
+    stream=true returns every matching row as one streamed JSON body."""
     _check_auth(x_admin_key)
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                wheres, params = [], []
-                if desde:
-                    wheres.append("fecha >= %s"); params.append(desde)
-                if hasta:
-                    wheres.append("fecha <= %s"); params.append(hasta)
-                if status and status != "all":
-                    wheres.append("status = %s"); params.append(status)
-                if source and source != "all":
-                    wheres.append("source = %s"); params.append(source)
-                if search:
-                    wheres.append(
-                        "(nombre_cliente ILIKE %s OR telefono ILIKE %s OR email ILIKE %s)"
-                    )
-                    s = f"%{search}%"; params += [s, s, s]
-                where_sql = ("WHERE " + " AND ".join(wheres)) if wheres else ""
-                params.append(limit)
-                cur.execute(f"""
-                    SELECT id, source, source_id, appointment_id,
-                           fecha, hora, nombre_cliente, email, telefono,
-                           servicio, num_personas, num_adultos, num_ninos,
-                           nombre_adultos, nombre_ninos,
-                           ingreso_reserva, ingreso_extras, ingreso_total,
-                           has_flex, COALESCE(flex_amount,0) AS flex_amount,
-                           costo_operativo_fijo, costo_operativo_variable, costo_operativo_total,
-                           ciudad_origen, como_supieron, clima_del_dia,
-                           categoria_clientes, tipo_clientes, quien_atendio,
-                           status, tiene_cruce, extras_json, observaciones,
-                           payment_id, payment_status,
-                           COALESCE(pagos, '[]'::jsonb) AS pagos,
-                           COALESCE(descuentos, '[]'::jsonb) AS descuentos,
-                           created_at, updated_at
-                    FROM {TABLE}
-                    {where_sql}
-                    ORDER BY fecha DESC, hora DESC NULLS LAST
-                    LIMIT %s
-                """, params)
-                cols = [d[0] for d in cur.description]
-                rows = []
-                for row in cur.fetchall():
-                    r = dict(zip(cols, row))
-                    for k in ("fecha", "created_at", "updated_at"):
-                        if r.get(k): r[k] = r[k].isoformat()
-                    if r.get("hora"): r["hora"] = str(r["hora"])
-                    for k in ("ingreso_reserva", "ingreso_extras", "ingreso_total",
-                              "flex_amount",
-                              "costo_operativo_fijo", "costo_operativo_variable", "costo_operativo_total"):
-                        if r.get(k) is not None: r[k] = float(r[k])
-                    if isinstance(r.get("pagos"), list):
-                        r["pagos"] = _normalize_pagos_for_db(r["pagos"])
-                    rows.append(r)
-        return {"reservas": rows, "total": len(rows)}
+        columns = admin_analytics.parse_fields(fields)
+        if cursor:
+            admin_analytics.decode_cursor(cursor)  # a 400 here, not a 500 from the query
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filters = dict(desde=desde, hasta=hasta, status=status, source=source, search=search,
+                   columns=columns, after=cursor)
+    if stream:
+        return StreamingResponse(_stream_reservas(filters), media_type="application/json")
+    try:
+        rows, next_cursor = await asyncio.to_thread(admin_analytics.list_reservas, limit, **filters)
+        return {"reservas": _reservas_json(rows), "total": len(rows), "next_cursor": next_cursor}
     except Exception as e:
         logger.error(f"Error listing reservas: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -337,12 +352,6 @@ async def update_reserva(rid: int, body: UpdateReservaRequest, x_admin_key: str
     _check_auth(x_admin_key)
     updates = {k: v for k, v in body.model_dump().items() if v is not None}
     # coupon fields are nullable — include them if explicitly sent in the request
-    if (
-        'coupon_code' in body.model_fields_set
-        or 'coupon_discount' in body.model_fields_set
-        or 'coupon_extra_benefit' in body.model_fields_set
-    ):
-        _ensure_coupons_table()
     if 'coupon_code' in body.model_fields_set:
         updates['coupon_code'] = body.coupon_code
     if 'coupon_discount' in body.model_fields_set:
@@ -662,32 +671,11 @@ async def get_conversion_funnel(
     x_admin_key: str = Header(""),
 ):
     """Embudo de conversión del sitio de reservas: cuántas sesiones llegaron
-    a cada etapa (booking_funnel_sessions es una vista sobre
-    booking_visitor_events — ver ensure_analytics_views en db.py)."""
+    a cada etapa. Cuenta desde booking_visitor_session_state (una fila por
+    sesión, mantenida por trigger) — ver admin_analytics.py."""
     _check_auth(x_admin_key)
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT
-                        COUNT(*)                                            AS total_sessions,
-                        COUNT(*) FILTER (WHERE viewed_prices)               AS viewed_prices,
-                        COUNT(*) FILTER (WHERE entered_booking_flow)        AS entered_booking_flow,
-                        COUNT(*) FILTER (WHERE selected_date)               AS selected_date,
-                        COUNT(*) FILTER (WHERE completed_booking)           AS completed_booking,
-                        COUNT(*) FILTER (WHERE link_token IS NOT NULL)      AS from_tracked_link
-                    FROM booking_funnel_sessions
-                    WHERE first_seen_at >= NOW() - (%s || ' days')::interval
-                    """,
-                    (days,),
-                )
-                row = cur.fetchone()
-                cols = [
-                    "total_sessions", "viewed_prices", "entered_booking_flow",
-                    "selected_date", "completed_booking", "from_tracked_link",
-                ]
-                return {"days": days, **dict(zip(cols, row))}
+        return await asyncio.to_thread(admin_analytics.conversion_funnel, days)
     except Exception as e:
         logger.error(f"get_conversion_funnel error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -706,41 +694,7 @@ async def get_visitor_activity(
     llegaron a una etapa), acá se ve cada acción, en orden, con fecha/hora."""
     _check_auth(x_admin_key)
     try:
-        wheres = ["recorded_at >= NOW() - (%s || ' days')::interval"]
-        params: list = [days]
-        if phone:
-            wheres.append("phone = %s")
-            params.append("".join(ch for ch in phone if ch.isdigit()))
-        if session_id:
-            wheres.append("session_id = %s")
-            params.append(session_id)
-        params.append(limit)
-
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    f"""
-                    SELECT id, session_id, event_type, extra_date, time_label,
-                           recorded_at, lang, referrer, is_returning, link_token,
-                           phone, customer_name
-                    FROM booking_visitor_activity
-                    WHERE {' AND '.join(wheres)}
-                    ORDER BY recorded_at DESC
-                    LIMIT %s
-                    """,
-                    tuple(params),
-                )
-                cols = [
-                    "id", "session_id", "event_type", "extra_date", "time_label",
-                    "recorded_at", "lang", "referrer", "is_returning", "link_token",
-                    "phone", "customer_name",
-                ]
-                rows = []
-                for r in cur.fetchall():
-                    d = dict(zip(cols, r))
-                    if d.get("recorded_at"):
-                        d["recorded_at"] = str(d["recorded_at"])
-                    rows.append(d)
+        rows = await asyncio.to_thread(admin_analytics.visitor_activity, phone, session_id, days, limit)
         return {"activity": rows}
     except Exception as e:
         logger.error(f"get_visitor_activity error: {e}")
@@ -754,56 +708,7 @@ async def get_stats(
 ):
     _check_auth(x_admin_key)
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                # Monthly revenue
-                cur.execute(f"""
-                    SELECT EXTRACT(MONTH FROM fecha)::int AS mes,
-                           COUNT(*) AS n_reservas,
-                           SUM(ingreso_total) AS ingresos,
-                           SUM(ingreso_extras) AS extras,
-                           SUM(costo_operativo_total) AS costos,
-                           SUM(ingreso_total - COALESCE(costo_operativo_total,0)) AS margen
-                    FROM {TABLE}
-                    WHERE EXTRACT(YEAR FROM fecha)=%s
-                      AND (status IS NULL OR status NOT IN ('cancelled','rejected','cancelada','rechazada'))
-                    GROUP BY mes ORDER BY mes
-                """, (year,))
-                monthly = [{"mes": int(r[0]), "n_reservas": int(r[1]),
-                            "ingresos": float(r[2] or 0), "extras": float(r[3] or 0),
-                            "costos": float(r[4] or 0), "margen": float(r[5] or 0)}
-                           for r in cur.fetchall()]
-
-                # Status breakdown
-                cur.execute(f"""
-                    SELECT status, COUNT(*) FROM {TABLE}
-                    WHERE EXTRACT(YEAR FROM fecha)=%s GROUP BY status
-                """, (year,))
-                by_status = {(r[0] or "sin estado"): int(r[1]) for r in cur.fetchall()}
-
-                # Source breakdown
-                cur.execute(f"""
-                    SELECT source, COUNT(*) FROM {TABLE}
-                    WHERE EXTRACT(YEAR FROM fecha)=%s GROUP BY source
-                """, (year,))
-                by_source = {(r[0] or "desconocido"): int(r[1]) for r in cur.fetchall()}
-
-                # Totals
-                cur.execute(f"""
-                    SELECT COUNT(*), SUM(ingreso_total), AVG(ingreso_total), AVG(num_personas::float)
-                    FROM {TABLE}
-                    WHERE EXTRACT(YEAR FROM fecha)=%s
-                      AND (status IS NULL OR status NOT IN ('cancelled','rejected','cancelada','rechazada'))
-                """, (year,))
-                r = cur.fetchone()
-                totals = {
-                    "total_reservas": int(r[0] or 0),
-                    "total_ingresos": float(r[1] or 0),
-                    "avg_reserva": float(r[2] or 0),
-                    "avg_personas": float(r[3] or 0) if r[3] else 0,
-                }
-
-        return {"monthly": monthly, "by_status": by_status, "by_source": by_source, **totals}
+        return await asyncio.to_thread(admin_analytics.year_stats, year)
     except Exception as e:
         logger.error(f"Stats error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -811,22 +716,171 @@ async def get_stats(
 
 # ── Log viewer ───────────────────────────────────────────────────────────────
 
+def _log_time(value: Optional[str], param: str) -> Optional[datetime]:
+    """ISO date/datetime from the log viewer; naive values are Chile time."""
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{param}: expected an ISO date/time, got {value!r}")
+    return ts if ts.tzinfo else ts.replace(tzinfo=CHILE_TZ)
+
+
 @admin_router.get("/api/admin/logs")
 async def get_logs(
-    n:      int = Query(200, ge=1, le=500),
-    level:  str = Query(""),
-    search: str = Query(""),
+    n:       int = Query(200, ge=1, le=2000),
+    level:   str = Query(""),
+    search:  str = Query(""),
+    logger_name: str = Query("", alias="logger"),
+    replica: str = Query(""),
+    desde:   Optional[str] = Query(None, description="Desde (ISO; sin zona = hora de Chile)"),
+    hasta:   Optional[str] = Query(None, description="Hasta, exclusivo"),
     x_admin_key: str = Header(""),
 ):
-    """Return the last N in-memory log lines, optionally filtered."""
-    from app.log_buffer import log_buffer
-    lines = list(log_buffer)[-n:]
+    """The newest N log lines of every replica (app_log), oldest first,
+    optionally within [desde, hasta) and by level, logger or replica.
+    Falls back to this replica's in-memory lines if app_log can't be read."""
+    from app import log_pipeline
+    _check_auth(x_admin_key)
+    levelno = None
     if level:
-        lines = [l for l in lines if l["level"] == level.upper()]
-    if search:
-        s = search.lower()
-        lines = [l for l in lines if s in l["message"].lower() or s in l["logger"].lower()]
-    return {"count": len(lines), "lines": lines}
+        levelno = logging.getLevelName(level.upper())
+        if not isinstance(levelno, int):
+            raise HTTPException(status_code=400, detail=f"unknown level: {level!r}")
+    since, until = _log_time(desde, "desde"), _log_time(hasta, "hasta")
+    try:
+        lines = await asyncio.to_thread(
+            log_pipeline.query_logs, n, since=since, until=until, level=levelno,
+            logger=logger_name or None, replica=replica or None, search=search or None,
+        )
+    except Exception as e:
+        logger.warning(f"app_log query failed, showing this replica's buffer: {e}")
+        lines = log_pipeline.recent_logs(n, level=levelno, search=search or None)
+        return {"count": len(lines), "lines": lines, "source": "local"}
+    for line in lines:
+        line["ts"] = line["ts"].astimezone(CHILE_TZ).strftime("%Y-%m-%d %H:%M:%S")
+    return {"count": len(lines), "lines": lines, "source": "app_log"}
+
+
+# ── Email outbox ─────────────────────────────────────────────────────────────
+
+@admin_router.get("/api/admin/email-outbox")
+async def get_email_outbox(
+    trigger:     str = Query(""),
+    status:      str = Query(""),
+    booking_ref: str = Query(""),
+    limit:       int = Query(50, ge=1, le=500),
+    x_admin_key: str = Header(""),
+):
+    """Delivery status per trigger plus the most recent outbox rows
+    (filterable by trigger / status / booking_ref)."""
+    _check_auth(x_admin_key)
+    from app.email import outbox
+    summary = await asyncio.to_thread(outbox.delivery_status)
+    rows = await asyncio.to_thread(outbox.recent, trigger or None, status or None,
+                                   booking_ref or None, limit)
+    return {"by_trigger": summary, "recent": rows}
+
+
+@admin_router.post("/api/admin/email-outbox/{outbox_id}/retry")
+async def retry_email_outbox(outbox_id: int, x_admin_key: str = Header("")):
+    """Re-queue a dead email for immediate delivery."""
+    _check_auth(x_admin_key)
+    from app.email import outbox
+    if not await asyncio.to_thread(outbox.retry, outbox_id):
+        raise HTTPException(status_code=404, detail="Email no encontrado o ya enviado")
+    return {"ok": True, "id": outbox_id}
+
+
+# ── Scheduler ────────────────────────────────────────────────────────────────
+
+@admin_router.get("/api/admin/scheduler/jobs")
+async def list_scheduler_jobs(x_admin_key: str = Header("")):
+    """Periodic jobs with next/last run, whether one is running now and duration/failure metrics."""
+    _check_auth(x_admin_key)
+    from app.scheduler import get_job_status
+    try:
+        return {"jobs": await asyncio.to_thread(get_job_status)}
+    except Exception as e:
+        logger.error(f"Scheduler status error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@admin_router.post("/api/admin/scheduler/jobs/{name}/run")
+async def run_scheduler_job_now(name: str, x_admin_key: str = Header("")):
+    """Make a job due now; the replica that claims it first runs it."""
+    _check_auth(x_admin_key)
+    from app.scheduler import trigger_job
+    if not await asyncio.to_thread(trigger_job, name):
+        raise HTTPException(status_code=404, detail=f"Unknown job: {name}")
+    return {"ok": True, "job": name}
+
+
+# ── Diagnostics ──────────────────────────────────────────────────────────────
+
+class LoopDiagnosticsRequest(BaseModel):
+    enabled: bool
+    threshold_ms: int = 100
+
+
+@admin_router.get("/api/admin/diagnostics/loop")
+async def get_loop_diagnostics(x_admin_key: str = Header("")):
+    """This replica's event-loop stalls by call site, with lag percentiles."""
+    _check_auth(x_admin_key)
+    from app.diagnostics import detector
+    from app.log_pipeline import REPLICA
+    return {"replica": REPLICA, **detector.report()}
+
+
+@admin_router.post("/api/admin/diagnostics/loop")
+async def set_loop_diagnostics(body: LoopDiagnosticsRequest, x_admin_key: str = Header("")):
+    """Switch the blocking detector on or off: here at once, on the other
+    replicas when they next read the setting."""
+    _check_auth(x_admin_key)
+    from app import diagnostics
+    threshold = max(diagnostics.MIN_THRESHOLD_MS, min(body.threshold_ms, 10_000))
+    conf = {"enabled": body.enabled, "threshold_ms": threshold}
+    if not await asyncio.to_thread(set_setting, diagnostics.SETTING_KEY, json.dumps(conf)):
+        raise HTTPException(status_code=500, detail="No se pudo guardar la configuración")
+    diagnostics.detector.configure(body.enabled, threshold)
+    return {"ok": True, **conf}
+
+
+@admin_router.post("/api/admin/diagnostics/loop/reset")
+async def reset_loop_diagnostics(x_admin_key: str = Header("")):
+    _check_auth(x_admin_key)
+    from app.diagnostics import detector
+    detector.reset()
+    return {"ok": True}
+
+
+@admin_router.get("/api/admin/diagnostics/profile")
+async def get_profile(
+    seconds: float = Query(10, gt=0, le=60),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    threads: str = Query("loop", pattern="^(loop|all)$"),
+    fmt: str = Query("svg", alias="format", pattern="^(svg|folded)$"),
+    x_admin_key: str = Header(""),
+):
+    """Sample this replica's stacks for `seconds` and return a flame graph
+    (SVG) or folded stacks for flamegraph.pl / speedscope. threads=loop
+    samples the event-loop thread only."""
+    _check_auth(x_admin_key)
+    import threading
+    from app import diagnostics
+    from app.log_pipeline import REPLICA
+    thread_id = threading.get_ident() if threads == "loop" else None
+    try:
+        samples = await asyncio.to_thread(diagnostics.profile, seconds, interval_ms / 1000, thread_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    stamp = datetime.now(CHILE_TZ)
+    if fmt == "folded":
+        return PlainTextResponse(diagnostics.folded(samples), headers={
+            "Content-Disposition": f'attachment; filename="profile_{stamp:%Y%m%d_%H%M%S}.folded"'})
+    title = f"{REPLICA} · {threads} · {seconds:g} s every {interval_ms:g} ms · {stamp:%Y-%m-%d %H:%M:%S}"
+    return Response(diagnostics.flamegraph_svg(samples, title), media_type="image/svg+xml")
 
 
 # ── Clients ───────────────────────────────────────────────────────────────────
@@ -839,36 +893,7 @@ async def list_clients(
 ):
     _check_auth(x_admin_key)
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                where, params = "", []
-                if search:
-                    where = "WHERE nombre_cliente ILIKE %s OR telefono ILIKE %s OR email ILIKE %s"
-                    s = f"%{search}%"; params = [s, s, s]
-                params.append(limit)
-                cur.execute(f"""
-                    SELECT telefono,
-                           MAX(nombre_cliente) AS nombre,
-                           MAX(email) AS email,
-                           COUNT(*) AS total_reservas,
-                           SUM(ingreso_total) AS total_gastado,
-                           MAX(fecha) AS ultima_reserva,
-                           MIN(fecha) AS primera_reserva
-                    FROM {TABLE}
-                    {where}
-                    GROUP BY telefono
-                    ORDER BY total_reservas DESC, ultima_reserva DESC
-                    LIMIT %s
-                """, params)
-                cols = [d[0] for d in cur.description]
-                clients = []
-                for row in cur.fetchall():
-                    c = dict(zip(cols, row))
-                    for k in ("ultima_reserva", "primera_reserva"):
-                        if c.get(k): c[k] = c[k].isoformat()
-                    if c.get("total_gastado"): c["total_gastado"] = float(c["total_gastado"])
-                    clients.append(c)
-        return {"clients": clients}
+        return {"clients": await asyncio.to_thread(admin_analytics.list_clients, search, limit)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1551,7 +1576,7 @@ async def send_recibo_email(body: ReciboSendBody, x_admin_key: str = Header(""))
         raise HTTPException(status_code=400, detail="Email del cliente no válido")
 
     from app.config import get_settings
-    from app.email.resend_booking import send_booking_html
+    from app.email.outbox import enqueue_email
 
     settings = get_settings()
     api_key = (getattr(settings, "resend_api_key", "") or "").strip()
@@ -1565,25 +1590,14 @@ async def send_recibo_email(body: ReciboSendBody, x_admin_key: str = Header(""))
     ).strip()
 
     try:
-        await asyncio.to_thread(
-            send_booking_html,
-            to=to_addr,
-            subject=body.subject,
-            html=body.html,
-            from_address=from_addr,
-            api_key=api_key,
+        outbox_id = await asyncio.to_thread(
+            enqueue_email, "recibo", to_addr, body.subject, body.html, from_addr,
         )
-        logger.info("Recibo enviado a %s — %s", to_addr, body.subject)
-        return {"ok": True, "to": to_addr}
+        logger.info("Recibo encolado para %s — %s", to_addr, body.subject)
+        return {"ok": True, "to": to_addr, "queued": True, "outbox_id": outbox_id}
     except Exception as e:
-        error_detail = str(e)
-        try:
-            if hasattr(e, "body"):
-                error_detail += f" | {e.body}"
-        except Exception:
-            pass
-        logger.error("send_recibo_email failed to=%s: %s", to_addr, error_detail)
-        raise HTTPException(status_code=500, detail=error_detail)
+        logger.error("send_recibo_email enqueue failed to=%s: %s", to_addr, e)
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @admin_router.post("/api/admin/daily-summary/send")
@@ -1658,17 +1672,8 @@ async def sync_tables(x_admin_key: str = Header("")):
                 updated_status = 0
 
                 # Sync reservas_con_extras → all_appointments (upsert by source_id)
-                cur.execute("""
-                    SELECT id, appointment_id, fecha, hora, nombre_cliente, email, telefono,
-                           servicio, num_personas, num_adultos, num_ninos,
-                           ingreso_reserva, ingreso_extras, ingreso_total,
-                           costo_operativo_fijo, costo_operativo_variable, costo_operativo_total,
-                           ciudad_origen, como_supieron, clima_del_dia, categoria_clientes,
-                           tipo_clientes, tiene_cruce, status, extras_json, created_at
-                    FROM reservas_con_extras
-                    ORDER BY fecha
-                """)
-                for row in cur.fetchall():
+                # Streamed: `cur` stays free for the per-row statements below.
+                for row in statements.stream(conn, "sync.reservas_con_extras"):
                     (rid, appt_id, fecha, hora, nombre, email, telefono,
                      servicio, num_p, num_adultos, num_ninos,
                      ing_res, ing_ext, ing_total, costo_fijo, costo_var, costo_total,
@@ -1795,11 +1800,8 @@ async def sync_tables(x_admin_key: str = Header("")):
 
 # ── Extras catalog (extras_visibility is the single source of truth) ──────────
 
-import unicodedata as _unicodedata
+from app.booking.catalog import slugify_extra as _slugify_extra  # noqa: E402
 
-def _slugify_extra(s: str) -> str:
-    s = _unicodedata.normalize("NFKD", str(s)).encode("ascii", "ignore").decode()
-    return re.sub(r"[^a-z0-9]+", "_", s.lower()).strip("_")
 
 def _parse_clp(s) -> int:
     if not s:
@@ -1811,24 +1813,6 @@ def _parse_clp(s) -> int:
 async def get_precios_extras(x_admin_key: str = Header("")):
     _check_auth(x_admin_key)
     try:
-        # Ensure all required columns exist (safe to run every time)
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                for col_def in [
-                    "name TEXT",
-                    "description TEXT",
-                    "precio_venta INTEGER",
-                    "costo INTEGER",
-                    "icon TEXT",
-                    "name_en TEXT",
-                    "name_pt TEXT",
-                    "description_en TEXT",
-                    "description_pt TEXT",
-                    "stock_product_id INTEGER",
-                ]:
-                    cur.execute(f"ALTER TABLE extras_visibility ADD COLUMN IF NOT EXISTS {col_def}")
-                conn.commit()
-
         with get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
@@ -2182,17 +2166,6 @@ async def auto_translate_precio_extra(extra_id: str, x_admin_key: str = Header("
     try:
         from app.booking.extras_translate import translate_extra_fields
 
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                for col_def in [
-                    "name_en TEXT",
-                    "name_pt TEXT",
-                    "description_en TEXT",
-                    "description_pt TEXT",
-                ]:
-                    cur.execute(f"ALTER TABLE extras_visibility ADD COLUMN IF NOT EXISTS {col_def}")
-                conn.commit()
-
         with get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(
@@ -2880,30 +2853,11 @@ def _exp_row(r, cols):
     return row
 
 
-def _ensure_experiences_admin_columns(cur) -> None:
-    cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS name_en TEXT")
-    cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS name_pt TEXT")
-    cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS description_en TEXT")
-    cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS description_pt TEXT")
-    cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS admin_whatsapp TEXT")
-    cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS extra_images JSONB DEFAULT '[]'::jsonb")
-
-
-def _ensure_packs_admin_columns(cur) -> None:
-    cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS name_en TEXT")
-    cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS name_pt TEXT")
-    cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS description_en TEXT")
-    cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS description_pt TEXT")
-    cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS admin_whatsapp TEXT")
-    cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS extra_images JSONB DEFAULT '[]'::jsonb")
-
-
 @admin_router.get("/api/admin/experiencias")
 async def admin_list_experiencias(x_admin_key: str = Header(...)):
     _check_auth(x_admin_key)
     with get_connection() as conn:
         with conn.cursor() as cur:
-            _ensure_experiences_admin_columns(cur)
             cur.execute(
                 "SELECT id,slug,name,icon,description,"
                 "COALESCE(name_en,'') AS name_en,COALESCE(name_pt,'') AS name_pt,"
@@ -2939,7 +2893,6 @@ async def admin_create_experiencia(body: ExperienceBody, x_admin_key: str = Head
     _check_auth(x_admin_key)
     with get_connection() as conn:
         with conn.cursor() as cur:
-            _ensure_experiences_admin_columns(cur)
             cur.execute(
                 "INSERT INTO experiences (slug,name,icon,description,name_en,name_pt,description_en,description_pt,"
                 "admin_whatsapp,price_per_person,cost_per_person,image_path,extra_images,is_active,display_order)"
@@ -2959,7 +2912,6 @@ async def admin_update_experiencia(exp_id: int, body: ExperienceBody, x_admin_ke
     _check_auth(x_admin_key)
     with get_connection() as conn:
         with conn.cursor() as cur:
-            _ensure_experiences_admin_columns(cur)
             cur.execute(
                 "UPDATE experiences SET slug=%s,name=%s,icon=%s,description=%s,"
                 "name_en=%s,name_pt=%s,description_en=%s,description_pt=%s,admin_whatsapp=%s,"
@@ -2999,7 +2951,6 @@ async def admin_upload_exp_image(exp_id: int, file: UploadFile = File(...), x_ad
     rel = f"/static/images/experiencias/exp_{exp_id}/{filename}"
     with get_connection() as conn:
         with conn.cursor() as cur:
-            _ensure_experiences_admin_columns(cur)
             cur.execute("SELECT image_path, COALESCE(extra_images,'[]'::jsonb) FROM experiences WHERE id=%s", (exp_id,))
             row = cur.fetchone()
             if row:
@@ -3182,7 +3133,6 @@ async def admin_list_packs(x_admin_key: str = Header(...)):
     _check_auth(x_admin_key)
     with get_connection() as conn:
         with conn.cursor() as cur:
-            _ensure_packs_admin_columns(cur)
             cur.execute(
                 "SELECT id,slug,name,icon,description,"
                 "COALESCE(name_en,'') AS name_en,COALESCE(name_pt,'') AS name_pt,"
@@ -3226,7 +3176,6 @@ async def admin_create_pack(body: PackBody, x_admin_key: str = Header(...)):
     _check_auth(x_admin_key)
     with get_connection() as conn:
         with conn.cursor() as cur:
-            _ensure_packs_admin_columns(cur)
             cur.execute(
                 "INSERT INTO packs (slug,name,icon,description,name_en,name_pt,description_en,description_pt,"
                 "admin_whatsapp,personas,price_from,cost_from,image_path,extra_images,includes,is_active,display_order)"
@@ -3249,7 +3198,6 @@ async def admin_update_pack(pack_id: int, body: PackBody, x_admin_key: str = Hea
     _check_auth(x_admin_key)
     with get_connection() as conn:
         with conn.cursor() as cur:
-            _ensure_packs_admin_columns(cur)
             cur.execute(
                 "UPDATE packs SET slug=%s,name=%s,icon=%s,description=%s,"
                 "name_en=%s,name_pt=%s,description_en=%s,description_pt=%s,admin_whatsapp=%s,"
@@ -3292,7 +3240,6 @@ async def admin_upload_pack_image(pack_id: int, file: UploadFile = File(...), x_
     rel = f"/static/images/packs/pack_{pack_id}/{filename}"
     with get_connection() as conn:
         with conn.cursor() as cur:
-            _ensure_packs_admin_columns(cur)
             cur.execute("SELECT image_path, COALESCE(extra_images,'[]'::jsonb) FROM packs WHERE id=%s", (pack_id,))
             row = cur.fetchone()
             if row:
@@ -3562,7 +3509,6 @@ class CouponBody(BaseModel):
 @admin_router.get("/api/admin/coupons")
 def list_coupons(x_admin_key: str = Header("")):
     _check_auth(x_admin_key)
-    _ensure_coupons_table()
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
@@ -3586,7 +3532,6 @@ def list_coupons(x_admin_key: str = Header("")):
 @admin_router.post("/api/admin/coupons")
 def create_coupon(body: CouponBody, x_admin_key: str = Header("")):
     _check_auth(x_admin_key)
-    _ensure_coupons_table()
     import json as _json
     rules_json = _json.dumps(body.rules) if body.rules else None
     with get_connection() as conn:
@@ -3610,7 +3555,6 @@ def create_coupon(body: CouponBody, x_admin_key: str = Header("")):
 @admin_router.put("/api/admin/coupons/{cid}")
 def update_coupon(cid: int, body: CouponBody, x_admin_key: str = Header("")):
     _check_auth(x_admin_key)
-    _ensure_coupons_table()
     import json as _json
     rules_json = _json.dumps(body.rules) if body.rules else None
     with get_connection() as conn:
@@ -3858,7 +3802,8 @@ async def test_notif_email(
     import asyncio
     from datetime import date, timedelta
     from app.booking.booking_email import send_yesterday_summary_email, send_weekly_summary_email, _NOTIF_TO, _build_booking_card_html, _fmt_clp_local, _get_from_addr
-    from app.booking.booking_email import send_booking_html, get_settings
+    from app.booking.booking_email import get_settings
+    from app.email.outbox import enqueue_email
     from app.db.connection import get_connection
 
     out: dict = {}
@@ -3947,8 +3892,8 @@ async def test_notif_email(
     subject = f"🚤 [TEST] {weekday_es} {target_str} — {len(bookings)} reserva{'s' if len(bookings)!=1 else ''}"
     from_addr = _get_from_addr(s)
     try:
-        result = send_booking_html(to=_NOTIF_TO, subject=subject, html=html, from_address=from_addr, api_key=api_key)
-        out["daily"] = {"sent": True, "count": len(bookings), "date": str(target), "resend_id": result.get("id") if isinstance(result, dict) else str(result)}
+        outbox_id = await asyncio.to_thread(enqueue_email, "daily_summary_test", _NOTIF_TO, subject, html, from_addr)
+        out["daily"] = {"sent": True, "count": len(bookings), "date": str(target), "outbox_id": outbox_id}
     except Exception as e:
         out["daily"] = {"sent": False, "error": str(e)}
 
@@ -4,13 +4,10 @@ import re
 from typing import Any, Dict, List, Optional
 
 from app.config import get_settings
-from app.booking.db import (
-    get_booking_by_ref, mark_confirmation_email_sent,
-    get_bookings_for_followup, mark_followup_email_sent,
-    mark_followup_sent_after_manual_send,
-)
-from app.booking.operator_settings import get_email_workflow, TRIGGER_META
-from app.email.resend_booking import send_booking_html
+from app.booking.db import get_booking_by_ref, get_bookings_for_followup
+from app.booking.operator_settings import get_email_workflows, get_setting, TRIGGER_META
+from app.email.outbox import dedup_key, enqueue_email, enqueue_emails, queued_result
+from app.email.templates import compile_builder, compile_template
 
 logger = logging.getLogger(__name__)
 
@@ -445,7 +442,7 @@ def _hotboat_email_card(
     phone   = ctx.get("business_phone", "")
     website = ctx.get("business_website", "#")
     biz     = ctx.get("business_name", "HotBoat")
-    wa_num  = phone.replace(" ", "").replace("+", "")
+    wa_num  = ctx.get("business_wa_num", "")
     # Logo: EMAIL_LOGO_URL env var > auto-detect Railway domain > text fallback
     import os as _os
     logo_url = _os.environ.get("EMAIL_LOGO_URL", "").strip()
@@ -600,9 +597,8 @@ def _cta_btn(label: str, url: str, solid: bool = True) -> str:
 def _default_html_booking_created(ctx: Dict[str, str]) -> str:
     lang      = ctx.get("customer_language", "es")
     name      = ctx.get("customer_name", "")
-    website   = ctx.get("business_website", "#")
-    firma_url = ctx.get("firma_url", "") or website
-    tabla_url = ctx.get("tabla_url", "") or "https://hotboatchile.com/tablas/"
+    firma_url = ctx.get("firma_link", "")
+    tabla_url = ctx.get("tabla_link", "")
 
     accent = (
         '<td width="33%" height="4" bgcolor="#c98a3c" style="line-height:4px;font-size:0;">&nbsp;</td>'
@@ -672,9 +668,8 @@ def _default_html_booking_created(ctx: Dict[str, str]) -> str:
 def _default_html_booking_confirmed(ctx: Dict[str, str]) -> str:
     lang      = ctx.get("customer_language", "es")
     name      = ctx.get("customer_name", "")
-    website   = ctx.get("business_website", "#")
-    firma_url = ctx.get("firma_url", "") or website
-    tabla_url = ctx.get("tabla_url", "") or "https://hotboatchile.com/tablas/"
+    firma_url = ctx.get("firma_link", "")
+    tabla_url = ctx.get("tabla_link", "")
 
     accent = (
         '<td width="50%" height="4" bgcolor="#2c7a72" style="line-height:4px;font-size:0;">&nbsp;</td>'
@@ -825,38 +820,11 @@ def _default_html_booking_followup(ctx: Dict[str, str]) -> str:
 
 
 def _default_html_admin_new_lead(ctx: Dict[str, str]) -> str:
-    name  = ctx.get("customer_name", "el cliente")
     date  = ctx.get("booking_date", "")
     time_ = ctx.get("booking_time", "")
     phone = ctx.get("customer_phone", "")
-    wa_msg = (
-        f"Hola {name}! Vimos que intentaste hacer una reserva en Hot Boat Chile "
-        f"para el {date} a las {time_}, pero parece que hubo un problema con el pago. "
-        f"¿Te podemos ayudar a completar tu reserva? 😊"
-    )
-    wa_url  = _wa_link(phone, wa_msg)
-    wa_btn  = "" if not phone else (
-        f"""<tr><td style="padding:4px 26px 24px;text-align:center;">
-  <a href="{wa_url}" target="_blank"
-     style="display:inline-block;background:#25d366;color:#ffffff;font-size:15px;
-            font-weight:600;text-decoration:none;padding:13px 32px;border-radius:8px;">
-    💬 Contactar por WhatsApp
-  </a>
-  <p style="margin:10px 0 0;font-size:12px;color:#64748b;">
-    Mensaje pre-cargado: problema con el pago de la reserva {date} {time_}
-  </p>
-</td></tr>"""
-    )
-    _ad = ctx.get("ad_source_label", "")
-    _ad_row = (
-        "<tr><td colspan='2' style='padding:0 26px 8px;'>"
-        "<table role='presentation' width='100%' style='background:#eff6ff;border-radius:8px;"
-        "border:1px solid #bfe3dd;font-size:14px;color:#235e58;'>"
-        "<tr><td style='padding:10px 16px'><strong>Anuncio (origen)</strong></td>"
-        "<td style='padding:10px 16px;text-align:right;font-weight:600'>\U0001f4e2 " + _ad + "</td>"
-        "</tr></table></td></tr>"
-        if _ad else ""
-    )
+    wa_btn  = ctx.get("admin_wa_btn_html", "")
+    _ad_row = ctx.get("ad_row_html", "")
     return (
         _header(ctx, "Nuevo lead en formulario", "#7c3aed")
         + f"""<tr><td style="padding:22px 26px 6px;color:#0f172a;font-size:15px;line-height:1.65;">
@@ -896,24 +864,7 @@ def _default_html_admin_pending_payment(ctx: Dict[str, str]) -> str:
     date  = ctx.get("booking_date", "")
     time_ = ctx.get("booking_time", "")
     phone = ctx.get("customer_phone", "")
-    wa_msg = (
-        f"Hola {name}! Vimos que intentaste hacer una reserva en Hot Boat Chile "
-        f"para el {date} a las {time_}, pero parece que hubo un problema con el pago. "
-        f"¿Te podemos ayudar a completar tu reserva? 😊"
-    )
-    wa_url = _wa_link(phone, wa_msg)
-    wa_btn = "" if not phone else (
-        f"""<tr><td style="padding:4px 26px 24px;text-align:center;">
-  <a href="{wa_url}" target="_blank"
-     style="display:inline-block;background:#25d366;color:#ffffff;font-size:15px;
-            font-weight:600;text-decoration:none;padding:13px 32px;border-radius:8px;">
-    💬 Contactar por WhatsApp
-  </a>
-  <p style="margin:10px 0 0;font-size:12px;color:#64748b;">
-    Mensaje pre-cargado: problema con el pago de la reserva {date} {time_}
-  </p>
-</td></tr>"""
-    )
+    wa_btn = ctx.get("admin_wa_btn_html", "")
     return (
         _header(ctx, "⚠️ Pago pendiente — sin completar", "#d97706")
         + f"""<tr><td style="padding:22px 26px 6px;color:#0f172a;font-size:15px;line-height:1.65;">
@@ -978,6 +929,50 @@ def _default_html_admin_booking_confirmed(ctx: Dict[str, str]) -> str:
     )
 
 
+def _template_ctx(ctx: Dict[str, str]) -> Dict[str, str]:
+    """ctx plus the values the default templates derive from it (links with
+    their fallbacks, the WhatsApp button, the ad-source row), so each
+    default builder is a plain lookup over ctx and compiles to static text."""
+    out = dict(ctx)
+    website = ctx.get("business_website", "#")
+    out["firma_link"] = ctx.get("firma_url", "") or website
+    out["tabla_link"] = ctx.get("tabla_url", "") or "https://hotboatchile.com/tablas/"
+    out["business_wa_num"] = ctx.get("business_phone", "").replace(" ", "").replace("+", "")
+
+    name  = ctx.get("customer_name", "el cliente")
+    date  = ctx.get("booking_date", "")
+    time_ = ctx.get("booking_time", "")
+    phone = ctx.get("customer_phone", "")
+    wa_msg = (
+        f"Hola {name}! Vimos que intentaste hacer una reserva en Hot Boat Chile "
+        f"para el {date} a las {time_}, pero parece que hubo un problema con el pago. "
+        f"¿Te podemos ayudar a completar tu reserva? 😊"
+    )
+    out["admin_wa_btn_html"] = "" if not phone else (
+        f"""<tr><td style="padding:4px 26px 24px;text-align:center;">
+  <a href="{_wa_link(phone, wa_msg)}" target="_blank"
+     style="display:inline-block;background:#25d366;color:#ffffff;font-size:15px;
+            font-weight:600;text-decoration:none;padding:13px 32px;border-radius:8px;">
+    💬 Contactar por WhatsApp
+  </a>
+  <p style="margin:10px 0 0;font-size:12px;color:#64748b;">
+    Mensaje pre-cargado: problema con el pago de la reserva {date} {time_}
+  </p>
+</td></tr>"""
+    )
+    _ad = ctx.get("ad_source_label", "")
+    out["ad_row_html"] = (
+        "<tr><td colspan='2' style='padding:0 26px 8px;'>"
+        "<table role='presentation' width='100%' style='background:#eff6ff;border-radius:8px;"
+        "border:1px solid #bfe3dd;font-size:14px;color:#235e58;'>"
+        "<tr><td style='padding:10px 16px'><strong>Anuncio (origen)</strong></td>"
+        "<td style='padding:10px 16px;text-align:right;font-weight:600'>\U0001f4e2 " + _ad + "</td>"
+        "</tr></table></td></tr>"
+        if _ad else ""
+    )
+    return out
+
+
 _DEFAULT_TEMPLATES = {
     "booking_created":           _default_html_booking_created,
     "booking_confirmed":         _default_html_booking_confirmed,
@@ -992,7 +987,82 @@ _DEFAULT_TEMPLATES = {
 
 def default_confirmation_html(ctx: Dict[str, str]) -> str:
     """Legacy alias used by old call sites."""
-    return _default_html_booking_confirmed(ctx)
+    return _default_html_booking_confirmed(_template_ctx(ctx))
+
+
+# ── Compiled templates ────────────────────────────────────────────────────────
+# Built-in templates compile once per (trigger, language) for the life of the
+# process. Operator-edited subjects/bodies compile once per version of the
+# email_workflows setting: the raw setting strings are the version key, so an
+# edit (which clears the settings cache) recompiles on the next send.
+
+_DEFAULT_COMPILED: Dict[tuple, Any] = {}
+_WORKFLOWS: Dict[str, Any] = {"version": None, "workflows": {}, "compiled": {}}
+
+
+def _compiled_default(trigger: str, lang: str):
+    key = (trigger, lang)
+    tpl = _DEFAULT_COMPILED.get(key)
+    if tpl is None:
+        builder = _DEFAULT_TEMPLATES.get(trigger, _default_html_booking_confirmed)
+        sample = _template_ctx(_sample_ctx("preview@hotboat.cl"))
+        # A second sample with the optional values blank exercises the
+        # fallbacks and empty rows.
+        blank = _template_ctx({**sample, "firma_url": "", "tabla_url": "", "customer_phone": "",
+                               "ad_source_label": "", "extras_card_rows": "", "gift_banner_html": ""})
+        tpl = compile_builder(builder, lang, [sample, blank])
+        _DEFAULT_COMPILED[key] = tpl
+    return tpl
+
+
+def _workflows() -> Dict[str, Any]:
+    version = (get_setting("email_workflows", ""), get_setting("email_booking", ""))
+    if _WORKFLOWS["version"] != version:
+        _WORKFLOWS.update(version=version, workflows=get_email_workflows(), compiled={})
+    return _WORKFLOWS
+
+
+def _workflow(trigger: str) -> dict:
+    return _workflows()["workflows"].get(trigger, {})
+
+
+def _compiled_for(trigger: str, lang: str):
+    """(subject template, html template) for trigger in lang."""
+    state = _workflows()
+    key = (trigger, lang)
+    pair = state["compiled"].get(key)
+    if pair is None:
+        cfg = state["workflows"].get(trigger, {})
+        raw_subject = (cfg.get("subject") or "").strip()
+        if not raw_subject:
+            raw_subject = (TRIGGER_META.get(trigger) or {}).get("default_subject", "Mensaje de HotBoat")
+        raw_html = (cfg.get("body_html") or "").strip()
+        html_tpl = compile_template(raw_html) if raw_html else _compiled_default(trigger, lang)
+        pair = (compile_template(raw_subject), html_tpl)
+        state["compiled"][key] = pair
+    return pair
+
+
+def render_email(trigger: str, ctx: Dict[str, str]) -> tuple:
+    """(subject, html) for one context."""
+    ctx = _template_ctx(ctx)
+    subject_tpl, html_tpl = _compiled_for(trigger, ctx.get("customer_language") or "es")
+    return subject_tpl.render(ctx), html_tpl.render(ctx)
+
+
+def render_emails(trigger: str, ctxs: List[Dict[str, str]]) -> List[tuple]:
+    """(subject, html) for each context — compiled templates are looked up
+    once per language, not once per email."""
+    out = []
+    by_lang: Dict[str, tuple] = {}
+    for ctx in ctxs:
+        ctx = _template_ctx(ctx)
+        lang = ctx.get("customer_language") or "es"
+        pair = by_lang.get(lang)
+        if pair is None:
+            pair = by_lang[lang] = _compiled_for(trigger, lang)
+        out.append((pair[0].render(ctx), pair[1].render(ctx)))
+    return out
 
 
 # ── Core send logic ───────────────────────────────────────────────────────────
@@ -1018,9 +1088,24 @@ def _get_bcc(settings) -> Optional[List[str]]:
     return lst if lst else None
 
 
+# Triggers an admin can legitimately fire more than once for the same
+# booking (a booking can be cancelled, reinstated and cancelled again);
+# every other trigger is queued at most once per booking_ref.
+_REPEATABLE_TRIGGERS = {"booking_status_changed", "booking_cancelled"}
+
+
+def _dedup_key(trigger: str, booking_ref: Optional[str]) -> Optional[str]:
+    if trigger in _REPEATABLE_TRIGGERS:
+        return None
+    return dedup_key(trigger, booking_ref)
+
+
 def _render_and_send(trigger: str, to_addr: str, ctx: Dict[str, str],
-                     subject_prefix: str = "") -> Dict[str, Any]:
-    """Render subject+HTML for trigger and send via Resend. Returns {sent, reason}."""
+                     subject_prefix: str = "", dedup: Optional[str] = None,
+                     after_send: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Render subject+HTML for trigger and queue it in the email outbox.
+    Returns {sent, reason}: sent=True means queued; reason "duplicate" when
+    ``dedup`` was already queued."""
     out: Dict[str, Any] = {"sent": False, "reason": ""}
     settings = get_settings()
     api_key = (getattr(settings, "resend_api_key", "") or "").strip()
@@ -1028,58 +1113,29 @@ def _render_and_send(trigger: str, to_addr: str, ctx: Dict[str, str],
         out["reason"] = "no_resend_key"
         return out
 
-    cfg = get_email_workflow(trigger)
-    raw_subject = (cfg.get("subject") or "").strip()
-    if not raw_subject:
-        raw_subject = (TRIGGER_META.get(trigger) or {}).get("default_subject", "Mensaje de HotBoat")
-    subject = subject_prefix + _apply_template(raw_subject, ctx)
-
-    raw_html = (cfg.get("body_html") or "").strip()
-    if raw_html:
-        html = _apply_template(raw_html, ctx)
-    else:
-        builder = _DEFAULT_TEMPLATES.get(trigger, _default_html_booking_confirmed)
-        html = builder(ctx)
+    subject, html = render_email(trigger, ctx)
+    subject = subject_prefix + subject
 
     from_addr = _get_from_addr(settings)
     # For customer-facing emails, set reply_to to the admin email so replies land in a real inbox
     is_admin_trigger = (TRIGGER_META.get(trigger) or {}).get("recipient") == "admin"
     reply_to_addr = None if is_admin_trigger else (_get_admin_email(settings) or None)
-    logger.info("Sending email trigger=%s to=%s from=%s reply_to=%s", trigger, to_addr, from_addr, reply_to_addr)
+    logger.info("Queueing email trigger=%s to=%s from=%s reply_to=%s", trigger, to_addr, from_addr, reply_to_addr)
     try:
-        send_booking_html(
-            to=to_addr,
-            subject=subject,
-            html=html,
-            from_address=from_addr,
-            api_key=api_key,
-            bcc=_get_bcc(settings),
-            reply_to=reply_to_addr,
+        outbox_id = enqueue_email(
+            trigger, to_addr, subject, html, from_addr,
+            bcc=_get_bcc(settings), reply_to=reply_to_addr,
+            booking_ref=ctx.get("booking_ref"), dedup_key=dedup, after_send=after_send,
         )
-        out["sent"] = True
-        out["reason"] = "ok"
     except Exception as e:
-        # Log the full Resend error so it appears in Railway logs
-        error_detail = str(e)
-        try:
-            # ResendError usually has a response body with more info
-            if hasattr(e, "response"):
-                error_detail += f" | response: {e.response}"
-            if hasattr(e, "body"):
-                error_detail += f" | body: {e.body}"
-        except Exception:
-            pass
-        logger.error(
-            "Email send FAILED trigger=%s to=%s from=%s | %s",
-            trigger, to_addr, from_addr, error_detail,
-        )
-        out["reason"] = error_detail
-    return out
+        logger.error("Email enqueue FAILED trigger=%s to=%s | %s", trigger, to_addr, e)
+        out["reason"] = f"enqueue_error: {e}"
+        return out
+    return queued_result(outbox_id)
 
 
 def _can_send(trigger: str) -> bool:
-    cfg = get_email_workflow(trigger)
-    return bool(cfg.get("enabled"))
+    return bool(_workflow(trigger).get("enabled"))
 
 
 # ── Public trigger functions ──────────────────────────────────────────────────
@@ -1124,12 +1180,9 @@ def send_email_for_trigger(trigger: str, booking_ref: str,
             return out
 
     ctx = _booking_ctx(booking, extra_ctx)
-    out = _render_and_send(trigger, to_addr, ctx)
-
-    if out.get("sent") and trigger == "booking_confirmed":
-        mark_confirmation_email_sent(booking_ref)
-
-    return out
+    after_send = {"hook": "confirmation_sent", "arg": booking_ref} if trigger == "booking_confirmed" else None
+    return _render_and_send(trigger, to_addr, ctx, dedup=_dedup_key(trigger, booking_ref),
+                            after_send=after_send)
 
 
 def send_email_for_trigger_with_data(trigger: str, to_addr: str,
@@ -1195,14 +1248,13 @@ def send_email_for_trigger_with_data(trigger: str, to_addr: str,
         "firma_url":         firma_url,
         "customer_language": raw_lang,
     }
-    return _render_and_send(trigger, to_addr, ctx)
+    return _render_and_send(trigger, to_addr, ctx, dedup=_dedup_key(trigger, booking_ref))
 
 
 def get_default_html_for_trigger(trigger: str) -> str:
     """Return the built-in HTML template for a trigger rendered with sample data."""
-    ctx = _sample_ctx("preview@hotboat.cl")
-    builder = _DEFAULT_TEMPLATES.get(trigger, _default_html_booking_confirmed)
-    return builder(ctx)
+    ctx = _template_ctx(_sample_ctx("preview@hotboat.cl"))
+    return _compiled_default(trigger, ctx.get("customer_language") or "es").render(ctx)
 
 
 def send_test_email_for_trigger(trigger: str, to_addr: str) -> Dict[str, Any]:
@@ -1296,18 +1348,56 @@ def send_manual_followup_email(rid: int) -> Dict[str, Any]:
         "customer_language": lang or "es",
     }
     ctx = _booking_ctx(booking)
-    result = _render_and_send("booking_followup", to_addr, ctx)
+    # Explicit admin action: no dedup key, so it goes out even if the
+    # automatic sweep already sent this booking's follow-up.
+    result = _render_and_send("booking_followup", to_addr, ctx,
+                              after_send={"hook": "manual_followup_sent", "arg": rid})
     if result.get("sent"):
-        mark_followup_sent_after_manual_send(rid)
-        out["sent"] = True
-        out["reason"] = "ok"
-        logger.info("Manual follow-up email sent rid=%s to=%s", rid, to_addr)
+        out.update(result)
+        logger.info("Manual follow-up email queued rid=%s to=%s", rid, to_addr)
     else:
         out["reason"] = result.get("reason") or "send_failed"
         logger.warning("Manual follow-up email failed rid=%s reason=%s", rid, out["reason"])
     return out
 
 
+def _render_and_send_many(trigger: str, messages: List[tuple],
+                          after_send_hook: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Bulk _render_and_send: messages are (to_addr, ctx). Renders every
+    email from the compiled template and queues them all in one INSERT,
+    each deduplicated on (trigger, booking_ref). ``after_send_hook`` runs
+    with the booking_ref once each email is delivered. Returns one
+    {sent, reason} per message, in order."""
+    settings = get_settings()
+    api_key = (getattr(settings, "resend_api_key", "") or "").strip()
+    if not api_key:
+        return [{"sent": False, "reason": "no_resend_key"} for _ in messages]
+    if not messages:
+        return []
+
+    rendered = render_emails(trigger, [ctx for _, ctx in messages])
+    from_addr = _get_from_addr(settings)
+    is_admin_trigger = (TRIGGER_META.get(trigger) or {}).get("recipient") == "admin"
+    reply_to_addr = None if is_admin_trigger else (_get_admin_email(settings) or None)
+    bcc = _get_bcc(settings)
+    queued = []
+    for (to_addr, ctx), (subject, html) in zip(messages, rendered):
+        ref = ctx.get("booking_ref")
+        queued.append({
+            "trigger": trigger, "to": to_addr, "subject": subject, "html": html,
+            "from_address": from_addr, "bcc": bcc, "reply_to": reply_to_addr,
+            "booking_ref": ref, "dedup_key": _dedup_key(trigger, ref),
+            "after_send": {"hook": after_send_hook, "arg": ref} if after_send_hook else None,
+        })
+    logger.info("Queueing %d emails trigger=%s from=%s", len(queued), trigger, from_addr)
+    try:
+        ids = enqueue_emails(queued)
+    except Exception as e:
+        logger.error("Email enqueue FAILED trigger=%s (%d emails) | %s", trigger, len(queued), e)
+        return [{"sent": False, "reason": f"enqueue_error: {e}"} for _ in messages]
+    return [queued_result(i) for i in ids]
+
+
 def run_followup_email_sweep() -> dict:
     """
     Run once per day: find confirmed bookings where booking_date = today - days_after
@@ -1315,7 +1405,7 @@ def run_followup_email_sweep() -> dict:
     Returns {"checked": N, "sent": N, "errors": [...]}
     """
     out = {"checked": 0, "sent": 0, "errors": []}
-    cfg = get_email_workflow("booking_followup")
+    cfg = _workflow("booking_followup")
     if not cfg.get("enabled"):
         out["reason"] = "disabled"
         return out
@@ -1329,15 +1419,19 @@ def run_followup_email_sweep() -> dict:
     bookings = get_bookings_for_followup(hours_after)
     out["checked"] = len(bookings)
 
-    for b in bookings:
-        to_addr = (b.get("customer_email") or "").strip()
-        if not to_addr:
-            continue
-        ctx = _booking_ctx(b)
-        result = _render_and_send("booking_followup", to_addr, ctx)
+    due = [b for b in bookings if (b.get("customer_email") or "").strip()]
+    results = _render_and_send_many(
+        "booking_followup",
+        [((b.get("customer_email") or "").strip(), _booking_ctx(b)) for b in due],
+        after_send_hook="followup_sent",
+    )
+    for b, result in zip(due, results):
         if result.get("sent"):
-            mark_followup_email_sent(b["booking_ref"])
             out["sent"] += 1
+        elif result.get("reason") == "duplicate":
+            # Queued by an earlier sweep and not delivered yet. A dead copy
+            # doesn't block the key, so it was queued again above.
+            continue
         else:
             out["errors"].append({"ref": b["booking_ref"], "reason": result.get("reason")})
 
@@ -1347,7 +1441,8 @@ def run_followup_email_sweep() -> dict:
 
 # ── Legacy aliases (backwards compat) ─────────────────────────────────────────
 
-def send_confirmation_admin_force(booking_id: int, dry_run: bool = False) -> Dict[str, Any]:
+def send_confirmation_admin_force(booking_id: int, dry_run: bool = False,
+                                  booking_ref: Optional[str] = None) -> Dict[str, Any]:
     """
     Force-send booking_confirmed email for any all_appointments row by integer id.
     Shows real extras, flex, coupon, and actual paid/balance amounts from the DB.
@@ -1356,6 +1451,10 @@ def send_confirmation_admin_force(booking_id: int, dry_run: bool = False) -> Dic
     dry_run=True builds the exact same subject/html but does not touch the
     idempotency flag nor actually send — used for the admin "preview before
     sending" flow (mirrors the receipt: see it, then click send).
+
+    booking_ref (payment flow) queues the email once per booking and sets
+    confirmation_email_sent_at on delivery; without it (admin button) every
+    call queues a new email.
     """
     import json as _json
     from app.booking.db import get_connection, _legacy_booking_from_aa
@@ -1608,19 +1707,13 @@ def send_confirmation_admin_force(booking_id: int, dry_run: bool = False) -> Dic
     if not api_key and not dry_run:
         return {"sent": False, "reason": "no_resend_key"}
 
-    cfg = get_email_workflow("booking_confirmed")
-    raw_subject = (cfg.get("subject") or "").strip()
-    if not raw_subject:
-        raw_subject = (TRIGGER_META.get("booking_confirmed") or {}).get(
-            "default_subject", "Confirmación de reserva"
-        )
-    subject = _apply_template(raw_subject, ctx)
-
+    ctx = _template_ctx(ctx)
     lang = ctx.get("customer_language", "es")
+    subject = _compiled_for("booking_confirmed", lang)[0].render(ctx)
+
     name = ctx.get("customer_name", "")
-    website  = ctx.get("business_website", "#")
-    firma_url = ctx.get("firma_url", "") or website
-    tabla_url = ctx.get("tabla_url", "") or "https://hotboatchile.com/tablas/"
+    firma_url = ctx["firma_link"]
+    tabla_url = ctx["tabla_link"]
     accent = (
         '<td width="50%" height="4" bgcolor="#34a394" style="line-height:4px;font-size:0;">&nbsp;</td>'
         '<td width="50%" height="4" bgcolor="#e8b86d" style="line-height:4px;font-size:0;">&nbsp;</td>'
@@ -1690,17 +1783,14 @@ def send_confirmation_admin_force(booking_id: int, dry_run: bool = False) -> Dic
         out["reason"] = "preview"
         return out
     try:
-        send_booking_html(
-            to=to_addr,
-            subject=subject,
-            html=html,
-            from_address=from_addr,
-            api_key=api_key,
-            bcc=_get_bcc(s),
-            reply_to=reply_to_addr,
+        outbox_id = enqueue_email(
+            "booking_confirmed", to_addr, subject, html, from_addr,
+            bcc=_get_bcc(s), reply_to=reply_to_addr,
+            booking_ref=booking_ref or ctx.get("booking_ref"),
+            dedup_key=dedup_key("booking_confirmed", booking_ref),
+            after_send={"hook": "confirmation_sent", "arg": booking_ref} if booking_ref else None,
         )
-        out["sent"] = True
-        out["reason"] = "ok"
+        out.update(queued_result(outbox_id))
     except Exception as e:
         out["reason"] = str(e)
         logger.error("send_confirmation_admin_force failed booking_id=%s to=%s: %s", booking_id, to_addr, e)
@@ -1728,12 +1818,10 @@ def try_send_booking_confirmation_after_payment(booking_ref: str) -> Dict[str, A
         logger.warning("try_send_booking_confirmation_after_payment: no id for ref=%s", booking_ref)
         return {"sent": False, "reason": "no_id"}
 
-    # Use the same rich-email builder the admin panel uses — always real data
-    result = send_confirmation_admin_force(booking_id)
-
-    # Mark idempotency flag so the pending-payment sweep doesn't re-send
-    if result.get("sent"):
-        mark_confirmation_email_sent(booking_ref)
+    # Use the same rich-email builder the admin panel uses — always real data.
+    # Queued once per booking_ref; confirmation_email_sent_at is set on
+    # delivery, so the pending-payment sweep doesn't re-send.
+    result = send_confirmation_admin_force(booking_id, booking_ref=booking_ref)
 
     # Also notify the operator
     try:
@@ -2005,16 +2093,9 @@ def send_daily_summary_email() -> Dict[str, Any]:
 
     from_addr = _get_from_addr(settings)
     try:
-        result = send_booking_html(
-            to=to_addr,
-            subject=subject,
-            html=html,
-            from_address=from_addr,
-            api_key=api_key,
-        )
+        out["outbox_id"] = enqueue_email("daily_summary", to_addr, subject, html, from_addr)
         out["sent"] = True
-        out["resend_id"] = result.get("id") if isinstance(result, dict) else str(result)
-        logger.info("daily_summary: sent to %s (%s bookings)", to_addr, len(bookings))
+        logger.info("daily_summary: queued for %s (%s bookings)", to_addr, len(bookings))
     except Exception as send_err:
         out["reason"] = f"send_error: {send_err}"
         logger.error("daily_summary: send error: %s", send_err)
@@ -2306,16 +2387,9 @@ def send_yesterday_summary_email() -> Dict[str, Any]:
 
     from_addr = _get_from_addr(s)
     try:
-        result = send_booking_html(
-            to=_NOTIF_TO,
-            subject=subject,
-            html=html,
-            from_address=from_addr,
-            api_key=api_key,
-        )
+        out["outbox_id"] = enqueue_email("yesterday_summary", _NOTIF_TO, subject, html, from_addr)
         out["sent"] = True
-        out["resend_id"] = result.get("id") if isinstance(result, dict) else str(result)
-        logger.info("yesterday_summary: sent %s bookings, %s alerts", len(bookings), n_alerts)
+        logger.info("yesterday_summary: queued %s bookings, %s alerts", len(bookings), n_alerts)
     except Exception as e:
         out["reason"] = str(e)
         logger.error("yesterday_summary send error: %s", e)
@@ -2410,16 +2484,9 @@ def send_weekly_summary_email() -> Dict[str, Any]:
 
     from_addr = _get_from_addr(s)
     try:
-        result = send_booking_html(
-            to=_NOTIF_TO,
-            subject=subject,
-            html=html,
-            from_address=from_addr,
-            api_key=api_key,
-        )
+        out["outbox_id"] = enqueue_email("weekly_summary", _NOTIF_TO, subject, html, from_addr)
         out["sent"] = True
-        out["resend_id"] = result.get("id") if isinstance(result, dict) else str(result)
-        logger.info("weekly_summary: sent %s bookings for week %s–%s", len(bookings), week_start_str, week_end_str)
+        logger.info("weekly_summary: queued %s bookings for week %s–%s", len(bookings), week_start_str, week_end_str)
     except Exception as e:
         out["reason"] = str(e)
         logger.error("weekly_summary send error: %s", e)
@@ -67,10 +67,7 @@ def _ensure_tables():
                     "menu_description_en TEXT",
                     "menu_description_pt TEXT",
                 ]:
-                    try:
-                        cur.execute(f"ALTER TABLE bot_responses ADD COLUMN IF NOT EXISTS {col_def}")
-                    except Exception:
-                        pass
+                    cur.execute(f"ALTER TABLE bot_responses ADD COLUMN IF NOT EXISTS {col_def}")
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS bot_keywords (
                         id           SERIAL PRIMARY KEY,
@@ -104,6 +101,7 @@ def _ensure_tables():
         logger.info("✅ bot_responses / bot_keywords / bot_ab_variants tables ready")
     except Exception as e:
         logger.warning("bot config tables setup failed: %s", e)
+        raise
 
 
 # ── Responses ─────────────────────────────────────────────────────────────────
@@ -217,7 +215,8 @@ async def get_quick_replies():
 # ── Shared helper (importable by other modules) ───────────────────────────────
 
 def get_bot_response(key: str, lang: str = "es") -> Optional[str]:
-    """Return bot response content from DB for the given key and language, or None."""
+    """Return bot response content for the given key and language, or None.
+    Served from the catalog snapshot — no query per call."""
     if lang == "es":
         from app.bot.variant_overrides import get_override
         override = get_override(key)
@@ -225,16 +224,10 @@ def get_bot_response(key: str, lang: str = "es") -> Optional[str]:
             return override
 
     try:
-        col = {"es": "content_es", "en": "content_en", "pt": "content_pt"}.get(lang, "content_es")
-        with _get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    f"SELECT {col}, content_es FROM bot_responses WHERE response_key = %s",
-                    (key,)
-                )
-                row = cur.fetchone()
+        from app.booking.catalog import catalog
+        row = catalog.snapshot().bot_responses.get(key)
         if row:
-            return row[0] or row[1]
+            return row.get(lang) or row["es"]
     except Exception:
         pass
     return None
@@ -1111,3 +1104,4 @@ def seed_defaults():
         logger.info("✅ bot config defaults seeded")
     except Exception as e:
         logger.warning("bot config seed failed: %s", e)
+        raise
@@ -0,0 +1,402 @@
+"""
+Catalog registry — one in-memory snapshot of everything customers browse
+
+Extras, packs, experiences, accommodations, per-person boat prices and bot
+responses used to be read straight from Postgres by each consumer on its
+own schedule: CartManager loaded extra prices once at startup, PRICES was
+filled once by load_prices_from_db(), get_bot_response() ran a SELECT per
+call and every /api/content/* request re-queried (and re-ALTERed) its
+table. An admin edit on one replica never reached the other three.
+
+Now a single CatalogRegistry holds an immutable snapshot built in one
+pass. Statement-level triggers on the catalog tables NOTIFY the
+``catalog_changed`` channel on any write — whichever admin endpoint (or
+stock movement) made it — and every replica's listener rebuilds its
+snapshot a moment later. Readers never query: they take the current
+snapshot reference, so a refresh swaps it atomically under them.
+
+``Snapshot.version`` is a hash of the snapshot's content, identical on
+every replica that loaded the same data, which makes it usable as the
+ETag of the public content endpoints.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "catalog_changed"
+# Writes come in bursts (an admin save touches several rows, auto stock
+# consumption updates several products) — coalesce them into one reload.
+REFRESH_DEBOUNCE_S = 1.0
+# Safety net in case a NOTIFY is lost while the listener reconnects.
+REFRESH_MAX_AGE_S = 300
+LISTEN_RETRY_S = 5
+
+# Tables whose writes invalidate the snapshot. stock_products/extras_bom
+# are here because an extra with no stock disappears from the booking app.
+_WATCHED_TABLES = (
+    "extras_visibility",
+    "extras_bom",
+    "stock_products",
+    "packs",
+    "experiences",
+    "alojamientos",
+    "bot_responses",
+)
+_SETTING_KEYS = ("prices_per_person",)
+
+
+class Snapshot:
+    """Immutable view of the catalog. Never mutate the collections of a
+    snapshot that has been published — copy a row before localizing it."""
+
+    __slots__ = (
+        "version", "generation", "loaded_at",
+        "extras", "extra_prices", "packs", "experiences", "alojamientos",
+        "prices", "bot_responses",
+    )
+
+    def __init__(self, generation: int, **sections):
+        self.generation = generation
+        self.loaded_at = time.time()
+        self.extras: List[dict] = sections["extras"]
+        self.extra_prices: Dict[str, int] = sections["extra_prices"]
+        self.packs: List[dict] = sections["packs"]
+        self.experiences: List[dict] = sections["experiences"]
+        self.alojamientos: List[dict] = sections["alojamientos"]
+        self.prices: Dict[int, int] = sections["prices"]
+        self.bot_responses: Dict[str, dict] = sections["bot_responses"]
+        digest = hashlib.sha1(
+            json.dumps(sections, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        self.version = digest[:16]
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.version}"'
+
+
+def slugify_extra(s: str) -> str:
+    """Stable key for an extra from its display name (also used by extras_bom)."""
+    s = unicodedata.normalize("NFKD", str(s)).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "_", s.lower()).strip("_")
+
+
+# ── Loaders (one per section, all on the same connection) ────────────────────
+
+def _load_extras(cur) -> tuple:
+    """Extras visible in the booking app, with every translation, already
+    filtered by stock (directly or through the BOM) — see list_extras()."""
+    cur.execute("""
+        SELECT ev.extra_name_lower,
+               COALESCE(ev.name, ev.extra_name_lower) AS name_es,
+               COALESCE(ev.precio_venta, 0)           AS price,
+               COALESCE(ev.icon, '')                  AS icon,
+               COALESCE(ev.description, '')           AS description_es,
+               COALESCE(NULLIF(TRIM(ev.name_en), ''), '') AS name_en,
+               COALESCE(NULLIF(TRIM(ev.name_pt), ''), '') AS name_pt,
+               COALESCE(NULLIF(TRIM(ev.description_en), ''), '') AS description_en,
+               COALESCE(NULLIF(TRIM(ev.description_pt), ''), '') AS description_pt,
+               COALESCE(ev.sort_order, 999)           AS sort_order
+        FROM extras_visibility ev
+        LEFT JOIN stock_products sp ON sp.id = ev.stock_product_id
+        WHERE ev.show_in_booking = TRUE
+          AND COALESCE(ev.user_hidden, FALSE) = FALSE
+          AND (ev.stock_product_id IS NULL OR sp.current_stock > 0)
+        ORDER BY ev.sort_order, ev.extra_name_lower
+    """)
+    extras = []
+    for row in cur.fetchall():
+        (name_lower, name_es, price, icon, description_es,
+         name_en, name_pt, description_en, description_pt, sort_order) = row
+        extras.append({
+            "id": name_lower,
+            "key": slugify_extra(name_es),
+            "name_es": name_es,
+            "name_en": (name_en or "").strip(),
+            "name_pt": (name_pt or "").strip(),
+            "description_es": description_es,
+            "description_en": (description_en or "").strip(),
+            "description_pt": (description_pt or "").strip(),
+            "price": price,
+            "icon": icon,
+            "sort_order": int(sort_order),
+            "has_variants": False,
+        })
+
+    # Stock-aware filtering via the BOM (bill of materials):
+    #   - non-variant rows: every component is consumed (all must be in stock)
+    #   - variant rows: the customer picks ONE (at least one must be in stock)
+    # extras_bom.extra_slug may hold either the pk or the slugified name.
+    if extras:
+        all_slugs = list({s for e in extras for s in (e["key"], e["id"])})
+        cur.execute("""
+            SELECT b.extra_slug, b.is_variant,
+                   COALESCE(sp.current_stock, 0) AS stock
+            FROM extras_bom b
+            LEFT JOIN stock_products sp ON sp.id = b.product_id
+            WHERE b.extra_slug = ANY(%s)
+        """, (all_slugs,))
+        bom_by_slug: Dict[str, list] = {}
+        for slug, is_var, stock in cur.fetchall():
+            bom_by_slug.setdefault(slug, []).append((bool(is_var), float(stock)))
+
+        visible = []
+        for e in extras:
+            rows = []
+            for s in {e["key"], e["id"]}:
+                rows.extend(bom_by_slug.get(s, []))
+            variant_rows = [r for r in rows if r[0]]
+            nonvariant_rows = [r for r in rows if not r[0]]
+            in_stock_variants = [r for r in variant_rows if r[1] > 0]
+            e["has_variants"] = bool(in_stock_variants)
+            if nonvariant_rows and any(r[1] <= 0 for r in nonvariant_rows):
+                continue
+            if variant_rows and not nonvariant_rows and not in_stock_variants:
+                continue
+            visible.append(e)
+        extras = visible
+
+    # Cart prices cover every priced extra, not only the bookable ones.
+    cur.execute("""
+        SELECT LOWER(COALESCE(name, extra_name_lower)), COALESCE(precio_venta, 0)
+        FROM extras_visibility
+        WHERE precio_venta IS NOT NULL AND precio_venta > 0
+    """)
+    extra_prices = {r[0]: r[1] for r in cur.fetchall()}
+    return extras, extra_prices
+
+
+def _load_rows(cur, sql: str) -> List[dict]:
+    cur.execute(sql)
+    cols = [d.name for d in cur.description]
+    return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def _load_alojamientos(cur) -> List[dict]:
+    return _load_rows(cur, (
+        "SELECT id,slug,name,group_name,icon,description,"
+        "COALESCE(name_en,'') AS name_en,COALESCE(name_pt,'') AS name_pt,"
+        "COALESCE(description_en,'') AS description_en,COALESCE(description_pt,'') AS description_pt,"
+        "COALESCE(group_name_en,'') AS group_name_en,COALESCE(group_name_pt,'') AS group_name_pt,"
+        "price_from,cost_from,capacity,image_path,"
+        "COALESCE(extra_images,'[]'::jsonb) AS extra_images,"
+        "is_active,display_order"
+        " FROM alojamientos ORDER BY display_order,id"
+    ))
+
+
+def _load_experiences(cur) -> List[dict]:
+    return _load_rows(cur, (
+        "SELECT id,slug,name,icon,description,"
+        "COALESCE(name_en,'') AS name_en,COALESCE(name_pt,'') AS name_pt,"
+        "COALESCE(description_en,'') AS description_en,COALESCE(description_pt,'') AS description_pt,"
+        "COALESCE(admin_whatsapp,'') AS admin_whatsapp,"
+        "price_per_person,cost_per_person,image_path,COALESCE(extra_images,'[]'::jsonb) AS extra_images,"
+        "is_active,display_order FROM experiences ORDER BY display_order,id"
+    ))
+
+
+def _load_packs(cur) -> List[dict]:
+    rows = _load_rows(cur, (
+        "SELECT id,slug,name,icon,description,"
+        "COALESCE(name_en,'') AS name_en,COALESCE(name_pt,'') AS name_pt,"
+        "COALESCE(description_en,'') AS description_en,COALESCE(description_pt,'') AS description_pt,"
+        "COALESCE(admin_whatsapp,'') AS admin_whatsapp,"
+        "personas,price_from,cost_from,image_path,COALESCE(extra_images,'[]'::jsonb) AS extra_images,"
+        "COALESCE(includes,'[]'::jsonb) AS includes,"
+        "COALESCE(includes_en,'[]'::jsonb) AS includes_en,"
+        "COALESCE(includes_pt,'[]'::jsonb) AS includes_pt,"
+        "is_active,display_order FROM packs ORDER BY display_order,id"
+    ))
+    for row in rows:
+        for col in ("includes", "includes_en", "includes_pt"):
+            if isinstance(row.get(col), str):
+                row[col] = json.loads(row[col])
+    return rows
+
+
+def _load_prices(cur) -> Dict[int, int]:
+    """Per-person boat prices: code defaults overlaid with the admin's
+    prices_per_person setting (same merge the admin endpoint does)."""
+    from app.booking.db import _DEFAULT_PRICES, _OLD_PRICES
+    prices = dict(_DEFAULT_PRICES)
+    cur.execute("SELECT value FROM hotboat_settings WHERE key = 'prices_per_person'")
+    row = cur.fetchone()
+    if row and row[0]:
+        stored = {int(k): int(v) for k, v in json.loads(row[0]).items()}
+        # load_prices_from_db() rewrites the pre-2026-06 schedule at startup
+        if stored != _OLD_PRICES:
+            prices.update(stored)
+    return prices
+
+
+def _load_bot_responses(cur) -> Dict[str, dict]:
+    cur.execute("SELECT response_key, content_es, content_en, content_pt FROM bot_responses")
+    return {r[0]: {"es": r[1], "en": r[2], "pt": r[3]} for r in cur.fetchall()}
+
+
+# (section, loader, empty value) — extras is loaded separately because it
+# yields two sections from the same queries.
+_SECTIONS = (
+    ("alojamientos", _load_alojamientos, list),
+    ("experiences", _load_experiences, list),
+    ("packs", _load_packs, list),
+    ("prices", _load_prices, dict),
+    ("bot_responses", _load_bot_responses, dict),
+)
+
+
+class CatalogRegistry:
+    def __init__(self):
+        self._snapshot: Optional[Snapshot] = None
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    def snapshot(self) -> Snapshot:
+        """Current snapshot; the first call loads it synchronously."""
+        snap = self._snapshot
+        if snap is None:
+            with self._lock:
+                snap = self._snapshot or self.refresh()
+        return snap
+
+    def refresh(self) -> Snapshot:
+        """Rebuild the snapshot from Postgres and publish it. A section that
+        fails to load (e.g. its table is missing) keeps its previous value."""
+        from app.db.connection import get_connection
+        prev = self._snapshot
+        sections: dict = {}
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                try:
+                    sections["extras"], sections["extra_prices"] = _load_extras(cur)
+                except Exception as e:
+                    conn.rollback()
+                    logger.warning(f"catalog: extras not refreshed: {e}")
+                    sections["extras"] = prev.extras if prev else []
+                    sections["extra_prices"] = prev.extra_prices if prev else {}
+                for name, loader, empty in _SECTIONS:
+                    try:
+                        sections[name] = loader(cur)
+                    except Exception as e:
+                        conn.rollback()
+                        logger.warning(f"catalog: {name} not refreshed: {e}")
+                        sections[name] = getattr(prev, name) if prev else empty()
+            conn.rollback()  # read-only
+        with self._lock:
+            self._generation += 1
+            snap = Snapshot(self._generation, **sections)
+            self._publish(snap)
+        return snap
+
+    def _publish(self, snap: Snapshot) -> None:
+        prev = self._snapshot
+        self._snapshot = snap
+        # PRICES is imported by name all over the booking code — replace its
+        # contents in place rather than rebinding it. Stale tiers go first and
+        # the rest is overwritten, so a reader never sees it empty.
+        from app.booking.db import PRICES
+        for n in PRICES.keys() - snap.prices.keys():
+            PRICES.pop(n, None)
+        PRICES.update(snap.prices)
+        if prev is None or prev.version != snap.version:
+            logger.info(
+                f"📚 Catalog v{snap.generation} ({snap.version}): {len(snap.extras)} extras, "
+                f"{len(snap.packs)} packs, {len(snap.experiences)} experiences, "
+                f"{len(snap.alojamientos)} alojamientos, {len(snap.bot_responses)} bot responses"
+            )
+
+    async def run_listener(self) -> None:
+        """LISTEN on catalog_changed and reload after each burst of writes.
+        Runs on every replica; a reload also happens after every (re)connect
+        and at least every REFRESH_MAX_AGE_S."""
+        from app.db.connection import connect_dedicated
+        while True:
+            try:
+                async with connect_dedicated("listen:catalog", autocommit=True) as aconn:
+                    await aconn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    while True:
+                        await asyncio.to_thread(self.refresh)
+                        # Block until the first write (or the max age)...
+                        async for _ in aconn.notifies(timeout=REFRESH_MAX_AGE_S, stop_after=1):
+                            pass
+                        # ...then swallow the rest of its burst.
+                        async for _ in aconn.notifies(timeout=REFRESH_DEBOUNCE_S):
+                            pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"catalog LISTEN error: {e}")
+            await asyncio.sleep(LISTEN_RETRY_S)
+
+
+catalog = CatalogRegistry()
+
+
+def ensure_catalog_notifications() -> None:
+    """Install the NOTIFY triggers on the catalog tables (idempotent; safe
+    with several replicas starting at once) and add the translation columns
+    the public endpoints used to ALTER in on every request."""
+    from app.db.connection import get_connection
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                for col_def in ("name TEXT", "description TEXT", "name_en TEXT", "name_pt TEXT",
+                                "description_en TEXT", "description_pt TEXT"):
+                    cur.execute(f"ALTER TABLE IF EXISTS extras_visibility ADD COLUMN IF NOT EXISTS {col_def}")
+                for table in ("experiences", "packs"):
+                    for col_def in ("name_en TEXT", "name_pt TEXT", "description_en TEXT",
+                                    "description_pt TEXT", "admin_whatsapp TEXT",
+                                    "extra_images JSONB DEFAULT '[]'::jsonb"):
+                        cur.execute(f"ALTER TABLE IF EXISTS {table} ADD COLUMN IF NOT EXISTS {col_def}")
+                for col_def in ("includes_en JSONB DEFAULT '[]'::jsonb", "includes_pt JSONB DEFAULT '[]'::jsonb"):
+                    cur.execute(f"ALTER TABLE IF EXISTS packs ADD COLUMN IF NOT EXISTS {col_def}")
+                cur.execute(f"""
+                    CREATE OR REPLACE FUNCTION notify_catalog_changed() RETURNS trigger AS $$
+                    BEGIN
+                        PERFORM pg_notify('{NOTIFY_CHANNEL}', TG_TABLE_NAME);
+                        RETURN NULL;
+                    END
+                    $$ LANGUAGE plpgsql
+                """)
+                cur.execute(
+                    "SELECT c.relname FROM pg_trigger t JOIN pg_class c ON c.oid = t.tgrelid "
+                    "WHERE t.tgname = 'trg_catalog_changed'"
+                )
+                installed = {r[0] for r in cur.fetchall()}
+                for table in _WATCHED_TABLES + ("hotboat_settings",):
+                    if table in installed:
+                        continue
+                    cur.execute("SELECT to_regclass(%s)", (table,))
+                    if cur.fetchone()[0] is None:
+                        continue
+                    if table == "hotboat_settings":
+                        # Settings hold much more than prices — only those keys count.
+                        keys = ", ".join(f"'{k}'" for k in _SETTING_KEYS)
+                        cur.execute(f"""
+                            CREATE TRIGGER trg_catalog_changed
+                            AFTER INSERT OR UPDATE ON hotboat_settings
+                            FOR EACH ROW WHEN (NEW.key IN ({keys}))
+                            EXECUTE FUNCTION notify_catalog_changed()
+                        """)
+                    else:
+                        cur.execute(f"""
+                            CREATE TRIGGER trg_catalog_changed
+                            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                            FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed()
+                        """)
+            conn.commit()
+        logger.info("✅ Catalog change notifications ready")
+    except Exception as e:
+        # Only runs from migrations, under the migration lock: no other
+        # replica is installing the same triggers.
+        logger.warning(f"catalog notification setup failed: {e}")
+        raise
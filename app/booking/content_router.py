@@ -3,8 +3,10 @@ import logging
 import os
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from pydantic import BaseModel
+from app.booking.catalog import catalog, slugify_extra
+from app.booking.occupancy import availability_calendars
 from app.db.connection import get_connection
 
 logger = logging.getLogger(__name__)
@@ -35,117 +37,43 @@ def _default_extra_icon(key: str) -> str:
     return "🎁"
 
 
+def _lang(lang: Optional[str]) -> str:
+    lang = (lang or "es").lower().strip()[:2]
+    return lang if lang in ("es", "en", "pt") else "es"
+
+
+def _not_modified(request: Request, response: Response, snap) -> Optional[Response]:
+    """Tag the response with the catalog version; short-circuit to 304 when
+    the client already holds it. The version is a content hash, so it is
+    the same whichever replica answers."""
+    response.headers["ETag"] = snap.etag
+    if snap.etag in (request.headers.get("if-none-match") or ""):
+        return Response(status_code=304, headers={"ETag": snap.etag})
+    return None
+
+
 @content_router.get("/api/content/extras")
-def list_extras(lang: str = Query("es", description="es | en | pt")):
+def list_extras(request: Request, response: Response, lang: str = Query("es", description="es | en | pt")):
     """Public endpoint: returns extras visible in the booking app (show_in_booking = TRUE)."""
     try:
-        from app.booking.admin_router import _slugify_extra
-        lang = (lang or "es").lower().strip()[:2]
-        if lang not in ("es", "en", "pt"):
-            lang = "es"
-        # Ensure columns exist before querying (may not exist on first deploy)
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                for col_def in [
-                    "name TEXT",
-                    "description TEXT",
-                    "name_en TEXT",
-                    "name_pt TEXT",
-                    "description_en TEXT",
-                    "description_pt TEXT",
-                ]:
-                    cur.execute(f"ALTER TABLE extras_visibility ADD COLUMN IF NOT EXISTS {col_def}")
-                conn.commit()
-
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT ev.extra_name_lower,
-                           COALESCE(ev.name, ev.extra_name_lower) AS name_es,
-                           COALESCE(ev.precio_venta, 0)           AS price,
-                           COALESCE(ev.icon, '')                  AS icon,
-                           COALESCE(ev.description, '')           AS description_es,
-                           COALESCE(NULLIF(TRIM(ev.name_en), ''), '') AS name_en,
-                           COALESCE(NULLIF(TRIM(ev.name_pt), ''), '') AS name_pt,
-                           COALESCE(NULLIF(TRIM(ev.description_en), ''), '') AS description_en,
-                           COALESCE(NULLIF(TRIM(ev.description_pt), ''), '') AS description_pt,
-                           COALESCE(ev.sort_order, 999)           AS sort_order
-                    FROM extras_visibility ev
-                    LEFT JOIN stock_products sp ON sp.id = ev.stock_product_id
-                    WHERE ev.show_in_booking = TRUE
-                      AND COALESCE(ev.user_hidden, FALSE) = FALSE
-                      AND (ev.stock_product_id IS NULL OR sp.current_stock > 0)
-                    ORDER BY ev.sort_order, ev.extra_name_lower
-                """)
-                extras = []
-                for row in cur.fetchall():
-                    (name_lower, name_es, price, icon, description_es,
-                     name_en, name_pt, description_en, description_pt, sort_order) = row
-                    if lang == "en":
-                        name = (name_en or "").strip() or name_es
-                        description = (description_en or "").strip() or description_es
-                    elif lang == "pt":
-                        name = (name_pt or "").strip() or name_es
-                        description = (description_pt or "").strip() or description_es
-                    else:
-                        name = name_es
-                        description = description_es
-                    key = _slugify_extra(name_es)
-                    resolved_icon = icon or _default_extra_icon(key)
-                    extras.append({
-                        "id": name_lower,
-                        "key": key,
-                        "name": name,
-                        "price": price,
-                        "icon": resolved_icon,
-                        "description": description,
-                        "sort_order": int(sort_order),
-                        "has_variants": False,   # filled below
-                    })
-
-                # Stock-aware filtering via the BOM (bill of materials).
-                # An extra's stock can be tracked through extras_bom in two ways:
-                #   - non-variant rows: every component is consumed (all must be in stock)
-                #   - variant rows: the customer picks ONE (at least one must be in stock)
-                # extras_bom.extra_slug may be stored as either the DB pk
-                # (extra_name_lower) or the slugified display name (key), so we
-                # gather both formats per extra.
-                if extras:
-                    all_slugs = list({s for e in extras for s in (e["key"], e["id"])})
-                    cur.execute("""
-                        SELECT b.extra_slug, b.is_variant,
-                               COALESCE(sp.current_stock, 0) AS stock
-                        FROM extras_bom b
-                        LEFT JOIN stock_products sp ON sp.id = b.product_id
-                        WHERE b.extra_slug = ANY(%s)
-                    """, (all_slugs,))
-                    bom_by_slug = {}
-                    for slug, is_var, stock in cur.fetchall():
-                        bom_by_slug.setdefault(slug, []).append((bool(is_var), float(stock)))
-
-                    visible = []
-                    for e in extras:
-                        rows = []
-                        for s in {e["key"], e["id"]}:
-                            rows.extend(bom_by_slug.get(s, []))
-                        variant_rows = [r for r in rows if r[0]]
-                        nonvariant_rows = [r for r in rows if not r[0]]
-                        in_stock_variants = [r for r in variant_rows if r[1] > 0]
-                        e["has_variants"] = bool(in_stock_variants)
-
-                        out_of_stock = False
-                        # Any required (non-variant) component depleted → can't make it
-                        if nonvariant_rows and any(r[1] <= 0 for r in nonvariant_rows):
-                            out_of_stock = True
-                        # Only stock source is variants and every one is depleted
-                        elif variant_rows and not nonvariant_rows and not in_stock_variants:
-                            out_of_stock = True
-
-                        if not out_of_stock:
-                            visible.append(e)
-                    extras = visible
-
-        # already sorted by DB ORDER BY
+        snap = catalog.snapshot()
+        not_modified = _not_modified(request, response, snap)
+        if not_modified:
+            return not_modified
+        lang = _lang(lang)
+        extras = []
+        # Already sorted and stock-filtered when the snapshot was built.
+        for e in snap.extras:
+            extras.append({
+                "id": e["id"],
+                "key": e["key"],
+                "name": e[f"name_{lang}"] or e["name_es"],
+                "price": e["price"],
+                "icon": e["icon"] or _default_extra_icon(e["key"]),
+                "description": e[f"description_{lang}"] or e["description_es"],
+                "sort_order": e["sort_order"],
+                "has_variants": e["has_variants"],
+            })
         return {"extras": extras}
     except Exception as e:
         logger.error(f"Error fetching public extras: {e}")
@@ -157,8 +85,7 @@ def list_extra_variants(slug: str):
     """Public: variant ingredient options for an extra, only those with current_stock > 0.
     Accepts both the slugified key and the raw extra_name_lower as slug formats."""
     try:
-        from app.booking.admin_router import _slugify_extra
-        alt_slug = _slugify_extra(slug)
+        alt_slug = slugify_extra(slug)
         slugs = list({slug, alt_slug})
         with get_connection() as conn:
             with conn.cursor() as cur:
@@ -183,38 +110,34 @@ def list_extra_variants(slug: str):
 
 
 @content_router.get("/api/content/alojamientos")
-def list_alojamientos(active_only: bool = True, lang: str = Query("es", description="es | en | pt")):
-    lang = (lang or "es").lower().strip()[:2]
-    if lang not in ("es", "en", "pt"):
-        lang = "es"
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            q = ("SELECT id,slug,name,group_name,icon,description,"
-                 "COALESCE(name_en,'') AS name_en,COALESCE(name_pt,'') AS name_pt,"
-                 "COALESCE(description_en,'') AS description_en,COALESCE(description_pt,'') AS description_pt,"
-                 "COALESCE(group_name_en,'') AS group_name_en,COALESCE(group_name_pt,'') AS group_name_pt,"
-                 "price_from,cost_from,capacity,image_path,"
-                 "COALESCE(extra_images,'[]'::jsonb) AS extra_images,"
-                 "is_active,display_order"
-                 " FROM alojamientos")
-            if active_only:
-                q += " WHERE is_active=TRUE"
-            q += " ORDER BY display_order,id"
-            cur.execute(q)
-            cols = [d.name for d in cur.description]
-            rows = []
-            for r in cur.fetchall():
-                row = dict(zip(cols, r))
-                if lang == "en":
-                    row["name"] = (row.get("name_en") or "").strip() or row.get("name")
-                    row["description"] = (row.get("description_en") or "").strip() or row.get("description")
-                    row["group_name"] = (row.get("group_name_en") or "").strip() or row.get("group_name")
-                elif lang == "pt":
-                    row["name"] = (row.get("name_pt") or "").strip() or row.get("name")
-                    row["description"] = (row.get("description_pt") or "").strip() or row.get("description")
-                    row["group_name"] = (row.get("group_name_pt") or "").strip() or row.get("group_name")
-                rows.append(row)
-            return {"alojamientos": rows}
+def list_alojamientos(request: Request, response: Response, active_only: bool = True,
+                      lang: str = Query("es", description="es | en | pt")):
+    snap = catalog.snapshot()
+    not_modified = _not_modified(request, response, snap)
+    if not_modified:
+        return not_modified
+    lang = _lang(lang)
+    rows = []
+    for aloj in snap.alojamientos:
+        if active_only and not aloj["is_active"]:
+            continue
+        row = dict(aloj)
+        if lang in ("en", "pt"):
+            row["name"] = (row.get(f"name_{lang}") or "").strip() or row.get("name")
+            row["description"] = (row.get(f"description_{lang}") or "").strip() or row.get("description")
+            row["group_name"] = (row.get(f"group_name_{lang}") or "").strip() or row.get("group_name")
+        rows.append(row)
+    return {"alojamientos": rows}
+
+
+@content_router.get("/api/content/accommodation-availability")
+def list_accommodation_availability(slugs: Optional[str] = Query(None, description="Comma-separated slugs; all active if omitted")):
+    """
+    Calendars for several accommodations in one call (the booking page shows
+    every unit). Same per-unit shape as the single-slug endpoint.
+    """
+    wanted = [s.strip() for s in slugs.split(",") if s.strip()] if slugs else None
+    return {"alojamientos": availability_calendars(wanted)}
 
 
 @content_router.get("/api/content/accommodation-availability/{slug}")
@@ -223,148 +146,53 @@ def get_accommodation_availability(slug: str):
     Returns fully_booked_dates (all units taken — disabled in calendar)
     and admin-blocked ranges (solicitud flow — look normal, different outcome).
     """
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id, COALESCE(total_units,1) FROM alojamientos WHERE slug=%s AND is_active=TRUE",
-                (slug,)
-            )
-            row = cur.fetchone()
-            if not row:
-                raise HTTPException(status_code=404, detail="Alojamiento no encontrado")
-            aloj_id, total_units = row[0], max(int(row[1]), 1)
-
-            # Dates where every unit is booked (count of overlapping confirmed bookings >= total_units)
-            cur.execute(
-                """
-                SELECT gs.d::text
-                FROM generate_series(
-                    CURRENT_DATE,
-                    CURRENT_DATE + INTERVAL '365 days',
-                    INTERVAL '1 day'
-                ) AS gs(d)
-                WHERE (
-                    SELECT COUNT(*) FROM accommodation_bookings ab
-                    WHERE ab.accommodation_id = %s
-                      AND ab.status NOT IN ('cancelled')
-                      AND ab.check_in  <= gs.d
-                      AND ab.check_out  > gs.d
-                ) >= %s
-                ORDER BY gs.d
-                """,
-                (aloj_id, total_units)
-            )
-            fully_booked = [r[0] for r in cur.fetchall()]
-
-            cur.execute(
-                "SELECT start_date::text, end_date::text, reason"
-                " FROM accommodation_blocked_dates"
-                " WHERE accommodation_id=%s AND end_date >= CURRENT_DATE"
-                " ORDER BY start_date",
-                (aloj_id,)
-            )
-            blocked = [{"start": r[0], "end": r[1], "reason": r[2]} for r in cur.fetchall()]
-
-            return {
-                "alojamiento_id": aloj_id,
-                "total_units": total_units,
-                "fully_booked_dates": fully_booked,
-                "blocked": blocked,
-            }
+    calendars = availability_calendars([slug])
+    if not calendars:
+        raise HTTPException(status_code=404, detail="Alojamiento no encontrado")
+    cal = calendars[0]
+    cal.pop("slug")
+    return cal
 
 
 @content_router.get("/api/content/experiencias")
-def list_experiencias(active_only: bool = True, lang: str = Query("es", description="es | en | pt")):
-    lang = (lang or "es").lower().strip()[:2]
-    if lang not in ("es", "en", "pt"):
-        lang = "es"
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS name_en TEXT")
-            cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS name_pt TEXT")
-            cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS description_en TEXT")
-            cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS description_pt TEXT")
-            cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS admin_whatsapp TEXT")
-            cur.execute("ALTER TABLE experiences ADD COLUMN IF NOT EXISTS extra_images JSONB DEFAULT '[]'::jsonb")
-            q = (
-                "SELECT id,slug,name,icon,description,"
-                "COALESCE(name_en,'') AS name_en,COALESCE(name_pt,'') AS name_pt,"
-                "COALESCE(description_en,'') AS description_en,COALESCE(description_pt,'') AS description_pt,"
-                "COALESCE(admin_whatsapp,'') AS admin_whatsapp,"
-                "price_per_person,cost_per_person,image_path,COALESCE(extra_images,'[]'::jsonb) AS extra_images,"
-                "is_active,display_order FROM experiences"
-            )
-            if active_only:
-                q += " WHERE is_active=TRUE"
-            q += " ORDER BY display_order,id"
-            cur.execute(q)
-            cols = [d.name for d in cur.description]
-            rows = []
-            for r in cur.fetchall():
-                row = dict(zip(cols, r))
-                if lang == "en":
-                    row["name"] = (row.get("name_en") or "").strip() or row.get("name")
-                    row["description"] = (row.get("description_en") or "").strip() or row.get("description")
-                elif lang == "pt":
-                    row["name"] = (row.get("name_pt") or "").strip() or row.get("name")
-                    row["description"] = (row.get("description_pt") or "").strip() or row.get("description")
-                rows.append(row)
-            return {"experiences": rows}
+def list_experiencias(request: Request, response: Response, active_only: bool = True,
+                      lang: str = Query("es", description="es | en | pt")):
+    snap = catalog.snapshot()
+    not_modified = _not_modified(request, response, snap)
+    if not_modified:
+        return not_modified
+    lang = _lang(lang)
+    rows = []
+    for exp in snap.experiences:
+        if active_only and not exp["is_active"]:
+            continue
+        row = dict(exp)
+        if lang in ("en", "pt"):
+            row["name"] = (row.get(f"name_{lang}") or "").strip() or row.get("name")
+            row["description"] = (row.get(f"description_{lang}") or "").strip() or row.get("description")
+        rows.append(row)
+    return {"experiences": rows}
 
 
 @content_router.get("/api/content/packs")
-def list_packs(active_only: bool = True, lang: str = Query("es", description="es | en | pt")):
-    lang = (lang or "es").lower().strip()[:2]
-    if lang not in ("es", "en", "pt"):
-        lang = "es"
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS name_en TEXT")
-            cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS name_pt TEXT")
-            cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS description_en TEXT")
-            cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS description_pt TEXT")
-            cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS includes_en JSONB DEFAULT '[]'::jsonb")
-            cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS includes_pt JSONB DEFAULT '[]'::jsonb")
-            cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS admin_whatsapp TEXT")
-            cur.execute("ALTER TABLE packs ADD COLUMN IF NOT EXISTS extra_images JSONB DEFAULT '[]'::jsonb")
-            q = (
-                "SELECT id,slug,name,icon,description,"
-                "COALESCE(name_en,'') AS name_en,COALESCE(name_pt,'') AS name_pt,"
-                "COALESCE(description_en,'') AS description_en,COALESCE(description_pt,'') AS description_pt,"
-                "COALESCE(admin_whatsapp,'') AS admin_whatsapp,"
-                "personas,price_from,cost_from,image_path,COALESCE(extra_images,'[]'::jsonb) AS extra_images,"
-                "COALESCE(includes,'[]'::jsonb) AS includes,"
-                "COALESCE(includes_en,'[]'::jsonb) AS includes_en,"
-                "COALESCE(includes_pt,'[]'::jsonb) AS includes_pt,"
-                "is_active,display_order FROM packs"
-            )
-            if active_only:
-                q += " WHERE is_active=TRUE"
-            q += " ORDER BY display_order,id"
-            cur.execute(q)
-            cols = [d.name for d in cur.description]
-            rows = []
-            for r in cur.fetchall():
-                row = dict(zip(cols, r))
-                if isinstance(row.get("includes"), str):
-                    import json
-                    row["includes"] = json.loads(row["includes"])
-                if isinstance(row.get("includes_en"), str):
-                    import json
-                    row["includes_en"] = json.loads(row["includes_en"])
-                if isinstance(row.get("includes_pt"), str):
-                    import json
-                    row["includes_pt"] = json.loads(row["includes_pt"])
-                if lang == "en":
-                    row["name"] = (row.get("name_en") or "").strip() or row.get("name")
-                    row["description"] = (row.get("description_en") or "").strip() or row.get("description")
-                    row["includes"] = row.get("includes_en") or row.get("includes") or []
-                elif lang == "pt":
-                    row["name"] = (row.get("name_pt") or "").strip() or row.get("name")
-                    row["description"] = (row.get("description_pt") or "").strip() or row.get("description")
-                    row["includes"] = row.get("includes_pt") or row.get("includes") or []
-                rows.append(row)
-            return {"packs": rows}
+def list_packs(request: Request, response: Response, active_only: bool = True,
+               lang: str = Query("es", description="es | en | pt")):
+    snap = catalog.snapshot()
+    not_modified = _not_modified(request, response, snap)
+    if not_modified:
+        return not_modified
+    lang = _lang(lang)
+    rows = []
+    for pack in snap.packs:
+        if active_only and not pack["is_active"]:
+            continue
+        row = dict(pack)
+        if lang in ("en", "pt"):
+            row["name"] = (row.get(f"name_{lang}") or "").strip() or row.get("name")
+            row["description"] = (row.get(f"description_{lang}") or "").strip() or row.get("description")
+            row["includes"] = row.get(f"includes_{lang}") or row.get("includes") or []
+        rows.append(row)
+    return {"packs": rows}
 
 
 # ── Public menu visibility settings (read-only) ───────────────────────────────
@@ -402,14 +230,8 @@ class PublicExtrasBookingBody(BaseModel):
 def get_active_experiences_db():
     """Returns list of active experience dicts (sync, safe to call from bot)."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT slug,name,icon,description,price_per_person FROM experiences"
-                    " WHERE is_active=TRUE ORDER BY display_order,id"
-                )
-                cols = [d.name for d in cur.description]
-                return [dict(zip(cols, r)) for r in cur.fetchall()]
+        keys = ("slug", "name", "icon", "description", "price_per_person")
+        return [{k: e[k] for k in keys} for e in catalog.snapshot().experiences if e["is_active"]]
     except Exception as e:
         logger.warning(f"get_active_experiences_db failed: {e}")
         return []
@@ -418,21 +240,8 @@ def get_active_experiences_db():
 def get_active_packs_db():
     """Returns list of active pack dicts (sync, safe to call from bot)."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT slug,name,icon,description,personas,price_from,includes FROM packs"
-                    " WHERE is_active=TRUE ORDER BY display_order,id"
-                )
-                cols = [d.name for d in cur.description]
-                rows = []
-                for r in cur.fetchall():
-                    row = dict(zip(cols, r))
-                    if isinstance(row.get("includes"), str):
-                        import json
-                        row["includes"] = json.loads(row["includes"])
-                    rows.append(row)
-                return rows
+        keys = ("slug", "name", "icon", "description", "personas", "price_from", "includes")
+        return [{k: p[k] for k in keys} for p in catalog.snapshot().packs if p["is_active"]]
     except Exception as e:
         logger.warning(f"get_active_packs_db failed: {e}")
         return []
@@ -556,15 +365,10 @@ def _send_accommodation_email(
         if not resend_key:
             logger.warning("_send_accommodation_email: no RESEND_API_KEY, skipping email")
             return
-        from app.email.resend_booking import send_booking_html
-        send_booking_html(
-            to=admin_email,
-            subject=f"🏠 Nueva solicitud: {item_name} ({fechas})",
-            html=html,
-            from_address=from_addr,
-            api_key=resend_key,
-        )
-        logger.info(f"Accommodation availability email sent for booking #{booking_id}")
+        from app.email.outbox import enqueue_email
+        enqueue_email("aloj_availability_request", admin_email,
+                      f"🏠 Nueva solicitud: {item_name} ({fechas})", html, from_addr)
+        logger.info(f"Accommodation availability email queued for booking #{booking_id}")
     except Exception as e:
         logger.warning(f"_send_accommodation_email send failed: {e}")
 
@@ -13,6 +13,8 @@ from app.db.connection import get_connection
 CHILE_TZ = ZoneInfo("America/Santiago")
 logger = logging.getLogger(__name__)
 PRICES = {2: 76990, 3: 59990, 4: 48990, 5: 42990, 6: 36990, 7: 33990}
+# PRICES is the live copy (admin overrides applied); these stay the code defaults.
+_DEFAULT_PRICES = dict(PRICES)
 CHILD_DISCOUNT_PER_CHILD = 10000  # CLP descontado por cada niño (0-12 años) sobre el total
 
 
@@ -0,0 +1,146 @@
+"""Bulk exports (CSV / XLSX) of reservations, clients, gastos and WhatsApp
+conversations, streamed from a server-side cursor (see tabular_export)."""
+import hmac
+import logging
+import os
+from datetime import date, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+
+from app.booking import admin_analytics
+from app.booking.gastos_router import gasto_row, gastos_query
+from app.booking.tabular_export import export_response
+
+logger = logging.getLogger(__name__)
+export_router = APIRouter()
+
+FORMAT = Query("csv", alias="format", pattern="^(csv|xlsx)$")
+
+CLIENT_COLUMNS = ["telefono", "nombre", "email", "total_reservas", "total_gastado",
+                  "ultima_reserva", "primera_reserva"]
+GASTO_COLUMNS = ["id", "fecha", "monto", "monto_neto", "iva_credito", "tipo_documento",
+                 "incluir_en_utilidad", "categoria1_nombre", "categoria2_nombre",
+                 "descripcion", "comercio", "notas", "imagen_path", "created_at"]
+CONVERSATION_COLUMNS = ["id", "created_at", "phone_number", "customer_name", "direction",
+                        "message_type", "message_text", "response_text"]
+
+
+def _check_auth(key: str):
+    """Bulk exports carry every client's contact data and conversations, so
+    unlike the rest of the admin API they check the key server-side: the
+    ADMIN_MASTER_KEY or one of the configured admin users' keys. With
+    neither configured there is nothing to check against, and exports stay
+    off."""
+    from app.booking.admin_router import _get_admin_users
+    master_key = os.environ.get("ADMIN_MASTER_KEY", "")
+    users = _get_admin_users()
+    if not master_key and not users:
+        raise HTTPException(status_code=403, detail="Exportación deshabilitada: configura ADMIN_MASTER_KEY o usuarios admin")
+    if not key:
+        raise HTTPException(status_code=401, detail="Falta X-Admin-Key")
+    valid = [master_key] if master_key else []
+    valid += [u.get("key") or "" for u in users]
+    if not any(k and hmac.compare_digest(k.encode(), key.encode()) for k in valid):
+        raise HTTPException(status_code=401, detail="Contraseña incorrecta")
+
+
+def _filename(name: str) -> str:
+    return f"{name}_{date.today():%Y%m%d}"
+
+
+def _day(value: Optional[str], param: str) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{param}: expected YYYY-MM-DD, got {value!r}")
+
+
+@export_router.get("/api/admin/export/reservas")
+async def export_reservas(
+    request: Request,
+    fmt: str = FORMAT,
+    desde: Optional[str] = Query(None),
+    hasta: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    search: Optional[str] = Query(None),
+    source: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Columnas separadas por coma; vacío = todas"),
+    x_admin_key: str = Header(""),
+):
+    """Every reservation matching the /api/admin/reservas filters, in its order."""
+    _check_auth(x_admin_key)
+    try:
+        columns = admin_analytics.parse_fields(fields) or list(admin_analytics.RESERVA_FIELDS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    sql, params = admin_analytics.reservas_query(desde=desde, hasta=hasta, status=status, source=source,
+                                                 search=search, columns=columns)
+    return export_response(_filename("reservas"), fmt, columns, sql, params + [None],  # LIMIT NULL
+                           accept_encoding=request.headers.get("accept-encoding", ""))
+
+
+@export_router.get("/api/admin/export/clients")
+async def export_clients(
+    request: Request,
+    fmt: str = FORMAT,
+    search: Optional[str] = Query(None),
+    x_admin_key: str = Header(""),
+):
+    """Every client of /api/admin/clients (one row per phone), without its limit."""
+    _check_auth(x_admin_key)
+    sql, params = admin_analytics.clients_query(search)
+    return export_response(_filename("clientes"), fmt, CLIENT_COLUMNS, sql, params + [None],
+                           accept_encoding=request.headers.get("accept-encoding", ""))
+
+
+@export_router.get("/api/admin/export/gastos")
+async def export_gastos(
+    request: Request,
+    fmt: str = FORMAT,
+    year: int = 0,
+    month: int = 0,
+    x_admin_key: str = Header(""),
+):
+    """The /api/admin/gastos list for the same year / month."""
+    _check_auth(x_admin_key)
+    sql, params = gastos_query(year, month)
+
+    def row(r):
+        g = gasto_row(r)
+        return tuple(g[c] for c in GASTO_COLUMNS)
+
+    return export_response(_filename("gastos"), fmt, GASTO_COLUMNS, sql, params, transform=row,
+                           accept_encoding=request.headers.get("accept-encoding", ""))
+
+
+@export_router.get("/api/admin/export/conversations")
+async def export_conversations(
+    request: Request,
+    fmt: str = FORMAT,
+    phone: Optional[str] = Query(None, description="Solo este número"),
+    desde: Optional[str] = Query(None),
+    hasta: Optional[str] = Query(None),
+    x_admin_key: str = Header(""),
+):
+    """WhatsApp messages oldest first, one row per message: the history
+    behind /api/conversations, optionally for one phone and a date range."""
+    _check_auth(x_admin_key)
+    wheres, params = [], []
+    if phone:
+        wheres.append("phone_number = %s"); params.append(phone)
+    if (d := _day(desde, "desde")):
+        wheres.append("created_at >= %s"); params.append(d)
+    if (d := _day(hasta, "hasta")):
+        wheres.append("created_at < %s"); params.append(d + timedelta(days=1))
+    where_sql = ("WHERE " + " AND ".join(wheres)) if wheres else ""
+    sql = f"""
+        SELECT {", ".join(CONVERSATION_COLUMNS)}
+        FROM whatsapp_conversations
+        {where_sql}
+        ORDER BY created_at, id
+    """
+    return export_response(_filename("conversaciones"), fmt, CONVERSATION_COLUMNS, sql, params,
+                           accept_encoding=request.headers.get("accept-encoding", ""))
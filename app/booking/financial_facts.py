@@ -0,0 +1,351 @@
+"""
+Financial fact tables: per-booking, per-payment and per-day figures the
+reports in financial_router aggregate instead of recomputing.
+
+Every P&L, cash-flow, inflows and forecast request used to re-read each
+booking in its range from all_appointments. It JSON-decoded pagos,
+descuentos and extras_json and ran split_booking_financials per booking.
+The forecast table did that twice per request, once for the totals and
+once for the zone split. Those numbers only change when the booking does,
+or when something the split looks up does, so they are now stored
+(migration 0106) and brought up to date by refresh_financial_facts():
+
+  • a booking is recomputed when all_appointments.updated_at no longer
+    matches the one stored with its facts, or when a catalog entry its
+    extras lines look up (extras_visibility.costo, alojamientos.cost_from)
+    changed — catalog_keys holds those lookups, so editing one extra's
+    cost touches only the bookings (and days) that carry it;
+  • every booking is recomputed when the experience whitelist, the
+    commission table or FACTS_VERSION changed;
+  • facts of bookings that are gone or no longer confirmed are deleted;
+  • the days any of that touched are re-summed into financial_daily_facts.
+
+costo_operativo_por_reserva, the structural daily cost and marketing are
+applied per day by the reports, so changing them needs no recomputation.
+
+The reports refresh before reading, so an edit shows up in the next
+request; when nothing changed that costs one anti-join. The
+"financial_facts" job keeps the tables warm, and "financial_facts_rebuild"
+recomputes everything nightly for writers that change a booking without
+bumping updated_at.
+"""
+import hashlib
+import json
+import logging
+from datetime import date
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
+
+from psycopg.types.json import Jsonb as PgJson
+
+from app.db.connection import get_connection
+from app.booking.financial_breakdown import (
+    FIN_STRUCTURE_KEY,
+    _aloj_slug_from_key,
+    _extras_json_as_dict,
+    _slugify,
+    get_financial_structure,
+    load_aloj_cost_catalog,
+    load_extra_cost_catalog,
+    split_booking_financials,
+)
+from app.booking.operator_settings import forget_setting
+
+logger = logging.getLogger(__name__)
+
+# Bump when the per-booking formulas below change: the next refresh then
+# recomputes every booking.
+FACTS_VERSION = 1
+REFRESH_BATCH = 500
+
+ZONES = ("ingreso_reserva", "ingreso_aloj", "ingreso_exp", "ingreso_extra")
+
+BOOKING_FACT_COLUMNS = (
+    "booking_id", "fecha", "status", "nombre_cliente", "src_updated_at", "pagos",
+    "ingreso_total", "gross", "disc_applied", "commission", "commission_deduction",
+    "net_income", "pagos_received",
+    "ingreso_reserva", "ingreso_aloj", "ingreso_exp", "ingreso_extra",
+    "cv_aloj", "cv_exp", "cv_extra",
+    "descuentos_total", "fc_gross", "fc_net", "costo_total",
+    "fc_ingreso_reserva", "fc_ingreso_aloj", "fc_ingreso_exp", "fc_ingreso_extra",
+    "catalog_keys",
+)
+
+PAYMENT_FACT_COLUMNS = (
+    "booking_id", "seq", "cf_day", "pago_date", "method_original", "method",
+    "is_fallback", "amount", "amount_bruto", "cf_commission", "cf_neto",
+    "in_commission", "in_neto",
+)
+
+# Per-day sums, in financial_daily_facts column order after fecha.
+DAILY_SUMS = (
+    ("n_reservas", "COUNT(*)"),
+    ("gross", "SUM(gross)"),
+    ("commission_deduction", "SUM(commission_deduction)"),
+    ("net_income", "SUM(net_income)"),
+    ("ingreso_reserva", "SUM(ingreso_reserva)"),
+    ("ingreso_aloj", "SUM(ingreso_aloj)"),
+    ("ingreso_exp", "SUM(ingreso_exp)"),
+    ("ingreso_extra", "SUM(ingreso_extra)"),
+    ("total_descuentos", "SUM(disc_applied)"),
+    ("cv_aloj", "SUM(cv_aloj)"),
+    ("cv_exp", "SUM(cv_exp)"),
+    ("cv_extra", "SUM(cv_extra)"),
+    ("fc_income", "SUM(trunc(fc_net))"),
+    ("fc_costs", "SUM(trunc(costo_total))"),
+)
+
+
+# ── Catalog lookups ───────────────────────────────────────────────────────────
+
+def catalog_snapshot(cost_catalog: Dict[str, float], aloj_catalog: Dict[str, float]) -> Dict[str, float]:
+    """Both cost catalogs as one map, keyed the way catalog_keys_for() names lookups."""
+    snap = {f"x:{k}": v for k, v in cost_catalog.items()}
+    snap.update({f"aloj:{k}": v for k, v in aloj_catalog.items()})
+    return snap
+
+
+def catalog_keys_for(extras_json: Any) -> List[str]:
+    """Every catalog key split_booking_financials() may look up for these
+    extras lines, whether or not the catalog has it today (adding an entry
+    changes the cost as much as editing one)."""
+    keys: Set[str] = set()
+    for key in _extras_json_as_dict(extras_json):
+        lk = str(key).lower()
+        keys.update(f"x:{c}" for c in (lk, _slugify(key), lk.split("__", 1)[-1]))
+        slug = _aloj_slug_from_key(key)
+        if slug:
+            s = slug.strip().lower()
+            t = s.replace("-", "_")
+            keys.update(f"aloj:{c}" for c in (s, _slugify(s), t, _slugify(t)))
+    return sorted(keys)
+
+
+def _changed_keys(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    return sorted(k for k in old.keys() | new.keys() if old.get(k) != new.get(k))
+
+
+def _inputs_hash(whitelist: Iterable[str], commissions: Dict) -> str:
+    raw = json.dumps({"version": FACTS_VERSION, "whitelist": sorted(whitelist),
+                      "commissions": commissions}, sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+# ── Per-booking computation ───────────────────────────────────────────────────
+
+def _scale_zones(split: Dict[str, int], target: float) -> Tuple[int, ...]:
+    """Zone incomes scaled so they sum to ``target`` (the discounted gross)."""
+    raw = sum(split[z] for z in ZONES)
+    if raw <= 0:
+        return tuple(split[z] for z in ZONES)
+    scale = target / raw
+    return tuple(int(round(split[z] * scale)) for z in ZONES)
+
+
+def booking_facts(
+    b: Dict[str, Any],
+    commissions: Dict,
+    cost_catalog: Dict[str, float],
+    whitelist: Set[str],
+    aloj_catalog: Dict[str, float],
+) -> Tuple[tuple, List[tuple]]:
+    """One financial_booking_facts row and its financial_payment_facts rows,
+    with the same arithmetic the reports used per request."""
+    from app.booking.financial_router import (
+        _calc_booking_pnl, _fmt_int, _net_amount, _normalize_payment_method,
+        _parse_pago_date, _sum_descuentos,
+    )
+
+    fecha = b["fecha"].isoformat()
+    pagos = b["pagos"]
+    sp = split_booking_financials(b, cost_catalog, whitelist, aloj_catalog)
+    gross_total = b["ingreso_total"]
+    manual_disc = _sum_descuentos(b["descuentos"])
+
+    # P&L: manual descuentos rounded to whole pesos (coupon is already in ingreso_total).
+    disc_applied = min(max(0, int(round(manual_disc))), max(0, int(round(gross_total))))
+    gross_split = gross_total - float(disc_applied)
+    pnl = _calc_booking_pnl(b, commissions, gross_override=gross_split, costo_override=0)
+
+    # Forecast table: the same cap without rounding.
+    fc_gross = gross_total - min(max(0.0, manual_disc), max(0.0, gross_total))
+    commission = 0.0
+    for p in pagos:
+        amt = float(p.get("amount", 0) or 0)
+        commission += amt - _net_amount(amt, p.get("method", "otro"), commissions)
+
+    row = (
+        b["id"], b["fecha"], b["status"], b["nombre_cliente"], b["updated_at"], PgJson(pagos),
+        gross_total, pnl["gross"], disc_applied, commission, pnl["commission_deduction"],
+        pnl["net_income"], pnl["pagos_received"],
+        *_scale_zones(sp, gross_split),
+        sp["cv_aloj"], sp["cv_exp"], sp["cv_extra"],
+        manual_disc, fc_gross, fc_gross - commission, b["costo_total"],
+        *_scale_zones(sp, fc_gross),
+        catalog_keys_for(b["extras_json"]),
+    )
+
+    payments: List[tuple] = []
+    if not pagos:
+        # No payment records: the whole ingreso_total counts as received on the booking date.
+        amt = gross_total
+        if amt:
+            net = _net_amount(amt, "transferencia", commissions)
+            payments.append((
+                b["id"], 0, fecha, _parse_pago_date(None, fecha), "sin registro", "sin_registro",
+                True, amt, _fmt_int(amt), 0, _fmt_int(net), _fmt_int(amt - net), _fmt_int(net),
+            ))
+    for seq, p in enumerate(pagos):
+        amt = float(p.get("amount", 0) or 0)
+        method_original = p.get("method", "otro")
+        method = _normalize_payment_method(method_original)
+        cf_net = _net_amount(amt, method_original, commissions)
+        in_net = _net_amount(amt, method, commissions)
+        payments.append((
+            b["id"], seq, str(p.get("date") or fecha), _parse_pago_date(p.get("date"), fecha),
+            method_original, method, False, amt, _fmt_int(amt),
+            _fmt_int(amt - cf_net), _fmt_int(cf_net), _fmt_int(amt - in_net), _fmt_int(in_net),
+        ))
+    return row, payments
+
+
+def _fetch_bookings(cur, ids: Sequence[int], statuses: List[str]) -> List[Dict[str, Any]]:
+    cur.execute("""
+        SELECT id, fecha, COALESCE(status, ''), COALESCE(nombre_cliente, ''), updated_at,
+               COALESCE(ingreso_reserva, 0), COALESCE(ingreso_extras, 0),
+               COALESCE(ingreso_total, 0), COALESCE(costo_operativo_total, 0),
+               COALESCE(pagos, '[]'::jsonb), COALESCE(descuentos, '[]'::jsonb),
+               COALESCE(extras_json, '{}'::jsonb)
+        FROM all_appointments
+        WHERE id = ANY(%s) AND status = ANY(%s)
+    """, (list(ids), statuses))
+    rows = []
+    for (bid, fecha, status, nombre, updated_at, ing_res, ing_ext, ing_total, costo_total,
+         pagos, desc, extras) in cur.fetchall():
+        if isinstance(pagos, str):
+            pagos = json.loads(pagos)
+        if isinstance(desc, str):
+            desc = json.loads(desc)
+        rows.append({
+            "id": bid, "fecha": fecha, "status": status, "nombre_cliente": nombre,
+            "updated_at": updated_at,
+            "ingreso_reserva": float(ing_res), "ingreso_extras": float(ing_ext),
+            "ingreso_total": float(ing_total), "costo_total": float(costo_total),
+            "pagos": pagos if isinstance(pagos, list) else [],
+            "descuentos": desc if isinstance(desc, list) else [],
+            "extras_json": _extras_json_as_dict(extras),
+        })
+    return rows
+
+
+def _copy_rows(cur, table: str, columns: Sequence[str], rows: List[tuple]) -> None:
+    if not rows:
+        return
+    with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+
+
+def _resum_days(cur, days: List[date]) -> None:
+    cols = ", ".join(c for c, _ in DAILY_SUMS)
+    sums = ", ".join(expr for _, expr in DAILY_SUMS)
+    cur.execute("DELETE FROM financial_daily_facts WHERE fecha = ANY(%s)", (days,))
+    cur.execute(f"""
+        INSERT INTO financial_daily_facts (fecha, {cols})
+        SELECT fecha, {sums}
+        FROM financial_booking_facts
+        WHERE fecha = ANY(%s)
+        GROUP BY fecha
+    """, (days,))
+
+
+# ── Refresh ───────────────────────────────────────────────────────────────────
+
+def refresh_financial_facts(full: bool = False, wait: bool = True) -> Dict[str, int]:
+    """Bring the fact tables up to date; ``full`` recomputes every booking.
+    Returns {"bookings": recomputed, "removed": deleted, "days": re-summed}.
+
+    With ``wait=False`` (report endpoints) it gives up at once if another
+    refresh holds the lock, and the caller reads the facts as they are;
+    the returned dict then has "skipped": 1."""
+    from app.booking.financial_router import CONFIRMED_STATUSES, _get_commissions
+
+    # Another replica may have just saved new settings; read what's stored
+    # so two replicas don't rebuild back and forth over a cached value.
+    forget_setting(FIN_STRUCTURE_KEY)
+    forget_setting("financial_commissions")
+    whitelist = set(get_financial_structure().get("experience_slug_whitelist") or [])
+    commissions = _get_commissions()
+    cost_catalog = load_extra_cost_catalog()
+    aloj_catalog = load_aloj_cost_catalog()
+    snapshot = catalog_snapshot(cost_catalog, aloj_catalog)
+    inputs_hash = _inputs_hash(whitelist, commissions)
+    statuses = list(CONFIRMED_STATUSES)
+
+    recomputed = removed = 0
+    days: Set[date] = set()
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            # One refresher at a time; the others wait here and then find
+            # nothing left to do, or (wait=False) skip the row and go.
+            cur.execute("SELECT cost_catalog, inputs_hash FROM financial_facts_state FOR UPDATE"
+                        + ("" if wait else " SKIP LOCKED"))
+            locked = cur.fetchone()
+            if locked is None:
+                return {"bookings": 0, "removed": 0, "days": 0, "skipped": 1}
+            stored_catalog, stored_hash = locked
+            full = full or stored_hash != inputs_hash
+            changed = [] if full else _changed_keys(stored_catalog or {}, snapshot)
+
+            cur.execute("""
+                SELECT a.id
+                FROM all_appointments a
+                LEFT JOIN financial_booking_facts f ON f.booking_id = a.id
+                WHERE a.status = ANY(%s)
+                  AND (%s OR f.booking_id IS NULL
+                       OR f.src_updated_at IS DISTINCT FROM a.updated_at
+                       OR f.catalog_keys && %s::text[])
+                ORDER BY a.id
+            """, (statuses, full, changed))
+            stale = [r[0] for r in cur.fetchall()]
+
+            cur.execute("""
+                DELETE FROM financial_booking_facts f
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM all_appointments a
+                    WHERE a.id = f.booking_id AND a.status = ANY(%s)
+                )
+                RETURNING fecha
+            """, (statuses,))
+            gone = cur.fetchall()
+            removed = len(gone)
+            days.update(r[0] for r in gone)
+
+            for i in range(0, len(stale), REFRESH_BATCH):
+                ids = stale[i:i + REFRESH_BATCH]
+                cur.execute("DELETE FROM financial_booking_facts WHERE booking_id = ANY(%s) RETURNING fecha",
+                            (ids,))
+                days.update(r[0] for r in cur.fetchall())
+                facts: List[tuple] = []
+                payments: List[tuple] = []
+                for b in _fetch_bookings(cur, ids, statuses):
+                    row, pays = booking_facts(b, commissions, cost_catalog, whitelist, aloj_catalog)
+                    facts.append(row)
+                    payments.extend(pays)
+                    days.add(b["fecha"])
+                _copy_rows(cur, "financial_booking_facts", BOOKING_FACT_COLUMNS, facts)
+                _copy_rows(cur, "financial_payment_facts", PAYMENT_FACT_COLUMNS, payments)
+                recomputed += len(facts)
+
+            if days:
+                _resum_days(cur, sorted(days))
+            if stored_hash != inputs_hash or (stored_catalog or {}) != snapshot:
+                cur.execute(
+                    "UPDATE financial_facts_state SET cost_catalog = %s, inputs_hash = %s, updated_at = NOW()",
+                    (PgJson(snapshot), inputs_hash),
+                )
+        conn.commit()
+
+    if recomputed or removed:
+        logger.info("financial facts: %d booking(s) recomputed, %d removed, %d day(s) re-summed%s",
+                    recomputed, removed, len(days), " (full)" if full else "")
+    return {"bookings": recomputed, "removed": removed, "days": len(days)}
@@ -0,0 +1,257 @@
+"""
+Columnar per-day frames behind the P&L and cash-flow reports.
+
+Both reports are a table of calendar days that the endpoints total, roll up
+by ISO week or month and (cash flow) carry a running balance through. A
+DayFrame holds the numeric columns of that table as arrays over one sorted
+day index. Totals, roll-ups and balances are then array reductions instead
+of a pass over a list of dicts per metric, and the dicts in the JSON are
+built once from the columns.
+
+evaluate_pnl_scenarios() runs the P&L of a range for a batch of what-if
+parameter sets (cost per reservation, structural daily cost, marketing
+factor, commission table) as one scenarios × days computation.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+NO_DAY = np.iinfo(np.int64).min  # key that isn't an ISO date
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def day_numbers(keys: Sequence[str]) -> np.ndarray:
+    """Days since 1970-01-01 for ISO date keys, NO_DAY where date.fromisoformat fails."""
+    if keys and all(len(k) == 10 for k in keys):
+        try:
+            return np.array(keys, dtype="datetime64[D]").astype(np.int64)
+        except ValueError:
+            pass
+    out = np.empty(len(keys), dtype=np.int64)
+    for i, k in enumerate(keys):
+        try:
+            out[i] = date.fromisoformat(k).toordinal() - _EPOCH_ORDINAL
+        except (TypeError, ValueError):
+            out[i] = NO_DAY
+    return out
+
+
+def _iso(day: int) -> str:
+    return date.fromordinal(int(day) + _EPOCH_ORDINAL).isoformat()
+
+
+@dataclass
+class Periods:
+    """Contiguous runs of a frame's days sharing a week or month key."""
+    heads: List[Dict[str, str]]   # {"week", "week_start", "week_end"} or {"month"}
+    starts: np.ndarray
+    ends: np.ndarray              # exclusive
+
+    def __len__(self) -> int:
+        return len(self.heads)
+
+    def sum(self, col: np.ndarray) -> np.ndarray:
+        """Per-period sums along the last axis."""
+        if not len(self):
+            return np.zeros(col.shape[:-1] + (0,), dtype=col.dtype)
+        return np.add.reduceat(col, self.starts, axis=-1)
+
+
+class DayFrame:
+    """Numeric per-day columns over a sorted, unique index of day keys.
+
+    Keys are the strings the reports use for days ("YYYY-MM-DD", though a
+    pago's free-form date can put something else in a cash-flow index);
+    they sort as strings, like the dicts the reports used to sort.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        self.keys: List[str] = sorted(set(keys))
+        self._sorted = np.array(self.keys, dtype=str)
+        self.days = day_numbers(self.keys)
+        self.cols: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.cols[name]
+
+    def __setitem__(self, name: str, values: Any) -> None:
+        self.cols[name] = np.asarray(values)
+
+    def positions(self, keys: Sequence[str]) -> np.ndarray:
+        """Index positions of keys, all of which must be in the index."""
+        if not len(keys):
+            return np.zeros(0, dtype=np.intp)
+        return np.searchsorted(self._sorted, np.array(keys, dtype=str))
+
+    def _at(self, where: Sequence[str] | np.ndarray) -> np.ndarray:
+        return where if isinstance(where, np.ndarray) else self.positions(where)
+
+    def put(self, where: Sequence[str] | np.ndarray, values: Sequence[int] | int) -> np.ndarray:
+        """An int64 column with `values` at `where` (keys, or positions from
+        positions()) and 0 elsewhere."""
+        col = np.zeros(len(self), dtype=np.int64)
+        col[self._at(where)] = values
+        return col
+
+    def sum_by_day(self, where: Sequence[str] | np.ndarray, values: Sequence[float]) -> np.ndarray:
+        """Per-day float sums, added in input order (as a `+=` loop would)."""
+        return np.bincount(self._at(where), weights=np.asarray(values, dtype=np.float64),
+                           minlength=len(self))
+
+    def between(self, d_from: date, d_to: date) -> np.ndarray:
+        """Mask of days that are valid dates within [d_from, d_to]."""
+        lo, hi = d_from.toordinal() - _EPOCH_ORDINAL, d_to.toordinal() - _EPOCH_ORDINAL
+        return (self.days >= lo) & (self.days <= hi)
+
+    def totals(self, names: Sequence[str]) -> Dict[str, int]:
+        return {n: int(self.cols[n].sum()) for n in names}
+
+    def rows(self, names: Sequence[str]) -> List[Dict[str, Any]]:
+        """One {"fecha", *names} dict per day, with Python ints."""
+        fields = ("fecha", *names)
+        columns = [self.cols[n].tolist() for n in names]
+        return [dict(zip(fields, values)) for values in zip(self.keys, *columns)]
+
+    def periods(self, by: str) -> Periods:
+        """ISO weeks ("week") or calendar months ("month") of the index.
+
+        Week keys need every key to be a date, as date.fromisoformat did for
+        the dict version; month keys are the first seven characters.
+        """
+        n = len(self)
+        if by == "week":
+            if n and (self.days == NO_DAY).any():
+                bad = self.keys[int(np.argmax(self.days == NO_DAY))]
+                raise ValueError(f"Invalid isoformat string: {bad!r}")
+            monday = self.days - (self.days + 3) % 7   # 1970-01-01 was a Thursday
+            thursday = monday + 3
+            iso_year = thursday.astype("datetime64[D]").astype("datetime64[Y]")
+            week = (thursday - iso_year.astype("datetime64[D]").astype(np.int64)) // 7 + 1
+            code = iso_year.astype(np.int64) * 100 + week
+        elif by == "month":
+            code = np.array([k[:7] for k in self.keys])
+        else:
+            raise ValueError(f"unknown period {by!r}")
+        if not n:
+            empty = np.zeros(0, dtype=np.intp)
+            return Periods([], empty, empty)
+        starts = np.flatnonzero(np.r_[True, code[1:] != code[:-1]])
+        ends = np.r_[starts[1:], n]
+        if by == "month":
+            heads = [{"month": str(code[s])} for s in starts]
+        else:
+            heads = [{
+                "week": f"{(c // 100) + 1970:04d}-W{c % 100:02d}",
+                "week_start": _iso(monday[s]),
+                "week_end": _iso(monday[s] + 6),
+            } for s, c in zip(starts.tolist(), code[starts].tolist())]
+        return Periods(heads, starts, ends)
+
+
+def running_balance(net: np.ndarray, opening: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Beginning and ending balance per day, truncated to whole pesos.
+
+    cumsum adds left to right, so each balance is the same float a running
+    `balance += net` produces.
+    """
+    bal = np.cumsum(np.concatenate(([float(opening or 0)], net.astype(np.float64))))
+    return bal[:-1].astype(np.int64), bal[1:].astype(np.int64)
+
+
+# ── What-if P&L ───────────────────────────────────────────────────────────────
+
+SCENARIO_FIELDS = (
+    "n_reservas", "gross", "commission_deduction", "net_income", "costo_operacional",
+    "marketing", "costo_estructural", "cv_aloj", "cv_exp", "cv_extra", "resultado",
+)
+
+
+def evaluate_pnl_scenarios(
+    frame: DayFrame,
+    booking_pos: np.ndarray,
+    booking_gross: np.ndarray,
+    pago_booking: np.ndarray,
+    pago_amount: np.ndarray,
+    pago_method: Sequence[Any],
+    params: List[Dict[str, Any]],
+    iva_rate: float,
+) -> List[Dict[str, Any]]:
+    """P&L totals and monthly series for each resolved parameter set.
+
+    frame carries the per-day columns that don't depend on the parameters
+    (n_reservas, gross, cv_*, marketing_raw as untruncated sums, in_struct
+    as a 0/1 mask). Bookings are given by day position and discounted gross;
+    pagos by booking position, amount and method as written. Each params
+    entry has costo_operativo_por_reserva (int), costo_fijo_diario (int),
+    marketing_factor and commissions (method -> {rate, iva_included}).
+
+    Per booking, commission is Σ amount − net over its pagos and is truncated
+    once, and net income is trunc(gross − commission). That is the
+    _calc_booking_pnl arithmetic, so parameters equal to the live settings
+    reproduce the P&L report.
+    """
+    n_s, n_d, n_b = len(params), len(frame), len(booking_gross)
+    methods = sorted({m for m in pago_method if m is not None})
+    code = {m: i for i, m in enumerate(methods)}
+    m_idx = np.fromiter((code.get(m, len(methods)) for m in pago_method),
+                        dtype=np.intp, count=len(pago_method))
+
+    # (scenario, method) tables; the extra last column is "not configured".
+    rate = np.zeros((n_s, len(methods) + 1))
+    iva = np.zeros((n_s, len(methods) + 1), dtype=bool)
+    for s, p in enumerate(params):
+        for m, i in code.items():
+            cfg = p["commissions"].get(m)
+            if cfg:
+                rate[s, i] = cfg["rate"]
+                iva[s, i] = bool(cfg["iva_included"])
+
+    amt = np.broadcast_to(pago_amount, (n_s, len(pago_amount)))
+    base = np.where(iva[:, m_idx], amt / (1 + iva_rate), amt)
+    commission_p = amt - base * (1 - rate[:, m_idx])
+    offsets = np.arange(n_s)[:, None]
+    commission_b = np.bincount((pago_booking + offsets * n_b).ravel(), weights=commission_p.ravel(),
+                               minlength=n_s * n_b).reshape(n_s, n_b)
+    net_b = np.trunc(booking_gross - commission_b)
+    to_day = (booking_pos + offsets * n_d).ravel()
+
+    def by_day(v: np.ndarray) -> np.ndarray:
+        return np.bincount(to_day, weights=v.ravel(), minlength=n_s * n_d).reshape(n_s, n_d).astype(np.int64)
+
+    cpr = np.array([p["costo_operativo_por_reserva"] for p in params], dtype=np.int64)[:, None]
+    struct = np.array([p["costo_fijo_diario"] for p in params], dtype=np.int64)[:, None]
+    mkt_factor = np.array([p["marketing_factor"] for p in params], dtype=np.float64)[:, None]
+
+    cols = {
+        "n_reservas": np.broadcast_to(frame["n_reservas"], (n_s, n_d)),
+        "gross": np.broadcast_to(frame["gross"], (n_s, n_d)),
+        "commission_deduction": by_day(np.trunc(commission_b)),
+        "net_income": by_day(net_b),
+        "costo_operacional": frame["n_reservas"] * cpr,
+        "marketing": (frame["marketing_raw"] * mkt_factor).astype(np.int64),
+        "costo_estructural": frame["in_struct"] * struct,
+        "cv_aloj": np.broadcast_to(frame["cv_aloj"], (n_s, n_d)),
+        "cv_exp": np.broadcast_to(frame["cv_exp"], (n_s, n_d)),
+        "cv_extra": np.broadcast_to(frame["cv_extra"], (n_s, n_d)),
+    }
+    cols["resultado"] = (cols["net_income"] - cols["costo_operacional"] - cols["cv_aloj"]
+                         - cols["cv_exp"] - cols["cv_extra"] - cols["marketing"]
+                         - cols["costo_estructural"])
+
+    months = frame.periods("month")
+    totals = {k: v.sum(axis=1).tolist() for k, v in cols.items()}
+    monthly = {k: months.sum(v).tolist() for k, v in cols.items()}
+    return [{
+        "totals": {k: totals[k][s] for k in SCENARIO_FIELDS},
+        "months": [
+            {**head, **{k: monthly[k][s][i] for k in SCENARIO_FIELDS}}
+            for i, head in enumerate(months.heads)
+        ],
+    } for s in range(n_s)]
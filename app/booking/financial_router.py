@@ -1,30 +1,29 @@
 """Financial module: P&L dashboard and Cash Flow statement."""
+import asyncio
 import json
 import logging
 import calendar as _cal
 from collections import defaultdict
 from datetime import date, datetime, timedelta
-from typing import Any, Dict, List, Optional
+from itertools import chain
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+import numpy as np
 from fastapi import APIRouter, Header, HTTPException, Query, Request
 from pydantic import BaseModel
 
 from app.db.connection import get_connection
 from app.booking.operator_settings import get_setting, set_setting
 from app.booking.financial_breakdown import (
-    aggregate_breakdown_into_week_month,
-    apply_structural_to_days,
     booking_discount_total_clp,
-    finalize_pnl_day,
     get_financial_structure,
     iso_dates_inclusive,
     load_aloj_cost_catalog,
     load_extra_cost_catalog,
-    merge_day_breakdown,
-    merge_day_discount,
-    new_empty_day,
     split_booking_financials,
 )
+from app.booking.financial_facts import refresh_financial_facts
+from app.booking.financial_frame import DayFrame, evaluate_pnl_scenarios, running_balance
 
 logger = logging.getLogger(__name__)
 financial_router = APIRouter()
@@ -135,74 +134,108 @@ def _get_bookings_range(date_from: date, date_to: date) -> List[Dict]:
             return rows
 
 
-def _get_bookings_cashflow_range(date_from: date, date_to: date) -> List[Dict]:
+# Per-day P&L sums kept in financial_daily_facts.
+_DAY_FACT_FIELDS = (
+    "n_reservas", "gross", "commission_deduction", "net_income",
+    "ingreso_reserva", "ingreso_aloj", "ingreso_exp", "ingreso_extra",
+    "total_descuentos", "cv_aloj", "cv_exp", "cv_extra",
+)
+
+_PNL_BOOKING_FIELDS = (
+    "id", "fecha", "nombre_cliente", "gross", "commission_deduction", "net_income", "pagos",
+    "ingreso_reserva", "ingreso_aloj", "ingreso_exp", "ingreso_extra", "disc_applied",
+    "cv_aloj", "cv_exp", "cv_extra",
+)
+
+
+async def _refresh_facts() -> None:
+    """Catch the fact tables up before a report, off the event loop. If a
+    refresh is already running elsewhere (the job, another replica) the
+    report reads the facts as they are rather than wait for it."""
+    await asyncio.to_thread(refresh_financial_facts, wait=False)
+
+
+def _columns(rows: List[tuple], names: Sequence[str]) -> Dict[str, Sequence]:
+    """Fetched rows as {name: column}."""
+    return dict(zip(names, list(zip(*rows)) or [()] * len(names)))
+
+
+def _get_pnl_facts(date_from: date, date_to: date) -> Tuple[Dict[str, Sequence], List[Dict]]:
+    """Per-day sums (as columns) and per-booking rows (fecha, id order) from the fact tables."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT fecha::text, {', '.join(_DAY_FACT_FIELDS)}
+                FROM financial_daily_facts
+                WHERE fecha BETWEEN %s AND %s
+            """, (date_from, date_to))
+            days = _columns(cur.fetchall(), ("fecha",) + _DAY_FACT_FIELDS)
+            cur.execute(f"""
+                SELECT booking_id, fecha::text, {', '.join(_PNL_BOOKING_FIELDS[2:])}
+                FROM financial_booking_facts
+                WHERE fecha BETWEEN %s AND %s
+                ORDER BY fecha, booking_id
+            """, (date_from, date_to))
+            bookings = [dict(zip(_PNL_BOOKING_FIELDS, r)) for r in cur.fetchall()]
+    return days, bookings
+
+
+# Bookings relevant for cash flow: `fecha` within range (opex + no-pagos
+# fallback) or any pago dated within range (anticipos/abonos for other dates).
+_CASHFLOW_BOOKINGS = """
+    WITH s AS (
+        SELECT booking_id, fecha, nombre_cliente, cv_aloj, cv_exp, cv_extra
+        FROM financial_booking_facts
+        WHERE fecha BETWEEN %(d_from)s AND %(d_to)s
+           OR booking_id IN (SELECT booking_id FROM financial_payment_facts
+                             WHERE pago_date BETWEEN %(d_from)s AND %(d_to)s)
+    )
+"""
+
+
+def _get_cashflow_facts(date_from: date, date_to: date) -> Tuple[Dict[str, Sequence], List[Dict]]:
     """
-    Return bookings relevant for cashflow/inflows in a date range.
-    Includes:
-    - bookings whose `fecha` is within range (needed for opex + no-pagos fallback)
-    - bookings with any pago `date` within range (anticipos/abonos for other booking dates)
+    For the cash-flow bookings of a range: booking count and variable costs
+    per booking date (as columns), and every payment row of those bookings.
     """
+    params = {"d_from": date_from, "d_to": date_to}
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_CASHFLOW_BOOKINGS + """
+                SELECT fecha::text, COUNT(*)::int, SUM(cv_aloj)::bigint,
+                       SUM(cv_exp)::bigint, SUM(cv_extra)::bigint
+                FROM s
+                GROUP BY fecha
+            """, params)
+            booking_days = _columns(cur.fetchall(), ("fecha", "n", "cv_aloj", "cv_exp", "cv_extra"))
+            cur.execute(_CASHFLOW_BOOKINGS + """
+                SELECT p.cf_day, s.booking_id, s.nombre_cliente, p.amount_bruto,
+                       p.cf_commission, p.cf_neto, p.method_original
+                FROM s JOIN financial_payment_facts p USING (booking_id)
+                ORDER BY s.fecha, s.booking_id, p.seq
+            """, params)
+            cols = ["cf_day", "booking_id", "nombre_cliente", "amount_bruto",
+                    "commission", "amount_neto", "method"]
+            payments = [dict(zip(cols, r)) for r in cur.fetchall()]
+    return booking_days, payments
+
+
+def _get_inflow_facts(date_from: date, date_to: date) -> List[Dict]:
+    """Payment rows dated within range, in booking (fecha, id) order."""
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
-                SELECT
-                    id,
-                    COALESCE(fecha::text, ''),
-                    COALESCE(ingreso_reserva, 0),
-                    COALESCE(ingreso_extras, 0),
-                    COALESCE(ingreso_total, 0),
-                    COALESCE(costo_operativo_fijo, 0),
-                    COALESCE(costo_operativo_variable, 0),
-                    COALESCE(costo_operativo_total, 0),
-                    COALESCE(pagos,      '[]'::jsonb),
-                    COALESCE(descuentos, '[]'::jsonb),
-                    COALESCE(nombre_cliente, ''),
-                    COALESCE(status, ''),
-                    COALESCE(num_personas::text, '0'),
-                    COALESCE(extras_json, '{}'::jsonb)
-                FROM all_appointments
-                WHERE status = ANY(%s)
-                  AND (
-                    fecha BETWEEN %s AND %s
-                    OR EXISTS (
-                        SELECT 1
-                        FROM jsonb_array_elements(COALESCE(pagos, '[]'::jsonb)) AS p
-                        WHERE (p->>'date') ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}'
-                          AND LEFT(p->>'date', 10)::date BETWEEN %s AND %s
-                    )
-                  )
-                ORDER BY fecha, id
-            """, (list(CONFIRMED_STATUSES), date_from, date_to, date_from, date_to))
-            cols = ["id", "fecha", "ingreso_reserva", "ingreso_extras",
-                    "ingreso_total", "costo_fijo", "costo_variable", "costo_total",
-                    "pagos", "descuentos", "nombre_cliente", "status", "num_personas",
-                    "extras_json"]
-            rows = []
-            for r in cur.fetchall():
-                d = dict(zip(cols, r))
-                d["ingreso_total"] = float(d["ingreso_total"])
-                d["ingreso_reserva"] = float(d["ingreso_reserva"])
-                d["ingreso_extras"] = float(d["ingreso_extras"])
-                d["costo_total"] = float(d["costo_total"])
-                d["costo_fijo"] = float(d["costo_fijo"])
-                d["costo_variable"] = float(d["costo_variable"])
-                pagos = d["pagos"]
-                if isinstance(pagos, str):
-                    pagos = json.loads(pagos)
-                d["pagos"] = pagos if isinstance(pagos, list) else []
-                desc = d["descuentos"]
-                if isinstance(desc, str):
-                    desc = json.loads(desc)
-                d["descuentos"] = desc if isinstance(desc, list) else []
-                ex = d["extras_json"]
-                if isinstance(ex, str):
-                    try:
-                        ex = json.loads(ex) if ex.strip() else {}
-                    except Exception:
-                        ex = {}
-                d["extras_json"] = ex if isinstance(ex, dict) else {}
-                rows.append(d)
-            return rows
+                SELECT p.method, f.booking_id, f.fecha::text, p.pago_date::text,
+                       f.nombre_cliente, p.method_original,
+                       p.amount_bruto, p.in_commission, p.in_neto
+                FROM financial_payment_facts p
+                JOIN financial_booking_facts f USING (booking_id)
+                WHERE p.pago_date BETWEEN %s AND %s AND p.amount > 0
+                ORDER BY f.fecha, f.booking_id, p.seq
+            """, (date_from, date_to))
+            cols = ["method", "booking_id", "booking_date", "payment_date", "nombre_cliente",
+                    "method_original", "inflow_bruto", "inflow_commission", "inflow_neto"]
+            return [dict(zip(cols, r)) for r in cur.fetchall()]
 
 
 _DATE_COL_CANDIDATES   = ("fecha", "date", "day", "dia", "cost_date", "fecha_costo", "report_date", "cost_day")
@@ -315,12 +348,6 @@ def _get_marketing_costs_range(date_from: date, date_to: date) -> List[Dict]:
 def _get_budget(year: int, month: int) -> Dict:
     with get_connection() as conn:
         with conn.cursor() as cur:
-            # Idempotent migration — adds zone columns if they don't exist yet
-            for col in ("aloj_budget", "exp_budget", "extra_budget", "reserva_budget"):
-                cur.execute(
-                    f"ALTER TABLE financial_budget ADD COLUMN IF NOT EXISTS {col} NUMERIC DEFAULT 0"
-                )
-            conn.commit()
             cur.execute("""
                 SELECT income_budget, costs_budget, marketing_budget, notes,
                        COALESCE(aloj_budget,0), COALESCE(exp_budget,0),
@@ -368,282 +395,184 @@ def _calc_booking_pnl(
     }
 
 
+_PNL_DAY_COLUMNS = (
+    "n_reservas", "gross", "commission_deduction", "net_income", "costo_operacional",
+    "marketing", "costo_estructural",
+    "ingreso_reserva", "ingreso_aloj", "ingreso_exp", "ingreso_extra", "total_descuentos",
+    "cv_aloj", "cv_exp", "cv_extra", "resultado",
+)
+_PNL_PERIOD_COLUMNS = (
+    "n_reservas", "gross", "commission_deduction", "net_income", "costo_operacional",
+    "marketing", "resultado", "costo_estructural",
+    "ingreso_reserva", "ingreso_aloj", "ingreso_exp", "ingreso_extra", "total_descuentos",
+    "cv_aloj", "cv_exp", "cv_extra",
+)
+
+
+def _structural_range(d_from: date, d_to: date) -> Tuple[date, date]:
+    """Structural cost covers full calendar months, so partial-range filters
+    still get the complete month's fixed cost (not just the days inside the
+    filter window)."""
+    return (date(d_from.year, d_from.month, 1),
+            date(d_to.year, d_to.month, _cal.monthrange(d_to.year, d_to.month)[1]))
+
+
 def _build_pnl_days(
-    bookings: List[Dict],
+    day_facts: Dict[str, Sequence],
+    booking_facts: List[Dict],
     marketing: List[Dict],
-    commissions: Dict,
     d_from: date,
     d_to: date,
-) -> Dict[str, Dict]:
-    """Build per-day P&L dict with income/cost breakdown and structural daily cost."""
-    structure = get_financial_structure()
-    daily_struct = float(structure.get("costo_fijo_diario_prorrateado") or 0)
-    costo_por_reserva = float(structure.get("costo_operativo_por_reserva") or 18000)
-    wl = set(structure.get("experience_slug_whitelist") or [])
-    cost_catalog = load_extra_cost_catalog()
-    aloj_cost_catalog = load_aloj_cost_catalog()
+) -> Tuple[DayFrame, List[Dict]]:
+    """Build the per-day P&L: income/cost breakdown and structural daily cost.
 
-    mkt_by_day: Dict[str, float] = defaultdict(float)
-    for m in marketing:
-        mkt_by_day[m["fecha"]] += m["amount"]
+    The per-booking split (zone incomes scaled to the discounted gross,
+    variable costs, commission) comes precomputed from the fact tables; only
+    the per-reservation opex, structural cost and marketing are applied here.
+    Returns the columns as a DayFrame and the day dicts, sorted by fecha.
+    """
+    structure = get_financial_structure()
+    daily_struct = int(round(float(structure.get("costo_fijo_diario_prorrateado") or 0)))
+    costo_por_reserva = _fmt_int(float(structure.get("costo_operativo_por_reserva") or 18000))
+
+    struct_from, struct_to = _structural_range(d_from, d_to)
+    struct_days = iso_dates_inclusive(struct_from, struct_to)
+    fechas = day_facts["fecha"]
+    mkt_days = [m["fecha"] for m in marketing]
+    frame = DayFrame(chain(fechas, struct_days, mkt_days))
+    at = frame.positions(fechas)
+    for k in _DAY_FACT_FIELDS:
+        frame[k] = frame.put(at, day_facts[k])
+    frame["costo_operacional"] = frame["n_reservas"] * costo_por_reserva
+    frame["costo_estructural"] = frame.put(struct_days, daily_struct)
+    frame["marketing"] = frame.sum_by_day(mkt_days, [m["amount"] for m in marketing]).astype(np.int64)
+    frame["resultado"] = (
+        frame["net_income"] - frame["costo_operacional"]
+        - frame["cv_aloj"] - frame["cv_exp"] - frame["cv_extra"]
+        - frame["marketing"] - frame["costo_estructural"]
+    )
 
-    days: Dict[str, Dict] = {}
-    for b in bookings:
-        day = b["fecha"]
-        if day not in days:
-            days[day] = new_empty_day(day)
-        sp = split_booking_financials(b, cost_catalog, wl, aloj_cost_catalog)
-        # Use ingreso_total as authoritative gross (coupon already baked in); only deduct manual descuentos
-        gross_total  = float(b.get("ingreso_total") or 0)
-        manual_disc  = _sum_descuentos(b.get("descuentos") or [])
-        disc_applied = min(max(0, int(round(manual_disc))), max(0, int(round(gross_total))))
-        gross_split  = gross_total - float(disc_applied)
-
-        # Scale zone incomes so they sum to gross_split (applies coupon + manual discount
-        # proportionally across reserva/aloj/exp/extra).  CV costs are not touched.
-        _split_raw = (sp["ingreso_reserva"] + sp["ingreso_aloj"]
-                      + sp["ingreso_exp"]   + sp["ingreso_extra"])
-        if _split_raw > 0:
-            _scale = gross_split / _split_raw
-            sp["ingreso_reserva"] = int(round(sp["ingreso_reserva"] * _scale))
-            sp["ingreso_aloj"]    = int(round(sp["ingreso_aloj"]    * _scale))
-            sp["ingreso_exp"]     = int(round(sp["ingreso_exp"]     * _scale))
-            sp["ingreso_extra"]   = int(round(sp["ingreso_extra"]   * _scale))
-
-        pnl = _calc_booking_pnl(
-            b,
-            commissions,
-            gross_override=gross_split,
-            costo_override=costo_por_reserva,
-        )
-        d = days[day]
-        d["n_reservas"] += 1
-        d["gross"] += pnl["gross"]
-        d["commission_deduction"] += pnl["commission_deduction"]
-        d["net_income"] += pnl["net_income"]
-        d["costo_operacional"] += pnl["costo_operacional"]
-        merge_day_breakdown(d, sp)
-        merge_day_discount(d, disc_applied)
-        d["bookings"].append({
+    days = frame.rows(_PNL_DAY_COLUMNS)
+    for d in days:
+        d["bookings"] = []
+    for pos, b in zip(frame.positions([b["fecha"] for b in booking_facts]).tolist(), booking_facts):
+        days[pos]["bookings"].append({
             "id":               b["id"],
             "nombre_cliente":   b["nombre_cliente"],
-            "ingreso_total":    pnl["gross"],
-            "commission":       pnl["commission_deduction"],
-            "net_income":       pnl["net_income"],
-            "costo":            pnl["costo_operacional"],
+            "ingreso_total":    b["gross"],
+            "commission":       b["commission_deduction"],
+            "net_income":       b["net_income"],
+            "costo":            costo_por_reserva,
             "pagos":            b["pagos"],
-            "ingreso_reserva":  sp["ingreso_reserva"],
-            "ingreso_aloj":     sp["ingreso_aloj"],
-            "ingreso_exp":      sp["ingreso_exp"],
-            "ingreso_extra":    sp["ingreso_extra"],
-            "descuentos_aplicados": disc_applied,
-            "cv_aloj":          sp["cv_aloj"],
-            "cv_exp":           sp["cv_exp"],
-            "cv_extra":         sp["cv_extra"],
+            "ingreso_reserva":  b["ingreso_reserva"],
+            "ingreso_aloj":     b["ingreso_aloj"],
+            "ingreso_exp":      b["ingreso_exp"],
+            "ingreso_extra":    b["ingreso_extra"],
+            "descuentos_aplicados": b["disc_applied"],
+            "cv_aloj":          b["cv_aloj"],
+            "cv_exp":           b["cv_exp"],
+            "cv_extra":         b["cv_extra"],
         })
+    return frame, days
+
+
+def _aggregate_periods(
+    frame: DayFrame, days: List[Dict], by: str, columns: Sequence[str],
+) -> List[Dict]:
+    """Roll day rows up into ISO weeks or months: column sums plus the days."""
+    periods = frame.periods(by)
+    sums = {k: periods.sum(frame[k]).tolist() for k in columns}
+    return [
+        {**head, **{k: sums[k][i] for k in columns}, "days": days[start:end]}
+        for i, (head, start, end) in enumerate(
+            zip(periods.heads, periods.starts.tolist(), periods.ends.tolist()))
+    ]
 
-    # Apply structural cost over full calendar months so partial-range filters still
-    # get the complete month's fixed cost (not just the days inside the filter window).
-    _struct_from = date(d_from.year, d_from.month, 1)
-    _struct_to   = date(d_to.year, d_to.month, _cal.monthrange(d_to.year, d_to.month)[1])
-    apply_structural_to_days(days, _struct_from, _struct_to, daily_struct)
 
-    all_days_with_mkt = set(days.keys()) | set(mkt_by_day.keys())
-    for day in all_days_with_mkt:
-        if day not in days:
-            days[day] = new_empty_day(day)
-        days[day]["marketing"] = _fmt_int(mkt_by_day.get(day, 0))
-        finalize_pnl_day(days[day])
+def _aggregate_weeks(frame: DayFrame, days: List[Dict]) -> List[Dict]:
+    return _aggregate_periods(frame, days, "week", _PNL_PERIOD_COLUMNS)
 
-    return days
 
-
-def _aggregate_weeks(days: Dict[str, Dict]) -> List[Dict]:
-    weeks: Dict[str, Dict] = {}
-    for day_str, d in sorted(days.items()):
-        dt = date.fromisoformat(day_str)
-        # ISO week key: YYYY-Www
-        week_key = dt.strftime("%G-W%V")
-        week_start = (dt - timedelta(days=dt.weekday())).isoformat()
-        week_end = (dt - timedelta(days=dt.weekday()) + timedelta(days=6)).isoformat()
-        if week_key not in weeks:
-            weeks[week_key] = {
-                "week": week_key, "week_start": week_start, "week_end": week_end,
-                "n_reservas": 0, "gross": 0, "commission_deduction": 0,
-                "net_income": 0, "costo_operacional": 0, "marketing": 0, "resultado": 0,
-                "costo_estructural": 0,
-                "ingreso_reserva": 0, "ingreso_aloj": 0, "ingreso_exp": 0, "ingreso_extra": 0,
-                "total_descuentos": 0,
-                "cv_aloj": 0, "cv_exp": 0, "cv_extra": 0,
-                "days": [],
-            }
-        w = weeks[week_key]
-        w["n_reservas"]           += d["n_reservas"]
-        w["gross"]                += d["gross"]
-        w["commission_deduction"] += d["commission_deduction"]
-        w["net_income"]           += d["net_income"]
-        w["costo_operacional"]    += d["costo_operacional"]
-        w["marketing"]            += d["marketing"]
-        w["resultado"]            += d["resultado"]
-        aggregate_breakdown_into_week_month(w, d)
-        w["days"].append(d)
-    return list(weeks.values())
-
-
-def _aggregate_months(days: Dict[str, Dict]) -> List[Dict]:
-    months: Dict[str, Dict] = {}
-    for day_str, d in sorted(days.items()):
-        month_key = day_str[:7]  # YYYY-MM
-        if month_key not in months:
-            months[month_key] = {
-                "month": month_key,
-                "n_reservas": 0, "gross": 0, "commission_deduction": 0,
-                "net_income": 0, "costo_operacional": 0, "marketing": 0, "resultado": 0,
-                "costo_estructural": 0,
-                "ingreso_reserva": 0, "ingreso_aloj": 0, "ingreso_exp": 0, "ingreso_extra": 0,
-                "total_descuentos": 0,
-                "cv_aloj": 0, "cv_exp": 0, "cv_extra": 0,
-                "days": [],
-            }
-        m = months[month_key]
-        m["n_reservas"]           += d["n_reservas"]
-        m["gross"]                += d["gross"]
-        m["commission_deduction"] += d["commission_deduction"]
-        m["net_income"]           += d["net_income"]
-        m["costo_operacional"]    += d["costo_operacional"]
-        m["marketing"]            += d["marketing"]
-        m["resultado"]            += d["resultado"]
-        aggregate_breakdown_into_week_month(m, d)
-        m["days"].append(d)
-    return list(months.values())
+def _aggregate_months(frame: DayFrame, days: List[Dict]) -> List[Dict]:
+    return _aggregate_periods(frame, days, "month", _PNL_PERIOD_COLUMNS)
 
 
 # ── Cash Flow calculation core ────────────────────────────────────────────────
 
+_CF_DAY_COLUMNS = (
+    "inflow_bruto", "inflow_commission", "inflow_neto",
+    "outflow_opex", "outflow_marketing", "outflow_estructural",
+    "outflow_cv_aloj", "outflow_cv_exp", "outflow_cv_extra",
+    "outflow_costo_fijo_reservas", "total_outflow", "net_cashflow",
+)
+
+
 def _build_cashflow_days(
-    bookings: List[Dict],
+    booking_days: Dict[str, Sequence],
+    payments: List[Dict],
     marketing: List[Dict],
-    commissions: Dict,
     d_from: date,
     d_to: date,
-) -> Dict[str, Dict]:
-    """Build per-day cash flow based on actual payment dates."""
+) -> Tuple[DayFrame, List[Dict]]:
+    """Build per-day cash flow based on actual payment dates.
+
+    Returns the columns as a DayFrame and the day dicts, sorted by fecha.
+    """
     structure = get_financial_structure()
     daily_struct = float(structure.get("costo_fijo_diario_prorrateado") or 0)
     costo_por_reserva = float(structure.get("costo_operativo_por_reserva") or 18000)
-    wl = set(structure.get("experience_slug_whitelist") or [])
-    cost_catalog = load_extra_cost_catalog()
-    aloj_cost_catalog = load_aloj_cost_catalog()
-
-    # Outflows: operational costs on booking date (total) + breakdown
-    opex_by_day: Dict[str, float] = defaultdict(float)
-    cf_opex_detail: Dict[str, Dict[str, int]] = defaultdict(
-        lambda: {"cv_aloj": 0, "cv_exp": 0, "cv_extra": 0, "costo_fijo": 0}
-    )
-    for b in bookings:
-        opex_by_day[b["fecha"]] += costo_por_reserva
-        sp = split_booking_financials(b, cost_catalog, wl, aloj_cost_catalog)
-        od = cf_opex_detail[b["fecha"]]
-        od["cv_aloj"] += sp["cv_aloj"]
-        od["cv_exp"] += sp["cv_exp"]
-        od["cv_extra"] += sp["cv_extra"]
-        od["costo_fijo"] = 0
-
-    # Outflows: marketing
-    mkt_by_day: Dict[str, float] = defaultdict(float)
-    for m in marketing:
-        mkt_by_day[m["fecha"]] += m["amount"]
-
-    # Inflows: pagos by payment date (net of commission).
-    # If a booking has no pagos, fall back to ingreso_total on the booking date.
-    inflows_by_day: Dict[str, List[Dict]] = defaultdict(list)
-    for b in bookings:
-        pagos = b["pagos"]
-        if not pagos:
-            # No payment records — treat the full ingreso_total as received on booking date
-            amt = b["ingreso_total"]
-            if amt and b["fecha"]:
-                net = _net_amount(amt, "transferencia", commissions)
-                inflows_by_day[b["fecha"]].append({
-                    "booking_id":     b["id"],
-                    "nombre_cliente": b["nombre_cliente"],
-                    "amount_bruto":   _fmt_int(amt),
-                    "commission":     0,
-                    "amount_neto":    _fmt_int(net),
-                    "method":         "sin registro",
-                })
-        else:
-            for p in pagos:
-                pago_date = p.get("date") or b["fecha"]
-                if not pago_date:
-                    continue
-                amt = float(p.get("amount", 0) or 0)
-                method = p.get("method", "otro")
-                net = _net_amount(amt, method, commissions)
-                commission = amt - net
-                inflows_by_day[pago_date].append({
-                    "booking_id":     b["id"],
-                    "nombre_cliente": b["nombre_cliente"],
-                    "amount_bruto":   _fmt_int(amt),
-                    "commission":     _fmt_int(commission),
-                    "amount_neto":    _fmt_int(net),
-                    "method":         method,
-                })
 
-    all_days = (
-        set(opex_by_day.keys())
-        | set(mkt_by_day.keys())
-        | set(inflows_by_day.keys())
-        | set(iso_dates_inclusive(d_from, d_to))
+    # Inflows: pagos by payment date (net of commission). A booking without
+    # pagos has a "sin registro" row for ingreso_total on the booking date.
+    # Outflows: operational costs and variable-cost breakdown on the booking
+    # date, marketing on its date, structural cost on every day in range.
+    opex_days = booking_days["fecha"]
+    mkt_days = [m["fecha"] for m in marketing]
+    pay_days = [p["cf_day"] for p in payments]
+    frame = DayFrame(chain(opex_days, mkt_days, pay_days, iso_dates_inclusive(d_from, d_to)))
+
+    pay_at, opex_at = frame.positions(pay_days), frame.positions(opex_days)
+    for col, key in (("inflow_bruto", "amount_bruto"), ("inflow_commission", "commission"),
+                     ("inflow_neto", "amount_neto")):
+        frame[col] = frame.sum_by_day(pay_at, [p[key] for p in payments]).astype(np.int64)
+    frame["outflow_opex"] = (
+        frame.put(opex_at, booking_days["n"]) * costo_por_reserva
+    ).astype(np.int64)
+    frame["outflow_marketing"] = frame.sum_by_day(
+        mkt_days, [m["amount"] for m in marketing]
+    ).astype(np.int64)
+    frame["outflow_estructural"] = frame.between(d_from, d_to) * int(round(daily_struct))
+    for k in ("cv_aloj", "cv_exp", "cv_extra"):
+        frame[f"outflow_{k}"] = frame.put(opex_at, booking_days[k])
+    frame["outflow_costo_fijo_reservas"] = np.zeros(len(frame), dtype=np.int64)
+    frame["total_outflow"] = (
+        frame["outflow_opex"] + frame["outflow_marketing"] + frame["outflow_estructural"]
     )
-
-    days: Dict[str, Dict] = {}
-    struct_int = int(round(daily_struct))
-    for day in all_days:
-        try:
-            dt = date.fromisoformat(day)
-            in_range = d_from <= dt <= d_to
-        except ValueError:
-            in_range = False
-        out_struct = struct_int if in_range else 0
-
-        total_inflow_neto = sum(p["amount_neto"] for p in inflows_by_day[day])
-        total_inflow_bruto = sum(p["amount_bruto"] for p in inflows_by_day[day])
-        total_commission = sum(p["commission"] for p in inflows_by_day[day])
-        outflow_opex = _fmt_int(opex_by_day[day])
-        outflow_mkt = _fmt_int(mkt_by_day[day])
-        det = cf_opex_detail[day]
-        total_outflow = outflow_opex + outflow_mkt + out_struct
-        days[day] = {
-            "fecha":              day,
-            "inflow_bruto":       _fmt_int(total_inflow_bruto),
-            "inflow_commission":  _fmt_int(total_commission),
-            "inflow_neto":        _fmt_int(total_inflow_neto),
-            "outflow_opex":       outflow_opex,
-            "outflow_marketing":  outflow_mkt,
-            "outflow_estructural": out_struct,
-            "outflow_cv_aloj":    int(det["cv_aloj"]),
-            "outflow_cv_exp":     int(det["cv_exp"]),
-            "outflow_cv_extra":   int(det["cv_extra"]),
-            "outflow_costo_fijo_reservas": int(det["costo_fijo"]),
-            "total_outflow":      total_outflow,
-            "net_cashflow":       _fmt_int(total_inflow_neto) - total_outflow,
-            "pagos_detail":       inflows_by_day[day],
-        }
-    return days
+    frame["net_cashflow"] = frame["inflow_neto"] - frame["total_outflow"]
+
+    days = frame.rows(_CF_DAY_COLUMNS)
+    for d in days:
+        d["pagos_detail"] = []
+    for pos, p in zip(pay_at.tolist(), payments):
+        days[pos]["pagos_detail"].append({
+            "booking_id":     p["booking_id"],
+            "nombre_cliente": p["nombre_cliente"],
+            "amount_bruto":   p["amount_bruto"],
+            "commission":     p["commission"],
+            "amount_neto":    p["amount_neto"],
+            "method":         p["method"],
+        })
+    return frame, days
 
 
-def _add_running_balance(days: Dict[str, Dict], opening_balance: float = 0) -> List[Dict]:
-    """Sort days and add beginning/ending balance."""
-    result = []
-    balance = opening_balance
-    for day_str in sorted(days.keys()):
-        d = dict(days[day_str])
-        d["beginning_balance"] = _fmt_int(balance)
-        balance += d["net_cashflow"]
-        d["ending_balance"] = _fmt_int(balance)
-        result.append(d)
-    return result
+def _add_running_balance(frame: DayFrame, days: List[Dict], opening_balance: float = 0) -> List[Dict]:
+    """Add beginning/ending balance to the (sorted) day rows."""
+    beginning, ending = running_balance(frame["net_cashflow"], opening_balance)
+    frame["beginning_balance"], frame["ending_balance"] = beginning, ending
+    for d, b, e in zip(days, beginning.tolist(), ending.tolist()):
+        d["beginning_balance"] = b
+        d["ending_balance"] = e
+    return days
 
 
 def _normalize_payment_method(method: Any) -> str:
@@ -672,14 +601,9 @@ def _parse_pago_date(raw_date: Any, fallback_date: Any) -> Optional[date]:
         return None
 
 
-def _build_inflows_by_method(
-    bookings: List[Dict],
-    commissions: Dict,
-    d_from: date,
-    d_to: date,
-) -> Dict[str, Dict[str, Any]]:
+def _build_inflows_by_method(payments: List[Dict]) -> Dict[str, Dict[str, Any]]:
     """
-    Aggregate inflows by payment method for a date range using payment date.
+    Aggregate inflows by payment method from _get_inflow_facts() rows.
     Returns dict method -> {count, inflow_bruto, inflow_commission, inflow_neto}.
     """
     grouped: Dict[str, Dict[str, Any]] = defaultdict(
@@ -691,122 +615,46 @@ def _build_inflows_by_method(
             "details": [],
         }
     )
-    for b in bookings:
-        pagos = b.get("pagos") or []
-        if not pagos:
-            pago_dt = _parse_pago_date(None, b.get("fecha"))
-            if not pago_dt or not (d_from <= pago_dt <= d_to):
-                continue
-            amt = float(b.get("ingreso_total") or 0)
-            if amt <= 0:
-                continue
-            method = "sin_registro"
-            net = _net_amount(amt, "transferencia", commissions)
-            commission = amt - net
-            g = grouped[method]
-            g["count"] += 1
-            amt_bruto = _fmt_int(amt)
-            amt_comm = _fmt_int(commission)
-            amt_neto = _fmt_int(net)
-            g["inflow_bruto"] += amt_bruto
-            g["inflow_commission"] += amt_comm
-            g["inflow_neto"] += amt_neto
-            g["details"].append({
-                "booking_id": b.get("id"),
-                "booking_date": b.get("fecha"),
-                "payment_date": pago_dt.isoformat(),
-                "nombre_cliente": b.get("nombre_cliente"),
-                "method_original": "sin registro",
-                "inflow_bruto": amt_bruto,
-                "inflow_commission": amt_comm,
-                "inflow_neto": amt_neto,
-            })
-            continue
-
-        for p in pagos:
-            pago_dt = _parse_pago_date(p.get("date"), b.get("fecha"))
-            if not pago_dt or not (d_from <= pago_dt <= d_to):
-                continue
-            amt = float(p.get("amount", 0) or 0)
-            if amt <= 0:
-                continue
-            method = _normalize_payment_method(p.get("method", "otro"))
-            net = _net_amount(amt, method, commissions)
-            commission = amt - net
-            g = grouped[method]
-            g["count"] += 1
-            amt_bruto = _fmt_int(amt)
-            amt_comm = _fmt_int(commission)
-            amt_neto = _fmt_int(net)
-            g["inflow_bruto"] += amt_bruto
-            g["inflow_commission"] += amt_comm
-            g["inflow_neto"] += amt_neto
-            g["details"].append({
-                "booking_id": b.get("id"),
-                "booking_date": b.get("fecha"),
-                "payment_date": pago_dt.isoformat(),
-                "nombre_cliente": b.get("nombre_cliente"),
-                "method_original": p.get("method", "otro"),
-                "inflow_bruto": amt_bruto,
-                "inflow_commission": amt_comm,
-                "inflow_neto": amt_neto,
-            })
+    for p in payments:
+        g = grouped[p["method"]]
+        g["count"] += 1
+        g["inflow_bruto"] += p["inflow_bruto"]
+        g["inflow_commission"] += p["inflow_commission"]
+        g["inflow_neto"] += p["inflow_neto"]
+        g["details"].append({
+            "booking_id": p["booking_id"],
+            "booking_date": p["booking_date"],
+            "payment_date": p["payment_date"],
+            "nombre_cliente": p["nombre_cliente"],
+            "method_original": p["method_original"],
+            "inflow_bruto": p["inflow_bruto"],
+            "inflow_commission": p["inflow_commission"],
+            "inflow_neto": p["inflow_neto"],
+        })
     return grouped
 
 
-def _aggregate_cf_weeks(days_list: List[Dict]) -> List[Dict]:
-    weeks: Dict[str, Dict] = {}
-    for d in days_list:
-        dt = date.fromisoformat(d["fecha"])
-        week_key = dt.strftime("%G-W%V")
-        week_start = (dt - timedelta(days=dt.weekday())).isoformat()
-        week_end = (dt - timedelta(days=dt.weekday()) + timedelta(days=6)).isoformat()
-        if week_key not in weeks:
-            weeks[week_key] = {
-                "week": week_key, "week_start": week_start, "week_end": week_end,
-                "inflow_bruto": 0, "inflow_commission": 0, "inflow_neto": 0,
-                "outflow_opex": 0, "outflow_marketing": 0, "outflow_estructural": 0,
-                "outflow_cv_aloj": 0, "outflow_cv_exp": 0, "outflow_cv_extra": 0,
-                "outflow_costo_fijo_reservas": 0,
-                "total_outflow": 0, "net_cashflow": 0,
-                "beginning_balance": d["beginning_balance"], "days": [],
-            }
-        w = weeks[week_key]
-        for k in ("inflow_bruto", "inflow_commission", "inflow_neto",
-                  "outflow_opex", "outflow_marketing", "outflow_estructural",
-                  "outflow_cv_aloj", "outflow_cv_exp", "outflow_cv_extra",
-                  "outflow_costo_fijo_reservas",
-                  "total_outflow", "net_cashflow"):
-            w[k] += d[k]
-        w["ending_balance"] = d["ending_balance"]
-        w["days"].append(d)
-    return list(weeks.values())
-
-
-def _aggregate_cf_months(days_list: List[Dict]) -> List[Dict]:
-    months: Dict[str, Dict] = {}
-    for d in days_list:
-        month_key = d["fecha"][:7]
-        if month_key not in months:
-            months[month_key] = {
-                "month": month_key,
-                "inflow_bruto": 0, "inflow_commission": 0, "inflow_neto": 0,
-                "outflow_opex": 0, "outflow_marketing": 0, "outflow_estructural": 0,
-                "outflow_cv_aloj": 0, "outflow_cv_exp": 0, "outflow_cv_extra": 0,
-                "outflow_costo_fijo_reservas": 0,
-                "total_outflow": 0, "net_cashflow": 0,
-                "beginning_balance": d["beginning_balance"], "days": [],
-            }
-        m = months[month_key]
-        for k in ("inflow_bruto", "inflow_commission", "inflow_neto",
-                  "outflow_opex", "outflow_marketing", "outflow_estructural",
-                  "outflow_cv_aloj", "outflow_cv_exp", "outflow_cv_extra",
-                  "outflow_costo_fijo_reservas",
-                  "total_outflow", "net_cashflow"):
-            m[k] += d[k]
-        m["ending_balance"] = d["ending_balance"]
-        m["days"].append(d)
-    return list(months.values())
+def _aggregate_cf_periods(frame: DayFrame, days: List[Dict], by: str) -> List[Dict]:
+    """Cash-flow roll-up: column sums, the balance the period opens and
+    closes with, and the days."""
+    periods = frame.periods(by)
+    sums = {k: periods.sum(frame[k]).tolist() for k in _CF_DAY_COLUMNS}
+    opening = frame["beginning_balance"][periods.starts].tolist()
+    closing = frame["ending_balance"][periods.ends - 1].tolist()
+    return [
+        {**head, **{k: sums[k][i] for k in _CF_DAY_COLUMNS},
+         "beginning_balance": opening[i], "days": days[start:end], "ending_balance": closing[i]}
+        for i, (head, start, end) in enumerate(
+            zip(periods.heads, periods.starts.tolist(), periods.ends.tolist()))
+    ]
+
+
+def _aggregate_cf_weeks(frame: DayFrame, days: List[Dict]) -> List[Dict]:
+    return _aggregate_cf_periods(frame, days, "week")
+
+
+def _aggregate_cf_months(frame: DayFrame, days: List[Dict]) -> List[Dict]:
+    return _aggregate_cf_periods(frame, days, "month")
 
 
 # ── P&L endpoints ─────────────────────────────────────────────────────────────
@@ -825,36 +673,19 @@ async def get_pnl(
         raise HTTPException(400, "Invalid date format, use YYYY-MM-DD")
 
     commissions = _get_commissions()
-    bookings  = _get_bookings_range(d_from, d_to)
+    await _refresh_facts()
+    day_facts, booking_facts = _get_pnl_facts(d_from, d_to)
     marketing = _get_marketing_costs_range(d_from, d_to)
 
-    days = _build_pnl_days(bookings, marketing, commissions, d_from, d_to)
+    frame, days = _build_pnl_days(day_facts, booking_facts, marketing, d_from, d_to)
     struct = get_financial_structure()
     period_days = (d_to - d_from).days + 1
-
-    totals = {
-        "n_reservas": sum(d["n_reservas"] for d in days.values()),
-        "gross": sum(d["gross"] for d in days.values()),
-        "commission_deduction": sum(d["commission_deduction"] for d in days.values()),
-        "net_income": sum(d["net_income"] for d in days.values()),
-        "costo_operacional": sum(d["costo_operacional"] for d in days.values()),
-        "marketing": sum(d["marketing"] for d in days.values()),
-        "costo_estructural": sum(d.get("costo_estructural", 0) for d in days.values()),
-        "ingreso_reserva": sum(d.get("ingreso_reserva", 0) for d in days.values()),
-        "ingreso_aloj": sum(d.get("ingreso_aloj", 0) for d in days.values()),
-        "ingreso_exp": sum(d.get("ingreso_exp", 0) for d in days.values()),
-        "ingreso_extra": sum(d.get("ingreso_extra", 0) for d in days.values()),
-        "total_descuentos": sum(d.get("total_descuentos", 0) for d in days.values()),
-        "cv_aloj": sum(d.get("cv_aloj", 0) for d in days.values()),
-        "cv_exp": sum(d.get("cv_exp", 0) for d in days.values()),
-        "cv_extra": sum(d.get("cv_extra", 0) for d in days.values()),
-        "resultado": sum(d["resultado"] for d in days.values()),
-    }
+    totals = frame.totals(_PNL_DAY_COLUMNS)
 
     if view == "weekly":
-        data = _aggregate_weeks(days)
+        data = _aggregate_weeks(frame, days)
     elif view == "monthly":
-        data = _aggregate_months(days)
+        data = _aggregate_months(frame, days)
         # Strip days outside the query range from the drill-down list.
         # Structural costs are intentionally expanded to the full month in the
         # monthly total, but daily sub-rows outside the range confuse the user.
@@ -863,7 +694,7 @@ async def get_pnl(
         for m in data:
             m["days"] = [d for d in m["days"] if d_from_str <= d["fecha"] <= d_to_str]
     else:
-        data = sorted(days.values(), key=lambda x: x["fecha"])
+        data = days
 
     return {
         "view": view,
@@ -893,17 +724,17 @@ async def get_cashflow(
     except ValueError:
         raise HTTPException(400, "Invalid date format, use YYYY-MM-DD")
 
-    commissions = _get_commissions()
-    bookings  = _get_bookings_cashflow_range(d_from, d_to)
+    await _refresh_facts()
+    booking_days, payments = _get_cashflow_facts(d_from, d_to)
     marketing = _get_marketing_costs_range(d_from, d_to)
 
-    days = _build_cashflow_days(bookings, marketing, commissions, d_from, d_to)
-    days_list = _add_running_balance(days, opening_balance)
+    frame, days = _build_cashflow_days(booking_days, payments, marketing, d_from, d_to)
+    days_list = _add_running_balance(frame, days, opening_balance)
 
     if view == "weekly":
-        data = _aggregate_cf_weeks(days_list)
+        data = _aggregate_cf_weeks(frame, days_list)
     elif view == "monthly":
-        data = _aggregate_cf_months(days_list)
+        data = _aggregate_cf_months(frame, days_list)
     else:
         data = days_list
 
@@ -930,9 +761,8 @@ async def get_inflows_by_method(
     except ValueError:
         raise HTTPException(400, "Invalid date format, use YYYY-MM-DD")
 
-    commissions = _get_commissions()
-    bookings = _get_bookings_cashflow_range(d_from, d_to)
-    grouped = _build_inflows_by_method(bookings, commissions, d_from, d_to)
+    await _refresh_facts()
+    grouped = _build_inflows_by_method(_get_inflow_facts(d_from, d_to))
 
     ordered_methods = [
         "efectivo",
@@ -980,38 +810,23 @@ async def get_forecast(
                   (today.month + months_ahead - 1) % 12 + 1,
                   1) - timedelta(days=1)
 
-    commissions = _get_commissions()
-
+    await _refresh_facts()
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
-                SELECT
-                    fecha::text,
-                    COALESCE(ingreso_total, 0),
-                    COALESCE(costo_operativo_total, 0),
-                    COALESCE(pagos, '[]'::jsonb),
-                    status,
-                    COALESCE(descuentos, '[]'::jsonb)
-                FROM all_appointments
+                SELECT fecha::text, ingreso_total, descuentos_total, commission,
+                       costo_total, status
+                FROM financial_booking_facts
                 WHERE fecha BETWEEN %s AND %s
-                  AND status = ANY(%s)
                 ORDER BY fecha
-            """, (d_from, d_to, list(CONFIRMED_STATUSES)))
+            """, (d_from, d_to))
             rows = cur.fetchall()
 
     months_data: Dict[str, Dict] = {}
     for r in rows:
-        day_str, gross, costo, pagos_raw, status, desc_raw = r
+        day_str, gross, descuentos, commission, costo, status = r
         month_key = day_str[:7]
-        gross = float(gross) - _sum_descuentos(desc_raw)
-        costo = float(costo)
-        pagos = pagos_raw if isinstance(pagos_raw, list) else json.loads(pagos_raw or "[]")
-
-        commission = sum(
-            float(p.get("amount", 0) or 0) - _net_amount(float(p.get("amount", 0) or 0),
-                                                           p.get("method", "otro"), commissions)
-            for p in pagos
-        )
+        gross = gross - descuentos
         net = gross - commission
 
         if month_key not in months_data:
@@ -1123,14 +938,6 @@ async def upsert_budget(year: int, month: int, body: BudgetIn,
                         x_admin_key: str = Header("")):
     with get_connection() as conn:
         with conn.cursor() as cur:
-            # Ensure zone columns exist (idempotent migration)
-            cur.execute("""
-                ALTER TABLE financial_budget
-                    ADD COLUMN IF NOT EXISTS aloj_budget    NUMERIC DEFAULT 0,
-                    ADD COLUMN IF NOT EXISTS exp_budget     NUMERIC DEFAULT 0,
-                    ADD COLUMN IF NOT EXISTS extra_budget   NUMERIC DEFAULT 0,
-                    ADD COLUMN IF NOT EXISTS reserva_budget NUMERIC DEFAULT 0
-            """)
             cur.execute("""
                 INSERT INTO financial_budget (year, month, income_budget, costs_budget,
                     marketing_budget, notes, aloj_budget, exp_budget, extra_budget, reserva_budget)
@@ -1213,7 +1020,6 @@ async def get_forecast_table(
         import calendar as _calendar
         today = date.today()
         cy, cm = today.year, today.month
-        commissions = _get_commissions()
         plan = _load_plan()
         week_budget_plan       = plan.get("week_budget", {})
         week_forecast_plan     = plan.get("week_forecast", {})
@@ -1277,32 +1083,19 @@ async def get_forecast_table(
                 except Exception:
                     pass
 
+            await _refresh_facts()
             by_week: Dict = {}
             with get_connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute("""
-                        SELECT COALESCE(fecha::text,''), COALESCE(ingreso_total,0),
-                               COALESCE(costo_operativo_total,0), COALESCE(pagos,'[]'::jsonb),
-                               COALESCE(descuentos,'[]'::jsonb)
-                        FROM all_appointments
-                        WHERE fecha BETWEEN %s AND %s AND status = ANY(%s)
-                        ORDER BY fecha
-                    """, (d_from_w, d_to_w, list(CONFIRMED_STATUSES)))
-                    for fecha_str, gross, costo, pagos_raw, desc_raw in cur.fetchall():
-                        if not fecha_str:
-                            continue
-                        dobj = datetime.strptime(fecha_str[:10], "%Y-%m-%d")
-                        iso = dobj.isocalendar()
-                        wk = f"{iso.year}-W{iso.week:02d}"
-                        _gf = float(gross)
-                        _disc = min(max(0.0, _sum_descuentos(desc_raw)), max(0.0, _gf))
-                        adj_gross = _gf - _disc
-                        net = _calc_net(adj_gross, pagos_raw, commissions)
-                        if wk not in by_week:
-                            by_week[wk] = {"income": 0, "costs": 0, "bookings": 0}
-                        by_week[wk]["income"]   += int(net)
-                        by_week[wk]["costs"]    += int(float(costo))
-                        by_week[wk]["bookings"] += 1
+                        SELECT to_char(fecha, 'IYYY-"W"IW'), SUM(fc_income)::bigint,
+                               SUM(fc_costs)::bigint, SUM(n_reservas)::int
+                        FROM financial_daily_facts
+                        WHERE fecha BETWEEN %s AND %s
+                        GROUP BY 1
+                    """, (d_from_w, d_to_w))
+                    for wk, income, costs, n in cur.fetchall():
+                        by_week[wk] = {"income": income, "costs": costs, "bookings": n}
 
             # Monthly budgets as fallback when no per-week budget set
             months_needed = set((w["ws"].year, w["ws"].month) for w in weeks_list)
@@ -1437,69 +1230,40 @@ async def get_forecast_table(
             _mk = _mr["fecha"][:7]
             mkt_by_month[_mk] = mkt_by_month.get(_mk, 0.0) + float(_mr["amount"])
 
+        # Actuals and zone split (ingreso_aloj / exp / extra) per month. Zone
+        # incomes carry the same discount scaling as P&L; cv_reserva uses the
+        # same criterion as P&L C.OP.
+        await _refresh_facts()
         by_month: Dict = {}
+        zone_by_month: Dict = {}
         with get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
-                    SELECT COALESCE(fecha::text,''), COALESCE(ingreso_total,0),
-                           COALESCE(pagos,'[]'::jsonb),
-                           COALESCE(descuentos,'[]'::jsonb)
-                    FROM all_appointments
-                    WHERE fecha BETWEEN %s AND %s AND status = ANY(%s)
-                    ORDER BY fecha
-                """, (d_from, d_to, list(CONFIRMED_STATUSES)))
-                for fecha_str, gross, pagos_raw, desc_raw in cur.fetchall():
-                    if not fecha_str:
-                        continue
-                    dobj = datetime.strptime(fecha_str[:10], "%Y-%m-%d")
-                    key = (dobj.year, dobj.month)
-                    _gf = float(gross)
-                    _disc = min(max(0.0, _sum_descuentos(desc_raw)), max(0.0, _gf))
-                    adj_gross = _gf - _disc
-                    net = _calc_net(adj_gross, pagos_raw, commissions)
-                    if key not in by_month:
-                        by_month[key] = {"income": 0, "costs": 0, "result": 0, "bookings": 0}
-                    by_month[key]["income"]   += int(adj_gross)           # GROSS (= P&L I.BRUTO)
-                    by_month[key]["costs"]    += int(costo_por_reserva_fc)
-                    by_month[key]["result"]   += int(net - costo_por_reserva_fc)  # net for correct result
-                    by_month[key]["bookings"] += 1
-                    by_month[key]["has_data"]  = True
-
-        # ── Zone actuals (ingreso_aloj / exp / extra) per month ─────────────
-        _wl              = set((structure.get("experience_slug_whitelist") or []))
-        _costo_x_reserva = costo_por_reserva_fc
-        _cc  = load_extra_cost_catalog()
-        _ac  = load_aloj_cost_catalog()
-        zone_by_month: Dict = {}
-        _bk_for_zones = _get_bookings_range(d_from, d_to)
-        for _bk in _bk_for_zones:
-            _mk = str(_bk["fecha"])[:7]
-            _sp = split_booking_financials(_bk, _cc, _wl, _ac)
-            # Apply same discount scaling as P&L so zone actuals reflect discounted income
-            _ing_total  = float(_bk.get("ingreso_total") or 0)
-            _man_disc   = _sum_descuentos(_bk.get("descuentos") or [])
-            _disc_cap   = min(max(0.0, _man_disc), max(0.0, _ing_total))
-            _gross_bk   = _ing_total - _disc_cap
-            _split_raw  = (_sp["ingreso_reserva"] + _sp["ingreso_aloj"]
-                           + _sp["ingreso_exp"]   + _sp["ingreso_extra"])
-            if _split_raw > 0:
-                _sc = _gross_bk / _split_raw
-                _sp["ingreso_reserva"] = int(round(_sp["ingreso_reserva"] * _sc))
-                _sp["ingreso_aloj"]    = int(round(_sp["ingreso_aloj"]    * _sc))
-                _sp["ingreso_exp"]     = int(round(_sp["ingreso_exp"]     * _sc))
-                _sp["ingreso_extra"]   = int(round(_sp["ingreso_extra"]   * _sc))
-            if _mk not in zone_by_month:
-                zone_by_month[_mk] = {"actual_reserva": 0, "cv_reserva": 0,
-                                       "actual_aloj": 0, "actual_exp": 0, "actual_extra": 0,
-                                       "cv_aloj": 0, "cv_exp": 0, "cv_extra": 0}
-            zone_by_month[_mk]["actual_reserva"] += _sp["ingreso_reserva"]
-            zone_by_month[_mk]["cv_reserva"]     += _costo_x_reserva  # mismo criterio que P&L C.OP
-            zone_by_month[_mk]["actual_aloj"]    += _sp["ingreso_aloj"]
-            zone_by_month[_mk]["actual_exp"]     += _sp["ingreso_exp"]
-            zone_by_month[_mk]["actual_extra"]   += _sp["ingreso_extra"]
-            zone_by_month[_mk]["cv_aloj"]        += _sp["cv_aloj"]
-            zone_by_month[_mk]["cv_exp"]         += _sp["cv_exp"]
-            zone_by_month[_mk]["cv_extra"]       += _sp["cv_extra"]
+                    SELECT EXTRACT(YEAR FROM fecha)::int, EXTRACT(MONTH FROM fecha)::int,
+                           COUNT(*)::int,
+                           SUM(trunc(fc_gross))::bigint,
+                           SUM(trunc(fc_net - %s))::bigint,
+                           SUM(fc_ingreso_reserva)::bigint, SUM(fc_ingreso_aloj)::bigint,
+                           SUM(fc_ingreso_exp)::bigint, SUM(fc_ingreso_extra)::bigint,
+                           SUM(cv_aloj)::bigint, SUM(cv_exp)::bigint, SUM(cv_extra)::bigint
+                    FROM financial_booking_facts
+                    WHERE fecha BETWEEN %s AND %s
+                    GROUP BY 1, 2
+                """, (costo_por_reserva_fc, d_from, d_to))
+                for (y, m, n, income, res, ing_res, ing_aloj, ing_exp, ing_extra,
+                     cv_aloj, cv_exp, cv_extra) in cur.fetchall():
+                    by_month[(y, m)] = {
+                        "income":   income,                               # GROSS (= P&L I.BRUTO)
+                        "costs":    n * int(costo_por_reserva_fc),
+                        "result":   res,                                  # net for correct result
+                        "bookings": n,
+                        "has_data": True,
+                    }
+                    zone_by_month[f"{y:04d}-{m:02d}"] = {
+                        "actual_reserva": ing_res, "cv_reserva": n * costo_por_reserva_fc,
+                        "actual_aloj": ing_aloj, "actual_exp": ing_exp, "actual_extra": ing_extra,
+                        "cv_aloj": cv_aloj, "cv_exp": cv_exp, "cv_extra": cv_extra,
+                    }
 
         budgets: Dict = {ym: _get_budget(ym[0], ym[1]) for ym in months_range}
 
@@ -1781,3 +1545,123 @@ async def save_sim_scenarios(request: Request, x_admin_key: str = Header("")):
         raise HTTPException(400, "Expected {scenarios: [...]}")
     set_setting("financial_simulator_scenarios", json.dumps(body))
     return body
+
+
+# ── What-if evaluation ────────────────────────────────────────────────────────
+
+_MAX_SCENARIOS = 200
+
+
+def _get_scenario_facts(
+    date_from: date, date_to: date,
+) -> Tuple[Dict[str, Sequence], Dict[str, Sequence], Dict[str, Sequence]]:
+    """As columns: day sums, booking_id / fecha / discounted gross per
+    booking and booking_id / amount / method per pago, for a range."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT fecha::text, n_reservas, gross, cv_aloj, cv_exp, cv_extra
+                FROM financial_daily_facts
+                WHERE fecha BETWEEN %s AND %s
+            """, (date_from, date_to))
+            days = _columns(cur.fetchall(),
+                            ("fecha", "n_reservas", "gross", "cv_aloj", "cv_exp", "cv_extra"))
+            cur.execute("""
+                SELECT booking_id, fecha::text, ingreso_total - disc_applied
+                FROM financial_booking_facts
+                WHERE fecha BETWEEN %s AND %s
+            """, (date_from, date_to))
+            bookings = _columns(cur.fetchall(), ("booking_id", "fecha", "gross"))
+            cur.execute("""
+                SELECT p.booking_id, p.amount, p.method_original
+                FROM financial_payment_facts p
+                JOIN financial_booking_facts f USING (booking_id)
+                WHERE f.fecha BETWEEN %s AND %s AND NOT p.is_fallback
+                ORDER BY p.booking_id, p.seq
+            """, (date_from, date_to))
+            pagos = _columns(cur.fetchall(), ("booking_id", "amount", "method"))
+    return days, bookings, pagos
+
+
+def _resolve_scenario(sc: Dict, structure: Dict, commissions: Dict) -> Dict:
+    """Scenario overrides on top of the live settings. Commission overrides
+    are merged per method, so {"mercadopago": {"rate": 0.03}} keeps its
+    iva_included."""
+    merged = {m: dict(cfg) for m, cfg in commissions.items()}
+    for m, cfg in (sc.get("commissions") or {}).items():
+        base = merged.get(m, {"rate": 0.0, "iva_included": False})
+        merged[m] = {"rate": float(cfg.get("rate", base["rate"])),
+                     "iva_included": bool(cfg.get("iva_included", base["iva_included"]))}
+    cpr = sc.get("costo_operativo_por_reserva", structure.get("costo_operativo_por_reserva") or 18000)
+    struct = sc.get("costo_fijo_diario_prorrateado", structure.get("costo_fijo_diario_prorrateado") or 0)
+    return {
+        "costo_operativo_por_reserva": _fmt_int(float(cpr)),
+        "costo_fijo_diario": int(round(float(struct))),
+        "marketing_factor": float(sc.get("marketing_factor", 1.0)),
+        "commissions": merged,
+    }
+
+
+@financial_router.post("/api/admin/financial/simulator/evaluate")
+async def evaluate_sim_scenarios(request: Request, x_admin_key: str = Header("")):
+    """
+    P&L of a date range under a batch of what-if parameter sets, evaluated
+    together. Body: {date_from, date_to, scenarios: [{name,
+    costo_operativo_por_reserva, costo_fijo_diario_prorrateado,
+    marketing_factor, commissions: {method: {rate, iva_included}}}]}; every
+    field but name is optional and defaults to the live settings, so an
+    empty scenario reproduces /pnl's totals.
+    """
+    body = await request.json()
+    if not isinstance(body, dict) or not isinstance(body.get("scenarios"), list):
+        raise HTTPException(400, "Expected {date_from, date_to, scenarios: [...]}")
+    scenarios = body["scenarios"]
+    if not scenarios or len(scenarios) > _MAX_SCENARIOS:
+        raise HTTPException(400, f"Between 1 and {_MAX_SCENARIOS} scenarios")
+    try:
+        d_from = date.fromisoformat(str(body.get("date_from")))
+        d_to   = date.fromisoformat(str(body.get("date_to")))
+    except ValueError:
+        raise HTTPException(400, "Invalid date format, use YYYY-MM-DD")
+
+    structure = get_financial_structure()
+    commissions = _get_commissions()
+    try:
+        params = [_resolve_scenario(sc, structure, commissions) for sc in scenarios]
+    except (AttributeError, TypeError, ValueError) as e:
+        raise HTTPException(400, f"Invalid scenario: {e}")
+
+    await _refresh_facts()
+    day_facts, bookings, pagos = _get_scenario_facts(d_from, d_to)
+    marketing = _get_marketing_costs_range(d_from, d_to)
+
+    struct_from, struct_to = _structural_range(d_from, d_to)
+    struct_days = iso_dates_inclusive(struct_from, struct_to)
+    fechas = day_facts["fecha"]
+    mkt_days = [m["fecha"] for m in marketing]
+    frame = DayFrame(chain(fechas, struct_days, mkt_days))
+    at = frame.positions(fechas)
+    for k in ("n_reservas", "gross", "cv_aloj", "cv_exp", "cv_extra"):
+        frame[k] = frame.put(at, day_facts[k])
+    frame["in_struct"] = frame.put(struct_days, 1)
+    frame["marketing_raw"] = frame.sum_by_day(mkt_days, [m["amount"] for m in marketing])
+
+    booking_pos = {bid: i for i, bid in enumerate(bookings["booking_id"])}
+    results = evaluate_pnl_scenarios(
+        frame,
+        booking_pos=frame.positions(bookings["fecha"]),
+        booking_gross=np.asarray(bookings["gross"], dtype=np.float64),
+        pago_booking=np.array([booking_pos[b] for b in pagos["booking_id"]], dtype=np.intp),
+        pago_amount=np.asarray(pagos["amount"], dtype=np.float64),
+        pago_method=pagos["method"],
+        params=params,
+        iva_rate=IVA_RATE,
+    )
+    return {
+        "date_from": d_from.isoformat(),
+        "date_to": d_to.isoformat(),
+        "scenarios": [
+            {"name": sc.get("name") or f"Escenario {i + 1}", "params": p, **r}
+            for i, (sc, p, r) in enumerate(zip(scenarios, params, results))
+        ],
+    }
@@ -68,6 +68,7 @@ def _ensure_tables():
         _seed_default_categories()
     except Exception as e:
         logger.error(f"gastos _ensure_tables: {e}")
+        raise
 
 
 def _seed_default_categories():
@@ -383,9 +384,9 @@ async def scan_receipt(body: ScanRequest, x_admin_key: str = Header("")):
 
 # ── Gastos CRUD ────────────────────────────────────────────────────────────────
 
-@gastos_router.get("/api/admin/gastos")
-async def list_gastos(year: int = 0, month: int = 0, x_admin_key: str = Header("")):
-    _check_auth(x_admin_key)
+def gastos_query(year: int = 0, month: int = 0) -> tuple:
+    """SQL and params for the gastos list (and its export), newest first;
+    rows go through gasto_row()."""
     conditions, params = [], []
     if year:
         conditions.append("EXTRACT(YEAR FROM g.fecha) = %s")
@@ -394,7 +395,7 @@ async def list_gastos(year: int = 0, month: int = 0, x_admin_key: str = Header("
         conditions.append("EXTRACT(MONTH FROM g.fecha) = %s")
         params.append(month)
     where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
-    sql = f"""
+    return f"""
         SELECT g.id, g.fecha, g.monto, g.descripcion, g.comercio, g.imagen_path,
                g.categoria1_id, c1.nombre, c1.color, c1.icono,
                g.categoria2_id, c2.nombre, c2.color, c2.icono,
@@ -405,37 +406,43 @@ async def list_gastos(year: int = 0, month: int = 0, x_admin_key: str = Header("
         LEFT JOIN gastos_categorias c2 ON g.categoria2_id = c2.id
         {where}
         ORDER BY g.fecha DESC, g.id DESC
-    """
+    """, params
+
+
+def gasto_row(r: tuple) -> dict:
+    m = r[2] or 0
+    tdoc = r[16] or "boleta"
+    neto = monto_neto(m, tdoc)
+    return {
+        "id": r[0], "fecha": str(r[1]), "monto": m,
+        "monto_neto": neto,
+        "iva_credito": (m - neto) if tdoc == "factura" else 0,
+        "tipo_documento": tdoc,
+        "incluir_en_utilidad": r[17] if r[17] is not None else True,
+        "descripcion": r[3] or "", "comercio": r[4] or "",
+        "imagen_path": r[5] or "",
+        "categoria1_id": r[6],
+        "categoria1_nombre": r[7] or "",
+        "categoria1_color": r[8] or "#6b7280",
+        "categoria1_icono": r[9] or "📌",
+        "categoria2_id": r[10],
+        "categoria2_nombre": r[11] or "",
+        "categoria2_color": r[12] or "#6b7280",
+        "categoria2_icono": r[13] or "📌",
+        "notas": r[14] or "",
+        "created_at": r[15].isoformat() if r[15] else "",
+    }
+
+
+@gastos_router.get("/api/admin/gastos")
+async def list_gastos(year: int = 0, month: int = 0, x_admin_key: str = Header("")):
+    _check_auth(x_admin_key)
+    sql, params = gastos_query(year, month)
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, params)
             rows = cur.fetchall()
-
-    def _build_row(r):
-        m = r[2] or 0
-        tdoc = r[16] or "boleta"
-        neto = monto_neto(m, tdoc)
-        return {
-            "id": r[0], "fecha": str(r[1]), "monto": m,
-            "monto_neto": neto,
-            "iva_credito": (m - neto) if tdoc == "factura" else 0,
-            "tipo_documento": tdoc,
-            "incluir_en_utilidad": r[17] if r[17] is not None else True,
-            "descripcion": r[3] or "", "comercio": r[4] or "",
-            "imagen_path": r[5] or "",
-            "categoria1_id": r[6],
-            "categoria1_nombre": r[7] or "",
-            "categoria1_color": r[8] or "#6b7280",
-            "categoria1_icono": r[9] or "📌",
-            "categoria2_id": r[10],
-            "categoria2_nombre": r[11] or "",
-            "categoria2_color": r[12] or "#6b7280",
-            "categoria2_icono": r[13] or "📌",
-            "notas": r[14] or "",
-            "created_at": r[15].isoformat() if r[15] else "",
-        }
-
-    return {"ok": True, "gastos": [_build_row(r) for r in rows]}
+    return {"ok": True, "gastos": [gasto_row(r) for r in rows]}
 
 
 @gastos_router.post("/api/admin/gastos")
@@ -0,0 +1,134 @@
+"""
+Accommodation availability from the occupancy index.
+
+accommodation_occupancy (migration 0102) holds units_booked per
+accommodation and night, maintained by a trigger on accommodation_bookings.
+A night is fully booked when units_booked >= the accommodation's
+total_units; blocked ranges (accommodation_blocked_dates) are reported
+separately because they go through the solicitud flow instead of being
+disabled in the calendar.
+
+Used by the public calendar endpoints in content_router and by the bot's
+accommodations handler.
+"""
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from app.db.connection import get_connection
+
+CALENDAR_DAYS = 365
+
+
+def _accommodations(cur, slugs: Optional[Iterable[str]] = None) -> List[tuple]:
+    """(id, slug, total_units) for active accommodations, in display order."""
+    sql = (
+        "SELECT id, slug, GREATEST(COALESCE(total_units, 1), 1)"
+        " FROM alojamientos WHERE is_active = TRUE"
+    )
+    params: tuple = ()
+    if slugs is not None:
+        sql += " AND slug = ANY(%s)"
+        params = (list(slugs),)
+    cur.execute(sql + " ORDER BY display_order, id", params)
+    return cur.fetchall()
+
+
+def _fully_booked(cur, units: Dict[int, int], start: date, end: date) -> Dict[int, List[str]]:
+    """accommodation_id → ISO dates in [start, end] with every unit taken."""
+    out: Dict[int, List[str]] = {aid: [] for aid in units}
+    if not units:
+        return out
+    ids = list(units)
+    cur.execute(
+        """
+        SELECT o.accommodation_id, o.day::text
+        FROM accommodation_occupancy o
+        JOIN unnest(%s::int[], %s::int[]) AS u(id, total_units) ON u.id = o.accommodation_id
+        WHERE o.day BETWEEN %s AND %s
+          AND o.units_booked >= u.total_units
+        ORDER BY o.accommodation_id, o.day
+        """,
+        (ids, [units[i] for i in ids], start, end),
+    )
+    for aid, day in cur.fetchall():
+        out[aid].append(day)
+    return out
+
+
+def _blocked(cur, ids: List[int], start: date) -> Dict[int, List[dict]]:
+    out: Dict[int, List[dict]] = {aid: [] for aid in ids}
+    if not ids:
+        return out
+    cur.execute(
+        "SELECT accommodation_id, start_date::text, end_date::text, reason"
+        " FROM accommodation_blocked_dates"
+        " WHERE accommodation_id = ANY(%s) AND end_date >= %s"
+        " ORDER BY accommodation_id, start_date",
+        (ids, start),
+    )
+    for aid, s, e, reason in cur.fetchall():
+        out[aid].append({"start": s, "end": e, "reason": reason})
+    return out
+
+
+def availability_calendars(slugs: Optional[Iterable[str]] = None,
+                           days: int = CALENDAR_DAYS) -> List[dict]:
+    """Calendar for each active accommodation (or only ``slugs``) from
+    today through today + ``days``: three queries regardless of how many
+    accommodations are asked for."""
+    start = date.today()
+    end = start + timedelta(days=days)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            rows = _accommodations(cur, slugs)
+            units = {aid: total for aid, _, total in rows}
+            booked = _fully_booked(cur, units, start, end)
+            blocked = _blocked(cur, list(units), start)
+    return [
+        {
+            "slug": slug,
+            "alojamiento_id": aid,
+            "total_units": total,
+            "fully_booked_dates": booked[aid],
+            "blocked": blocked[aid],
+        }
+        for aid, slug, total in rows
+    ]
+
+
+def unavailable_slugs(check_in: date, check_out: date) -> Dict[str, str]:
+    """Active accommodations that can't take a stay of [check_in, check_out):
+    slug → "full" (some night has every unit booked) or "blocked" (overlaps
+    an admin-blocked range)."""
+    if check_out <= check_in:
+        check_out = check_in + timedelta(days=1)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT a.slug,
+                       CASE WHEN EXISTS (
+                           SELECT 1 FROM accommodation_occupancy o
+                           WHERE o.accommodation_id = a.id
+                             AND o.day >= %(ci)s AND o.day < %(co)s
+                             AND o.units_booked >= GREATEST(COALESCE(a.total_units, 1), 1)
+                       ) THEN 'full' ELSE 'blocked' END
+                FROM alojamientos a
+                WHERE a.is_active = TRUE
+                  AND (
+                      EXISTS (
+                          SELECT 1 FROM accommodation_occupancy o
+                          WHERE o.accommodation_id = a.id
+                            AND o.day >= %(ci)s AND o.day < %(co)s
+                            AND o.units_booked >= GREATEST(COALESCE(a.total_units, 1), 1)
+                      )
+                      OR EXISTS (
+                          SELECT 1 FROM accommodation_blocked_dates b
+                          WHERE b.accommodation_id = a.id
+                            AND b.start_date < %(co)s AND b.end_date >= %(ci)s
+                      )
+                  )
+                """,
+                {"ci": check_in, "co": check_out},
+            )
+            return {slug: reason for slug, reason in cur.fetchall()}
@@ -60,6 +60,12 @@ def set_setting(key: str, value: str) -> bool:
         return False
 
 
+def forget_setting(key: str) -> None:
+    """Drop the cached value so the next get_setting() reads the database —
+    for callers that must not act on another replica's previous value."""
+    _SETTINGS_CACHE.pop(key, None)
+
+
 def _json_setting(key: str, default: dict) -> dict:
     raw = get_setting(key, "")
     if not raw:
@@ -997,6 +1003,7 @@ def seed_email_workflow_defaults() -> None:
             logger.info("Email workflow defaults seeded: %s", _TRIGGERS_ENABLED_DEFAULT - set(raw.keys() - {k for k in raw}))
     except Exception as e:
         logger.warning(f"seed_email_workflow_defaults: {e}")
+        raise
 
 
 def get_email_workflows() -> dict:
@@ -1,12 +1,12 @@
 """FastAPI router for /booking and /api/booking/*"""
 import html as _html
 import logging, os, time as _time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime, timedelta
 from urllib.parse import quote
 from zoneinfo import ZoneInfo
 from fastapi import APIRouter, HTTPException, Query, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from pydantic import BaseModel
 
 # Simple in-memory cache for availability (avoids re-running 60-day scan on rapid reloads)
@@ -661,7 +661,13 @@ async def create_booking_endpoint(request: CreateBookingRequest):
                             " WHERE phone_number=%s AND (ad_source IS NULL OR ad_source='')",
                             (_utm_label[:200], request.customer_phone),
                         )
+                        _updated = _cur.rowcount > 0
                     _conn.commit()
+                if _updated:
+                    # Same as the writers in app/db/leads.py: drop the cached
+                    # lead so the bot doesn't keep serving the old ad_source.
+                    from app.db.leads import invalidate_lead
+                    invalidate_lead(request.customer_phone)
             except Exception as _ue:
                 logger.debug("web booking leads.ad_source update: %s", _ue)
 
@@ -1340,9 +1346,9 @@ def _email_aloj_booking(
     hotboat_ref: str | None = None,
     confirmed: bool = False,
 ):
-    """Send email notification to admin for accommodation booking events."""
+    """Queue the admin notification email for accommodation booking events."""
     from app.config import get_settings
-    from app.email.resend_booking import send_booking_html
+    from app.email.outbox import enqueue_emails
 
     settings = get_settings()
     resend_key = (getattr(settings, "resend_api_key", "") or "").strip()
@@ -1399,16 +1405,16 @@ def _email_aloj_booking(
   </p>
 </div>"""
 
+    trigger = "aloj_booking_confirmed" if confirmed else "aloj_booking_created"
     try:
-        for recipient in recipients:
-            send_booking_html(
-                to=recipient,
-                subject=subject,
-                html=html,
-                from_address=from_addr,
-                api_key=resend_key,
-            )
-        logger.info("_email_aloj_booking sent for %s (confirmed=%s) to %s", aloj_ref, confirmed, recipients)
+        # Payment webhook and return page can both report the same payment.
+        enqueue_emails([
+            {"trigger": trigger, "to": recipient, "subject": subject, "html": html,
+             "from_address": from_addr, "booking_ref": aloj_ref,
+             "dedup_key": f"{trigger}:{aloj_ref}:{recipient}"}
+            for recipient in recipients
+        ])
+        logger.info("_email_aloj_booking queued for %s (confirmed=%s) to %s", aloj_ref, confirmed, recipients)
     except Exception as e:
         logger.warning("_email_aloj_booking send error %s: %s", aloj_ref, e)
 
@@ -1455,10 +1461,10 @@ async def _notify_solicitud(req: SolicitudRequest, ref: str):
 
 
 def _email_accommodation_solicitud(req: SolicitudRequest, ref: str):
-    """Send email with WhatsApp links to admin for accommodation inquiries."""
+    """Queue an email with WhatsApp links to admin for accommodation inquiries."""
     import urllib.parse
     from app.config import get_settings
-    from app.email.resend_booking import send_booking_html
+    from app.email.outbox import enqueue_emails
     from app.db.connection import get_connection
 
     # Parse accommodation ID/slug from service_type ("alojamiento:ID_OR_SLUG")
@@ -1580,15 +1586,13 @@ def _email_accommodation_solicitud(req: SolicitudRequest, ref: str):
             logger.warning("_email_accommodation_solicitud: RESEND_API_KEY not set, skipping email")
             return
 
-        for recipient in recipients:
-            send_booking_html(
-                to=recipient,
-                subject=f"🏠 Nueva solicitud: {aloj_name} · {req.dates_preference or 'fechas a definir'}",
-                html=html,
-                from_address=from_addr,
-                api_key=resend_key,
-            )
-        logger.info(f"Accommodation solicitud email sent for {ref} to {recipients}")
+        subject = f"🏠 Nueva solicitud: {aloj_name} · {req.dates_preference or 'fechas a definir'}"
+        enqueue_emails([
+            {"trigger": "aloj_solicitud", "to": recipient, "subject": subject, "html": html,
+             "from_address": from_addr, "booking_ref": ref}
+            for recipient in recipients
+        ])
+        logger.info(f"Accommodation solicitud email queued for {ref} to {recipients}")
     except Exception as e:
         logger.warning(f"_email_accommodation_solicitud send error: {e}")
 
@@ -2441,13 +2445,28 @@ async def create_pack_booking(request: PackBookingRequest):
 # turned into several partial rows. _close_stale_visitor_sessions() below
 # replaces that: it reads the full event history straight from the DB (always
 # complete, no matter which replica handled each event) on a periodic sweep
-# instead. Raw event persistence (persist_booking_visitor_event, below) was
-# never affected by this — it writes straight to the DB on every call.
+# instead, finding stale sessions through booking_visitor_session_state. Raw
+# event persistence was never affected by this — every event is written to
+# booking_visitor_events (buffered and batched, see
+# app/booking/visitor_ingest.py).
 
+# A batched payload carries at most this many events, each at most this old.
+TRACK_MAX_EVENTS = 50
+TRACK_MAX_AGO_MS = 10 * 60 * 1000
 
-class TrackEventRequest(BaseModel):
+
+class TrackEventItem(BaseModel):
     event: str
     date: Optional[str] = None
+    ago_ms: Optional[int] = 0  # how long before the request the event happened
+
+
+class TrackEventRequest(BaseModel):
+    # Either one event (event/date) or a batch (events) sharing the
+    # session-level fields below.
+    event: Optional[str] = None
+    events: Optional[List[TrackEventItem]] = None
+    date: Optional[str] = None
     lang: Optional[str] = "es"
     referrer: Optional[str] = ""
     session_id: Optional[str] = ""
@@ -2466,57 +2485,73 @@ class TrackEventRequest(BaseModel):
 @router.post("/api/booking/track")
 async def track_booking_event(body: TrackEventRequest):
     """
-    Persists one visitor event to the DB on every call. Session classification
-    (grouping a visitor's events, deciding "Muy interesado" vs "Solo mirando",
-    closing after 5 min of inactivity) happens later, out of band, in
-    _close_stale_visitor_sessions — see the module docstring above.
+    Queues the visitor event(s) for the buffered writer — a single event or a
+    batch of up to TRACK_MAX_EVENTS from the same session. Session
+    classification (grouping a visitor's events, deciding "Muy interesado"
+    vs "Solo mirando", closing after 5 min of inactivity) happens later, out
+    of band, in _close_stale_visitor_sessions — see the module docstring above.
     """
     sid = (body.session_id or "").strip()[:64]
     if not sid:
         return {"ok": True, "sent": False}
 
+    from app.booking.visitor_ingest import BufferFull, visitor_events
+    from app.booking.visitor_tracking import visitor_event_row
+
     now_cl = datetime.now(CHILE_TZ)
+    items = body.events or []
+    if body.event:
+        items = [TrackEventItem(event=body.event, date=body.date), *items]
+    shared = dict(
+        lang=str(body.lang or "es"),
+        referrer=str(body.referrer or ""),
+        is_returning=bool(body.is_returning),
+        link_token=(body.link_token or "").strip() or None,
+        visitor_id=(body.visitor_id or "").strip() or None,
+        utm_source=(body.utm_source or "").strip() or None,
+        utm_medium=(body.utm_medium or "").strip() or None,
+        utm_campaign=(body.utm_campaign or "").strip() or None,
+        utm_content=(body.utm_content or "").strip() or None,
+        fbclid=(body.fbclid or "").strip() or None,
+        parametro_url=(body.parametro_url or "").strip() or None,
+    )
+    rows = []
+    for item in items[:TRACK_MAX_EVENTS]:
+        ago_ms = min(max(int(item.ago_ms or 0), 0), TRACK_MAX_AGO_MS)
+        at = now_cl - timedelta(milliseconds=ago_ms)
+        rows.append(visitor_event_row(
+            sid, (item.event or "").strip(),
+            extra_date=(item.date or "").strip() or None,
+            time_label=at.strftime("%H:%M"),
+            recorded_at=at,
+            **shared,
+        ))
 
     try:
-        from app.booking.visitor_tracking import persist_booking_visitor_event
-
-        persist_booking_visitor_event(
-            sid,
-            (body.event or "").strip(),
-            extra_date=(body.date or "").strip() or None,
-            time_label=now_cl.strftime("%H:%M"),
-            lang=str(body.lang or "es"),
-            referrer=str(body.referrer or ""),
-            is_returning=bool(body.is_returning),
-            recorded_at=now_cl,
-            link_token=(body.link_token or "").strip() or None,
-            visitor_id=(body.visitor_id or "").strip() or None,
-            utm_source=(body.utm_source or "").strip() or None,
-            utm_medium=(body.utm_medium or "").strip() or None,
-            utm_campaign=(body.utm_campaign or "").strip() or None,
-            utm_content=(body.utm_content or "").strip() or None,
-            fbclid=(body.fbclid or "").strip() or None,
-            parametro_url=(body.parametro_url or "").strip() or None,
-        )
-    except Exception as _persist_e:
-        logger.warning("visitor event persist failed: %s", _persist_e)
-
-    return {"ok": True, "sent": False}
+        queued = await visitor_events.put(rows)
+    except BufferFull as e:
+        logger.warning("visitor events rejected: %s", e)
+        return JSONResponse({"ok": False, "sent": False}, status_code=503, headers={"Retry-After": "5"})
+    return {"ok": True, "sent": False, "queued": queued}
 
 
 def _close_stale_visitor_sessions(inactivity_minutes: int = 5, batch_limit: int = 200) -> dict:
-    """Find sessions whose last event is older than `inactivity_minutes` and
-    that haven't been closed yet (no row in booking_visitor_sessions), rebuild
-    each one's full event list from the DB, classify it, and persist it via
-    the existing _send_session_summary (same email-gating + DB-write logic the
-    old in-memory path used). Runs on whichever process holds the scheduler
-    advisory lock (see try_acquire_scheduler_lock), so a session is only ever
-    closed once — no cross-replica races.
-
-    UTM/ad attribution (utm_source, fbclid, etc.) is only ever non-empty on
-    the first event or two of a session (it comes from the landing URL's
-    query string) — picked per-session below via the same array_agg+FILTER
-    pattern already used for referrer, taking the earliest non-null value.
+    """Close sessions whose last event is older than `inactivity_minutes`:
+    rebuild each one's full event list from the DB, classify it, and persist
+    it via the existing _send_session_summary (same email-gating + DB-write
+    logic the old in-memory path used). Runs as the "visitor_session_closer"
+    job, whose claim on its delayed_jobs row (app/scheduler/jobs.py) keeps
+    it on one replica at a time, so a session is only ever closed once — no
+    cross-replica races.
+
+    Which sessions are stale, and their per-session fields (first/last seen,
+    latest lang/referrer, earliest non-null visitor_id and utm_*/fbclid/
+    parametro_url), come from booking_visitor_session_state, which a trigger
+    on booking_visitor_events keeps current as events are written (migration
+    0105) — an index range scan on last_seen_at instead of re-aggregating
+    every raw event. The events of the whole batch are then read in one
+    query, bounded by the oldest first_seen_at so only the relevant daily
+    partitions are scanned.
     """
     from app.db.connection import get_connection
 
@@ -2524,50 +2559,39 @@ def _close_stale_visitor_sessions(inactivity_minutes: int = 5, batch_limit: int
         with conn.cursor() as cur:
             cur.execute(
                 """
-                SELECT session_id, MIN(recorded_at), MAX(recorded_at),
-                       (array_agg(lang ORDER BY recorded_at DESC))[1],
-                       (array_agg(referrer ORDER BY recorded_at DESC)
-                            FILTER (WHERE referrer IS NOT NULL AND referrer <> ''))[1],
-                       bool_or(is_returning),
-                       (array_agg(visitor_id ORDER BY recorded_at)
-                            FILTER (WHERE visitor_id IS NOT NULL))[1],
-                       (array_agg(utm_source ORDER BY recorded_at)
-                            FILTER (WHERE utm_source IS NOT NULL))[1],
-                       (array_agg(utm_medium ORDER BY recorded_at)
-                            FILTER (WHERE utm_medium IS NOT NULL))[1],
-                       (array_agg(utm_campaign ORDER BY recorded_at)
-                            FILTER (WHERE utm_campaign IS NOT NULL))[1],
-                       (array_agg(utm_content ORDER BY recorded_at)
-                            FILTER (WHERE utm_content IS NOT NULL))[1],
-                       (array_agg(fbclid ORDER BY recorded_at)
-                            FILTER (WHERE fbclid IS NOT NULL))[1],
-                       (array_agg(parametro_url ORDER BY recorded_at)
-                            FILTER (WHERE parametro_url IS NOT NULL))[1]
-                FROM booking_visitor_events
-                WHERE session_id NOT IN (SELECT DISTINCT session_id FROM booking_visitor_sessions)
-                GROUP BY session_id
-                HAVING MAX(recorded_at) < NOW() - (%s || ' minutes')::interval
+                SELECT session_id, first_seen_at, lang, referrer, is_returning, visitor_id,
+                       utm_source, utm_medium, utm_campaign, utm_content, fbclid, parametro_url
+                FROM booking_visitor_session_state
+                WHERE closed_at IS NULL
+                  AND last_seen_at < NOW() - make_interval(mins => %s)
+                ORDER BY last_seen_at
                 LIMIT %s
                 """,
                 (inactivity_minutes, batch_limit),
             )
             stale = cur.fetchall()
+            if not stale:
+                return {"closed": 0, "found": 0}
+            cur.execute(
+                """
+                SELECT session_id, event_type, extra_date, time_label FROM booking_visitor_events
+                WHERE session_id = ANY(%s) AND recorded_at >= %s
+                ORDER BY session_id, recorded_at
+                """,
+                ([r[0] for r in stale], min(r[1] for r in stale)),
+            )
+            events_by_session = {}
+            for session_id, event_type, extra_date, time_label in cur.fetchall():
+                events_by_session.setdefault(session_id, []).append(
+                    {"event": event_type, "date": extra_date, "time": time_label})
 
-    closed = 0
-    for (session_id, started_at, ended_at, lang, referrer, is_returning, visitor_id,
+    closed, done = 0, []
+    for (session_id, started_at, lang, referrer, is_returning, visitor_id,
          utm_source, utm_medium, utm_campaign, utm_content, fbclid, parametro_url) in stale:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT event_type, extra_date, time_label FROM booking_visitor_events
-                    WHERE session_id = %s ORDER BY recorded_at
-                    """,
-                    (session_id,),
-                )
-                ev_rows = cur.fetchall()
-        events = [{"event": r[0], "date": r[1], "time": r[2]} for r in ev_rows]
+        events = events_by_session.get(session_id)
         if not events:
+            # Raw events already past retention: nothing left to summarise.
+            done.append(session_id)
             continue
         session = {
             "session_id": session_id,
@@ -2584,22 +2608,20 @@ def _close_stale_visitor_sessions(inactivity_minutes: int = 5, batch_limit: int
         try:
             _send_session_summary(session)
             closed += 1
+            done.append(session_id)
         except Exception as e:
             logger.warning("_close_stale_visitor_sessions: failed to close %s: %s", session_id, e)
 
-    return {"closed": closed, "found": len(stale)}
-
+    if done:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE booking_visitor_session_state SET closed_at = NOW() WHERE session_id = ANY(%s)",
+                    (done,),
+                )
+            conn.commit()
 
-async def _run_visitor_session_closer_scheduler():
-    import asyncio
-    while True:
-        try:
-            result = await asyncio.get_event_loop().run_in_executor(None, _close_stale_visitor_sessions)
-            if result.get("closed"):
-                logger.info("visitor_session_closer: closed %d session(s)", result["closed"])
-        except Exception as e:
-            logger.warning("visitor_session_closer error: %s", e)
-        await asyncio.sleep(120)
+    return {"closed": closed, "found": len(stale)}
 
 
 def _classify_visitor(events: list) -> tuple:
@@ -2714,7 +2736,7 @@ def _send_visitor_email(session: dict, classification: str, cls_desc: str, event
     try:
         from app.config import get_settings
         from app.booking.booking_email import _get_admin_email, _get_from_addr
-        from app.email.resend_booking import send_booking_html
+        from app.email.outbox import enqueue_email
 
         cfg = get_settings()
         api_key   = (getattr(cfg, "resend_api_key", "") or "").strip()
@@ -2861,10 +2883,9 @@ def _send_visitor_email(session: dict, classification: str, cls_desc: str, event
   </table>
 </div>"""
 
-            send_booking_html(to=to_addr, subject=subject, html=html,
-                              from_address=from_addr, api_key=api_key)
+            enqueue_email("visitor_session_summary", to_addr, subject, html, from_addr)
             sent_ok = True
-            logger.info("visitor_session_summary sent: sid=%s events=%d cls=%s",
+            logger.info("visitor_session_summary queued: sid=%s events=%d cls=%s",
                         session.get("session_id", "?"), len(events), classification)
     except Exception as e:
         logger.warning("_send_session_summary error: %s", e)
@@ -7,9 +7,9 @@ logger = logging.getLogger(__name__)
 ADMIN_NOTIFICATION_EMAIL = "hotboatnotification@gmail.com"
 
 
-def _send(to: str, subject: str, html: str) -> None:
+def _send(trigger: str, to: str, subject: str, html: str, booking_ref: Optional[str] = None) -> None:
     from app.config import get_settings
-    from app.email.resend_booking import send_booking_html
+    from app.email.outbox import dedup_key, enqueue_email
 
     settings = get_settings()
     api_key = (getattr(settings, "resend_api_key", "") or "").strip()
@@ -23,13 +23,8 @@ def _send(to: str, subject: str, html: str) -> None:
         or "noreply@reservas.hotboat.cl"
     ).strip()
 
-    send_booking_html(
-        to=to,
-        subject=subject,
-        html=html,
-        from_address=from_addr,
-        api_key=api_key,
-    )
+    enqueue_email(trigger, to, subject, html, from_addr, booking_ref=booking_ref,
+                  dedup_key=dedup_key(trigger, booking_ref))
 
 
 def _fmt_date(d: Optional[str]) -> str:
@@ -95,8 +90,9 @@ def notify_admin_new_signature(sig: dict, booking: dict) -> None:
 </html>
 """
     try:
-        _send(ADMIN_NOTIFICATION_EMAIL, subject, html)
-        logger.info("notify_admin_new_signature sent for %s / sig_id=%s", booking_ref, sig.get("id"))
+        # Several passengers sign per booking: one email each, no dedup.
+        _send("signature_new", ADMIN_NOTIFICATION_EMAIL, subject, html)
+        logger.info("notify_admin_new_signature queued for %s / sig_id=%s", booking_ref, sig.get("id"))
     except Exception as e:
         logger.error("notify_admin_new_signature failed: %s", e)
 
@@ -162,8 +158,8 @@ def send_booking_signature_summary(booking_ref: str, booking: dict, signatures:
 </html>
 """
     try:
-        _send(ADMIN_NOTIFICATION_EMAIL, subject, html)
-        logger.info("send_booking_signature_summary sent for %s (%d sigs)", booking_ref, signed)
+        _send("signature_summary", ADMIN_NOTIFICATION_EMAIL, subject, html, booking_ref=booking_ref)
+        logger.info("send_booking_signature_summary queued for %s (%d sigs)", booking_ref, signed)
     except Exception as e:
         logger.error("send_booking_signature_summary failed for %s: %s", booking_ref, e)
 
@@ -365,8 +361,9 @@ def send_pre_booking_notification(booking: dict, prev_bookings: int = 0) -> None
 </body>
 </html>"""
     try:
-        _send(ADMIN_NOTIFICATION_EMAIL, subject, html)
-        logger.info("pre_booking_notification sent for %s (%s %s, prev=%d)", ref, bdate, btime, prev_bookings)
+        _send("pre_booking_notification", ADMIN_NOTIFICATION_EMAIL, subject, html,
+              booking_ref=booking.get("booking_ref"))
+        logger.info("pre_booking_notification queued for %s (%s %s, prev=%d)", ref, bdate, btime, prev_bookings)
     except Exception as e:
         logger.error("pre_booking_notification failed for %s: %s", ref, e)
 
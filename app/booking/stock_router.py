@@ -28,13 +28,8 @@ def _row_to_dict(cur, row):
     return dict(zip([d.name for d in cur.description], row))
 
 
-_tables_ensured = False  # DDL solo debe correr una vez por proceso, no en cada request
-
-
 def _ensure_tables():
-    global _tables_ensured
-    if _tables_ensured:
-        return
+    """Stock schema — applied by the baseline migration (app/db/migrations)."""
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
@@ -72,7 +67,6 @@ def _ensure_tables():
                     ADD COLUMN IF NOT EXISTS consumption_qty NUMERIC DEFAULT 1;
             """)
             conn.commit()
-    _tables_ensured = True
 
 
 def _apply_movement(cur, product_id: int, delta: float, reason: str,
@@ -171,7 +165,6 @@ class ProductBody(BaseModel):
 @stock_router.get("/api/admin/stock/products")
 def list_products(x_admin_key: str = Header("")):
     _check_auth(x_admin_key)
-    _ensure_tables()
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
@@ -511,6 +504,11 @@ def consume_for_booking(body: ConsumeBody, x_admin_key: str = Header("")):
                     (-old_delta, product_id)
                 )
             cur.execute("DELETE FROM stock_movements WHERE booking_ref=%s", (ref,))
+            if body.undo:
+                # Returned stock: let the auto-consumer pick the booking up again.
+                cur.execute("DELETE FROM stock_consumptions WHERE booking_ref=%s AND reason='booking'", (ref,))
+            else:
+                _claim_consumption(cur, ref)
 
             if not body.undo:
                 for item in body.extras:
@@ -695,17 +693,19 @@ def _booking_paid_tabla(extras_json) -> bool:
     return False
 
 
-def _consume_booking_extras(cur, booking_ref: str, extras_json, tabla_selection=None,
-                            customer_name=None, booking_date=None):
-    """Consume stock for one booking. Returns number of movements applied."""
-    import json as _json
-    # Etiqueta legible de la reserva para las notas del movimiento: "Nombre · Fecha".
-    # Si falta el nombre, cae al código de reserva como respaldo.
+def _reservation_label(booking_ref: str, customer_name=None, booking_date=None) -> str:
+    """Etiqueta legible de la reserva para las notas del movimiento: "Nombre · Fecha".
+    Si falta el nombre, cae al código de reserva como respaldo."""
     _who  = (str(customer_name).strip() if customer_name else "")
     _when = (str(booking_date)[:10] if booking_date else "")
-    _res_label = " · ".join([p for p in (_who, _when) if p]) or booking_ref
+    return " · ".join([p for p in (_who, _when) if p]) or booking_ref
 
-    # Parse extras
+
+def _parse_booking_extras(extras_json):
+    """Split a booking's extras_json into BOM items [(slug, qty)] and the
+    tabla ingredients embedded in its tabla__* entries (fallback for when
+    there's no tabla_selections row)."""
+    import json as _json
     if isinstance(extras_json, str):
         try:
             extras_json = _json.loads(extras_json)
@@ -720,8 +720,7 @@ def _consume_booking_extras(cur, booking_ref: str, extras_json, tabla_selection=
     for slug, val in extras_json.items():
         if slug.startswith("tabla__"):
             # Tabla keys are handled via ingredient list, not BOM.
-            # If tabla_selections DB lookup failed, fall back to elige_* in the dict.
-            if not tabla_selection and isinstance(val, dict):
+            if isinstance(val, dict):
                 elig1 = val.get("elige_1")
                 elig2 = val.get("elige_2") or []
                 elig3 = val.get("elige_3") or []
@@ -747,7 +746,38 @@ def _consume_booking_extras(cur, booking_ref: str, extras_json, tabla_selection=
         except (TypeError, ValueError):
             qty = 1
         if qty > 0:
-            items.append({"extra_slug": slug, "quantity": qty, "variant_product_id": None})
+            items.append((slug, qty))
+    return items, extracted_tabla_ingredients
+
+
+def _selection_ingredients(elige_1, elige_2, elige_3) -> list:
+    """Ingredient names from a tabla_selections row."""
+    import json as _json
+    out = []
+    if elige_1:
+        out.append(elige_1)
+    for fld in (elige_2, elige_3):
+        if fld:
+            try:
+                out.extend(_json.loads(fld) if isinstance(fld, str) else fld)
+            except Exception:
+                pass
+    return out
+
+
+def _claim_consumption(cur, booking_ref: str) -> None:
+    cur.execute(
+        "INSERT INTO stock_consumptions (booking_ref, reason) VALUES (%s, 'booking') ON CONFLICT DO NOTHING",
+        (booking_ref,),
+    )
+
+
+def _consume_booking_extras(cur, booking_ref: str, extras_json, tabla_selection=None,
+                            customer_name=None, booking_date=None):
+    """Consume stock for one booking. Returns number of movements applied."""
+    _res_label = _reservation_label(booking_ref, customer_name, booking_date)
+    bom_items, extracted_tabla_ingredients = _parse_booking_extras(extras_json)
+    items = [{"extra_slug": slug, "quantity": qty, "variant_product_id": None} for slug, qty in bom_items]
 
     # Use DB-provided list first; fall back to what was embedded in extras_json
     all_tabla_ingredients = tabla_selection or extracted_tabla_ingredients or []
@@ -817,6 +847,158 @@ def _consume_booking_extras(cur, booking_ref: str, extras_json, tabla_selection=
 TRIP_DURATION_HOURS = 2
 
 
+# Bookings handled per transaction by auto_consume_past_bookings().
+CONSUME_BATCH_SIZE = 500
+
+
+def _consume_batch(conn) -> dict:
+    """
+    One transaction of the consumer: lock up to CONSUME_BATCH_SIZE finished,
+    unconsumed bookings, claim them in stock_consumptions, resolve their
+    extras against the BOM in one joined query, then write every movement
+    with one multi-row INSERT and one grouped stock UPDATE.
+    """
+    consumed, skipped, unmatched_ingredients = [], [], []
+    with conn.cursor() as cur:
+        # "Finished" = fecha + hora (end of day if missing) + trip duration
+        # is in the past, Chile time. Rows are locked so a second replica
+        # running the job skips them instead of waiting.
+        cur.execute("""
+            SELECT aa.id, COALESCE(NULLIF(aa.source_id, ''), 'AA-' || aa.id::text) AS ref,
+                   aa.fecha, aa.extras_json, aa.nombre_cliente,
+                   ts.elige_1, ts.elige_2, ts.elige_3
+            FROM all_appointments aa
+            LEFT JOIN tabla_selections ts
+                   ON ts.booking_ref = COALESCE(NULLIF(aa.source_id, ''), 'AA-' || aa.id::text)
+            WHERE aa.stock_consumed_at IS NULL
+              AND aa.fecha <= (NOW() AT TIME ZONE 'America/Santiago')::date
+              AND aa.status IN ('confirmed', 'CONFIRMED', 'pending', 'PENDING')
+              AND ((aa.fecha + COALESCE(aa.hora, TIME '23:59')) AT TIME ZONE 'America/Santiago')
+                  + make_interval(hours => %s) <= NOW()
+            ORDER BY aa.id
+            LIMIT %s
+            FOR UPDATE OF aa SKIP LOCKED
+        """, (TRIP_DURATION_HOURS, CONSUME_BATCH_SIZE))
+        rows = cur.fetchall()
+        if not rows:
+            return {"rows": 0, "consumed": consumed, "skipped": skipped,
+                    "unmatched_ingredients": unmatched_ingredients}
+
+        # A ref can appear on several rows; the first one carries the booking.
+        bookings = {}
+        for row_id, ref, fecha, extras_json, customer_name, e1, e2, e3 in rows:
+            if ref not in bookings:
+                bookings[ref] = (fecha, extras_json, customer_name, (e1, e2, e3))
+
+        # Idempotency: only bookings we manage to claim get movements.
+        cur.execute("""
+            INSERT INTO stock_consumptions (booking_ref, reason)
+            SELECT ref, 'booking' FROM unnest(%s::text[]) AS r(ref)
+            ON CONFLICT DO NOTHING
+            RETURNING booking_ref
+        """, (list(bookings),))
+        claimed = {r[0] for r in cur.fetchall()}
+
+        bom_refs, bom_slugs, bom_qtys = [], [], []
+        tabla = {}   # ref → ingredient names
+        for ref, (fecha, extras_json, customer_name, selection) in bookings.items():
+            if ref not in claimed:
+                continue
+            items, extracted = _parse_booking_extras(extras_json)
+            for slug, qty in items:
+                bom_refs.append(ref)
+                bom_slugs.append(slug)
+                bom_qtys.append(qty)
+            # tabla_selections only counts when the tabla was actually paid/included.
+            ingredients = _selection_ingredients(*selection) if _booking_paid_tabla(extras_json) else []
+            ingredients = ingredients or extracted
+            if ingredients:
+                tabla[ref] = ingredients
+
+        # (product_id, product_name, delta, booking_ref, extra_slug, notes)
+        movements = []
+
+        if bom_refs:
+            # Extras with variants need the chosen variant, which bookings
+            # don't carry — those are skipped, as before.
+            cur.execute("""
+                SELECT i.ref, i.slug, i.qty, b.product_id, b.quantity, COALESCE(p.name, '')
+                FROM unnest(%s::text[], %s::text[], %s::int[]) WITH ORDINALITY AS i(ref, slug, qty, n)
+                JOIN extras_bom b ON b.extra_slug = i.slug
+                LEFT JOIN stock_products p ON p.id = b.product_id
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM extras_bom v WHERE v.extra_slug = i.slug AND v.is_variant
+                )
+                ORDER BY i.n, b.id
+            """, (bom_refs, bom_slugs, bom_qtys))
+            for ref, slug, qty, product_id, bom_qty, pname in cur.fetchall():
+                fecha, _, customer_name, _ = bookings[ref]
+                label = _reservation_label(ref, customer_name, fecha)
+                movements.append((product_id, pname, -float(bom_qty * qty), ref, slug,
+                                  f"Reserva {label} — {slug}"))
+
+        if tabla:
+            import difflib
+            cur.execute("SELECT id, name, COALESCE(consumption_qty, 1) FROM stock_products")
+            all_product_names = []
+            norm_to_product = {}
+            for pid, pname, cqty in cur.fetchall():
+                all_product_names.append(pname)
+                norm_to_product.setdefault(_norm_name(pname), (pid, pname, float(cqty or 1)))
+            for ref, ingredients in tabla.items():
+                fecha, _, customer_name, _ = bookings[ref]
+                label = _reservation_label(ref, customer_name, fecha)
+                for ingredient_name in ingredients:
+                    match = norm_to_product.get(_norm_name(ingredient_name))
+                    if match:
+                        pid, pname, cqty = match
+                        movements.append((pid, pname, -cqty, ref, _norm_name(ingredient_name),
+                                          f"Tabla de {label} — {ingredient_name}"))
+                    else:
+                        close = difflib.get_close_matches(ingredient_name, all_product_names, n=1, cutoff=0.6)
+                        suggestion = close[0] if close else None
+                        logger.warning(
+                            "⚠️ Stock NO descontado para reserva %s: ingrediente '%s' no coincide "
+                            "con ningún producto en stock_products.%s",
+                            ref, ingredient_name,
+                            f" ¿Quizás '{suggestion}'?" if suggestion else "",
+                        )
+                        unmatched_ingredients.append(
+                            {"booking_ref": ref, "ingredient": ingredient_name, "suggestion": suggestion})
+
+        if movements:
+            cols = list(zip(*movements))
+            cur.execute("""
+                INSERT INTO stock_movements
+                    (product_id, product_name, delta, reason, booking_ref, extra_slug, notes)
+                SELECT m.product_id, m.product_name, m.delta, 'booking', m.booking_ref, m.extra_slug, m.notes
+                FROM unnest(%s::int[], %s::text[], %s::numeric[], %s::text[], %s::text[], %s::text[])
+                     AS m(product_id, product_name, delta, booking_ref, extra_slug, notes)
+            """, [list(c) for c in cols])
+            cur.execute("""
+                UPDATE stock_products sp
+                SET current_stock = sp.current_stock + d.delta, updated_at = NOW()
+                FROM (
+                    SELECT product_id, SUM(delta) AS delta
+                    FROM unnest(%s::int[], %s::numeric[]) AS m(product_id, delta)
+                    GROUP BY product_id
+                ) d
+                WHERE sp.id = d.product_id
+            """, (list(cols[0]), list(cols[2])))
+
+        cur.execute(
+            "UPDATE all_appointments SET stock_consumed_at = NOW() WHERE id = ANY(%s)",
+            ([r[0] for r in rows],),
+        )
+    conn.commit()
+
+    moved_refs = {m[3] for m in movements}
+    for ref in bookings:
+        (consumed if ref in moved_refs else skipped).append(ref)
+    return {"rows": len(rows), "consumed": consumed, "skipped": skipped,
+            "unmatched_ingredients": unmatched_ingredients}
+
+
 def auto_consume_past_bookings() -> dict:
     """
     Deduct stock for confirmed/pending reservations that have ALREADY FINISHED
@@ -824,129 +1006,33 @@ def auto_consume_past_bookings() -> dict:
     stock has not been consumed yet.
     Called on startup and every ~15 min by the background scheduler, so a tabla
     is discounted shortly after that customer's reservation ends.
-    Returns a summary dict.
+    Works in batches of CONSUME_BATCH_SIZE, one transaction each (see
+    _consume_batch). Returns a summary dict.
     """
-    import json as _json
-    from datetime import datetime, time as _time, timedelta
-    from zoneinfo import ZoneInfo
-
-    CHILE_TZ = ZoneInfo("America/Santiago")
-    now_chile = datetime.now(CHILE_TZ)
-    today = now_chile.date().isoformat()
     consumed = []
     skipped = []
-    not_finished = []
     unmatched_ingredients = []
 
-    def _has_finished(fecha_val, hora_val) -> bool:
-        """True if booking date+time+duration is already in the past (Chile)."""
-        if fecha_val is None:
-            return False
-        # Parse date
-        try:
-            d = fecha_val if hasattr(fecha_val, "year") else datetime.fromisoformat(str(fecha_val)).date()
-        except Exception:
-            return False
-        # Parse time (default to end-of-day if missing, so it only fires next day)
-        if hora_val is None:
-            t = _time(23, 59)
-        elif hasattr(hora_val, "hour"):
-            t = hora_val
-        else:
-            try:
-                parts = str(hora_val).split(":")
-                t = _time(int(parts[0]), int(parts[1]) if len(parts) > 1 else 0)
-            except Exception:
-                t = _time(23, 59)
-        start_dt = datetime.combine(d, t).replace(tzinfo=CHILE_TZ)
-        end_dt = start_dt + timedelta(hours=TRIP_DURATION_HOURS)
-        return now_chile >= end_dt
-
     try:
         with get_connection() as conn:
+            while True:
+                batch = _consume_batch(conn)
+                consumed.extend(batch["consumed"])
+                skipped.extend(batch["skipped"])
+                unmatched_ingredients.extend(batch["unmatched_ingredients"])
+                if batch["rows"] < CONSUME_BATCH_SIZE:
+                    break
+
+            # Today's reservations that haven't ended yet (reported only).
             with conn.cursor() as cur:
-                # all_appointments: single source of truth for all reservations
                 cur.execute("""
-                    SELECT id, source_id, fecha, hora, extras_json, stock_consumed_at, nombre_cliente
+                    SELECT COALESCE(NULLIF(source_id, ''), 'AA-' || id::text)
                     FROM all_appointments
-                    WHERE fecha <= %s
+                    WHERE stock_consumed_at IS NULL
+                      AND fecha <= (NOW() AT TIME ZONE 'America/Santiago')::date
                       AND status IN ('confirmed', 'CONFIRMED', 'pending', 'PENDING')
-                      AND stock_consumed_at IS NULL
-                """, (today,))
-                all_rows = cur.fetchall()
-
-            processed_refs = set()
-
-            for table_name, rows in [("all_appointments", all_rows)]:
-                for (row_id, source_id, fecha, hora, extras_json, _, customer_name) in rows:
-                    ref = source_id or f"AA-{row_id}"
-                    if ref in processed_refs:
-                        continue
-                    processed_refs.add(ref)
-
-                    # Only consume once the reservation has actually ended
-                    if not _has_finished(fecha, hora):
-                        not_finished.append(ref)
-                        continue
-
-                    # Check if already consumed (via stock_movements)
-                    with conn.cursor() as cur:
-                        cur.execute(
-                            "SELECT COUNT(*) FROM stock_movements WHERE booking_ref=%s AND reason='booking'",
-                            (ref,)
-                        )
-                        already = cur.fetchone()[0]
-                        if already > 0:
-                            # Mark as consumed so we don't check again
-                            cur.execute(
-                                f"UPDATE {table_name} SET stock_consumed_at=NOW() WHERE id=%s",
-                                (row_id,)
-                            )
-                            conn.commit()
-                            skipped.append(ref)
-                            continue
-
-                        # Check for tabla selection — pero solo si la tabla fue
-                        # realmente pagada/incluida en la reserva (el cliente puede
-                        # haber llenado el formulario sin que se haya cobrado).
-                        tabla_ingredients = []
-                        if _booking_paid_tabla(extras_json):
-                            cur.execute(
-                                "SELECT elige_1, elige_2, elige_3 FROM tabla_selections WHERE booking_ref=%s",
-                                (ref,)
-                            )
-                            tabla_row = cur.fetchone()
-                            if tabla_row:
-                                elige_1, elige_2, elige_3 = tabla_row
-                                if elige_1:
-                                    tabla_ingredients.append(elige_1)
-                                if elige_2:
-                                    try:
-                                        tabla_ingredients.extend(_json.loads(elige_2) if isinstance(elige_2, str) else elige_2)
-                                    except Exception:
-                                        pass
-                                if elige_3:
-                                    try:
-                                        tabla_ingredients.extend(_json.loads(elige_3) if isinstance(elige_3, str) else elige_3)
-                                    except Exception:
-                                        pass
-
-                        mvts, unmatched = _consume_booking_extras(cur, ref, extras_json, tabla_ingredients or None, customer_name, fecha)
-                        if unmatched:
-                            for u in unmatched:
-                                unmatched_ingredients.append({"booking_ref": ref, **u})
-
-                        # Mark as consumed
-                        cur.execute(
-                            f"UPDATE {table_name} SET stock_consumed_at=NOW() WHERE id=%s",
-                            (row_id,)
-                        )
-                        conn.commit()
-
-                        if mvts > 0:
-                            consumed.append(ref)
-                        else:
-                            skipped.append(ref)
+                """)
+                not_finished = list(dict.fromkeys(r[0] for r in cur.fetchall()))
 
             alerts = _check_low_stock(conn)
 
@@ -1182,6 +1268,7 @@ def reconsume_booking(booking_ref: str, x_admin_key: str = Header("")):
             mvts, unmatched = _consume_booking_extras(cur, ref, extras_json, tabla_ingredients or None, customer_name, booking_date)
 
             # 4) Marcar como consumida
+            _claim_consumption(cur, ref)
             cur.execute(f"UPDATE {found_table} SET stock_consumed_at=NOW() WHERE id=%s", (found_id,))
             conn.commit()
 
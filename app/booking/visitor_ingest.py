@@ -0,0 +1,213 @@
+"""
+Buffered ingestion for booking-page visitor events.
+
+/api/booking/track used to do one synchronous single-row INSERT per call,
+on the event loop. During an ad campaign the booking pages fire these in
+bursts, and every one of them cost a pool connection and a commit.
+
+Events now go into a bounded in-process buffer. A background flusher
+writes them with a single COPY each time FLUSH_BATCH_EVENTS rows have
+piled up, or every FLUSH_INTERVAL_MS, whichever comes first.
+
+  • Backpressure: once BUFFER_MAX_EVENTS rows are waiting (the database
+    is slow or down), put() waits for the flusher to drain. If nothing
+    drains within BACKPRESSURE_TIMEOUT_S it raises BufferFull, and the
+    endpoint answers 503 instead of letting memory grow.
+  • At-least-once: a batch leaves the buffer only after its COPY commits.
+    A flush that fails on the connection (OperationalError, pool timeout)
+    puts the batch back at the front and retries with backoff. close(),
+    called from the app lifespan on shutdown, drains whatever is left. A
+    batch whose commit succeeded but whose connection dropped before the
+    ack can be written twice, never zero times. Only a hard kill
+    (SIGKILL / OOM) loses the last FLUSH_INTERVAL_MS of events.
+  • Bad rows: any other failure is about the data (a value COPY rejects),
+    and retrying would block ingestion for good. The batch is split in
+    halves until the rows COPY refuses are alone; those are logged and
+    dropped (counters["dropped"]), the rest is written.
+
+The flusher starts lazily on the first put(), so every deployment role
+that serves the booking pages gets one without extra wiring.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Deque, Iterable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_EVENTS = 200
+FLUSH_INTERVAL_MS = 500
+# One COPY never carries more than this many rows.
+FLUSH_MAX_ROWS = 2000
+BUFFER_MAX_EVENTS = 20000
+BACKPRESSURE_TIMEOUT_S = 2.0
+FLUSH_RETRY_MAX_S = 30.0
+CLOSE_ATTEMPTS = 3
+CLOSE_TIMEOUT_S = 10.0
+
+
+class BufferFull(Exception):
+    """The buffer stayed full for BACKPRESSURE_TIMEOUT_S."""
+
+
+def _is_transient(exc: Exception) -> bool:
+    """Connection trouble (worth retrying the batch as is), as opposed to
+    rows the database refuses."""
+    import psycopg
+    return isinstance(exc, (psycopg.OperationalError, psycopg.InterfaceError))
+
+
+def _default_writer(rows: Sequence[tuple]) -> None:
+    from app.booking.visitor_tracking import persist_booking_visitor_events
+    persist_booking_visitor_events(rows)
+
+
+class VisitorEventBuffer:
+    def __init__(self, writer: Optional[Callable[[Sequence[tuple]], None]] = None,
+                 batch_events: int = FLUSH_BATCH_EVENTS,
+                 interval_ms: int = FLUSH_INTERVAL_MS,
+                 max_events: int = BUFFER_MAX_EVENTS):
+        self._writer = writer or _default_writer
+        self.batch_events = batch_events
+        self.interval_s = interval_ms / 1000
+        self.max_events = max_events
+        self._rows: Deque[tuple] = deque()
+        self._wake: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self._failures = 0
+        self.counters = {"accepted": 0, "written": 0, "batches": 0, "flush_errors": 0,
+                         "backpressure_waits": 0, "rejected": 0, "dropped": 0}
+
+    # -- producer side (event loop) ---------------------------------------
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._space = asyncio.Condition()
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, rows: Iterable[tuple]) -> int:
+        """Queue rows for the next flush; returns how many were queued.
+        Waits while the buffer is full; raises BufferFull on timeout."""
+        rows = [r for r in rows if r is not None]
+        if not rows:
+            return 0
+        if self._closed:
+            # Shutting down: nobody will flush after us — write through.
+            await asyncio.to_thread(self._writer, rows)
+            self.counters["written"] += len(rows)
+            return len(rows)
+        self._ensure_started()
+        if len(self._rows) + len(rows) > self.max_events:
+            self.counters["backpressure_waits"] += 1
+            self._wake.set()
+            try:
+                async with self._space:
+                    await asyncio.wait_for(
+                        self._space.wait_for(lambda: len(self._rows) + len(rows) <= self.max_events),
+                        BACKPRESSURE_TIMEOUT_S,
+                    )
+            except asyncio.TimeoutError:
+                self.counters["rejected"] += len(rows)
+                raise BufferFull(f"{len(self._rows)} visitor events waiting to be written")
+        self._rows.extend(rows)
+        self.counters["accepted"] += len(rows)
+        if len(self._rows) >= self.batch_events:
+            self._wake.set()
+        return len(rows)
+
+    # -- flusher ----------------------------------------------------------
+
+    def _write_splitting(self, rows: Sequence[tuple]) -> list:
+        """Write rows, halving around the ones the writer refuses; returns
+        those (with their error). Transient errors propagate. Runs in a
+        worker thread."""
+        try:
+            self._writer(rows)
+            return []
+        except Exception as e:
+            if _is_transient(e):
+                raise
+            if len(rows) == 1:
+                return [(rows[0], e)]
+        mid = len(rows) // 2
+        return self._write_splitting(rows[:mid]) + self._write_splitting(rows[mid:])
+
+    async def _flush_batch(self) -> bool:
+        """Write one batch from the front of the buffer. On a connection
+        failure the rows go back where they were (order preserved) and
+        False is returned; rows the database refuses are dropped."""
+        n = min(len(self._rows), FLUSH_MAX_ROWS)
+        batch = [self._rows.popleft() for _ in range(n)]
+        try:
+            bad = await asyncio.to_thread(self._write_splitting, batch)
+        except asyncio.CancelledError:
+            # The COPY may or may not have committed — keep the rows
+            # (at-least-once) and let close() write them.
+            self._rows.extendleft(reversed(batch))
+            raise
+        except Exception as e:
+            self._rows.extendleft(reversed(batch))
+            self._failures += 1
+            self.counters["flush_errors"] += 1
+            logger.warning(f"visitor events: flush of {n} failed ({self._failures} in a row): {e}")
+            return False
+        if bad:
+            self.counters["dropped"] += len(bad)
+            row, err = bad[0]
+            logger.error(f"visitor events: dropped {len(bad)} of {n} row(s) the database refused, "
+                         f"e.g. {row!r:.300}: {err}")
+        self._failures = 0
+        self.counters["written"] += n - len(bad)
+        self.counters["batches"] += 1
+        if self._space is not None:
+            async with self._space:
+                self._space.notify_all()
+        return True
+
+    async def flush(self) -> None:
+        """Write everything buffered so far (stops at the first failure)."""
+        while self._rows:
+            if not await self._flush_batch():
+                return
+
+    async def _run(self) -> None:
+        from app.db.connection import use_pool
+        use_pool("ingest")  # started by whichever request came first
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+            if self._failures and not self._closed:
+                await asyncio.sleep(min(self.interval_s * 2 ** self._failures, FLUSH_RETRY_MAX_S))
+
+    async def close(self) -> None:
+        """Stop the flusher and write out what is left (app shutdown)."""
+        self._closed = True
+        if self._task is not None:
+            # Let an in-flight flush finish rather than cancelling it mid-COPY.
+            self._wake.set()
+            try:
+                await asyncio.wait_for(self._task, CLOSE_TIMEOUT_S)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            self._task = None
+        for attempt in range(CLOSE_ATTEMPTS):
+            await self.flush()
+            if not self._rows:
+                return
+            await asyncio.sleep(0.5 * (attempt + 1))
+        logger.error(f"visitor events: {len(self._rows)} event(s) could not be written on shutdown")
+
+    def stats(self) -> dict:
+        return {"buffered": len(self._rows), "running": bool(self._task and not self._task.done()),
+                **self.counters}
+
+
+visitor_events = VisitorEventBuffer()
+
@@ -2,8 +2,8 @@
 from __future__ import annotations
 
 import logging
-from datetime import datetime
-from typing import Any, Dict, Optional
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 from psycopg import errors as pg_errors
 from psycopg.types.json import Jsonb as PgJson
@@ -13,7 +13,19 @@ from app.db.connection import get_connection
 _log = logging.getLogger(__name__)
 
 
-def persist_booking_visitor_event(
+VISITOR_EVENT_COLUMNS = (
+    "session_id", "event_type", "extra_date", "time_label",
+    "lang", "referrer", "is_returning", "recorded_at", "link_token", "visitor_id",
+    "utm_source", "utm_medium", "utm_campaign", "utm_content", "fbclid", "parametro_url",
+)
+
+
+def _text(value: Optional[str]) -> str:
+    # Postgres text can't hold NUL; one in a referrer would fail the whole COPY.
+    return (value or "").replace("\x00", "")
+
+
+def visitor_event_row(
     session_id: str,
     event_type: str,
     *,
@@ -31,8 +43,9 @@ def persist_booking_visitor_event(
     utm_content: Optional[str] = None,
     fbclid: Optional[str] = None,
     parametro_url: Optional[str] = None,
-) -> None:
-    """Append one tracking event (one row per /api/booking/track call).
+) -> Optional[tuple]:
+    """One booking_visitor_events row (VISITOR_EVENT_COLUMNS order), trimmed
+    to the column sizes; None when session_id or event_type is empty.
     link_token (if present) ties this visit's whole funnel back to a specific
     per-client tracked link (see app/booking/link_tracking_router.py).
     visitor_id (if present) is the persistent hb_uid set by hotboat-marketing-web's
@@ -41,61 +54,232 @@ def persist_booking_visitor_event(
     The utm_*/fbclid/parametro_url ad-attribution fields are only ever
     non-empty on the first event or two of a session (they come from the
     landing URL's query string), but are stored on every row for simplicity —
-    _close_stale_visitor_sessions picks the first non-null value per session
-    when rebuilding it for the summary email."""
-    sid = (session_id or "").strip()[:64]
-    et = (event_type or "").strip()[:96]
+    the booking_visitor_session_state trigger keeps the first non-null value
+    per session for the summary email."""
+    sid = _text(session_id).strip()[:64]
+    et = _text(event_type).strip()[:96]
     if not sid or not et:
-        return
-    extra = (extra_date or "").strip()[:120] if extra_date else None
-    lt = (link_token or "").strip()[:16] or None
-    vid = (visitor_id or "").strip()[:64] or None
-    utm_s = (utm_source or "").strip()[:200] or None
-    utm_m = (utm_medium or "").strip()[:200] or None
-    utm_c = (utm_campaign or "").strip()[:200] or None
-    utm_ct = (utm_content or "").strip()[:200] or None
-    fbc = (fbclid or "").strip()[:200] or None
-    param_url = (parametro_url or "").strip()[:500] or None
-
-    sql = """
-        INSERT INTO booking_visitor_events (
-            session_id, event_type, extra_date, time_label,
-            lang, referrer, is_returning, recorded_at, link_token, visitor_id,
-            utm_source, utm_medium, utm_campaign, utm_content, fbclid, parametro_url
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """
-    params = (
-        sid, et, extra, (time_label or "")[:16], (lang or "es")[:8],
-        (referrer or "")[:500], bool(is_returning), recorded_at, lt, vid,
-        utm_s, utm_m, utm_c, utm_ct, fbc, param_url,
+        return None
+    return (
+        sid, et,
+        _text(extra_date).strip()[:120] if extra_date else None,
+        _text(time_label)[:16], _text(lang or "es")[:8],
+        _text(referrer)[:500], bool(is_returning), recorded_at,
+        _text(link_token).strip()[:16] or None,
+        _text(visitor_id).strip()[:64] or None,
+        _text(utm_source).strip()[:200] or None,
+        _text(utm_medium).strip()[:200] or None,
+        _text(utm_campaign).strip()[:200] or None,
+        _text(utm_content).strip()[:200] or None,
+        _text(fbclid).strip()[:200] or None,
+        _text(parametro_url).strip()[:500] or None,
     )
+
+
+def _add_missing_event_columns() -> None:
+    # Self-heal: the startup migration that adds these columns may not
+    # have run yet on this deployment.
+    _log.warning("booking_visitor_events missing columns — adding now")
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS link_token VARCHAR(16);"
+                "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS visitor_id VARCHAR(64);"
+                "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS utm_source TEXT;"
+                "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS utm_medium TEXT;"
+                "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS utm_campaign TEXT;"
+                "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS utm_content TEXT;"
+                "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS fbclid TEXT;"
+                "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS parametro_url TEXT;"
+            )
+        conn.commit()
+
+
+def _copy_visitor_events(rows: Sequence[tuple]) -> None:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            with cur.copy(
+                f"COPY booking_visitor_events ({', '.join(VISITOR_EVENT_COLUMNS)}) FROM STDIN"
+            ) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        conn.commit()
+
+
+def persist_booking_visitor_events(rows: Sequence[tuple]) -> None:
+    """Write many visitor_event_row() tuples in one COPY and one commit.
+    Raises on failure — nothing of the batch is stored in that case."""
+    if not rows:
+        return
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params)
-            conn.commit()
+        _copy_visitor_events(rows)
     except pg_errors.UndefinedColumn:
-        # Self-heal: the startup migration that adds these columns may not
-        # have run yet on this deployment. Add them once, then retry.
-        _log.warning("booking_visitor_events missing columns — adding now")
-        with get_connection() as conn:
-            with conn.cursor() as cur:
+        _add_missing_event_columns()
+        _copy_visitor_events(rows)
+
+
+def persist_booking_visitor_event(session_id: str, event_type: str, **fields: Any) -> None:
+    """Append one tracking event right away (synchronous, no buffering).
+    /api/booking/track goes through app.booking.visitor_ingest instead."""
+    row = visitor_event_row(session_id, event_type, **fields)
+    if row is not None:
+        persist_booking_visitor_events([row])
+
+
+# booking_visitor_events is range-partitioned by recorded_at (migration
+# 0105). With a retention window the partitions are UTC days, so expiry
+# drops whole days instead of DELETEing rows; with retention off (the
+# default) they are UTC months, so keeping everything adds 12 partitions a
+# year rather than 365. The history from before the cutover stays in the
+# default partition, which otherwise only catches rows outside the
+# partitions created below.
+EVENT_PARTITION_PREFIX = "booking_visitor_events_p"
+EVENT_PARTITIONS_AHEAD_DAYS = 7
+
+
+def _month_after(day: date) -> date:
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def _event_partitions(cur) -> List[Tuple[str, date, date]]:
+    """(name, first day, day after the last) of each dated partition, read
+    back from the names: pYYYYMMDD is one day, pYYYYMM one month."""
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'booking_visitor_events'::regclass
+          AND c.relname LIKE %s
+        """,
+        (EVENT_PARTITION_PREFIX + "%",),
+    )
+    out = []
+    for (name,) in cur.fetchall():
+        suffix = name[len(EVENT_PARTITION_PREFIX):]
+        try:
+            if len(suffix) == 8:
+                start = datetime.strptime(suffix, "%Y%m%d").date()
+                out.append((name, start, start + timedelta(days=1)))
+            elif len(suffix) == 6:
+                start = datetime.strptime(suffix, "%Y%m").date()
+                out.append((name, start, _month_after(start)))
+        except ValueError:
+            continue
+    return out
+
+
+def _create_event_partition(cur, name: str, start: date, end: date) -> None:
+    """Create one partition for [start, end).
+
+    Postgres refuses to create a partition whose range has rows in the
+    default partition (e.g. the job didn't run for a week, or the current
+    month when the history was moved in). Such a range is built as a plain
+    table, its rows moved into it out of the default, and then attached.
+    The rows never pass through the parent, so the session-state trigger
+    doesn't count them a second time."""
+    bounds = (f"FOR VALUES FROM ('{start.isoformat()} 00:00+00') "
+              f"TO ('{end.isoformat()} 00:00+00')")
+    lo = datetime.combine(start, datetime.min.time(), tzinfo=timezone.utc)
+    hi = datetime.combine(end, datetime.min.time(), tzinfo=timezone.utc)
+    cur.execute(
+        """
+        SELECT EXISTS (SELECT 1 FROM booking_visitor_events_default
+                       WHERE recorded_at >= %s AND recorded_at < %s)
+        """,
+        (lo, hi),
+    )
+    if not cur.fetchone()[0]:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF booking_visitor_events {bounds}")
+        return
+    cur.execute(f"CREATE TABLE {name} (LIKE booking_visitor_events INCLUDING DEFAULTS)")
+    cur.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM booking_visitor_events_default
+            WHERE recorded_at >= %s AND recorded_at < %s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+        """,
+        (lo, hi),
+    )
+    _log.info("Moved %s visitor events for %s..%s out of the default partition",
+              cur.rowcount, start, end)
+    cur.execute(f"ALTER TABLE booking_visitor_events ATTACH PARTITION {name} {bounds}")
+
+
+def create_visitor_event_partitions(cur, first_day: date, last_day: date,
+                                    monthly: bool = False) -> int:
+    """Make sure first_day..last_day (UTC) are covered by partitions, on the
+    caller's cursor/transaction: monthly ones if `monthly`, else daily.
+    Days an existing partition already covers are left alone, and a month
+    that would overlap existing daily partitions is filled with days
+    instead (retention was switched off mid-month). Returns how many
+    partitions were created."""
+    existing = [(start, end) for _, start, end in _event_partitions(cur)]
+
+    def free(start: date, end: date) -> bool:
+        return not any(s < end and start < e for s, e in existing)
+
+    created = 0
+    day = first_day
+    while day <= last_day:
+        if free(day, day + timedelta(days=1)):
+            month = day.replace(day=1)
+            if monthly and free(month, _month_after(month)):
+                name, start, end = f"{EVENT_PARTITION_PREFIX}{month:%Y%m}", month, _month_after(month)
+            else:
+                name, start, end = f"{EVENT_PARTITION_PREFIX}{day:%Y%m%d}", day, day + timedelta(days=1)
+            _create_event_partition(cur, name, start, end)
+            existing.append((start, end))
+            created += 1
+        day += timedelta(days=1)
+    return created
+
+
+def maintain_visitor_event_partitions(retention_days: Optional[int] = None) -> dict:
+    """Create the partitions for the next EVENT_PARTITIONS_AHEAD_DAYS and
+    drop the ones entirely older than the retention window
+    (VISITOR_EVENTS_RETENTION_DAYS; 0 keeps everything, in monthly
+    partitions). Closed session-state rows past the window go too. Runs as
+    the "visitor_event_partitions" job."""
+    if retention_days is None:
+        from app.config import get_settings
+        retention_days = get_settings().visitor_events_retention_days
+    today = datetime.now(timezone.utc).date()
+    created = dropped = 0
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT relkind FROM pg_class WHERE oid = to_regclass('booking_visitor_events')"
+            )
+            row = cur.fetchone()
+            if not row or row[0] != "p":
+                return {"created": 0, "dropped": 0, "partitioned": False}
+            # Partition DDL locks the parent; never queue ingestion behind it.
+            cur.execute("SET LOCAL lock_timeout = '5s'")
+            created = create_visitor_event_partitions(
+                cur, today, today + timedelta(days=EVENT_PARTITIONS_AHEAD_DAYS),
+                monthly=retention_days <= 0)
+            if retention_days > 0:
+                cutoff = today - timedelta(days=retention_days)
+                for name, _, end in _event_partitions(cur):
+                    if end <= cutoff:
+                        cur.execute(f"DROP TABLE {name}")
+                        dropped += 1
                 cur.execute(
-                    "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS link_token VARCHAR(16);"
-                    "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS visitor_id VARCHAR(64);"
-                    "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS utm_source TEXT;"
-                    "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS utm_medium TEXT;"
-                    "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS utm_campaign TEXT;"
-                    "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS utm_content TEXT;"
-                    "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS fbclid TEXT;"
-                    "ALTER TABLE booking_visitor_events ADD COLUMN IF NOT EXISTS parametro_url TEXT;"
+                    "DELETE FROM booking_visitor_events_default WHERE recorded_at < %s",
+                    (cutoff,),
                 )
-            conn.commit()
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params)
-            conn.commit()
+                cur.execute(
+                    """
+                    DELETE FROM booking_visitor_session_state
+                    WHERE closed_at IS NOT NULL AND last_seen_at < %s
+                    """,
+                    (cutoff,),
+                )
+        conn.commit()
+    return {"created": created, "dropped": dropped, "partitioned": True}
 
 
 def persist_booking_visitor_session_closed(
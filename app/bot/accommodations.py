@@ -4,6 +4,7 @@ All accommodations are loaded dynamically from the `alojamientos` DB table.
 Each row is a single accommodation option (flat structure, no JSONB variants).
 """
 import logging
+from datetime import date
 from typing import Dict, List, Optional, Any
 
 from app.config.accommodations_config import ACCOMMODATION_IMAGES
@@ -117,6 +118,36 @@ class AccommodationsHandler:
     def get_all_accommodations(self) -> List[AccommodationInfo]:
         return list(self._accommodations)
 
+    def unavailable_for(self, check_in: date, check_out: Optional[date] = None) -> Optional[Dict[str, str]]:
+        """
+        Options that can't take a stay of [check_in, check_out) — slug →
+        "full" | "blocked" — read from the same occupancy index as the
+        booking page calendar. None if the DB is unreachable.
+        """
+        try:
+            from app.booking.occupancy import unavailable_slugs
+            return unavailable_slugs(check_in, check_out or check_in)
+        except Exception as e:
+            logger.warning(f"Accommodation availability lookup failed: {e}")
+            return None
+
+    def get_availability_text(self, check_in: date) -> str:
+        """Reply lines for a question that names a night: which options are
+        free and which are on request (blocked), or that everything is
+        full. Empty if availability can't be read."""
+        taken = self.unavailable_for(check_in)
+        if taken is None:
+            return ""
+        free = [acc.name for acc in self._accommodations if acc.slug not in taken]
+        on_request = [acc.name for acc in self._accommodations if taken.get(acc.slug) == "blocked"]
+        day = check_in.strftime("%d/%m")
+        if not free and not on_request:
+            return f"📅 Para la noche del {day} los alojamientos están completos — revisa otras fechas en la página."
+        lines = [f"📅 Para la noche del {day}:"]
+        lines += [f"✅ {name}" for name in free]
+        lines += [f"📩 {name} (a solicitud)" for name in on_request]
+        return "\n".join(lines)
+
     def get_text_response(self, language: str = "es") -> str:
         return get_text("accommodations", language)
 
@@ -5,8 +5,6 @@ Supports MCP (Model Context Protocol) servers
 import logging
 import json
 from typing import List, Dict, Optional, Any
-from openai import OpenAI
-
 from app.config import get_settings
 
 try:
@@ -25,6 +23,7 @@ class AIHandler:
     
     def __init__(self):
         # Use OpenAI SDK but point to Groq's OpenAI-compatible API
+        from openai import OpenAI
         self.client = OpenAI(
             api_key=settings.groq_api_key,
             base_url="https://api.groq.com/openai/v1"  # Groq's OpenAI-compatible endpoint
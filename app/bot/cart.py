@@ -8,6 +8,7 @@ from zoneinfo import ZoneInfo
 from dataclasses import dataclass, asdict
 import json
 
+from app.db import statements
 from app.db.connection import get_connection
 
 # Chilean timezone
@@ -226,31 +227,16 @@ class CartManager:
         "flex": {"name": "Reserva FLEX (+10%)", "price": 0},
     }
 
-    # Live prices loaded from extras_visibility (refreshed on startup and periodically)
-    _db_prices: dict = {}  # {name_lower: price}
-
-    @classmethod
-    def refresh_prices_from_db(cls):
-        """Load/refresh extra prices from extras_visibility (single source of truth)."""
+    def get_extra_price(self, display_name: str, fallback_price: int) -> int:
+        """Get live price for an extra, preferring DB value over hardcoded.
+        Prices come from extras_visibility via the catalog snapshot."""
         try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT LOWER(COALESCE(name, extra_name_lower)),
-                               COALESCE(precio_venta, 0)
-                        FROM extras_visibility
-                        WHERE precio_venta IS NOT NULL AND precio_venta > 0
-                    """)
-                    cls._db_prices = {row[0]: row[1] for row in cur.fetchall()}
-            logger.info(f"CartManager: loaded {len(cls._db_prices)} extra prices from extras_visibility")
+            from app.booking.catalog import catalog
+            prices = catalog.snapshot().extra_prices
         except Exception as e:
-            logger.warning(f"CartManager: could not load prices from DB: {e}")
-
-    def get_extra_price(self, display_name: str, fallback_price: int) -> int:
-        """Get live price for an extra, preferring DB value over hardcoded."""
-        if not self.__class__._db_prices:
-            self.__class__.refresh_prices_from_db()
-        return self.__class__._db_prices.get(display_name.lower(), fallback_price)
+            logger.warning(f"CartManager: catalog unavailable, using fallback price: {e}")
+            return fallback_price
+        return prices.get(display_name.lower(), fallback_price)
 
     # Prices per person based on capacity
     PRICES_PER_PERSON = {
@@ -272,13 +258,7 @@ class CartManager:
         try:
             with get_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT cart_data, updated_at
-                        FROM whatsapp_carts
-                        WHERE phone_number = %s
-                        ORDER BY updated_at DESC
-                        LIMIT 1
-                    """, (phone_number,))
+                    statements.execute(cur, "cart.get", (phone_number,))
                     
                     result = cur.fetchone()
                     
@@ -305,15 +285,8 @@ class CartManager:
             with get_connection() as conn:
                 with conn.cursor() as cur:
                     # Upsert cart
-                    cur.execute("""
-                        INSERT INTO whatsapp_carts (phone_number, customer_name, cart_data, updated_at)
-                        VALUES (%s, %s, %s, %s)
-                        ON CONFLICT (phone_number) 
-                        DO UPDATE SET 
-                            cart_data = EXCLUDED.cart_data,
-                            customer_name = EXCLUDED.customer_name,
-                            updated_at = EXCLUDED.updated_at
-                    """, (phone_number, customer_name, cart_data, datetime.now(CHILE_TZ)))
+                    statements.execute(cur, "cart.put",
+                                       (phone_number, customer_name, cart_data, datetime.now(CHILE_TZ)))
                     
                     conn.commit()
                     logger.info(f"Cart saved for {phone_number}")
@@ -23,13 +23,6 @@ from app.config import get_settings
 from app.db.leads import get_or_create_lead, get_conversation_history, save_lead_language
 from app.whatsapp.client import WhatsAppClient
 
-try:
-    import resend
-    RESEND_AVAILABLE = True
-except ImportError:
-    RESEND_AVAILABLE = False
-    logging.warning("Resend not installed - email notifications will be disabled")
-
 logger = logging.getLogger(__name__)
 
 # Número del Capitán Tomás para notificaciones
@@ -83,6 +76,7 @@ def ensure_conversation_state_table() -> None:
             conn.commit()
     except Exception as e:
         logger.warning(f"bot_conversation_state table setup failed: {e}")
+        raise
 
 
 class ConversationManager:
@@ -430,13 +424,17 @@ class ConversationManager:
         """
         try:
             # Get or create conversation context (loads history from DB)
-            conversation = await self.get_conversation(from_number, contact_name)
-            processed_ids: set = conversation.setdefault("processed_message_ids", set())
-            if message_id and message_id in processed_ids:
+            # The webhook already claimed message_id through incoming_dedup
+            # (owned → proceed); direct callers (smoke test, tools) claim here.
+            from app.whatsapp.dedup import incoming_dedup
+            if (
+                message_id
+                and not incoming_dedup.owned(message_id)
+                and await incoming_dedup.is_duplicate(message_id)
+            ):
                 logger.info(f"Duplicate message detected (ID: {message_id}), skipping processing.")
                 return None
-            if message_id:
-                processed_ids.add(message_id)
+            conversation = await self.get_conversation(from_number, contact_name)
             
             logger.info(f"Processing message from {contact_name}: {message_text}")
             logger.info(f"Current metadata state: {conversation.get('metadata', {})}")
@@ -739,6 +737,13 @@ class ConversationManager:
             elif self._is_accommodation_query(message_text):
                 logger.info("User asking about accommodations - redirecting to booking page")
                 response = "🏠 Para ver nuestros alojamientos disponibles y hacer tu reserva, visita nuestra página de reservas:\n\n👉 https://whatsapp.hotboat.cl/booking\n\n¡Ahí podrás ver disponibilidad, fotos y reservar directamente! ⚓"
+                # A question that names a night ("¿tienen cabaña el 14 de febrero?")
+                # gets that night's availability from the occupancy index first.
+                check_in = self.availability_checker.parse_exact_date(message_text)
+                if check_in:
+                    note = await asyncio.to_thread(accommodations_handler.get_availability_text, check_in.date())
+                    if note:
+                        response = f"{note}\n\n{response}"
             # Check if user wants to make a reservation (but didn't specify date/time yet)
             # THIS MUST BE EARLY to catch "quiero reservar", "reservar" before other parsers
             elif self._is_reservation_intent(message_text):
@@ -867,24 +872,23 @@ Yo lo agrego automáticamente al carrito y luego puedes:
         one, in a previous process) last saved for this phone. Returns None
         if there is none yet (brand-new conversation, or pre-dates this
         mechanism)."""
+        from app.db import statements
         from app.db.connection import get_connection
 
         def _read():
             with get_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute(
-                        "SELECT state FROM bot_conversation_state WHERE phone_number=%s",
-                        (phone_number,),
-                    )
+                    statements.execute(cur, "bot_state.get", (phone_number,))
                     row = cur.fetchone()
                     return row[0] if row else None
 
         try:
-            raw = await asyncio.get_event_loop().run_in_executor(None, _read)
+            raw = await asyncio.to_thread(_read)
             if not raw:
                 return None
             state = json.loads(raw) if isinstance(raw, str) else raw
-            state["processed_message_ids"] = set(state.get("processed_message_ids") or [])
+            # Blobs saved before app/whatsapp/dedup.py still carry this list.
+            state.pop("processed_message_ids", None)
             return state
         except Exception as e:
             logger.warning(f"Failed to load persisted conversation state for {phone_number}: {e}")
@@ -898,31 +902,23 @@ Yo lo agrego automáticamente al carrito y luego puedes:
             return
 
         payload = dict(conv)
-        payload["processed_message_ids"] = list(payload.get("processed_message_ids") or [])
         # Cap stored history — only recent messages matter for context/flow
         # state; unbounded growth here would bloat the JSONB blob forever.
         if len(payload.get("messages", [])) > 100:
             payload["messages"] = payload["messages"][-100:]
 
+        from app.db import statements
         from app.db.connection import get_connection
 
         def _write(data: str):
             with get_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        INSERT INTO bot_conversation_state (phone_number, state, updated_at)
-                        VALUES (%s, %s, NOW())
-                        ON CONFLICT (phone_number) DO UPDATE SET
-                            state = EXCLUDED.state, updated_at = NOW()
-                        """,
-                        (phone_number, data),
-                    )
+                    statements.execute(cur, "bot_state.put", (phone_number, data))
                 conn.commit()
 
         try:
             data = json.dumps(payload, default=str)
-            await asyncio.get_event_loop().run_in_executor(None, _write, data)
+            await asyncio.to_thread(_write, data)
         except Exception as e:
             logger.warning(f"Failed to persist conversation state for {phone_number}: {e}")
 
@@ -994,8 +990,7 @@ Yo lo agrego automáticamente al carrito y luego puedes:
                     "language": detected_language,
                     "language_selected": True,
                     "bot_variant": lead.get("bot_variant") if lead else None,
-                },
-                "processed_message_ids": set()
+                }
             }
 
             if history:
@@ -2882,15 +2877,11 @@ Por favor, elige un horario con al menos 4 horas de anticipación 🚤"""
         return summary
     
     async def _send_notification_email(self, subject: str, body: str, priority: str = "high") -> None:
-        """Send email notification using Resend API (works on Railway/PaaS)."""
+        """Queue an email notification in the outbox (delivered via Resend)."""
         if not getattr(self.settings, "email_enabled", False):
             logger.info("Email notifications disabled (EMAIL_ENABLED=false); skipping send.")
             return
         
-        if not RESEND_AVAILABLE:
-            logger.warning("Resend library not installed; cannot send email notification.")
-            return
-        
         if not self.notification_email_recipients:
             logger.warning("No notification emails configured (NOTIFICATION_EMAILS env variable). Skipping email send.")
             return
@@ -2901,23 +2892,19 @@ Por favor, elige un horario con al menos 4 horas de anticipación 🚤"""
             return
         
         try:
-            # Configure Resend API key
-            resend.api_key = resend_key
+            from app.email.outbox import enqueue_email
             
             # Convert body to HTML (preserve line breaks)
             html_body = f"<pre style='font-family: monospace; white-space: pre-wrap;'>{body}</pre>"
             
-            # Send email via Resend API
-            result = resend.Emails.send({
-                "from": self.email_sender,
-                "to": self.notification_email_recipients,
-                "subject": subject,
-                "html": html_body,
-            })
+            outbox_id = await asyncio.to_thread(
+                enqueue_email, "bot_notification", self.notification_email_recipients,
+                subject, html_body, self.email_sender,
+            )
             
-            logger.info(f"Email notification sent via Resend: {subject} (ID: {result.get('id', 'N/A')})")
+            logger.info(f"Email notification queued: {subject} (outbox {outbox_id})")
         except Exception as e:
-            logger.error(f"Error sending email notification via Resend: {e}")
+            logger.error(f"Error queueing email notification: {e}")
             import traceback
             traceback.print_exc()
     
@@ -3006,11 +2993,7 @@ Cliente: {customer_name} ({customer_phone})"""
 </div>
 """
             
-            # Use the same method as other working emails
-            if not RESEND_AVAILABLE:
-                logger.warning("Resend library not installed; cannot send accommodation email.")
-                return
-            
+            # Same recipients and sender as the other bot notifications
             if not self.notification_email_recipients:
                 logger.warning("No notification emails configured. Skipping accommodation email.")
                 return
@@ -3020,19 +3003,14 @@ Cliente: {customer_name} ({customer_phone})"""
                 logger.warning("RESEND_API_KEY not configured; cannot send accommodation email.")
                 return
             
-            # Configure Resend API key
-            resend.api_key = resend_key
-            
-            # Send email via Resend API using same format as working emails
-            result = resend.Emails.send({
-                "from": self.email_sender,
-                "to": self.notification_email_recipients,
-                "subject": subject,
-                "html": html_body,
-            })
+            from app.email.outbox import enqueue_email
+            outbox_id = await asyncio.to_thread(
+                enqueue_email, "bot_accommodation_request", self.notification_email_recipients,
+                subject, html_body, self.email_sender,
+            )
             
-            logger.info(f"✅ Accommodation availability email sent: {accommodation_name} (ID: {result.get('id', 'N/A')})")
-            logger.info(f"   📧 Sent to: {self.notification_email_recipients}")
+            logger.info(f"✅ Accommodation availability email queued: {accommodation_name} (outbox {outbox_id})")
+            logger.info(f"   📧 To: {self.notification_email_recipients}")
             logger.info(f"   📞 Contact: {contact['name']} - {contact['whatsapp']}")
             
         except Exception as e:
@@ -48,6 +48,11 @@ class Settings(BaseSettings):
     meta_marketing_token: str = ""
     # Facebook Page ID linked to the WhatsApp Business Account (required for Conversions API)
     meta_page_id: str = ""
+    # Raw booking-page visitor events are kept this many days (daily
+    # partitions, see app/booking/visitor_tracking.py); closed sessions stay
+    # in booking_visitor_sessions. 0 = keep forever, in monthly partitions
+    # (the default: dropping raw events is opt-in).
+    visitor_events_retention_days: int = 0
     
     # Automations
     automation_phone_numbers: str = ""  # Comma-separated phone numbers for automation notifications
@@ -63,6 +68,10 @@ class Settings(BaseSettings):
     notification_emails: str = ""  # Comma-separated list of emails to notify
     # Direct URL of the logo image used in booking emails (must be publicly accessible)
     email_logo_url: str = ""
+    # Outbound email queue (app/email/outbox.py). The URL is overridable so
+    # tests can point the worker at a local fake Resend server.
+    resend_api_url: str = "https://api.resend.com"
+    email_outbox_concurrency: int = 4
     
     # SMTP Email Configuration (alternative to Resend)
     email_host: str = ""
@@ -86,6 +95,16 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     environment: str = "production"  # Options: production, staging, development
     log_level: str = "INFO"
+    # Rows kept in the shared app_log ring (app/log_pipeline.py), all replicas together
+    log_ring_size: int = 200000
+    # DB pool max sizes per traffic class, e.g. "admin=4,batch=1" (app/db/connection.py)
+    db_pools: str = ""
+    # Server-side prepared statements (app/db/statements.py); off behind a transaction-mode PgBouncer
+    db_prepare_statements: bool = True
+    # Bearer token required by GET /metrics; empty = open (e.g. private network only)
+    metrics_token: str = ""
+    # Which routers/background workers this deployment runs — see app/routers.py
+    app_role: str = "all"  # Options: webhook, public, admin, all
     
     @property
     def is_production(self) -> bool:
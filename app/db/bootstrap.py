@@ -0,0 +1,293 @@
+"""
+Tables and seed rows the baseline migration (0100) sets up: web push
+subscriptions, the extras catalog with its clothing items, and the
+canonical packs.
+
+They used to run from app.main's lifespan on every boot. They live here so
+that the migration (and `python -m app.db.migrate`) doesn't have to import
+the whole app to reach them. Each one raises on failure, so the migration
+aborts and is retried.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _ensure_web_push_table():
+    """Create web_push_subscriptions table if it doesn't exist."""
+    try:
+        from app.db.connection import get_connection
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS web_push_subscriptions (
+                        id           SERIAL PRIMARY KEY,
+                        endpoint     TEXT UNIQUE NOT NULL,
+                        p256dh       TEXT NOT NULL,
+                        auth         TEXT NOT NULL,
+                        created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                        last_used_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                    )
+                """)
+                conn.commit()
+        logger.info("✅ web_push_subscriptions table ready")
+    except Exception as e:
+        logger.warning(f"web_push_subscriptions table setup failed: {e}")
+        raise
+
+
+def _ensure_extras_visibility_table():
+    """Create extras_visibility table if it doesn't exist (survives Sheets re-sync)."""
+    try:
+        from app.db.connection import get_connection
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS extras_visibility (
+                        extra_name_lower TEXT PRIMARY KEY,
+                        show_in_booking  BOOLEAN NOT NULL DEFAULT FALSE,
+                        sort_order       INTEGER NOT NULL DEFAULT 999,
+                        description      TEXT,
+                        precio_venta     INTEGER,
+                        costo            INTEGER,
+                        icon             TEXT,
+                        updated_at       TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                    )
+                """)
+                for col, definition in [
+                    ("sort_order",      "INTEGER NOT NULL DEFAULT 999"),
+                    ("description",     "TEXT"),
+                    ("precio_venta",    "INTEGER"),
+                    ("costo",           "INTEGER"),
+                    ("icon",            "TEXT"),
+                    ("name",            "TEXT"),
+                    ("user_hidden",     "BOOLEAN NOT NULL DEFAULT FALSE"),
+                    ("stock_product_id","INTEGER"),
+                ]:
+                    cur.execute(f"ALTER TABLE extras_visibility ADD COLUMN IF NOT EXISTS {col} {definition}")
+
+                conn.commit()
+        logger.info("✅ extras_visibility table ready")
+    except Exception as e:
+        logger.error(f"extras_visibility table init error: {e}")
+        raise
+
+
+_EXTRAS_SEED = [
+    # (extra_name_lower, display_name, precio_venta, costo, icon, sort_order)
+    ("tabla_4_personas",  "Tabla de Picoteo Grande (4 personas)",     25000,  0, "🍇",  1),
+    ("tabla_2_personas",  "Tabla de Picoteo Pequeña (2 personas)",    20000,  0, "🍇",  2),
+    ("jugo_natural",      "Jugo Natural 1L (piña o naranja)",         10000,  0, "🥤",  3),
+    ("lata_bebida",       "Lata Bebida (Coca-Cola o Fanta)",           2900,  0, "🥤",  4),
+    ("agua_mineral",      "Agua Mineral 1.5L",                         2500,  0, "💧",  5),
+    ("helado",            "Helado Individual",                          3500,  0, "🍦",  6),
+    ("modo_romantico",    "Modo Romántico (pétalos + decoración)",    25000,  0, "🌹",  7),
+    ("velas_led",         "Velas LED Decorativas",                    10000,  0, "🕯️",  8),
+    ("letras_luminosas",  "Letras Luminosas 'Te Amo' / 'Love'",       15000,  0, "✨",  9),
+    ("pack_velas_letras", "Pack Nocturno Completo (velas + letras)",  20000,  0, "🌙", 10),
+    ("video_15_seg",      "Video Personalizado 15s",                  30000,  0, "🎥", 11),
+    ("video_1_min",       "Video Personalizado 60s",                  40000,  0, "🎥", 12),
+    ("transporte",        "Transporte Ida y Vuelta desde Pucón",      50000,  0, "🚐", 13),
+    ("toalla_normal",     "Toalla Normal",                             9000,  0, "🧻", 14),
+    ("toalla_poncho",     "Toalla Poncho",                            10000,  0, "🧻", 15),
+    ("chalas",            "Chalas de Ducha",                          10000,  0, "🩴", 16),
+    ("reserva_flex",      "Reserva FLEX (+10%)",                          0,  0, "🔄", 17),
+]
+
+
+def _seed_extras_visibility():
+    """Populate extras_visibility with the canonical catalog if still empty."""
+    try:
+        from app.db.connection import get_connection
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM extras_visibility")
+                if cur.fetchone()[0] > 0:
+                    return  # already seeded
+                for (key, name, price, cost, icon, sort) in _EXTRAS_SEED:
+                    cur.execute("""
+                        INSERT INTO extras_visibility
+                            (extra_name_lower, name, precio_venta, costo, icon,
+                             sort_order, show_in_booking)
+                        VALUES (%s, %s, %s, %s, %s, %s, TRUE)
+                        ON CONFLICT DO NOTHING
+                    """, (key, name, price, cost, icon, sort))
+                conn.commit()
+        logger.info("✅ extras_visibility seeded with %d items", len(_EXTRAS_SEED))
+    except Exception as e:
+        logger.warning("extras_visibility seed failed: %s", e)
+        raise
+
+
+_CLOTHING_FLAT_SEED = [
+    # (slug, name, cost, price, icon, sort, stock)
+    # Polera Blanca — S/M/L/XL
+    ("polera_blanca_s",          "Polera Blanca S",          4141,  17990, "👕", 30, 2),
+    ("polera_blanca_m",          "Polera Blanca M",          4141,  17990, "👕", 31, 3),
+    ("polera_blanca_l",          "Polera Blanca L",          4141,  17990, "👕", 32, 3),
+    ("polera_blanca_xl",         "Polera Blanca XL",         4141,  17990, "👕", 33, 2),
+    # Polera Negra
+    ("polera_negra_s",           "Polera Negra S",           4141,  17990, "👕", 34, 2),
+    ("polera_negra_m",           "Polera Negra M",           4141,  17990, "👕", 35, 4),
+    ("polera_negra_l",           "Polera Negra L",           4141,  17990, "👕", 36, 4),
+    ("polera_negra_xl",          "Polera Negra XL",          4141,  17990, "👕", 37, 2),
+    # Polera Verde
+    ("polera_verde_s",           "Polera Verde S",           4141,  17990, "👕", 38, 1),
+    ("polera_verde_m",           "Polera Verde M",           4141,  17990, "👕", 39, 2),
+    ("polera_verde_l",           "Polera Verde L",           4141,  17990, "👕", 40, 2),
+    ("polera_verde_xl",          "Polera Verde XL",          4141,  17990, "👕", 41, 1),
+    # Polerón Negro
+    ("poleron_negro_s",          "Polerón Negro S",          8841,  29990, "🧥", 42, 1),
+    ("poleron_negro_m",          "Polerón Negro M",          8841,  29990, "🧥", 43, 2),
+    ("poleron_negro_l",          "Polerón Negro L",          8841,  29990, "🧥", 44, 2),
+    ("poleron_negro_xl",         "Polerón Negro XL",         8841,  29990, "🧥", 45, 1),
+    # Polerón Azul Marino
+    ("poleron_azul_marino_s",    "Polerón Azul Marino S",    8841,  29990, "🧥", 46, 1),
+    ("poleron_azul_marino_m",    "Polerón Azul Marino M",    8841,  29990, "🧥", 47, 2),
+    ("poleron_azul_marino_l",    "Polerón Azul Marino L",    8841,  29990, "🧥", 48, 2),
+    ("poleron_azul_marino_xl",   "Polerón Azul Marino XL",   8841,  29990, "🧥", 49, 1),
+    # Polerón Grueso Negro
+    ("poleron_grueso_negro_s",   "Polerón Grueso Negro S",   12841, 34990, "🧥", 50, 0),
+    ("poleron_grueso_negro_m",   "Polerón Grueso Negro M",   12841, 34990, "🧥", 51, 3),
+    ("poleron_grueso_negro_l",   "Polerón Grueso Negro L",   12841, 34990, "🧥", 52, 3),
+    ("poleron_grueso_negro_xl",  "Polerón Grueso Negro XL",  12841, 34990, "🧥", 53, 0),
+    # Gorros — sin talla
+    ("gorro_verde",              "Gorro Verde",              4304,  14990, "🧢", 54, 8),
+    ("gorro_blanco",             "Gorro Blanco",             4304,  14990, "🧢", 55, 8),
+    ("gorro_negro",              "Gorro Negro",              4304,  14990, "🧢", 56, 8),
+]
+
+# Slugs usados en intentos anteriores de seed (para limpiar si existen)
+_CLOTHING_LEGACY_SLUGS = [
+    "polera_blanca", "polera_negra", "polera_verde",
+    "poleron_negro", "poleron_azul_marino", "poleron_grueso_negro",
+    "gorro_verde", "gorro_blanco", "gorro_negro",
+]
+
+
+def _seed_clothing_products():
+    """Un extra independiente por cada talla/color + gorros sin talla."""
+    try:
+        from app.db.connection import get_connection
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                # Already seeded correctly → nothing to do
+                cur.execute(
+                    "SELECT COUNT(*) FROM extras_visibility "
+                    "WHERE extra_name_lower = 'polera_blanca_s'"
+                )
+                if cur.fetchone()[0] > 0:
+                    return
+
+                # Limpiar intentos anteriores (slug sin talla o con variantes)
+                all_old = _CLOTHING_LEGACY_SLUGS + [r[0] for r in _CLOTHING_FLAT_SEED]
+                cur.execute(
+                    "DELETE FROM extras_bom WHERE extra_slug = ANY(%s)",
+                    (all_old,),
+                )
+                cur.execute(
+                    """
+                    DELETE FROM stock_products WHERE id IN (
+                        SELECT stock_product_id FROM extras_visibility
+                        WHERE extra_name_lower = ANY(%s)
+                          AND stock_product_id IS NOT NULL
+                    )
+                    """,
+                    (all_old,),
+                )
+                cur.execute(
+                    "DELETE FROM extras_visibility WHERE extra_name_lower = ANY(%s)",
+                    (all_old,),
+                )
+
+                for (slug, name, cost, price, icon, sort, stock) in _CLOTHING_FLAT_SEED:
+                    cur.execute(
+                        """
+                        INSERT INTO stock_products
+                            (name, category, unit, current_stock,
+                             min_stock, cost_per_unit, is_active)
+                        VALUES (%s, 'Ropa', 'unidad', %s, 0, %s, TRUE)
+                        RETURNING id
+                        """,
+                        (name, stock, cost),
+                    )
+                    pid = cur.fetchone()[0]
+                    cur.execute(
+                        """
+                        INSERT INTO extras_visibility
+                            (extra_name_lower, name, precio_venta, costo, icon,
+                             sort_order, show_in_booking, stock_product_id)
+                        VALUES (%s, %s, %s, %s, %s, %s, FALSE, %s)
+                        ON CONFLICT DO NOTHING
+                        """,
+                        (slug, name, price, cost, icon, sort, pid),
+                    )
+                    cur.execute(
+                        "INSERT INTO extras_bom (extra_slug, product_id, quantity) "
+                        "VALUES (%s, %s, 1)",
+                        (slug, pid),
+                    )
+
+                conn.commit()
+        logger.info("✅ Clothing products seeded (%d extras)", len(_CLOTHING_FLAT_SEED))
+    except Exception as e:
+        logger.warning("Clothing products seed failed: %s", e)
+        raise
+
+
+_PACKS_CATALOG_SEED = [
+    {
+        "slug": "termas-angostura",
+        "name": "Pack Termas Angostura",
+        "icon": "♨️",
+        "description": (
+            "¿Te animas a una pausa?\n\n"
+            "Escápate a una cabaña rodeada de bosque nativo, donde el tiempo se detiene. "
+            "Durante dos noches disfrutarás de desayuno, almuerzo y cena en el restaurante "
+            "del complejo, y de acceso ilimitado a las piscinas de aguas termales al aire libre.\n\n"
+            "Y como broche de oro: la experiencia única e inigualable del HotBoat — una tinaja "
+            "flotante que navega en medio de la laguna, rodeada de volcanes y bosque nativo. "
+            "Una sensación que no encontrarás en ningún otro lugar del mundo."
+        ),
+        "personas": "2 personas",
+        "price_from": 399990,
+        "cost_from": 0,
+        "includes": [
+            "2 noches en Cabaña exclusiva Termas Angostura",
+            "Acceso ilimitado a Termas Angostura",
+            "Pensión completa (desayuno, almuerzo y cena)",
+            "Paseo en HotBoat (2 personas)",
+        ],
+        "display_order": 4,
+    },
+]
+
+
+def _seed_packs_catalog():
+    """Insert canonical packs that don't yet exist in DB (ON CONFLICT DO NOTHING)."""
+    import json as _json
+    try:
+        from app.db.connection import get_connection
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                for p in _PACKS_CATALOG_SEED:
+                    cur.execute(
+                        """
+                        INSERT INTO packs
+                          (slug, name, icon, description, personas,
+                           price_from, cost_from, includes,
+                           is_active, display_order)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, TRUE, %s)
+                        ON CONFLICT (slug) DO NOTHING
+                        """,
+                        (
+                            p["slug"], p["name"], p["icon"], p["description"],
+                            p["personas"], p["price_from"], p["cost_from"],
+                            _json.dumps(p["includes"], ensure_ascii=False),
+                            p["display_order"],
+                        ),
+                    )
+        logger.info("✅ Packs catalog seeded")
+    except Exception as _e:
+        logger.warning(f"Pack catalog seed skipped: {_e}")
+        raise
@@ -1,29 +1,160 @@
 """
 Database connection management
+
+Connections come from one of five named pools, one per traffic class, so
+a heavy report can't starve the WhatsApp webhook of connections:
+
+  realtime  webhook, inbox worker, bot replies — small queries that a
+            customer is waiting on; fails fast rather than queueing
+  web       booking site, chat UI and anything untagged
+  admin     admin panel: reports, forecasts, exports
+  batch     scheduled jobs (several fire together at 09:00, auto_sync and
+            the financial facts rebuild run for minutes), delayed queue,
+            outbox / follow-up workers, migrations
+  ingest    visitor-event flusher and log writer: short, steady writes
+            that must not queue behind a 15-minute batch statement
+
+Per replica that is at most 4 + 4 + 3 + 4 + 2 = 17 pooled connections, plus
+the dedicated LISTEN connections (catalog, follow-up queue, job scheduler,
+outbox): about 21, or 84 for four replicas, against Postgres'
+max_connections.
+
+Each pool has its own size, acquire timeout, statement_timeout and
+idle_in_transaction_session_timeout (set at connect time, so they cost
+nothing per query). Sizes can be overridden with DB_POOLS, e.g.
+"admin=4,batch=1".
+
+get_connection() takes its pool from a context variable. PoolRoutingMiddleware
+sets it per request from the path, the workers set it once at start
+(use_pool), and `with db_pool("admin"):` tags a call site explicitly. The
+variable follows the request into asyncio.to_thread and tasks created from
+it. get_connection("batch") picks a pool directly.
+
+Long-lived LISTEN connections don't belong to a pool. They go through
+connect_dedicated(), which counts them for /metrics, so everything this
+process holds open is visible: the pools' max sizes plus the dedicated
+connections (connection_budget()).
 """
-import psycopg
+from psycopg import AsyncConnection, Cursor
 from psycopg_pool import ConnectionPool
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Tuple
 import logging
+import threading
+import time
+
+from app import metrics
 
 from app.config import get_settings
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
-# Connection pool
-_pool: ConnectionPool = None
 
+@dataclass(frozen=True)
+class PoolSpec:
+    min_size: int
+    max_size: int
+    timeout: float                      # seconds a caller waits for a connection
+    statement_timeout: str              # Postgres durations; "0" = no limit
+    idle_in_transaction_timeout: str
+
+
+# idle_in_transaction is there to reap leaked sessions, not to police
+# normal code, some of which keeps a transaction open across an API call.
+POOLS: Dict[str, PoolSpec] = {
+    "realtime": PoolSpec(min_size=2, max_size=4, timeout=5, statement_timeout="10s",
+                         idle_in_transaction_timeout="60s"),
+    "web": PoolSpec(min_size=1, max_size=4, timeout=10, statement_timeout="30s",
+                    idle_in_transaction_timeout="60s"),
+    "admin": PoolSpec(min_size=1, max_size=3, timeout=30, statement_timeout="5min",
+                      idle_in_transaction_timeout="5min"),
+    "batch": PoolSpec(min_size=0, max_size=4, timeout=60, statement_timeout="15min",
+                      idle_in_transaction_timeout="10min"),
+    "ingest": PoolSpec(min_size=1, max_size=2, timeout=5, statement_timeout="30s",
+                       idle_in_transaction_timeout="60s"),
+}
+DEFAULT_POOL = "web"
+
+# Request path prefix → pool, first match wins (PoolRoutingMiddleware).
+PATH_POOLS: Sequence[Tuple[str, str]] = (
+    ("/webhook", "realtime"),
+    ("/api/admin", "admin"),
+    ("/admin", "admin"),
+)
+
+_pools: Dict[str, ConnectionPool] = {}
+# get_pool() is also called from threads (the log pipeline's writer, jobs
+# in to_thread), so creating a pool must not race.
+_pool_lock = threading.Lock()
+_pool_class: ContextVar[str] = ContextVar("db_pool", default=DEFAULT_POOL)
+_dedicated: Dict[str, int] = {}
+
+
+class TimedCursor(Cursor):
+    """Client cursor that reports each execute's duration to app.metrics
+    (per-request DB time and query counts)."""
+
+    def execute(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            metrics.observe_query(time.perf_counter() - t0)
+
+    def executemany(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            metrics.observe_query(time.perf_counter() - t0)
 
-def get_pool() -> ConnectionPool:
-    """Get or create connection pool"""
-    global _pool
-    if _pool is None:
-        _pool = ConnectionPool(
+
+def pool_specs() -> Dict[str, PoolSpec]:
+    """POOLS with the DB_POOLS max_size overrides applied."""
+    specs = dict(POOLS)
+    for item in filter(None, (p.strip() for p in settings.db_pools.split(","))):
+        name, _, size = item.partition("=")
+        name = name.strip()
+        if name not in specs or not size.strip().isdigit():
+            logger.warning(f"DB_POOLS: ignoring {item!r}")
+            continue
+        spec = specs[name]
+        max_size = max(1, int(size))
+        specs[name] = PoolSpec(min(spec.min_size, max_size), max_size, spec.timeout,
+                               spec.statement_timeout, spec.idle_in_transaction_timeout)
+    return specs
+
+
+def _options(spec: PoolSpec) -> str:
+    return (f"-c statement_timeout={spec.statement_timeout} "
+            f"-c idle_in_transaction_session_timeout={spec.idle_in_transaction_timeout}")
+
+
+def get_pool(name: Optional[str] = None) -> ConnectionPool:
+    """Get or create the named pool (default: the current context's)."""
+    name = name or _pool_class.get()
+    pool = _pools.get(name)
+    if pool is not None:
+        return pool
+    with _pool_lock:
+        if name in _pools:
+            return _pools[name]
+        spec = pool_specs().get(name)
+        if spec is None:
+            raise ValueError(f"unknown DB pool: {name!r}")
+        kwargs = {"cursor_factory": TimedCursor, "application_name": f"hotboat:{name}",
+                  "options": _options(spec)}
+        if not settings.db_prepare_statements:
+            kwargs["prepare_threshold"] = None     # no automatic preparing either
+        _pools[name] = pool = ConnectionPool(
             conninfo=settings.database_url,
-            min_size=2,
-            max_size=10,
-            timeout=30,
+            name=name,
+            min_size=spec.min_size,
+            max_size=spec.max_size,
+            timeout=spec.timeout,
             # Validate a connection (cheap round-trip) before handing it to
             # application code. Without this, a connection that Railway/
             # Postgres silently closed while idle (or a network blip) looks
@@ -35,52 +166,98 @@ def get_pool() -> ConnectionPool:
             # Proactively recycle connections that have been idle too long,
             # instead of waiting for them to go stale and fail.
             max_idle=300,
+            kwargs=kwargs,
         )
-        logger.info("✅ Database connection pool created")
-    return _pool
+        logger.info(f"✅ Database pool '{name}' created (max {spec.max_size}, "
+                    f"statement_timeout {spec.statement_timeout})")
+    return pool
 
 
 @contextmanager
-def get_connection():
-    """Get database connection from pool"""
-    pool = get_pool()
-    with pool.connection() as conn:
+def get_connection(pool: Optional[str] = None):
+    """Get a database connection from the named pool, or from the current
+    context's (see db_pool / use_pool)."""
+    name = pool or _pool_class.get()
+    p = get_pool(name)
+    t0 = time.perf_counter()
+    with p.connection() as conn:
+        metrics.observe_pool_wait(time.perf_counter() - t0, name)
         yield conn
 
 
-# Arbitrary constant used as the advisory-lock key below. Any unique int64
-# works; this one has no special meaning.
-_SCHEDULER_LOCK_KEY = 918273645
+@contextmanager
+def db_pool(name: str):
+    """Run the block's get_connection() calls on the `name` pool."""
+    if name not in POOLS:
+        raise ValueError(f"unknown DB pool: {name!r}")
+    token = _pool_class.set(name)
+    try:
+        yield
+    finally:
+        _pool_class.reset(token)
+
+
+def use_pool(name: str) -> None:
+    """Tag the rest of the current task / thread context (worker loops)."""
+    if name not in POOLS:
+        raise ValueError(f"unknown DB pool: {name!r}")
+    _pool_class.set(name)
+
+
+def current_pool() -> str:
+    return _pool_class.get()
+
+
+def pool_for_path(path: str) -> str:
+    for prefix, name in PATH_POOLS:
+        if path == prefix or path.startswith(prefix + "/"):
+            return name
+    return DEFAULT_POOL
+
+
+class PoolRoutingMiddleware:
+    """Tags each HTTP request with its pool (PATH_POOLS) before routing."""
 
-# Held open for the process lifetime once acquired — advisory locks are
-# session-scoped, so releasing/reusing this connection would drop the lock.
-_scheduler_lock_conn = None
+    def __init__(self, app):
+        self.app = app
 
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _pool_class.set(pool_for_path(scope.get("path", "")))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _pool_class.reset(token)
 
-def try_acquire_scheduler_lock() -> bool:
-    """
-    Claim the single "runs the background schedulers" slot via a Postgres
-    advisory lock. When the app runs with multiple uvicorn workers, each
-    worker is a separate process that would otherwise start its own copy of
-    the auto-sync/email/notification schedulers, sending every automated
-    email and WhatsApp message once per worker. Only the worker that wins
-    this lock should start them; the rest just serve requests.
-    """
-    global _scheduler_lock_conn
-    conn = psycopg.connect(settings.database_url, autocommit=True)
-    with conn.cursor() as cur:
-        cur.execute("SELECT pg_try_advisory_lock(%s)", (_SCHEDULER_LOCK_KEY,))
-        acquired = cur.fetchone()[0]
-    if acquired:
-        _scheduler_lock_conn = conn
-        return True
-    conn.close()
-    return False
 
+@asynccontextmanager
+async def connect_dedicated(purpose: str, **kwargs):
+    """A connection of its own (LISTEN loops), outside every pool but
+    counted in connection_budget() and /metrics."""
+    conn = await AsyncConnection.connect(settings.database_url, application_name=f"hotboat:{purpose}",
+                                         **kwargs)
+    _dedicated[purpose] = _dedicated.get(purpose, 0) + 1
+    try:
+        async with conn:
+            yield conn
+    finally:
+        _dedicated[purpose] -= 1
 
 
+def pool_stats() -> Dict[str, dict]:
+    """psycopg_pool counters (get_stats()) per pool created so far."""
+    return {name: pool.get_stats() for name, pool in list(_pools.items())}
 
 
+def dedicated_connections() -> Dict[str, int]:
+    return dict(_dedicated)
 
 
+def connection_budget() -> dict:
+    """Most connections this process can hold: every pool at max_size
+    (created or not) plus the dedicated connections open now."""
+    pools = {name: spec.max_size for name, spec in pool_specs().items()}
+    dedicated = sum(_dedicated.values())
+    return {"pools": pools, "dedicated": dedicated, "total": sum(pools.values()) + dedicated}
 
@@ -2,12 +2,13 @@
 Leads and contacts management
 """
 import logging
-import random
 import re
+import time
 from typing import Optional, List, Dict
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
+from app.db import statements
 from app.db.connection import get_connection
 
 # Chilean timezone
@@ -15,66 +16,75 @@ CHILE_TZ = ZoneInfo("America/Santiago")
 
 logger = logging.getLogger(__name__)
 
-_ad_col_cached: bool | None = None
-
-def _ad_source_col_exists(cur) -> bool:
-    """Check (once, then cache) whether whatsapp_leads.ad_source column exists."""
-    global _ad_col_cached
-    if _ad_col_cached is not None:
-        return _ad_col_cached
-    cur.execute("""
-        SELECT 1 FROM information_schema.columns
-        WHERE table_name='whatsapp_leads' AND column_name='ad_source'
-    """)
-    _ad_col_cached = cur.fetchone() is not None
-    return _ad_col_cached
-
-
-_lang_col_ensured: bool = False
-
-def _ensure_lang_col(cur) -> None:
-    """Add preferred_language column if not present (runs once per process)."""
-    global _lang_col_ensured
-    if _lang_col_ensured:
-        return
-    cur.execute(
-        "ALTER TABLE whatsapp_leads ADD COLUMN IF NOT EXISTS preferred_language TEXT"
-    )
-    _lang_col_ensured = True
-
-
-_variant_col_ensured: bool = False
-
-def _ensure_variant_col(cur) -> None:
-    """Add bot_variant column if not present (runs once per process)."""
-    global _variant_col_ensured
-    if _variant_col_ensured:
-        return
-    cur.execute(
-        "ALTER TABLE whatsapp_leads ADD COLUMN IF NOT EXISTS bot_variant TEXT"
-    )
-    _variant_col_ensured = True
-
-
-def _pick_active_variant(cur) -> Optional[str]:
-    """Randomly pick one currently-active A/B variant for a brand-new lead,
-    or None if no experiment is running (bot_ab_variants table missing or
-    empty is a normal, expected state — most of the time there's no test
-    active)."""
-    try:
-        cur.execute("SELECT variant_key FROM bot_ab_variants WHERE is_active = TRUE")
-        keys = [r[0] for r in cur.fetchall()]
-    except Exception:
+# ── Lead lookup cache ─────────────────────────────────────────────────────────
+# get_or_create_lead() runs for every inbound message, and again from
+# ConversationManager.get_conversation() for the same message. Fields the
+# bot reads (bot_enabled, preferred_language, bot_variant) are served from
+# this per-process cache for a few seconds. Writers on this process
+# invalidate their phone; on other replicas the entry simply expires, so
+# an admin toggling the bot off takes effect within LEAD_CACHE_TTL_S.
+LEAD_CACHE_TTL_S = 10
+LEAD_CACHE_MAX = 5000
+_lead_cache: Dict[str, tuple] = {}  # phone → (lead dict, expires_monotonic)
+
+
+def invalidate_lead(phone_number: str) -> None:
+    _lead_cache.pop(phone_number, None)
+
+
+def _cache_lead(lead: Dict) -> None:
+    if len(_lead_cache) >= LEAD_CACHE_MAX:
+        now = time.monotonic()
+        for phone in [p for p, (_, exp) in _lead_cache.items() if exp <= now]:
+            del _lead_cache[phone]
+        if len(_lead_cache) >= LEAD_CACHE_MAX:
+            _lead_cache.clear()
+    _lead_cache[lead["phone_number"]] = (lead, time.monotonic() + LEAD_CACHE_TTL_S)
+
+
+def _cached_lead(phone_number: str) -> Optional[Dict]:
+    entry = _lead_cache.get(phone_number)
+    if entry is None:
+        return None
+    if entry[1] <= time.monotonic():
+        _lead_cache.pop(phone_number, None)
         return None
-    return random.choice(keys) if keys else None
+    return dict(entry[0])
+
+
+def _lead_from_row(row) -> Dict:
+    """A RETURNING row of statements.SQL["lead.upsert"]."""
+    return {
+        "id": row[0],
+        "phone_number": row[1],
+        "customer_name": row[2],
+        "lead_status": row[3],
+        "notes": row[4],
+        "tags": row[5] if row[5] else [],
+        "created_at": row[6].isoformat() if row[6] else None,
+        "updated_at": row[7].isoformat() if row[7] else None,
+        "last_interaction_at": row[8].isoformat() if row[8] else None,
+        "bot_enabled": row[9] if row[9] is not None else True,
+        "unread_count": row[10] or 0,
+        "last_read_at": row[11].isoformat() if row[11] else None,
+        "priority": row[12] or 0,
+        "ad_source": row[13],
+        "ad_platform": row[14],
+        "ad_media_type": row[15],
+        "ad_creative_url": row[16],
+        "ad_ctwa_clid": row[17],
+        "ad_audience": row[18],
+        "preferred_language": row[19],
+        "bot_variant": row[20],
+    }
 
 
 def save_lead_language(phone_number: str, language: str) -> None:
     """Persist the user's preferred language to the DB (synchronous)."""
+    invalidate_lead(phone_number)
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
-                _ensure_lang_col(cur)
                 cur.execute(
                     "UPDATE whatsapp_leads SET preferred_language = %s, updated_at = NOW() WHERE phone_number = %s",
                     (language, phone_number),
@@ -87,117 +97,32 @@ def save_lead_language(phone_number: str, language: str) -> None:
 async def get_or_create_lead(phone_number: str, customer_name: str = None) -> Dict:
     """
     Get or create a lead in the database
-    
+
+    One INSERT ... ON CONFLICT DO UPDATE ... RETURNING creates the lead or
+    bumps last_interaction_at (and the name, if a new one came in) and
+    returns the row. Repeat calls within LEAD_CACHE_TTL_S with no new name
+    are answered from the per-process cache without a round-trip.
+
     Args:
         phone_number: Contact phone number
         customer_name: Contact name
-    
+
     Returns:
         Lead dictionary
     """
+    cached = _cached_lead(phone_number)
+    if cached is not None and (not customer_name or customer_name == cached["customer_name"]):
+        return cached
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
-                _ensure_lang_col(cur)
-                _ensure_variant_col(cur)
-                try:
-                    cur.execute("""
-                        SELECT
-                            id, phone_number, customer_name, lead_status,
-                            notes, tags, created_at, updated_at, last_interaction_at, bot_enabled,
-                            unread_count, last_read_at, priority, ad_source,
-                            ad_platform, ad_media_type, ad_creative_url, ad_ctwa_clid, ad_audience,
-                            preferred_language, bot_variant
-                        FROM whatsapp_leads
-                        WHERE phone_number = %s
-                    """, (phone_number,))
-                except Exception:
-                    conn.rollback()  # psycopg3: reset aborted transaction before fallback
-                    cur.execute("""
-                        SELECT
-                            id, phone_number, customer_name, lead_status,
-                            notes, tags, created_at, updated_at, last_interaction_at, bot_enabled,
-                            unread_count, last_read_at, priority
-                        FROM whatsapp_leads
-                        WHERE phone_number = %s
-                    """, (phone_number,))
-
+                statements.execute(cur, "lead.upsert", {"phone": phone_number, "name": customer_name})
                 row = cur.fetchone()
+            conn.commit()
+        lead = _lead_from_row(row)
+        _cache_lead(lead)
+        return dict(lead)
 
-                if row:
-                    # Update last interaction
-                    cur.execute("""
-                        UPDATE whatsapp_leads
-                        SET last_interaction_at = NOW(),
-                            updated_at = NOW()
-                        WHERE phone_number = %s
-                    """, (phone_number,))
-
-                    if customer_name and customer_name != row[2]:
-                        # Update name if different
-                        cur.execute("""
-                            UPDATE whatsapp_leads
-                            SET customer_name = %s, updated_at = NOW()
-                            WHERE phone_number = %s
-                        """, (customer_name, phone_number))
-
-                    conn.commit()
-
-                    return {
-                        "id": row[0],
-                        "phone_number": row[1],
-                        "customer_name": row[2],
-                        "lead_status": row[3],
-                        "notes": row[4],
-                        "tags": row[5] if row[5] else [],
-                        "created_at": row[6].isoformat() if row[6] else None,
-                        "updated_at": row[7].isoformat() if row[7] else None,
-                        "last_interaction_at": row[8].isoformat() if row[8] else None,
-                        "bot_enabled": row[9] if len(row) > 9 else True,
-                        "unread_count": row[10] if len(row) > 10 else 0,
-                        "last_read_at": row[11].isoformat() if len(row) > 11 and row[11] else None,
-                        "priority": row[12] if len(row) > 12 else 0,
-                        "ad_source": row[13] if len(row) > 13 else None,
-                        "ad_platform": row[14] if len(row) > 14 else None,
-                        "ad_media_type": row[15] if len(row) > 15 else None,
-                        "ad_creative_url": row[16] if len(row) > 16 else None,
-                        "ad_ctwa_clid": row[17] if len(row) > 17 else None,
-                        "ad_audience": row[18] if len(row) > 18 else None,
-                        "preferred_language": row[19] if len(row) > 19 else None,
-                        "bot_variant": row[20] if len(row) > 20 else None,
-                    }
-                else:
-                    # Create new lead — randomly assign an active A/B variant
-                    # (if any experiment is running) so it sticks for the
-                    # whole conversation.
-                    variant_key = _pick_active_variant(cur)
-                    cur.execute("""
-                        INSERT INTO whatsapp_leads
-                        (phone_number, customer_name, lead_status, last_interaction_at, created_at, updated_at, bot_variant)
-                        VALUES (%s, %s, 'unknown', NOW(), NOW(), NOW(), %s)
-                        RETURNING id
-                    """, (phone_number, customer_name, variant_key))
-
-                    lead_id = cur.fetchone()[0]
-                    conn.commit()
-
-                    return {
-                        "id": lead_id,
-                        "phone_number": phone_number,
-                        "customer_name": customer_name,
-                        "lead_status": "unknown",
-                        "notes": None,
-                        "tags": [],
-                        "created_at": datetime.now(CHILE_TZ).isoformat(),
-                        "updated_at": datetime.now(CHILE_TZ).isoformat(),
-                        "last_interaction_at": datetime.now(CHILE_TZ).isoformat(),
-                        "bot_enabled": True,
-                        "unread_count": 0,
-                        "last_read_at": None,
-                        "priority": 0,
-                        "bot_variant": variant_key,
-                    }
-    
     except Exception as e:
         logger.error(f"Error getting/creating lead: {e}")
         import traceback
@@ -217,6 +142,7 @@ async def update_lead_status(phone_number: str, lead_status: str, notes: str = N
     Returns:
         True if successful
     """
+    invalidate_lead(phone_number)
     try:
         valid_statuses = ['potential_client', 'bad_lead', 'customer', 'unknown']
         if lead_status not in valid_statuses:
@@ -257,6 +183,7 @@ async def toggle_bot_for_lead(phone_number: str, bot_enabled: bool) -> bool:
     Returns:
         True if successful
     """
+    invalidate_lead(phone_number)
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
@@ -289,26 +216,25 @@ async def get_leads_by_status(lead_status: Optional[str] = None, limit: int = 50
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
-                ad_col = "ad_source" if _ad_source_col_exists(cur) else "NULL::text AS ad_source"
                 if lead_status:
-                    cur.execute(f"""
+                    cur.execute("""
                         SELECT
                             id, phone_number, customer_name, lead_status,
                             notes, tags, created_at, updated_at, last_interaction_at, bot_enabled,
                             unread_count, last_read_at, priority,
-                            {ad_col}
+                            ad_source
                         FROM whatsapp_leads
                         WHERE lead_status = %s
                         ORDER BY last_interaction_at DESC NULLS LAST
                         LIMIT %s
                     """, (lead_status, limit))
                 else:
-                    cur.execute(f"""
+                    cur.execute("""
                         SELECT
                             id, phone_number, customer_name, lead_status,
                             notes, tags, created_at, updated_at, last_interaction_at, bot_enabled,
                             unread_count, last_read_at, priority,
-                            {ad_col}
+                            ad_source
                         FROM whatsapp_leads
                         ORDER BY last_interaction_at DESC NULLS LAST
                         LIMIT %s
@@ -362,27 +288,10 @@ async def get_conversation_history(
         with get_connection() as conn:
             with conn.cursor() as cur:
                 fetch_limit = limit + 1 if return_has_more else limit
-                params = [phone_number]
-                before_clause = ""
                 if before:
-                    before_clause = " AND created_at < %s"
-                    params.append(before)
-                
-                params.append(fetch_limit)
-                cur.execute(f"""
-                    SELECT 
-                        id,
-                        message_text,
-                        response_text,
-                        message_type,
-                        direction,
-                        created_at
-                    FROM whatsapp_conversations
-                    WHERE phone_number = %s
-                    {before_clause}
-                    ORDER BY created_at DESC
-                    LIMIT %s
-                """, tuple(params))
+                    statements.execute(cur, "conversation.history_before", (phone_number, before, fetch_limit))
+                else:
+                    statements.execute(cur, "conversation.history", (phone_number, fetch_limit))
                 
                 rows = cur.fetchall()
                 has_more = False
@@ -555,6 +464,7 @@ async def increment_unread_count(phone_number: str) -> bool:
     Returns:
         True if successful
     """
+    invalidate_lead(phone_number)
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
@@ -585,6 +495,7 @@ async def mark_conversation_as_read(phone_number: str) -> bool:
     Returns:
         True if successful
     """
+    invalidate_lead(phone_number)
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
@@ -617,6 +528,7 @@ async def update_lead_priority(phone_number: str, priority: int) -> bool:
     Returns:
         True if successful
     """
+    invalidate_lead(phone_number)
     try:
         # Validate priority value
         # 0 = none, 1 = high, 2 = medium, 3 = low, 4 = "Ya reservó" (displayed as "0")
@@ -717,22 +629,11 @@ async def save_lead_ad_source(phone_number: str, referral: dict) -> str | None:
     creative_url  = (referral.get("image_url") or referral.get("video_url") or None)
     ctwa_clid     = referral.get("ctwa_clid") or None
 
+    invalidate_lead(phone_number)
     try:
         import json as _json
         with get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    ALTER TABLE whatsapp_leads
-                    ADD COLUMN IF NOT EXISTS ad_source TEXT,
-                    ADD COLUMN IF NOT EXISTS ad_referral JSONB,
-                    ADD COLUMN IF NOT EXISTS ad_platform TEXT,
-                    ADD COLUMN IF NOT EXISTS ad_media_type TEXT,
-                    ADD COLUMN IF NOT EXISTS ad_creative_url TEXT,
-                    ADD COLUMN IF NOT EXISTS ad_ctwa_clid TEXT,
-                    ADD COLUMN IF NOT EXISTS ad_audience TEXT
-                """)
-                global _ad_col_cached
-                _ad_col_cached = True
                 cur.execute("""
                     UPDATE whatsapp_leads
                     SET ad_source      = %s,
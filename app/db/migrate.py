@@ -0,0 +1,197 @@
+"""
+Versioned schema migrations
+
+Migrations live in app/db/migrations/ as ``NNNN_description.sql`` or
+``NNNN_description.py`` (the latter exposing ``upgrade(conn)``), applied
+in version order and recorded in the schema_version table.
+
+Startup cost is one query: every replica reads MAX(version) and, if that
+is already the newest file on disk, moves on. Only when something is
+pending does a replica take the migration advisory lock, re-read the
+applied set (another replica may have finished while it waited) and apply
+the rest — so DDL locks are taken once per deploy by one replica, not by
+all four on every boot.
+
+The old manual path (migrations/NNN_*.sql + run_migration_0xx.py at the
+repo root) is frozen: all of it was applied to production before this
+engine existed. New schema changes go here.
+
+    python -m app.db.migrate            # apply pending migrations
+    python -m app.db.migrate status     # show applied / pending
+"""
+import hashlib
+import importlib.util
+import logging
+import os
+import re
+import time
+from typing import List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+# Arbitrary but fixed: pg_advisory_lock key shared by every replica.
+MIGRATION_LOCK_KEY = 4_187_300_031
+
+_FILE_RE = re.compile(r"^(\d{4})_([a-z0-9_]+)\.(sql|py)$")
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    path: str
+    kind: str  # "sql" | "py"
+
+    @property
+    def checksum(self) -> str:
+        with open(self.path, "rb") as fh:
+            return hashlib.sha256(fh.read()).hexdigest()[:16]
+
+
+def discover() -> List[Migration]:
+    """Migration files on disk, in version order. Duplicate versions are
+    a packaging error and fail loudly."""
+    found = {}
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        m = _FILE_RE.match(filename)
+        if not m:
+            continue
+        version = int(m.group(1))
+        if version in found:
+            raise RuntimeError(f"duplicate migration version {version}: {found[version].path}, {filename}")
+        found[version] = Migration(version, m.group(2), os.path.join(MIGRATIONS_DIR, filename), m.group(3))
+    return [found[v] for v in sorted(found)]
+
+
+def head_version() -> int:
+    migrations = discover()
+    return migrations[-1].version if migrations else 0
+
+
+def current_version() -> int:
+    """The fast probe: MAX(version), or 0 on a database that has never
+    been migrated."""
+    import psycopg
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        try:
+            row = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()
+            return int(row[0])
+        except psycopg.errors.UndefinedTable:
+            conn.rollback()
+            return 0
+
+
+def _ensure_version_table(conn) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version     INTEGER PRIMARY KEY,
+            name        TEXT NOT NULL,
+            checksum    TEXT NOT NULL,
+            applied_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            duration_ms INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.commit()
+
+
+def _apply(conn, migration: Migration) -> int:
+    """Run one migration and record it. SQL files run in a single
+    transaction together with their schema_version row; Python migrations
+    may commit on their own (the baseline calls helpers that do). Those
+    helpers must raise on failure, not just log: the version is recorded
+    only if upgrade() returns, so a failed step is retried on the next
+    boot."""
+    started = time.monotonic()
+    if migration.kind == "sql":
+        with open(migration.path, "r", encoding="utf-8") as fh:
+            conn.execute(fh.read())
+    else:
+        spec = importlib.util.spec_from_file_location(f"_migration_{migration.version}", migration.path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.upgrade(conn)
+    duration_ms = int((time.monotonic() - started) * 1000)
+    conn.execute(
+        "INSERT INTO schema_version (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s)",
+        (migration.version, migration.name, migration.checksum, duration_ms),
+    )
+    conn.commit()
+    return duration_ms
+
+
+def migrate_to_head() -> dict:
+    """Bring the database to the newest migration. Cheap when already
+    there (one SELECT); otherwise serialised across replicas by an
+    advisory lock. Returns {"from", "to", "applied"}."""
+    from app.db.connection import db_pool, get_connection
+    head = head_version()
+    current = current_version()
+    if current >= head:
+        return {"from": current, "to": current, "applied": []}
+
+    applied_now = []
+    # On the batch pool, helpers the migrations call included.
+    with db_pool("batch"), get_connection() as conn:
+        # A migration may build an index for longer than the batch pool's
+        # statement_timeout allows; RESET below restores the pool's value.
+        conn.execute("SET statement_timeout = 0")
+        conn.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            _ensure_version_table(conn)
+            done = {r[0] for r in conn.execute("SELECT version FROM schema_version").fetchall()}
+            conn.commit()
+            for migration in discover():
+                if migration.version in done:
+                    continue
+                logger.info(f"🗄️ Applying migration {migration.version:04d}_{migration.name}")
+                try:
+                    ms = _apply(conn, migration)
+                except Exception:
+                    conn.rollback()
+                    logger.exception(f"Migration {migration.version:04d}_{migration.name} failed")
+                    raise
+                logger.info(f"✅ Migration {migration.version:04d}_{migration.name} applied in {ms} ms")
+                applied_now.append(migration.version)
+        finally:
+            conn.rollback()
+            conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+            conn.execute("RESET statement_timeout")
+            conn.commit()
+    return {"from": current, "to": head, "applied": applied_now}
+
+
+def status() -> List[dict]:
+    """Every migration on disk with its applied state, flagging files
+    edited after they were applied."""
+    from app.db.connection import get_connection
+    applied = {}
+    if current_version():
+        with get_connection() as conn:
+            for version, checksum, applied_at in conn.execute(
+                "SELECT version, checksum, applied_at FROM schema_version"
+            ).fetchall():
+                applied[version] = (checksum, applied_at)
+    out = []
+    for m in discover():
+        rec: Optional[tuple] = applied.get(m.version)
+        out.append({
+            "version": m.version,
+            "name": m.name,
+            "applied_at": rec[1].isoformat() if rec else None,
+            "modified": bool(rec and rec[0] != m.checksum),
+        })
+    return out
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if len(sys.argv) > 1 and sys.argv[1] == "status":
+        for row in status():
+            state = row["applied_at"] or "pending"
+            flag = "  (modified since applied)" if row["modified"] else ""
+            print(f"{row['version']:04d}_{row['name']:<40} {state}{flag}")
+    else:
+        result = migrate_to_head()
+        print(f"schema_version {result['from']} → {result['to']} (applied: {result['applied'] or 'none'})")
@@ -0,0 +1,80 @@
+"""
+Baseline: everything lifespan() used to run on every boot, plus the DDL
+that request handlers ran lazily (coupons, stock, lead columns, the
+experiences/packs translation columns, the budget zone columns).
+
+Every step is idempotent (CREATE ... IF NOT EXISTS / ON CONFLICT DO
+NOTHING), so this is safe on the existing production database as well as
+on an empty one. The helpers stay where they are (the ones lifespan()
+defined itself moved to app/db/bootstrap.py, so this doesn't import
+app.main); from now on a change to one of them needs a new migration that
+calls it again.
+"""
+
+
+def upgrade(conn) -> None:
+    from app.db.bootstrap import (
+        _ensure_web_push_table,
+        _ensure_extras_visibility_table,
+        _seed_extras_visibility,
+        _seed_clothing_products,
+        _seed_packs_catalog,
+    )
+    from app.whatsapp.webhook import _ensure_dedup_table
+    from app.whatsapp.inbox import _ensure_inbox_table
+    from app.scheduler import ensure_delayed_jobs_table, ensure_scheduler_table
+    from app.bot.conversation import ensure_conversation_state_table
+    from app.booking.operator_settings import seed_email_workflow_defaults
+    from app.booking import db as booking_db
+    from app.booking.bot_config_router import _ensure_tables as ensure_bot_tables, seed_defaults as seed_bot_defaults
+    from app.booking.gastos_router import _ensure_tables as ensure_gastos_tables
+    from app.booking.tabla_router import (
+        _ensure_tabla_table, _seed_tabla_products, _ensure_catalog_table, _seed_catalog_defaults,
+    )
+    from app.booking.stock_router import _ensure_tables as ensure_stock_tables
+    from app.booking.admin_router import _ensure_coupons_table
+    from app.booking.catalog import ensure_catalog_notifications
+
+    _ensure_dedup_table()
+    ensure_delayed_jobs_table()
+    _ensure_inbox_table()
+    ensure_scheduler_table()
+    ensure_conversation_state_table()
+    _ensure_web_push_table()
+    _ensure_extras_visibility_table()
+    _seed_extras_visibility()
+    _seed_clothing_products()
+    _seed_packs_catalog()
+    seed_email_workflow_defaults()
+    booking_db.ensure_db_columns()
+    booking_db.ensure_signatures_table()
+    booking_db.ensure_analytics_views()
+    booking_db.ensure_visitor_identity_tables()
+    booking_db.ensure_dynamic_pricing_columns()
+    booking_db.ensure_alojamientos_table()
+    ensure_bot_tables()
+    seed_bot_defaults()
+    ensure_gastos_tables()
+    _ensure_tabla_table()
+    _seed_tabla_products()
+    _ensure_catalog_table()
+    _seed_catalog_defaults()
+    ensure_stock_tables()
+    _ensure_coupons_table()
+
+    # Lead columns get_or_create_lead() used to ALTER in on first use.
+    conn.execute("ALTER TABLE whatsapp_leads ADD COLUMN IF NOT EXISTS preferred_language TEXT")
+    conn.execute("ALTER TABLE whatsapp_leads ADD COLUMN IF NOT EXISTS bot_variant TEXT")
+    # Budget zone columns the financial budget endpoints used to ALTER in.
+    conn.execute("""
+        ALTER TABLE IF EXISTS financial_budget
+            ADD COLUMN IF NOT EXISTS aloj_budget    NUMERIC DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS exp_budget     NUMERIC DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS extra_budget   NUMERIC DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS reserva_budget NUMERIC DEFAULT 0
+    """)
+    conn.commit()
+
+    # Last: installs triggers on the tables created above, and adds the
+    # experiences/packs columns the admin endpoints used to ALTER per request.
+    ensure_catalog_notifications()
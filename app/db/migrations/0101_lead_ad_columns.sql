@@ -0,0 +1,11 @@
+-- Ad-referral columns save_lead_ad_source() used to ALTER in on every call.
+-- With them guaranteed, get_or_create_lead() can read them in its single
+-- upsert statement without probing information_schema first.
+ALTER TABLE whatsapp_leads
+    ADD COLUMN IF NOT EXISTS ad_source       TEXT,
+    ADD COLUMN IF NOT EXISTS ad_referral     JSONB,
+    ADD COLUMN IF NOT EXISTS ad_platform     TEXT,
+    ADD COLUMN IF NOT EXISTS ad_media_type   TEXT,
+    ADD COLUMN IF NOT EXISTS ad_creative_url TEXT,
+    ADD COLUMN IF NOT EXISTS ad_ctwa_clid    TEXT,
+    ADD COLUMN IF NOT EXISTS ad_audience     TEXT;
@@ -0,0 +1,79 @@
+-- Daily occupancy per accommodation.
+--
+-- The availability calendar used to count overlapping bookings with a
+-- correlated subquery for each of the next 365 days. accommodation_occupancy
+-- keeps that count materialised (one row per accommodation and booked
+-- night) and a row trigger on accommodation_bookings keeps it current on
+-- insert, update (dates, unit, status → cancelled) and delete, whichever
+-- code path does the write.
+--
+-- A booking counts when status <> 'cancelled', matching the old query's
+-- "status NOT IN ('cancelled')". Nights are [check_in, check_out).
+
+CREATE TABLE IF NOT EXISTS accommodation_occupancy (
+    accommodation_id INTEGER NOT NULL,
+    day              DATE    NOT NULL,
+    units_booked     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (accommodation_id, day)
+);
+
+CREATE OR REPLACE FUNCTION accommodation_occupancy_apply(
+    p_accommodation_id INTEGER, p_check_in DATE, p_check_out DATE, p_delta INTEGER
+) RETURNS void AS $$
+BEGIN
+    IF p_accommodation_id IS NULL OR p_check_in IS NULL OR p_check_out IS NULL
+       OR p_check_out <= p_check_in THEN
+        RETURN;
+    END IF;
+    INSERT INTO accommodation_occupancy (accommodation_id, day, units_booked)
+    SELECT p_accommodation_id, d::date, p_delta
+    FROM generate_series(p_check_in, p_check_out - 1, INTERVAL '1 day') AS d
+    ON CONFLICT (accommodation_id, day)
+    DO UPDATE SET units_booked = accommodation_occupancy.units_booked + EXCLUDED.units_booked;
+    IF p_delta < 0 THEN
+        DELETE FROM accommodation_occupancy
+        WHERE accommodation_id = p_accommodation_id
+          AND day >= p_check_in AND day < p_check_out
+          AND units_booked <= 0;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION accommodation_occupancy_sync() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND (OLD.status <> 'cancelled') IS TRUE THEN
+        PERFORM accommodation_occupancy_apply(OLD.accommodation_id, OLD.check_in, OLD.check_out, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND (NEW.status <> 'cancelled') IS TRUE THEN
+        PERFORM accommodation_occupancy_apply(NEW.accommodation_id, NEW.check_in, NEW.check_out, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_accommodation_occupancy ON accommodation_bookings;
+DROP TRIGGER IF EXISTS trg_accommodation_occupancy_upd ON accommodation_bookings;
+CREATE TRIGGER trg_accommodation_occupancy
+    AFTER INSERT OR DELETE ON accommodation_bookings
+    FOR EACH ROW EXECUTE FUNCTION accommodation_occupancy_sync();
+-- Payment/status updates that don't touch the unit, the dates or the
+-- cancelled flag (most of them) skip the trigger entirely.
+CREATE TRIGGER trg_accommodation_occupancy_upd
+    AFTER UPDATE ON accommodation_bookings
+    FOR EACH ROW
+    WHEN (OLD.accommodation_id IS DISTINCT FROM NEW.accommodation_id
+          OR OLD.check_in IS DISTINCT FROM NEW.check_in
+          OR OLD.check_out IS DISTINCT FROM NEW.check_out
+          OR (OLD.status <> 'cancelled') IS DISTINCT FROM (NEW.status <> 'cancelled'))
+    EXECUTE FUNCTION accommodation_occupancy_sync();
+
+-- Backfill from existing bookings.
+TRUNCATE accommodation_occupancy;
+INSERT INTO accommodation_occupancy (accommodation_id, day, units_booked)
+SELECT ab.accommodation_id, d::date, COUNT(*)
+FROM accommodation_bookings ab,
+     generate_series(ab.check_in, ab.check_out - 1, INTERVAL '1 day') AS d
+WHERE ab.accommodation_id IS NOT NULL
+  AND ab.status <> 'cancelled'
+  AND ab.check_out > ab.check_in
+GROUP BY ab.accommodation_id, d::date;
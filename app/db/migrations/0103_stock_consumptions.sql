@@ -0,0 +1,27 @@
+-- One row per booking whose stock has been consumed (reason 'booking').
+--
+-- stock_movements has one row per product moved, so it can't carry a
+-- unique (booking_ref, reason) itself; this ledger does. The batch
+-- consumer claims a booking by inserting here (ON CONFLICT DO NOTHING)
+-- in the same transaction as its movements, so a booking is never
+-- deducted twice, even if two replicas run the job at once.
+
+CREATE TABLE IF NOT EXISTS stock_consumptions (
+    booking_ref TEXT        NOT NULL,
+    reason      TEXT        NOT NULL DEFAULT 'booking',
+    consumed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (booking_ref, reason)
+);
+
+-- Bookings already consumed under the old per-row check
+-- ("any stock_movements row with this booking_ref and reason").
+INSERT INTO stock_consumptions (booking_ref, reason, consumed_at)
+SELECT booking_ref, reason, MIN(created_at)
+FROM stock_movements
+WHERE reason = 'booking' AND COALESCE(booking_ref, '') <> ''
+GROUP BY booking_ref, reason
+ON CONFLICT DO NOTHING;
+
+-- The consumer's candidate scan: past bookings not yet consumed.
+CREATE INDEX IF NOT EXISTS idx_aa_stock_pending
+    ON all_appointments (fecha) WHERE stock_consumed_at IS NULL;
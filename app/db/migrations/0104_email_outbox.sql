@@ -0,0 +1,54 @@
+-- Outbound email queue.
+--
+-- Every transactional email is written here first and delivered to Resend
+-- by the outbox worker (app/email/outbox.py), so a slow or failing provider
+-- never holds up the request that triggered the email. Rows are claimed
+-- with FOR UPDATE SKIP LOCKED plus a lease, retried with exponential
+-- backoff and parked as 'dead' after max_attempts.
+--
+-- dedup_key is '<trigger>:<booking_ref>' for emails that go out once per
+-- booking (confirmation, follow-up, admin lead notice...). The unique index
+-- makes a second enqueue of the same email a no-op, whichever replica or
+-- code path (payment return, webhook, sweep) gets there second.
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id              BIGSERIAL   PRIMARY KEY,
+    trigger         TEXT        NOT NULL,
+    booking_ref     TEXT,
+    dedup_key       TEXT,
+    payload         JSONB       NOT NULL,
+    after_send      JSONB,
+    status          TEXT        NOT NULL DEFAULT 'pending',
+    attempts        INTEGER     NOT NULL DEFAULT 0,
+    max_attempts    INTEGER     NOT NULL DEFAULT 6,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    locked_until    TIMESTAMPTZ,
+    provider_id     TEXT,
+    last_error      TEXT,
+    created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    sent_at         TIMESTAMPTZ
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_email_outbox_dedup
+    ON email_outbox (dedup_key) WHERE dedup_key IS NOT NULL;
+
+-- The worker's claim scan only ever looks at unfinished rows.
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due
+    ON email_outbox (next_attempt_at) WHERE status IN ('pending', 'sending');
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_trigger
+    ON email_outbox (trigger, created_at DESC);
+
+-- Per-trigger delivery status for the admin panel.
+CREATE OR REPLACE VIEW email_delivery_status AS
+SELECT trigger,
+       COUNT(*) FILTER (WHERE status = 'pending')  AS pending,
+       COUNT(*) FILTER (WHERE status = 'sending')  AS sending,
+       COUNT(*) FILTER (WHERE status = 'sent')     AS sent,
+       COUNT(*) FILTER (WHERE status = 'dead')     AS dead,
+       COUNT(*) FILTER (WHERE status = 'pending' AND attempts > 0) AS retrying,
+       MAX(sent_at)                                AS last_sent_at,
+       MAX(updated_at) FILTER (WHERE status = 'dead') AS last_failed_at
+FROM email_outbox
+GROUP BY trigger;
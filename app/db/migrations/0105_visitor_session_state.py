@@ -0,0 +1,193 @@
+"""
+Rolling visitor-session state, and booking_visitor_events partitioned by day.
+
+The session closer used to GROUP BY every row of booking_visitor_events
+(anti-joined against booking_visitor_sessions) every two minutes, then
+re-read each stale session's events one query at a time. Now:
+
+  • booking_visitor_session_state holds one row per session: first/last
+    seen, the attribution fields (first non-null value), the set of event
+    types and an event count. A statement-level trigger with a transition
+    table keeps it current. It fires once per INSERT or COPY, so the
+    buffered writer's batches and hotboat.cl's tracker.js inserts on the
+    shared database are both covered. Finding stale sessions becomes a
+    range scan on the partial last_seen_at index.
+  • booking_visitor_events becomes range-partitioned on recorded_at plus a
+    default partition: one partition per UTC day with a retention window,
+    per UTC month while VISITOR_EVENTS_RETENTION_DAYS is 0. The
+    "visitor_event_partitions" job creates upcoming ones and drops those
+    past the window.
+
+The conversion copies the existing rows into the partitioned table. The
+history lands in the default partition: partitions are only created from
+today on, so a long history doesn't mean thousands of partitions (and
+their locks, and their indexes) in this one transaction. It
+keeps the columns (CREATE TABLE ... LIKE, so columns another writer added
+come along too), the id sequence and the index names. Dropping the old
+table drops the analytics views that read it, so they are recreated
+afterwards. Each step checks what's already there, which makes a re-run
+after the views step failed safe.
+"""
+from datetime import datetime, timedelta, timezone
+
+STATE_DDL = """
+CREATE TABLE IF NOT EXISTS booking_visitor_session_state (
+    session_id     VARCHAR(64) PRIMARY KEY,
+    first_seen_at  TIMESTAMPTZ NOT NULL,
+    last_seen_at   TIMESTAMPTZ NOT NULL,
+    lang           VARCHAR(8),
+    referrer       TEXT,
+    is_returning   BOOLEAN NOT NULL DEFAULT FALSE,
+    visitor_id     VARCHAR(64),
+    utm_source     TEXT,
+    utm_medium     TEXT,
+    utm_campaign   TEXT,
+    utm_content    TEXT,
+    fbclid         TEXT,
+    parametro_url  TEXT,
+    event_types    TEXT[] NOT NULL DEFAULT '{}',
+    event_count    INTEGER NOT NULL DEFAULT 0,
+    closed_at      TIMESTAMPTZ
+);
+-- The closer's scan: open sessions, oldest activity first.
+CREATE INDEX IF NOT EXISTS idx_bvss_open_last_seen
+    ON booking_visitor_session_state (last_seen_at) WHERE closed_at IS NULL;
+"""
+
+# Per-session aggregate of a set of event rows, in the column order of
+# booking_visitor_session_state (minus closed_at). lang and referrer follow
+# the latest event; visitor and ad attribution keep the earliest non-null.
+SESSION_AGGREGATE = """
+    SELECT session_id, MIN(recorded_at), MAX(recorded_at),
+           (array_agg(lang ORDER BY recorded_at DESC))[1],
+           (array_agg(referrer ORDER BY recorded_at DESC)
+                FILTER (WHERE referrer IS NOT NULL AND referrer <> ''))[1],
+           COALESCE(bool_or(is_returning), FALSE),
+           (array_agg(visitor_id ORDER BY recorded_at) FILTER (WHERE visitor_id IS NOT NULL))[1],
+           (array_agg(utm_source ORDER BY recorded_at) FILTER (WHERE utm_source IS NOT NULL))[1],
+           (array_agg(utm_medium ORDER BY recorded_at) FILTER (WHERE utm_medium IS NOT NULL))[1],
+           (array_agg(utm_campaign ORDER BY recorded_at) FILTER (WHERE utm_campaign IS NOT NULL))[1],
+           (array_agg(utm_content ORDER BY recorded_at) FILTER (WHERE utm_content IS NOT NULL))[1],
+           (array_agg(fbclid ORDER BY recorded_at) FILTER (WHERE fbclid IS NOT NULL))[1],
+           (array_agg(parametro_url ORDER BY recorded_at) FILTER (WHERE parametro_url IS NOT NULL))[1],
+           array_agg(DISTINCT event_type ORDER BY event_type),
+           COUNT(*)::int
+    FROM {source}
+    GROUP BY session_id
+"""
+
+STATE_COLUMNS = """session_id, first_seen_at, last_seen_at, lang, referrer, is_returning,
+        visitor_id, utm_source, utm_medium, utm_campaign, utm_content, fbclid,
+        parametro_url, event_types, event_count"""
+
+
+def _keep_first(col: str) -> str:
+    # Earliest non-null wins: take the incoming batch's value only when it
+    # starts before what is stored (events can arrive slightly out of order).
+    return (f"{col} = CASE WHEN EXCLUDED.first_seen_at < s.first_seen_at "
+            f"THEN COALESCE(EXCLUDED.{col}, s.{col}) ELSE COALESCE(s.{col}, EXCLUDED.{col}) END")
+
+
+TRIGGER_DDL = f"""
+CREATE OR REPLACE FUNCTION booking_visitor_session_state_apply() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- ORDER BY session_id: concurrent batches lock state rows in the same
+    -- order, so two COPYs touching the same sessions can't deadlock.
+    INSERT INTO booking_visitor_session_state AS s ({STATE_COLUMNS})
+    SELECT * FROM ({SESSION_AGGREGATE.format(source="new_events")}) agg
+    ORDER BY 1
+    ON CONFLICT (session_id) DO UPDATE SET
+        first_seen_at = LEAST(s.first_seen_at, EXCLUDED.first_seen_at),
+        last_seen_at  = GREATEST(s.last_seen_at, EXCLUDED.last_seen_at),
+        lang = CASE WHEN EXCLUDED.last_seen_at >= s.last_seen_at
+                    THEN COALESCE(EXCLUDED.lang, s.lang) ELSE s.lang END,
+        referrer = CASE WHEN EXCLUDED.last_seen_at >= s.last_seen_at
+                        THEN COALESCE(EXCLUDED.referrer, s.referrer)
+                        ELSE COALESCE(s.referrer, EXCLUDED.referrer) END,
+        is_returning = s.is_returning OR EXCLUDED.is_returning,
+        {_keep_first("visitor_id")},
+        {_keep_first("utm_source")},
+        {_keep_first("utm_medium")},
+        {_keep_first("utm_campaign")},
+        {_keep_first("utm_content")},
+        {_keep_first("fbclid")},
+        {_keep_first("parametro_url")},
+        event_types = ARRAY(SELECT DISTINCT t FROM unnest(s.event_types || EXCLUDED.event_types) t ORDER BY t),
+        event_count = s.event_count + EXCLUDED.event_count;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_bve_session_state ON booking_visitor_events;
+CREATE TRIGGER trg_bve_session_state
+    AFTER INSERT ON booking_visitor_events
+    REFERENCING NEW TABLE AS new_events
+    FOR EACH STATEMENT EXECUTE FUNCTION booking_visitor_session_state_apply();
+"""
+
+
+def _partition_events(conn) -> None:
+    from app.booking.visitor_tracking import EVENT_PARTITIONS_AHEAD_DAYS, create_visitor_event_partitions
+    from app.config import get_settings
+
+    kind = conn.execute(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass('booking_visitor_events')"
+    ).fetchone()
+    if kind and kind[0] == "p":
+        return
+
+    seq = conn.execute("SELECT pg_get_serial_sequence('booking_visitor_events', 'id')").fetchone()[0]
+    today = datetime.now(timezone.utc).date()
+
+    conn.execute("UPDATE booking_visitor_events SET recorded_at = NOW() WHERE recorded_at IS NULL")
+    conn.execute("ALTER TABLE booking_visitor_events RENAME TO booking_visitor_events_unpartitioned")
+    conn.execute("""
+        CREATE TABLE booking_visitor_events
+            (LIKE booking_visitor_events_unpartitioned INCLUDING DEFAULTS)
+            PARTITION BY RANGE (recorded_at)
+    """)
+    conn.execute("ALTER TABLE booking_visitor_events ALTER COLUMN recorded_at SET NOT NULL")
+    conn.execute("CREATE TABLE booking_visitor_events_default PARTITION OF booking_visitor_events DEFAULT")
+    with conn.cursor() as cur:
+        create_visitor_event_partitions(cur, today, today + timedelta(days=EVENT_PARTITIONS_AHEAD_DAYS),
+                                        monthly=get_settings().visitor_events_retention_days <= 0)
+    conn.execute("INSERT INTO booking_visitor_events SELECT * FROM booking_visitor_events_unpartitioned")
+
+    if seq:
+        conn.execute(f"ALTER SEQUENCE {seq} OWNED BY NONE")
+    # CASCADE takes booking_funnel_sessions / tracked_link_conversion /
+    # booking_visitor_activity with it; upgrade() recreates them.
+    conn.execute("DROP TABLE booking_visitor_events_unpartitioned CASCADE")
+    if seq:
+        conn.execute(f"ALTER SEQUENCE {seq} OWNED BY booking_visitor_events.id")
+    # Same names as before, now that the old table's indexes are gone.
+    # The primary key has to include the partition key.
+    conn.execute("""
+        ALTER TABLE booking_visitor_events
+            ADD CONSTRAINT booking_visitor_events_pkey PRIMARY KEY (id, recorded_at);
+        CREATE INDEX idx_booking_visitor_events_session ON booking_visitor_events (session_id);
+        CREATE INDEX idx_booking_visitor_events_recorded ON booking_visitor_events (recorded_at);
+        CREATE INDEX idx_booking_visitor_events_link_token ON booking_visitor_events (link_token);
+        CREATE INDEX idx_bve_visitor_id ON booking_visitor_events (visitor_id);
+    """)
+
+
+def upgrade(conn) -> None:
+    from app.booking import db as booking_db
+
+    _partition_events(conn)
+
+    conn.execute(STATE_DDL)
+    conn.execute(f"""
+        INSERT INTO booking_visitor_session_state ({STATE_COLUMNS}, closed_at)
+        SELECT agg.*, (SELECT MAX(ended_at) FROM booking_visitor_sessions bvs
+                       WHERE bvs.session_id = agg.session_id)
+        FROM ({SESSION_AGGREGATE.format(source="booking_visitor_events")}) agg
+        ON CONFLICT (session_id) DO NOTHING
+    """)
+    conn.execute(TRIGGER_DDL)
+    conn.commit()
+
+    # Own connection, so only after the commit above releases the table.
+    booking_db.ensure_analytics_views()
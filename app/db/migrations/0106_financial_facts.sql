@@ -0,0 +1,111 @@
+-- Financial fact tables behind the P&L, cash-flow, inflows-by-method and
+-- forecast reports (app/booking/financial_facts.py keeps them current).
+--
+-- financial_booking_facts: one row per confirmed booking with everything the
+-- reports used to recompute per request from all_appointments — the P&L
+-- figures (zone incomes scaled to the discounted gross, variable costs,
+-- commission, net) and the forecast-table figures, which cap discounts
+-- without rounding them. src_updated_at is all_appointments.updated_at as of
+-- the computation; catalog_keys lists every extras_visibility /
+-- alojamientos entry the booking's extras lines look up, so a catalog edit
+-- recomputes only the bookings that reference it.
+--
+-- financial_payment_facts: one row per pago, or one "sin registro" row for a
+-- booking without pagos. cf_day is the day the cash-flow report books it
+-- under, pago_date the parsed date inflows-by-method filters on.
+--
+-- financial_daily_facts: per-day sums of financial_booking_facts.
+--
+-- The tables start empty; the first refresh (report request or the
+-- financial_facts job) builds them, since inputs_hash doesn't match yet.
+
+CREATE TABLE IF NOT EXISTS financial_booking_facts (
+    booking_id           INTEGER     PRIMARY KEY,
+    fecha                DATE        NOT NULL,
+    status               TEXT        NOT NULL DEFAULT '',
+    nombre_cliente       TEXT        NOT NULL DEFAULT '',
+    src_updated_at       TIMESTAMPTZ,
+    pagos                JSONB       NOT NULL DEFAULT '[]'::jsonb,
+    ingreso_total        DOUBLE PRECISION NOT NULL DEFAULT 0,
+    -- P&L
+    gross                BIGINT      NOT NULL DEFAULT 0,
+    disc_applied         BIGINT      NOT NULL DEFAULT 0,
+    commission           DOUBLE PRECISION NOT NULL DEFAULT 0,
+    commission_deduction BIGINT      NOT NULL DEFAULT 0,
+    net_income           BIGINT      NOT NULL DEFAULT 0,
+    pagos_received       BIGINT      NOT NULL DEFAULT 0,
+    ingreso_reserva      BIGINT      NOT NULL DEFAULT 0,
+    ingreso_aloj         BIGINT      NOT NULL DEFAULT 0,
+    ingreso_exp          BIGINT      NOT NULL DEFAULT 0,
+    ingreso_extra        BIGINT      NOT NULL DEFAULT 0,
+    cv_aloj              BIGINT      NOT NULL DEFAULT 0,
+    cv_exp               BIGINT      NOT NULL DEFAULT 0,
+    cv_extra             BIGINT      NOT NULL DEFAULT 0,
+    -- Forecast
+    descuentos_total     DOUBLE PRECISION NOT NULL DEFAULT 0,
+    fc_gross             DOUBLE PRECISION NOT NULL DEFAULT 0,
+    fc_net               DOUBLE PRECISION NOT NULL DEFAULT 0,
+    costo_total          DOUBLE PRECISION NOT NULL DEFAULT 0,
+    fc_ingreso_reserva   BIGINT      NOT NULL DEFAULT 0,
+    fc_ingreso_aloj      BIGINT      NOT NULL DEFAULT 0,
+    fc_ingreso_exp       BIGINT      NOT NULL DEFAULT 0,
+    fc_ingreso_extra     BIGINT      NOT NULL DEFAULT 0,
+    catalog_keys         TEXT[]      NOT NULL DEFAULT '{}',
+    computed_at          TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_fbf_fecha ON financial_booking_facts (fecha);
+CREATE INDEX IF NOT EXISTS idx_fbf_catalog_keys ON financial_booking_facts USING GIN (catalog_keys);
+
+CREATE TABLE IF NOT EXISTS financial_payment_facts (
+    booking_id      INTEGER     NOT NULL
+                    REFERENCES financial_booking_facts (booking_id) ON DELETE CASCADE,
+    seq             SMALLINT    NOT NULL,
+    cf_day          TEXT        NOT NULL,
+    pago_date       DATE,
+    method_original TEXT,
+    method          TEXT        NOT NULL,
+    is_fallback     BOOLEAN     NOT NULL DEFAULT FALSE,
+    amount          DOUBLE PRECISION NOT NULL DEFAULT 0,
+    amount_bruto    BIGINT      NOT NULL DEFAULT 0,
+    -- cash flow charges the method as written, inflows the normalized one
+    cf_commission   BIGINT      NOT NULL DEFAULT 0,
+    cf_neto         BIGINT      NOT NULL DEFAULT 0,
+    in_commission   BIGINT      NOT NULL DEFAULT 0,
+    in_neto         BIGINT      NOT NULL DEFAULT 0,
+    PRIMARY KEY (booking_id, seq)
+);
+
+CREATE INDEX IF NOT EXISTS idx_fpf_pago_date ON financial_payment_facts (pago_date);
+
+CREATE TABLE IF NOT EXISTS financial_daily_facts (
+    fecha                DATE        PRIMARY KEY,
+    n_reservas           INTEGER     NOT NULL DEFAULT 0,
+    gross                BIGINT      NOT NULL DEFAULT 0,
+    commission_deduction BIGINT      NOT NULL DEFAULT 0,
+    net_income           BIGINT      NOT NULL DEFAULT 0,
+    ingreso_reserva      BIGINT      NOT NULL DEFAULT 0,
+    ingreso_aloj         BIGINT      NOT NULL DEFAULT 0,
+    ingreso_exp          BIGINT      NOT NULL DEFAULT 0,
+    ingreso_extra        BIGINT      NOT NULL DEFAULT 0,
+    total_descuentos     BIGINT      NOT NULL DEFAULT 0,
+    cv_aloj              BIGINT      NOT NULL DEFAULT 0,
+    cv_exp               BIGINT      NOT NULL DEFAULT 0,
+    cv_extra             BIGINT      NOT NULL DEFAULT 0,
+    -- forecast table, weekly view: Σ int(net) and Σ int(costo_operativo_total)
+    fc_income            BIGINT      NOT NULL DEFAULT 0,
+    fc_costs             BIGINT      NOT NULL DEFAULT 0,
+    updated_at           TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- What the facts were computed with: the cost catalogs (flattened, see
+-- financial_facts.catalog_snapshot) and a hash of the experience whitelist,
+-- the commission table and the fact-code version.
+CREATE TABLE IF NOT EXISTS financial_facts_state (
+    id           BOOLEAN     PRIMARY KEY DEFAULT TRUE CHECK (id),
+    cost_catalog JSONB       NOT NULL DEFAULT '{}'::jsonb,
+    inputs_hash  TEXT        NOT NULL DEFAULT '',
+    updated_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO financial_facts_state (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
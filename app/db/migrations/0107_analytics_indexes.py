@@ -0,0 +1,69 @@
+"""
+Index pack for the admin analytics endpoints (app/booking/admin_analytics.py).
+
+all_appointments:
+  • idx_aa_fecha_cover — btree on fecha carrying every column the year
+    stats aggregate, so /api/admin/stats is an index-only range scan. It
+    replaces idx_aa_fecha (same key), which would only add write cost.
+  • idx_aa_telefono_cover — btree on telefono carrying what /clients
+    aggregates, so the per-phone grouping streams off the index in order
+    instead of sorting or hashing the table. Replaces idx_aa_telefono.
+  • idx_aa_{nombre,telefono,email}_trgm — pg_trgm GIN indexes for the
+    ILIKE '%term%' search of /reservas and /clients.
+  • idx_aa_active_fecha — partial btree on (fecha, hora) for bookings that
+    aren't cancelled or rejected. The per-day "who is booked" lookups
+    (availability, day sheet, slot fixes) all exclude at least those two
+    statuses, so their predicates imply this one and they skip the dead
+    rows.
+
+booking_visitor_session_state:
+  • idx_bvss_first_seen — the funnel's window is a range on first_seen_at.
+
+pg_trgm ships with the managed Postgres and migration 011 already uses it.
+Where the extension can't be created (a bare local server), the trigram
+indexes are skipped with a warning instead of failing the deploy; search
+still works, with a sequential scan.
+
+The table is a few tens of thousands of rows, so plain CREATE INDEX (brief
+write lock, inside the migration's transaction) is fine.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_aa_fecha_cover ON all_appointments (fecha)
+    INCLUDE (status, source, num_personas, ingreso_total, ingreso_extras, costo_operativo_total);
+DROP INDEX IF EXISTS idx_aa_fecha;
+
+CREATE INDEX IF NOT EXISTS idx_aa_telefono_cover ON all_appointments (telefono)
+    INCLUDE (fecha, ingreso_total, nombre_cliente, email);
+DROP INDEX IF EXISTS idx_aa_telefono;
+
+CREATE INDEX IF NOT EXISTS idx_aa_active_fecha ON all_appointments (fecha, hora)
+    WHERE status NOT IN ('cancelled', 'rejected');
+
+CREATE INDEX IF NOT EXISTS idx_bvss_first_seen
+    ON booking_visitor_session_state (first_seen_at);
+"""
+
+TRIGRAM_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_aa_nombre_trgm
+    ON all_appointments USING gin (nombre_cliente gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_aa_telefono_trgm
+    ON all_appointments USING gin (telefono gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_aa_email_trgm
+    ON all_appointments USING gin (email gin_trgm_ops);
+"""
+
+
+def upgrade(conn) -> None:
+    conn.execute(INDEXES)
+    try:
+        with conn.transaction():
+            conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            conn.execute(TRIGRAM_INDEXES)
+    except Exception as e:
+        logger.warning(f"pg_trgm unavailable, skipping trigram search indexes: {e}")
+    conn.execute("ANALYZE all_appointments")
+    conn.commit()
@@ -0,0 +1,28 @@
+-- Shared application log (app/log_pipeline.py).
+--
+-- A fixed-size ring: each replica's log listener takes seq from
+-- app_log_seq and upserts into slot = seq % ring size, so the table never
+-- grows past the ring size and needs no pruning job. /api/admin/logs reads
+-- it newest first over a time range, optionally by level, logger or
+-- replica, across every replica.
+--
+-- level is the logging module's number (10 DEBUG … 50 CRITICAL). extra
+-- holds the record's structured fields (logger.info(..., extra={...})) and
+-- sample_rate when the message was sampled.
+
+CREATE SEQUENCE IF NOT EXISTS app_log_seq;
+
+CREATE TABLE IF NOT EXISTS app_log (
+    slot     INTEGER     PRIMARY KEY,
+    seq      BIGINT      NOT NULL,
+    ts       TIMESTAMPTZ NOT NULL,
+    level    SMALLINT    NOT NULL,
+    logger   TEXT        NOT NULL,
+    replica  TEXT        NOT NULL,
+    message  TEXT        NOT NULL,
+    extra    JSONB
+);
+
+CREATE INDEX IF NOT EXISTS idx_app_log_ts ON app_log (ts);
+CREATE INDEX IF NOT EXISTS idx_app_log_level_ts ON app_log (level, ts);
+CREATE INDEX IF NOT EXISTS idx_app_log_logger_ts ON app_log (logger, ts);
@@ -0,0 +1,26 @@
+-- A/B variant tables, as a migration of their own.
+--
+-- statements.SQL["lead.upsert"] picks a new lead's bot_variant with a
+-- sub-select on bot_ab_variants, so without the table every
+-- get_or_create_lead() fails. The baseline creates it via
+-- bot_config_router._ensure_tables(), but databases baselined while that
+-- helper still swallowed its errors can be missing it. Same definitions,
+-- IF NOT EXISTS: a no-op where the tables are already there, and a failed
+-- migration (not a silently broken lead path) where they can't be created.
+
+CREATE TABLE IF NOT EXISTS bot_ab_variants (
+    id           SERIAL PRIMARY KEY,
+    variant_key  TEXT UNIQUE NOT NULL,
+    label        TEXT NOT NULL,
+    is_active    BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS bot_message_overrides (
+    id           SERIAL PRIMARY KEY,
+    variant_key  TEXT NOT NULL REFERENCES bot_ab_variants(variant_key) ON DELETE CASCADE,
+    message_key  TEXT NOT NULL,
+    content_es   TEXT NOT NULL,
+    updated_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    UNIQUE(variant_key, message_key)
+);
@@ -0,0 +1,12 @@
+-- Dead outbox rows no longer hold their dedup_key.
+--
+-- With the 0104 index a row parked as 'dead' kept its '<trigger>:<booking_ref>'
+-- key for the whole retention period, so every later enqueue of that email
+-- (the daily follow-up sweep, a payment-return retry) was a silent no-op
+-- and the email was never sent. Only pending, sending and sent rows claim
+-- the key now; enqueue_emails() uses the same predicate in ON CONFLICT.
+
+DROP INDEX IF EXISTS uq_email_outbox_dedup;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_email_outbox_dedup_live
+    ON email_outbox (dedup_key) WHERE dedup_key IS NOT NULL AND status <> 'dead';
@@ -0,0 +1,26 @@
+-- Periodic jobs run on the delayed-job engine.
+--
+-- Each declared job is now a row of the 'scheduler' queue in delayed_jobs
+-- (job_key = job name) that re-arms itself after every run, so claiming,
+-- leases and wake-ups are the engine's. scheduler_jobs keeps only the run
+-- history. Existing next runs are carried over so a deploy doesn't shift
+-- any job's schedule; a fresh database (baseline already without these
+-- columns) has nothing to copy.
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'scheduler_jobs' AND column_name = 'next_run_at'
+    ) THEN
+        INSERT INTO delayed_jobs (queue, job_key, payload, due_at)
+        SELECT 'scheduler', name, jsonb_build_object('schedule', schedule), next_run_at
+        FROM scheduler_jobs
+        ON CONFLICT (queue, job_key) DO NOTHING;
+    END IF;
+END $$;
+
+ALTER TABLE scheduler_jobs
+    DROP COLUMN IF EXISTS next_run_at,
+    DROP COLUMN IF EXISTS lease_owner,
+    DROP COLUMN IF EXISTS lease_until;
@@ -6,6 +6,7 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 from zoneinfo import ZoneInfo
 
+from app.db import statements
 from app.db.connection import get_connection
 
 # Chilean timezone
@@ -184,26 +185,8 @@ async def get_booked_slots(
             with conn.cursor() as cur:
                 from datetime import time as dt_time
 
-                if eff_exclude:
-                    placeholders = ",".join(["%s"] * len(eff_exclude))
-                    status_filter = f"AND (status IS NULL OR status NOT IN ({placeholders}))"
-                    params = (start_date.date(), end_date.date()) + tuple(eff_exclude)
-                else:
-                    status_filter = ""
-                    params = (start_date.date(), end_date.date())
-
-                cur.execute(
-                    f"""
-                    SELECT id, fecha, hora, servicio, nombre_cliente, status, source
-                    FROM all_appointments
-                    WHERE fecha >= %s::date
-                      AND fecha <= %s::date
-                      AND hora IS NOT NULL
-                      {status_filter}
-                    ORDER BY fecha, hora
-                    """,
-                    params,
-                )
+                statements.execute(cur, "availability.booked_slots",
+                                   (start_date.date(), end_date.date(), eff_exclude))
 
                 booked_slots = []
                 for row in cur.fetchall():
@@ -271,34 +254,19 @@ async def save_conversation(
             with conn.cursor() as cur:
                 # Check if message already exists (by message_id if available)
                 if message_id:
-                    cur.execute("""
-                        SELECT id FROM whatsapp_conversations
-                        WHERE message_id = %s
-                    """, (message_id,))
+                    statements.execute(cur, "conversation.find", (message_id,))
                     existing = cur.fetchone()
                     if existing:
                         logger.info(f"Conversation with message_id {message_id} already exists, skipping")
                         return existing[0]
 
-                cur.execute("""
-                    INSERT INTO whatsapp_conversations
-                    (phone_number, customer_name, message_text, response_text, message_type, message_id, direction, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
-                    RETURNING id
-                """, (phone_number, customer_name, message_text, response_text, message_type, message_id, direction))
+                statements.execute(cur, "conversation.insert", (
+                    phone_number, customer_name, message_text, response_text, message_type, message_id, direction))
                 new_id = cur.fetchone()[0]
 
                 # Trim old rows so history doesn't grow unbounded per customer
-                cur.execute("""
-                    DELETE FROM whatsapp_conversations
-                    WHERE phone_number = %s
-                      AND id NOT IN (
-                          SELECT id FROM whatsapp_conversations
-                          WHERE phone_number = %s
-                          ORDER BY created_at DESC
-                          LIMIT %s
-                      )
-                """, (phone_number, phone_number, MAX_CONVERSATION_ROWS_PER_PHONE))
+                statements.execute(cur, "conversation.trim",
+                                   (phone_number, phone_number, MAX_CONVERSATION_ROWS_PER_PHONE))
             conn.commit()
             logger.info(f"Conversation saved for {phone_number}")
             return new_id
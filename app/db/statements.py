@@ -0,0 +1,179 @@
+"""
+Named hot statements and streaming reads
+
+The queries every inbound WhatsApp message runs (dedup claim, lead upsert,
+bot state, cart, history, save_conversation, booked slots) live here under
+a name, and run through execute(), which asks psycopg to prepare them on
+the connection from the first call: Postgres parses and plans them once
+per connection instead of on every message. psycopg would otherwise only
+prepare a statement after its 5th run on a given connection, and with
+the pools recycling idle connections after 5 minutes a quiet replica
+rarely got there. The statement text must not vary between calls (no
+f-string-built placeholder lists), or each variant is a separate statement.
+
+execute() also records db_statement_duration_seconds{statement} for
+/metrics.
+
+DB_PREPARE_STATEMENTS=false turns server-side preparation off entirely
+(here and psycopg's automatic one, see connection.get_pool), for a
+transaction-mode PgBouncer in front of Postgres.
+
+stream() reads a large result through a server-side cursor, STREAM_ITERSIZE
+rows per round trip, so the client never holds the whole result at once —
+as long as the caller handles each row and lets it go (the sync loops).
+Collecting the rows into a list holds them all anyway; use fetchall() then.
+The rows come from an open transaction: don't commit on the connection
+until the iteration is done.
+"""
+from itertools import count
+from typing import Any, Dict, Iterator, Optional
+import time
+
+from app import metrics
+from app.config import get_settings
+
+settings = get_settings()
+
+STREAM_ITERSIZE = 2000
+
+SQL: Dict[str, str] = {
+    # app/whatsapp/webhook.py — _is_duplicate_incoming
+    "webhook.dedup_claim": """
+        INSERT INTO incoming_message_dedup (message_id, inbox_id) VALUES (%s, %s)
+        ON CONFLICT (message_id) DO UPDATE SET seen_at = incoming_message_dedup.seen_at
+        WHERE incoming_message_dedup.inbox_id = EXCLUDED.inbox_id
+    """,
+    # app/db/queries.py — save_conversation
+    "conversation.find": "SELECT id FROM whatsapp_conversations WHERE message_id = %s",
+    "conversation.insert": """
+        INSERT INTO whatsapp_conversations
+        (phone_number, customer_name, message_text, response_text, message_type, message_id, direction, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+        RETURNING id
+    """,
+    "conversation.trim": """
+        DELETE FROM whatsapp_conversations
+        WHERE phone_number = %s
+          AND id NOT IN (
+              SELECT id FROM whatsapp_conversations
+              WHERE phone_number = %s
+              ORDER BY created_at DESC
+              LIMIT %s
+          )
+    """,
+    # app/db/leads.py — get_conversation_history, with and without `before`
+    "conversation.history": """
+        SELECT id, message_text, response_text, message_type, direction, created_at
+        FROM whatsapp_conversations
+        WHERE phone_number = %s
+        ORDER BY created_at DESC
+        LIMIT %s
+    """,
+    "conversation.history_before": """
+        SELECT id, message_text, response_text, message_type, direction, created_at
+        FROM whatsapp_conversations
+        WHERE phone_number = %s AND created_at < %s
+        ORDER BY created_at DESC
+        LIMIT %s
+    """,
+    # app/bot/conversation.py — persisted conversation state
+    "bot_state.get": "SELECT state FROM bot_conversation_state WHERE phone_number = %s",
+    "bot_state.put": """
+        INSERT INTO bot_conversation_state (phone_number, state, updated_at)
+        VALUES (%s, %s, NOW())
+        ON CONFLICT (phone_number) DO UPDATE SET
+            state = EXCLUDED.state, updated_at = NOW()
+    """,
+    # app/db/leads.py — get_or_create_lead
+    "lead.upsert": """
+        INSERT INTO whatsapp_leads
+            (phone_number, customer_name, lead_status, last_interaction_at, created_at, updated_at, bot_variant)
+        VALUES (
+            %(phone)s, %(name)s, 'unknown', NOW(), NOW(), NOW(),
+            -- Brand-new leads get a random active A/B variant (if an experiment
+            -- is running) so it sticks for the whole conversation. The table
+            -- is guaranteed by migration 0109.
+            (SELECT variant_key FROM bot_ab_variants WHERE is_active = TRUE ORDER BY random() LIMIT 1)
+        )
+        ON CONFLICT (phone_number) DO UPDATE
+        SET last_interaction_at = NOW(),
+            updated_at = NOW(),
+            customer_name = COALESCE(NULLIF(EXCLUDED.customer_name, ''), whatsapp_leads.customer_name)
+        RETURNING
+            id, phone_number, customer_name, lead_status,
+            notes, tags, created_at, updated_at, last_interaction_at, bot_enabled,
+            unread_count, last_read_at, priority, ad_source,
+            ad_platform, ad_media_type, ad_creative_url, ad_ctwa_clid, ad_audience,
+            preferred_language, bot_variant
+    """,
+    # app/bot/cart.py — CartManager.get_cart / save_cart
+    "cart.get": """
+        SELECT cart_data, updated_at
+        FROM whatsapp_carts
+        WHERE phone_number = %s
+        ORDER BY updated_at DESC
+        LIMIT 1
+    """,
+    "cart.put": """
+        INSERT INTO whatsapp_carts (phone_number, customer_name, cart_data, updated_at)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (phone_number)
+        DO UPDATE SET
+            cart_data = EXCLUDED.cart_data,
+            customer_name = EXCLUDED.customer_name,
+            updated_at = EXCLUDED.updated_at
+    """,
+    # app/db/queries.py — get_booked_slots; excluded statuses as one array
+    # parameter so the text is the same whatever the list
+    "availability.booked_slots": """
+        SELECT id, fecha, hora, servicio, nombre_cliente, status, source
+        FROM all_appointments
+        WHERE fecha >= %s::date
+          AND fecha <= %s::date
+          AND hora IS NOT NULL
+          AND (status IS NULL OR status <> ALL(%s::text[]))
+        ORDER BY fecha, hora
+    """,
+    # app/main.py _do_auto_sync and POST /api/admin/sync (streamed)
+    "sync.reservas_con_extras": """
+        SELECT id, appointment_id, fecha, hora, nombre_cliente, email, telefono,
+               servicio, num_personas, num_adultos, num_ninos,
+               ingreso_reserva, ingreso_extras, ingreso_total,
+               costo_operativo_fijo, costo_operativo_variable, costo_operativo_total,
+               ciudad_origen, como_supieron, clima_del_dia, categoria_clientes,
+               tipo_clientes, tiene_cruce, status, extras_json, created_at
+        FROM reservas_con_extras
+        ORDER BY fecha
+    """,
+}
+
+_cursor_ids = count(1)
+
+
+def execute(cur, name: str, params: Any = None):
+    """Run the statement registered as `name` on `cur`, prepared."""
+    t0 = time.perf_counter()
+    try:
+        return cur.execute(SQL[name], params, prepare=settings.db_prepare_statements)
+    finally:
+        metrics.observe_statement(name, time.perf_counter() - t0)
+
+
+def stream(conn, query: str, params: Any = None, itersize: int = STREAM_ITERSIZE) -> Iterator[tuple]:
+    """Rows of `query` (a registered name, or SQL) through a server-side
+    cursor, fetched `itersize` at a time."""
+    name: Optional[str] = query if query in SQL else None
+    sql = SQL[name] if name else query
+    with conn.cursor(name=f"stream_{next(_cursor_ids)}") as cur:
+        t0 = time.perf_counter()
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(itersize)
+            elapsed = time.perf_counter() - t0
+            metrics.observe_query(elapsed)
+            if name:
+                metrics.observe_statement(name, elapsed)
+            if not rows:
+                return
+            yield from rows
+            t0 = time.perf_counter()
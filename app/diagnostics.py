@@ -0,0 +1,339 @@
+"""
+Event-loop diagnostics: a stall detector and an on-demand sampling profiler.
+
+Blocking detector — a lot of sync I/O still runs inside `async def`
+handlers (psycopg, the OpenAI client, Resend, ffmpeg via subprocess,
+Pillow). While one of them runs, the loop serves nothing else. When the
+detector is on, a heartbeat task wakes every threshold / 4 and a watchdog
+thread watches it. If the heartbeat is late by more than the threshold,
+the watchdog grabs the loop thread's stack as it is at that moment, i.e.
+the code that is blocking, and the heartbeat files the stall under its
+call site (the innermost frame in app/ code) once it runs again. Each
+stall is also logged as a warning, so app_log has them from every
+replica.
+
+The switch and threshold live in hotboat_settings ("loop_diagnostics"),
+so turning it on from the admin panel reaches every replica within
+about SETTINGS_POLL_S plus the settings cache TTL. Reports are per
+replica.
+
+Profiler — profile() samples thread stacks (the loop thread, or all of
+them) every few ms for a given time and returns collapsed stacks. Those
+can be rendered as folded text (flamegraph.pl / speedscope input) or as
+a standalone SVG flame graph (flamegraph_svg).
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+SETTING_KEY = "loop_diagnostics"
+DEFAULT_THRESHOLD_MS = 100
+MIN_THRESHOLD_MS = 20
+SETTINGS_POLL_S = 15
+MAX_SITES = 200
+STACK_DEPTH = 30
+LAG_WINDOW = 2_000          # heartbeats kept for the lag percentiles
+
+NOT_CAPTURED = "<not captured>"   # the stall ended before the watchdog looked
+OTHER_SITES = "<other>"
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_ROOT_DIR = os.path.dirname(_APP_DIR)
+_STDLIB_DIR = os.path.dirname(os.__file__)
+
+loop_stalls = metrics.Counter(
+    "event_loop_stalls_total", "Heartbeats late by more than the diagnostics threshold, by call site", ["site"])
+
+
+def _short(path: str) -> str:
+    for base in (_ROOT_DIR, _STDLIB_DIR):
+        if path.startswith(base + os.sep):
+            return path[len(base) + 1:]
+    i = path.find("site-packages" + os.sep)
+    return path[i + 14:] if i >= 0 else os.path.basename(path)
+
+
+def _stack(frame) -> List[Tuple[str, int, str]]:
+    """(file, line, function) from the outermost frame to `frame`."""
+    out = []
+    while frame is not None:
+        out.append((frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+        frame = frame.f_back
+    out.reverse()
+    return out
+
+
+def _call_site(stack: List[Tuple[str, int, str]]) -> str:
+    for path, line, func in reversed(stack):
+        if path.startswith(_APP_DIR + os.sep) and path != __file__:
+            return f"{_short(path)}:{line} {func}"
+    if stack:
+        path, line, func = stack[-1]
+        return f"{_short(path)}:{line} {func}"
+    return NOT_CAPTURED
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class BlockingDetector:
+    """Heartbeat task plus watchdog thread; see the module docstring."""
+
+    def __init__(self):
+        self.enabled = False
+        self.threshold_ms = DEFAULT_THRESHOLD_MS
+        self._lock = threading.Lock()
+        self._sites: Dict[str, Dict[str, Any]] = {}
+        self._lags: deque = deque(maxlen=LAG_WINDOW)
+        self._since = datetime.now(timezone.utc)
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._interval = DEFAULT_THRESHOLD_MS / 4000
+        self._beat = 0
+        self._beat_at = time.monotonic()
+        self._pending: Optional[Tuple[int, List[Tuple[str, int, str]], str]] = None
+
+    # ── Switching ────────────────────────────────────────────────────────────
+
+    def configure(self, enabled: bool, threshold_ms: int = DEFAULT_THRESHOLD_MS) -> None:
+        """Turn the detector on or off in this process. Call on the loop."""
+        threshold_ms = max(MIN_THRESHOLD_MS, int(threshold_ms))
+        if enabled and self.enabled and threshold_ms == self.threshold_ms:
+            return
+        self._halt()
+        self.enabled, self.threshold_ms = enabled, threshold_ms
+        if enabled:
+            self._interval = threshold_ms / 4000
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+            self._beat_at = time.monotonic()
+            self._stop = threading.Event()
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+            self._watchdog = threading.Thread(target=self._watch, args=(self._stop,),
+                                              name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+            logger.info("loop diagnostics on (threshold %d ms)", threshold_ms)
+
+    def _halt(self) -> None:
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        self._stop.set()
+        self._watchdog = None
+        if self.enabled:
+            logger.info("loop diagnostics off")
+        self.enabled = False
+
+    async def run(self) -> None:
+        """Follow the shared setting (every replica runs this)."""
+        from app.booking.operator_settings import get_setting
+        try:
+            while True:
+                try:
+                    raw = await asyncio.to_thread(get_setting, SETTING_KEY, "")
+                    conf = json.loads(raw) if raw else {}
+                    self.configure(bool(conf.get("enabled")), conf.get("threshold_ms") or DEFAULT_THRESHOLD_MS)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"loop diagnostics setting unreadable: {e}")
+                await asyncio.sleep(SETTINGS_POLL_S)
+        finally:
+            self._halt()
+
+    # ── Detection ────────────────────────────────────────────────────────────
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._beat_at = time.monotonic()
+            self._beat += 1
+            await asyncio.sleep(self._interval)
+            lag = max(0.0, time.monotonic() - self._beat_at - self._interval)
+            self._lags.append(lag)
+            if lag * 1000 >= self.threshold_ms:
+                self._record(lag)
+
+    def _watch(self, stop: threading.Event) -> None:
+        captured = 0
+        while not stop.wait(self._interval):
+            beat, beat_at = self._beat, self._beat_at
+            late = time.monotonic() - beat_at - self._interval
+            if late * 1000 < self.threshold_ms or beat == captured:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = _stack(frame)
+            del frame
+            task = asyncio.current_task(self._loop) if self._loop else None
+            self._pending = (beat, stack, task.get_name() if task else "")
+            captured = beat
+
+    def _record(self, lag: float) -> None:
+        pending, self._pending = self._pending, None
+        if pending and pending[0] == self._beat:
+            _, stack, task = pending
+            site = _call_site(stack)
+        else:
+            stack, task, site = [], "", NOT_CAPTURED
+        ms = lag * 1000
+        with self._lock:
+            if site not in self._sites and len(self._sites) >= MAX_SITES:
+                site = OTHER_SITES
+            s = self._sites.setdefault(site, {"site": site, "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            s["count"] += 1
+            s["total_ms"] += ms
+            s["max_ms"] = max(s["max_ms"], ms)
+            s["last_ms"] = ms
+            s["last_at"] = datetime.now(timezone.utc)
+            if stack:
+                s["task"] = task
+                s["stack"] = [f"{_short(p)}:{line} {func}" for p, line, func in stack[-STACK_DEPTH:]]
+        loop_stalls.inc(site)
+        logger.warning("event loop blocked %.0f ms at %s", ms, site,
+                       extra={"blocked_ms": round(ms, 1), "site": site, "task": task})
+
+    # ── Reporting ────────────────────────────────────────────────────────────
+
+    def report(self) -> Dict[str, Any]:
+        lags = [l * 1000 for l in self._lags]
+        with self._lock:
+            sites = sorted((dict(s) for s in self._sites.values()), key=lambda s: -s["total_ms"])
+        for s in sites:
+            s["total_ms"], s["max_ms"], s["last_ms"] = round(s["total_ms"], 1), round(s["max_ms"], 1), round(s["last_ms"], 1)
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold_ms,
+            "since": self._since,
+            "stalls": sum(s["count"] for s in sites),
+            "blocked_ms": round(sum(s["total_ms"] for s in sites), 1),
+            "lag_ms": {"p50": round(_percentile(lags, 0.5), 2), "p99": round(_percentile(lags, 0.99), 2),
+                       "max": round(max(lags, default=0.0), 2), "samples": len(lags)},
+            "sites": sites,
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._sites.clear()
+        self._lags.clear()
+        self._since = datetime.now(timezone.utc)
+
+
+detector = BlockingDetector()
+
+
+# ── Sampling profiler ────────────────────────────────────────────────────────
+
+_profile_lock = threading.Lock()
+
+
+def profile(seconds: float, interval: float = 0.01, thread_id: Optional[int] = None) -> Counter:
+    """Sample stacks every `interval` for `seconds`: the thread `thread_id`
+    only, or every thread but this one. Returns a Counter of stacks, each a
+    tuple of "file:function" from the outermost frame (with the thread
+    name first when sampling them all). Blocks for the duration; raises
+    RuntimeError if a profile is already running in this process."""
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("a profile is already running")
+    try:
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        samples: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for tid, frame in sys._current_frames().items():
+                if tid == me or (thread_id is not None and tid != thread_id):
+                    continue
+                stack = tuple(f"{_short(p)}:{func}" for p, _, func in _stack(frame))
+                if thread_id is None:
+                    stack = (f"thread:{names.get(tid, tid)}",) + stack
+                samples[stack] += 1
+            time.sleep(interval)
+        return samples
+    finally:
+        _profile_lock.release()
+
+
+def folded(samples: Counter) -> str:
+    """Collapsed-stack text: "frame;frame;frame count" per line."""
+    return "".join(f"{';'.join(stack)} {n}\n" for stack, n in sorted(samples.items()))
+
+
+def _tree(samples: Counter) -> Dict[str, Any]:
+    root: Dict[str, Any] = {"name": "all", "value": 0, "children": {}}
+    for stack, n in samples.items():
+        node = root
+        node["value"] += n
+        for name in stack:
+            node = node["children"].setdefault(name, {"name": name, "value": 0, "children": {}})
+            node["value"] += n
+    return root
+
+
+def _escape_xml(s: str) -> str:
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+def flamegraph_svg(samples: Counter, title: str = "", width: int = 1200, row: int = 17) -> str:
+    """A standalone SVG flame graph (root at the bottom, one box per frame,
+    width proportional to samples; hover for counts)."""
+    root = _tree(samples)
+    total = root["value"] or 1
+    boxes: List[Tuple[int, float, float, str, int]] = []   # depth, x, w, name, samples
+
+    def walk(node, depth, x):
+        w = node["value"] / total * width
+        if w < 0.3:
+            return
+        boxes.append((depth, x, w, node["name"], node["value"]))
+        for child in sorted(node["children"].values(), key=lambda c: c["name"]):
+            walk(child, depth + 1, x)
+            x += child["value"] / total * width
+
+    walk(root, 0, 0.0)
+    depth = max((b[0] for b in boxes), default=0) + 1
+    top = 28
+    height = top + depth * row + 4
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="monospace" font-size="11">',
+        f'<rect width="{width}" height="{height}" fill="#fdfdf6"/>',
+        f'<text x="{width / 2}" y="18" text-anchor="middle" font-size="14">'
+        f'{_escape_xml(title or "Flame graph")} — {root["value"]} samples</text>',
+    ]
+    for d, x, w, name, n in boxes:
+        y = height - 4 - (d + 1) * row
+        h = zlib.crc32(name.encode())
+        fill = f"rgb({205 + h % 50},{(h >> 8) % 200},{(h >> 16) % 55})"
+        if w >= 7 * len(name) + 6:
+            label = name
+        else:
+            label = name[: int(w / 7) - 2] + ".." if w > 30 else ""
+        pct = n / total * 100
+        out.append(
+            f'<g><title>{_escape_xml(name)} ({n} samples, {pct:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="{fill}" rx="2"/>'
+            + (f'<text x="{x + 3:.1f}" y="{y + row - 5}">{_escape_xml(label)}</text>' if label else "")
+            + "</g>"
+        )
+    out.append("</svg>")
+    return "\n".join(out)
@@ -0,0 +1,411 @@
+"""
+Outbound email queue (Postgres outbox)
+
+Every send used to be a blocking Resend SDK call made inline by whatever
+triggered it — the payment return, an admin save, the bot's notification
+path — so a slow provider held those responses up and a failed call simply
+lost the email. Now callers only enqueue_email() (one INSERT) and the outbox
+worker delivers:
+
+  • claims due rows with FOR UPDATE SKIP LOCKED plus a lease, so the worker
+    can run on every replica and a crashed delivery is picked up again;
+  • at most settings.email_outbox_concurrency requests in flight per
+    replica (Resend rate-limits per account);
+  • 5xx / 429 / network errors retry with exponential backoff and jitter;
+    other 4xx and rows past max_attempts are parked as 'dead';
+  • each row is sent with Idempotency-Key outbox-<id>, so a retry after a
+    timeout that actually reached Resend doesn't send twice. This is why
+    the worker doesn't use Resend's batch endpoint (and why the old
+    send_booking_html_batch helper is gone): a batch has one idempotency
+    key and is accepted or rejected as a whole, while rows retry and die
+    one by one, so the batch a retried row lands in is never the same
+    twice. Bulk sweeps still cost one INSERT; delivery is per row;
+  • dedup_key ('<trigger>:<booking_ref>') makes a repeat enqueue a no-op
+    while an earlier copy is pending, sending or sent; a 'dead' one doesn't
+    count, so the email can be queued again.
+
+Post-delivery bookkeeping (confirmation_email_sent_at & co.) runs as a
+named after_send hook once Resend has accepted the email. Delivery status
+per trigger is in the email_delivery_status view (migration 0104), served
+by /api/admin/email-outbox.
+"""
+import asyncio
+import importlib
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "email_outbox"
+# The worker also wakes on its own this often, for rows whose backoff
+# expired and for a missed NOTIFY.
+OUTBOX_POLL_S = 15
+OUTBOX_BATCH_SIZE = 20
+# A claimed row not finished within the lease is assumed to belong to a
+# dead worker. Covers a full batch queued behind the concurrency limit.
+OUTBOX_LEASE_S = 120
+OUTBOX_HTTP_TIMEOUT_S = 15
+OUTBOX_MAX_ATTEMPTS = 6
+# 30 s, 1 min, 2 min, 4 min, 8 min between attempts (capped at 1 h).
+OUTBOX_BACKOFF_BASE_S = 30
+OUTBOX_BACKOFF_MAX_S = 3600
+OUTBOX_RETENTION_DAYS = 30
+OUTBOX_PURGE_EVERY_S = 3600
+LISTEN_RETRY_S = 5
+
+# after_send hook name → "module:function". Resolved when the hook runs, so
+# the worker doesn't depend on which routers this replica happened to import.
+AFTER_SEND_HOOKS = {
+    "confirmation_sent": "app.booking.db:mark_confirmation_email_sent",
+    "followup_sent": "app.booking.db:mark_followup_email_sent",
+    "manual_followup_sent": "app.booking.db:mark_followup_sent_after_manual_send",
+}
+
+
+def dedup_key(trigger: str, booking_ref: Optional[str]) -> Optional[str]:
+    return f"{trigger}:{booking_ref}" if booking_ref else None
+
+
+def enqueue_emails(messages: List[dict]) -> List[Optional[int]]:
+    """
+    Queue several emails in one round-trip. Each message is a dict with
+    trigger, to, subject, html, from_address and optionally bcc, reply_to,
+    booking_ref, dedup_key and after_send ({"hook": name, "arg": value}).
+
+    Returns the outbox id per message, in order; None where dedup_key is
+    already queued or sent. Raises if the database is unreachable.
+    """
+    if not messages:
+        return []
+    from psycopg.types.json import Jsonb
+    from app.db.connection import get_connection
+    from app.email.resend_booking import _payload
+    for m in messages:
+        hook = (m.get("after_send") or {}).get("hook")
+        if hook and hook not in AFTER_SEND_HOOKS:
+            raise ValueError(f"unknown after_send hook: {hook}")
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO email_outbox (trigger, booking_ref, dedup_key, payload, after_send, max_attempts)
+                SELECT t.trigger, t.booking_ref, t.dedup_key, t.payload, t.after_send, %s
+                FROM unnest(%s::text[], %s::text[], %s::text[], %s::jsonb[], %s::jsonb[])
+                     WITH ORDINALITY AS t(trigger, booking_ref, dedup_key, payload, after_send, ord)
+                ORDER BY t.ord
+                ON CONFLICT (dedup_key) WHERE dedup_key IS NOT NULL AND status <> 'dead' DO NOTHING
+                RETURNING id, dedup_key
+                """,
+                (
+                    OUTBOX_MAX_ATTEMPTS,
+                    [m["trigger"] for m in messages],
+                    [m.get("booking_ref") or None for m in messages],
+                    [m.get("dedup_key") for m in messages],
+                    [Jsonb(_payload(m["to"], m["subject"], m["html"], m["from_address"],
+                                    m.get("bcc"), m.get("reply_to"))) for m in messages],
+                    [Jsonb(m["after_send"]) if m.get("after_send") else None for m in messages],
+                ),
+            )
+            inserted = cur.fetchall()
+            if inserted:
+                cur.execute("SELECT pg_notify(%s, '')", (NOTIFY_CHANNEL,))
+        conn.commit()
+    # RETURNING order isn't guaranteed; map back by dedup_key where there is
+    # one and by position for the rest (ids are allocated in insert order).
+    by_key = {k: i for i, k in inserted if k is not None}
+    keyless = iter(sorted(i for i, k in inserted if k is None))
+    seen: set = set()
+    out: List[Optional[int]] = []
+    for m in messages:
+        key = m.get("dedup_key")
+        if key is None:
+            out.append(next(keyless, None))
+        elif key in by_key and key not in seen:
+            seen.add(key)
+            out.append(by_key[key])
+        else:
+            out.append(None)
+    return out
+
+
+def enqueue_email(trigger: str, to: Union[str, List[str]], subject: str, html: str,
+                  from_address: str, bcc: Optional[List[str]] = None,
+                  reply_to: Optional[str] = None, booking_ref: Optional[str] = None,
+                  dedup_key: Optional[str] = None,
+                  after_send: Optional[Dict[str, Any]] = None) -> Optional[int]:
+    """Queue one email; returns its outbox id, or None if ``dedup_key`` was
+    already queued (or sent)."""
+    return enqueue_emails([{
+        "trigger": trigger, "to": to, "subject": subject, "html": html,
+        "from_address": from_address, "bcc": bcc, "reply_to": reply_to,
+        "booking_ref": booking_ref, "dedup_key": dedup_key, "after_send": after_send,
+    }])[0]
+
+
+def queued_result(outbox_id: Optional[int]) -> Dict[str, Any]:
+    """The {sent, reason} shape the email helpers return, for a queued send."""
+    if outbox_id is None:
+        return {"sent": False, "reason": "duplicate"}
+    return {"sent": True, "queued": True, "reason": "queued", "outbox_id": outbox_id}
+
+
+# ── Worker ────────────────────────────────────────────────────────────────────
+
+def _claim_due(limit: int = OUTBOX_BATCH_SIZE, triggers: Optional[List[str]] = None) -> List[tuple]:
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE email_outbox
+                SET status = 'sending', attempts = attempts + 1, updated_at = NOW(),
+                    locked_until = NOW() + make_interval(secs => %s)
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE ((status = 'pending' AND next_attempt_at <= NOW())
+                           OR (status = 'sending' AND locked_until < NOW()))
+                      AND (%s::text[] IS NULL OR trigger = ANY(%s::text[]))
+                    ORDER BY next_attempt_at, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT %s
+                )
+                RETURNING id, trigger, payload, after_send, attempts, max_attempts
+                """,
+                (OUTBOX_LEASE_S, triggers, triggers, limit),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    return sorted(rows, key=lambda r: r[0])
+
+
+def _mark_sent(outbox_id: int, provider_id: Optional[str]) -> None:
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE email_outbox SET status='sent', sent_at=NOW(), updated_at=NOW(), "
+                "locked_until=NULL, provider_id=%s, last_error=NULL WHERE id=%s",
+                (provider_id, outbox_id),
+            )
+        conn.commit()
+
+
+def _mark_failed(outbox_id: int, error: str, retry_in: Optional[float]) -> None:
+    """Schedule another attempt in ``retry_in`` seconds, or park the row as
+    'dead' when retry_in is None."""
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            if retry_in is None:
+                cur.execute(
+                    "UPDATE email_outbox SET status='dead', updated_at=NOW(), locked_until=NULL, "
+                    "last_error=%s WHERE id=%s",
+                    (error[:1000], outbox_id),
+                )
+            else:
+                cur.execute(
+                    "UPDATE email_outbox SET status='pending', updated_at=NOW(), locked_until=NULL, "
+                    "last_error=%s, next_attempt_at=NOW() + make_interval(secs => %s) WHERE id=%s",
+                    (error[:1000], retry_in, outbox_id),
+                )
+        conn.commit()
+
+
+def _backoff_s(attempts: int, retry_after: Optional[float] = None) -> float:
+    delay = min(OUTBOX_BACKOFF_BASE_S * 2 ** max(attempts - 1, 0), OUTBOX_BACKOFF_MAX_S)
+    delay *= random.uniform(0.8, 1.2)
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _run_after_send(outbox_id: int, after_send: Optional[dict]) -> None:
+    hook = (after_send or {}).get("hook")
+    if not hook:
+        return
+    try:
+        module, _, name = AFTER_SEND_HOOKS[hook].partition(":")
+        getattr(importlib.import_module(module), name)(after_send.get("arg"))
+    except Exception as e:
+        # The email went out; only the bookkeeping flag is missing.
+        logger.warning(f"email_outbox {outbox_id}: after_send hook {hook} failed: {e}")
+
+
+async def _deliver(client, sem: asyncio.Semaphore, row: tuple) -> None:
+    from app.config import get_settings
+    outbox_id, trigger, payload, after_send, attempts, max_attempts = row
+    settings = get_settings()
+    api_key = (getattr(settings, "resend_api_key", "") or "").strip()
+    url = (getattr(settings, "resend_api_url", "") or "https://api.resend.com").rstrip("/") + "/emails"
+
+    error, retryable, retry_after, provider_id = "", True, None, None
+    if not api_key:
+        error = "RESEND_API_KEY is not configured"
+    else:
+        async with sem:
+            try:
+                resp = await client.post(
+                    url, json=payload,
+                    headers={"Authorization": f"Bearer {api_key}",
+                             "Idempotency-Key": f"outbox-{outbox_id}"},
+                )
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if resp.status_code < 300:
+                    try:
+                        provider_id = (resp.json() or {}).get("id")
+                    except Exception:
+                        provider_id = None
+                else:
+                    error = f"HTTP {resp.status_code}: {resp.text[:500]}"
+                    retryable = resp.status_code >= 500 or resp.status_code in (408, 409, 429)
+                    try:
+                        retry_after = float(resp.headers.get("retry-after") or 0) or None
+                    except ValueError:
+                        retry_after = None
+
+    if not error:
+        await asyncio.to_thread(_mark_sent, outbox_id, provider_id)
+        logger.info("📧 email_outbox %s sent trigger=%s to=%s id=%s",
+                    outbox_id, trigger, payload.get("to"), provider_id)
+        await asyncio.to_thread(_run_after_send, outbox_id, after_send)
+        return
+
+    if retryable and attempts < max_attempts:
+        delay = _backoff_s(attempts, retry_after)
+        logger.warning("email_outbox %s trigger=%s attempt %s/%s failed, retry in %.0fs: %s",
+                       outbox_id, trigger, attempts, max_attempts, delay, error)
+        await asyncio.to_thread(_mark_failed, outbox_id, error, delay)
+    else:
+        logger.error("email_outbox %s trigger=%s to=%s dead after %s attempt(s): %s",
+                     outbox_id, trigger, payload.get("to"), attempts, error)
+        await asyncio.to_thread(_mark_failed, outbox_id, error, None)
+
+
+async def deliver_due(client=None, concurrency: Optional[int] = None,
+                      triggers: Optional[List[str]] = None) -> int:
+    """Deliver every row that is due right now (only ``triggers``, if
+    given); returns how many were attempted. Used by the worker loop and
+    directly by tests, which restrict it to their own trigger."""
+    import httpx
+    from app.config import get_settings
+    limit = concurrency or max(int(getattr(get_settings(), "email_outbox_concurrency", 4) or 4), 1)
+    sem = asyncio.Semaphore(limit)
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(timeout=OUTBOX_HTTP_TIMEOUT_S)
+    total = 0
+    try:
+        while True:
+            rows = await asyncio.to_thread(_claim_due, OUTBOX_BATCH_SIZE, triggers)
+            if not rows:
+                return total
+            total += len(rows)
+            await asyncio.gather(*(_deliver(client, sem, r) for r in rows))
+    finally:
+        if own_client:
+            await client.aclose()
+
+
+def _purge_sent() -> int:
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM email_outbox WHERE status IN ('sent', 'dead') "
+                "AND updated_at < NOW() - make_interval(days => %s)",
+                (OUTBOX_RETENTION_DAYS,),
+            )
+            deleted = cur.rowcount
+        conn.commit()
+    return deleted
+
+
+async def run_outbox_worker() -> None:
+    """Delivery loop, on every replica that runs workers. Wakes on the
+    email_outbox NOTIFY sent by enqueue_emails() and at least every
+    OUTBOX_POLL_S for retries whose backoff has expired."""
+    import httpx
+    from app.db.connection import connect_dedicated, use_pool
+    use_pool("batch")
+    last_purge = 0.0
+    async with httpx.AsyncClient(timeout=OUTBOX_HTTP_TIMEOUT_S) as client:
+        while True:
+            try:
+                async with connect_dedicated("listen:outbox", autocommit=True) as aconn:
+                    await aconn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    while True:
+                        try:
+                            await deliver_due(client)
+                        except Exception as e:
+                            logger.warning(f"email outbox delivery error: {e}")
+                        if time.monotonic() - last_purge > OUTBOX_PURGE_EVERY_S:
+                            last_purge = time.monotonic()
+                            deleted = await asyncio.to_thread(_purge_sent)
+                            if deleted:
+                                logger.info(f"🧹 email_outbox: purged {deleted} old row(s)")
+                        async for _ in aconn.notifies(timeout=OUTBOX_POLL_S, stop_after=1):
+                            pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"email outbox LISTEN error: {e}")
+            await asyncio.sleep(LISTEN_RETRY_S)
+
+
+# ── Admin queries ─────────────────────────────────────────────────────────────
+
+def delivery_status() -> List[dict]:
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM email_delivery_status ORDER BY trigger")
+            cols = [d[0] for d in cur.description]
+            return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def recent(trigger: Optional[str] = None, status: Optional[str] = None,
+           booking_ref: Optional[str] = None, limit: int = 50) -> List[dict]:
+    from app.db.connection import get_connection
+    where, params = [], []
+    for col, val in (("trigger", trigger), ("status", status), ("booking_ref", booking_ref)):
+        if val:
+            where.append(f"{col} = %s")
+            params.append(val)
+    sql = (
+        "SELECT id, trigger, booking_ref, payload->'to' AS to_addr, payload->>'subject' AS subject, "
+        "status, attempts, max_attempts, next_attempt_at, last_error, provider_id, "
+        "created_at, sent_at FROM email_outbox"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + " ORDER BY id DESC LIMIT %s"
+    )
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, (*params, max(1, min(int(limit), 500))))
+            cols = [d[0] for d in cur.description]
+            return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def retry(outbox_id: int) -> bool:
+    """Put a dead (or pending) row back at the front of the queue. False if
+    the row is gone, or if its email was queued again since it died (the
+    live copy holds the dedup_key)."""
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE email_outbox SET status='pending', next_attempt_at=NOW(), updated_at=NOW(), "
+                "max_attempts=GREATEST(max_attempts, attempts + 1) "
+                "WHERE id=%s AND status IN ('dead', 'pending') "
+                "AND NOT EXISTS (SELECT 1 FROM email_outbox o WHERE o.dedup_key = email_outbox.dedup_key "
+                "AND o.status <> 'dead' AND o.id <> email_outbox.id)",
+                (outbox_id,),
+            )
+            ok = cur.rowcount > 0
+            if ok:
+                cur.execute("SELECT pg_notify(%s, '')", (NOTIFY_CHANNEL,))
+        conn.commit()
+    return ok
@@ -1,10 +1,28 @@
-"""Send transactional HTML email via Resend (booking confirmations)."""
+"""Send transactional HTML email via Resend (booking confirmations).
+
+App code queues email through app.email.outbox instead; the synchronous
+send_booking_html() is kept for scripts and one-off admin tooling."""
 import logging
-from typing import List, Optional
+from typing import List, Optional, Union
 
 logger = logging.getLogger(__name__)
 
 
+def _payload(to: Union[str, List[str]], subject: str, html: str, from_address: str,
+             bcc: Optional[List[str]] = None, reply_to: Optional[str] = None) -> dict:
+    payload = {
+        "from": from_address,
+        "to": [to] if isinstance(to, str) else list(to),
+        "subject": subject,
+        "html": html,
+    }
+    if bcc:
+        payload["bcc"] = bcc
+    if reply_to:
+        payload["reply_to"] = [reply_to]
+    return payload
+
+
 def send_booking_html(
     to: str,
     subject: str,
@@ -24,16 +42,6 @@ def send_booking_html(
         raise ValueError("RESEND_API_KEY is not configured")
 
     resend.api_key = api_key
-    payload = {
-        "from": from_address,
-        "to": [to],
-        "subject": subject,
-        "html": html,
-    }
-    if bcc:
-        payload["bcc"] = bcc
-    if reply_to:
-        payload["reply_to"] = [reply_to]
-    result = resend.Emails.send(payload)
+    result = resend.Emails.send(_payload(to, subject, html, from_address, bcc, reply_to))
     logger.info("Resend booking email sent to %s id=%s", to, result.get("id", "?"))
     return result
@@ -0,0 +1,320 @@
+"""
+Structured log pipeline: non-blocking emission, sampling and a shared,
+queryable log table.
+
+install() leaves one handler on the root logger, a QueueHandler onto a
+bounded queue, so a logging call on a request path costs a queue put.
+A QueueListener thread does the rest, through:
+
+  • the handlers that were on the root logger before (basicConfig's
+    console output, which Railway collects);
+  • RingTableHandler — batched upserts into app_log (migration 0108), a
+    fixed-size ring shared by every replica and indexed by time, level
+    and logger. query_logs() reads it for /api/admin/logs;
+  • recent — the last 500 records of this process, what /api/admin/logs
+    falls back to when the database can't be reached.
+
+%-style arguments are formatted in the listener thread when they are
+plain values (str, numbers, None...). Anything else could change before
+the listener gets to it, so it is formatted on the spot. Use
+logger.info("... %s", value), not an f-string, on hot paths.
+
+Sampling: below WARNING, a call site that fires more than SAMPLE_BURST
+times within SAMPLE_WINDOW seconds is kept 1 in SAMPLE_EVERY for the rest
+of the window. Kept records carry sample_rate (in app_log.extra). Warnings
+and errors are never sampled.
+
+If the queue is full (the listener stuck behind a slow database) records
+are dropped rather than blocking the caller, and a warning says how many.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from logging.handlers import BufferingHandler, QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional
+
+REPLICA = os.getenv("RAILWAY_REPLICA_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+QUEUE_SIZE = 10_000
+FLUSH_ROWS = 500            # a batch is written once it has this many records...
+FLUSH_INTERVAL = 1.0        # ...or this many seconds after the last write
+RETRY_AFTER = 30.0          # no table writes for this long after a failed one
+MAX_MESSAGE_CHARS = 8_000
+
+SAMPLE_WINDOW = 10.0
+SAMPLE_BURST = 50
+SAMPLE_EVERY = 20
+
+recent: deque = deque(maxlen=500)
+
+_PLAIN = (str, int, float, bool, type(None))
+# Attributes every LogRecord has; anything else came in through extra=.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "taskName", "color_message",   # the last one is uvicorn's
+}
+
+
+def _ts(record: logging.LogRecord) -> datetime:
+    return datetime.fromtimestamp(record.created, timezone.utc)
+
+
+def _message(record: logging.LogRecord) -> str:
+    # The console formatter (first in the listener) has usually set .message.
+    msg = record.__dict__.get("message") or record.getMessage()
+    if record.exc_text:
+        msg = f"{msg}\n{record.exc_text}"
+    return msg
+
+
+def _extra(record: logging.LogRecord) -> Optional[Dict[str, Any]]:
+    extra = {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS}
+    return extra or None
+
+
+class SamplingFilter(logging.Filter):
+    """Thins out call sites that log below WARNING in bursts (see module doc)."""
+
+    def __init__(self, burst: int = SAMPLE_BURST, every: int = SAMPLE_EVERY, window: float = SAMPLE_WINDOW):
+        super().__init__()
+        self.burst, self.every, self.window = burst, every, window
+        self._counts: Dict[tuple, int] = {}
+        self._window_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._window_start >= self.window:
+                self._counts.clear()
+                self._window_start = now
+            n = self._counts[key] = self._counts.get(key, 0) + 1
+        if n <= self.burst:
+            return True
+        if (n - self.burst) % self.every:
+            return False
+        record.sample_rate = self.every
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    """Never blocks: a full queue drops the record and counts it."""
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+        self._formatter = logging.Formatter()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Tracebacks are rendered here, while the frames are current; the
+        # message is left for the listener when its args can't change.
+        if record.exc_info:
+            record.exc_text = record.exc_text or self._formatter.formatException(record.exc_info)
+            record.exc_info = None
+        # A dict in args may be a %(name)s mapping or a lone "%s" argument;
+        # either way it is mutable, so it is formatted now.
+        args = record.args or ()
+        if isinstance(args, dict) or not all(isinstance(v, _PLAIN) for v in args) \
+                or not isinstance(record.msg, str):
+            record.msg, record.args = record.getMessage(), None
+        return record
+
+
+class _RecentHandler(logging.Handler):
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            recent.append({
+                "ts": _ts(record).isoformat(timespec="seconds"),
+                "level": record.levelname,
+                "logger": record.name,
+                "replica": REPLICA,
+                "message": _message(record)[:MAX_MESSAGE_CHARS],
+            })
+        except Exception:
+            self.handleError(record)
+
+
+_INSERT = """
+    INSERT INTO app_log (slot, seq, ts, level, logger, replica, message, extra)
+    SELECT seq %% %(size)s, seq, ts, level, logger, %(replica)s, message, extra::jsonb
+    FROM (
+        SELECT nextval('app_log_seq') AS seq, u.*
+        FROM unnest(%(ts)s::timestamptz[], %(level)s::smallint[], %(logger)s::text[],
+                    %(message)s::text[], %(extra)s::text[]) AS u(ts, level, logger, message, extra)
+    ) r
+    ON CONFLICT (slot) DO UPDATE SET
+        seq = EXCLUDED.seq, ts = EXCLUDED.ts, level = EXCLUDED.level, logger = EXCLUDED.logger,
+        replica = EXCLUDED.replica, message = EXCLUDED.message, extra = EXCLUDED.extra
+"""
+
+
+class RingTableHandler(BufferingHandler):
+    """Writes records to app_log in batches of up to FLUSH_ROWS, one statement
+    per batch. A failed write drops its batch (the console still has it)
+    and pauses writes for RETRY_AFTER, e.g. before migrations have run."""
+
+    def __init__(self, size: int, capacity: int = FLUSH_ROWS):
+        super().__init__(capacity)
+        self.size = size
+        self._paused_until = 0.0
+
+    def flush(self) -> None:
+        with self.lock:
+            records, self.buffer = self.buffer, []
+        if not records or time.monotonic() < self._paused_until:
+            return
+        try:
+            self._write(records)
+        except Exception as e:
+            self._paused_until = time.monotonic() + RETRY_AFTER
+            # Not through logging: that would queue more rows for this handler.
+            sys.stderr.write(f"app_log: dropped {len(records)} records, write failed: {e}\n")
+
+    def _write(self, records: List[logging.LogRecord]) -> None:
+        from app.db.connection import get_pool
+
+        params = {"size": self.size, "replica": REPLICA, "ts": [], "level": [], "logger": [],
+                  "message": [], "extra": []}
+        for r in records:
+            extra = _extra(r)
+            params["ts"].append(_ts(r))
+            params["level"].append(r.levelno)
+            params["logger"].append(r.name)
+            params["message"].append(_message(r)[:MAX_MESSAGE_CHARS])
+            params["extra"].append(json.dumps(extra, default=str) if extra else None)
+        with get_pool("ingest").connection(timeout=5) as conn:
+            conn.execute(_INSERT, params)
+
+
+class _Pipeline:
+    def __init__(self, ring_size: int):
+        self.queue: queue.Queue = queue.Queue(QUEUE_SIZE)
+        self.handler = _QueueHandler(self.queue)
+        self.handler.addFilter(SamplingFilter())
+        self.ring = RingTableHandler(ring_size)
+        recent_handler = _RecentHandler()
+        root = logging.getLogger()
+        self.console = list(root.handlers)
+        for h in self.console:
+            root.removeHandler(h)
+        root.addHandler(self.handler)
+        self.listener = QueueListener(self.queue, *self.console, recent_handler, self.ring,
+                                      respect_handler_level=True)
+        self._stop = threading.Event()
+        self._ticker = threading.Thread(target=self._tick, name="log-flush", daemon=True)
+
+    def start(self) -> None:
+        self.listener.start()
+        self._ticker.start()
+
+    def _tick(self) -> None:
+        while not self._stop.wait(FLUSH_INTERVAL):
+            self.ring.flush()
+            dropped, self.handler.dropped = self.handler.dropped, 0
+            if dropped:
+                logging.getLogger(__name__).warning("log queue full: %d records dropped", dropped)
+
+    def stop(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self.listener.stop()        # drains the queue
+        self.ring.flush()
+        root = logging.getLogger()
+        root.removeHandler(self.handler)
+        for h in self.console:
+            root.addHandler(h)
+
+
+_pipeline: Optional[_Pipeline] = None
+
+
+def install(ring_size: int = 200_000) -> None:
+    """Route the root logger through the pipeline (idempotent). Call after
+    logging.basicConfig(): the console handlers it set up move to the
+    listener."""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = _Pipeline(ring_size)
+        _pipeline.start()
+        atexit.register(shutdown)
+
+
+def shutdown() -> None:
+    """Write out everything still queued and put the console handlers back."""
+    global _pipeline
+    if _pipeline is not None:
+        _pipeline.stop()
+        _pipeline = None
+
+
+# ── Querying ──────────────────────────────────────────────────────────────────
+
+def query_logs(
+    limit: int = 200,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    level: Optional[int] = None,
+    logger: Optional[str] = None,
+    replica: Optional[str] = None,
+    search: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """The newest `limit` app_log rows matching, from every replica, returned
+    oldest first. since / until bound ts (until exclusive); search is a
+    case-insensitive substring of the message or logger name."""
+    from app.db.connection import get_connection
+
+    wheres, params = [], []
+    if since:
+        wheres.append("ts >= %s"); params.append(since)
+    if until:
+        wheres.append("ts < %s"); params.append(until)
+    if level is not None:
+        wheres.append("level = %s"); params.append(level)
+    if logger:
+        wheres.append("logger = %s"); params.append(logger)
+    if replica:
+        wheres.append("replica = %s"); params.append(replica)
+    if search:
+        s = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        wheres.append("(message ILIKE %s OR logger ILIKE %s)"); params += [s, s]
+    where_sql = ("WHERE " + " AND ".join(wheres)) if wheres else ""
+    with get_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT ts, level, logger, replica, message, extra
+            FROM app_log
+            {where_sql}
+            ORDER BY ts DESC, seq DESC
+            LIMIT %s
+        """, params + [limit]).fetchall()
+    return [{"ts": ts, "level": logging.getLevelName(level), "logger": name, "replica": rep,
+             "message": message, "extra": extra}
+            for ts, level, name, rep, message, extra in reversed(rows)]
+
+
+def recent_logs(limit: int = 200, level: Optional[int] = None, search: Optional[str] = None) -> List[Dict[str, Any]]:
+    """This process's last records (the fallback when app_log can't be read)."""
+    lines = list(recent)
+    if level is not None:
+        name = logging.getLevelName(level)
+        lines = [l for l in lines if l["level"] == name]
+    if search:
+        s = search.lower()
+        lines = [l for l in lines if s in l["message"].lower() or s in l["logger"].lower()]
+    return lines[-limit:]
@@ -9,19 +9,9 @@ import asyncio
 import logging
 import httpx
 
-from app.booking.router import router as booking_router
-from app.booking.router import _run_visitor_session_closer_scheduler
 from app.whatsapp.webhook import run_followup_nudge_scheduler
-from app.booking.admin_router import admin_router
-from app.booking.content_router import content_router
-from app.booking.signatures_router import signatures_router
-from app.booking.stock_router import stock_router
-from app.booking.financial_router import financial_router
-from app.booking.bot_config_router import bot_config_router, _ensure_tables as _ensure_bot_tables, seed_defaults as seed_bot_defaults
-from app.booking.gastos_router import gastos_router, _ensure_tables as _ensure_gastos_tables
-from app.booking.tabla_router import tabla_router, _ensure_tabla_table, _seed_tabla_products, _ensure_catalog_table, _seed_catalog_defaults
-from app.booking.reserva_router import reserva_router
-from app.booking.link_tracking_router import link_tracking_router
+from app.scheduler import Job, JobScheduler
+from app.routers import mount_routers, resolve_role, runs_workers
 from app.meta_pixel import apply_meta_pixel_placeholder, is_meta_pixel_enabled
 from app.config import get_settings
 from app.booking.operator_settings import get_setting as _get_operator_setting
@@ -55,9 +45,9 @@ logger = logging.getLogger(__name__)
 # Reduce httpx logging noise (403 errors from expired media)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
-# ── In-memory log buffer (last 500 lines, queryable via /api/admin/logs) ──────
-from app.log_buffer import install as _install_log_buffer
-_install_log_buffer()
+# ── Log pipeline (queue → console + shared app_log table, /api/admin/logs) ────
+from app.log_pipeline import install as _install_log_pipeline
+_install_log_pipeline(get_settings().log_ring_size)
 
 # Get settings
 settings = get_settings()
@@ -171,6 +161,7 @@ def _do_auto_sync():
     to do ~400+ sequential blocking DB round-trips straight on the event
     loop, stalling every other request (webhooks, admin panel, booking page)
     for the whole duration of each sync."""
+    from app.db import statements
     from app.db.connection import get_connection
     from app.booking.admin_router import TABLE
     import re
@@ -200,17 +191,8 @@ def _do_auto_sync():
                     return
 
                 # Sync reservas_con_extras → all_appointments (upsert)
-                cur.execute("""
-                    SELECT id, appointment_id, fecha, hora, nombre_cliente, email, telefono,
-                           servicio, num_personas, num_adultos, num_ninos,
-                           ingreso_reserva, ingreso_extras, ingreso_total,
-                           costo_operativo_fijo, costo_operativo_variable, costo_operativo_total,
-                           ciudad_origen, como_supieron, clima_del_dia, categoria_clientes,
-                           tipo_clientes, tiene_cruce, status, extras_json, created_at
-                    FROM reservas_con_extras
-                    ORDER BY fecha
-                """)
-                for row in cur.fetchall():
+                # Streamed: `cur` stays free for the per-row statements below.
+                for row in statements.stream(conn, "sync.reservas_con_extras"):
                     (rid, appt_id, fecha, hora, nombre, email, telefono,
                      servicio, num_p, num_adultos, num_ninos,
                      ing_res, ing_ext, ing_total, costo_fijo, costo_var, costo_total,
@@ -336,585 +318,198 @@ def _do_auto_sync():
         logger.error(f"❌ Auto-sync error: {e}")
 
 
-async def _run_auto_sync():
-    """Run all_appointments sync every SYNC_INTERVAL_MINUTES minutes."""
-    await asyncio.sleep(60)  # Wait 1 min after startup before first sync
-    while True:
-        await asyncio.to_thread(_do_auto_sync)
-        await asyncio.sleep(SYNC_INTERVAL_MINUTES * 60)
+# ── Periodic jobs ─────────────────────────────────────────────────────────────
+# Declared here, run by app/scheduler/jobs.py on every replica (each job is
+# a row of the delayed-job "scheduler" queue; its claim decides who runs
+# what). Bodies are sync and run in a worker thread; a truthy return value
+# is logged.
 
+def _job_followup_email_sweep():
+    """Follow-up email sweep (DB flags ensure idempotency)."""
+    from app.booking.booking_email import run_followup_email_sweep
+    result = run_followup_email_sweep()
+    if result.get("sent", 0) or result.get("errors"):
+        return result
 
-async def _run_email_sweeps_scheduler():
-    """Run the follow-up email sweep every 30 min (DB flags ensure idempotency)."""
-    await asyncio.sleep(120)  # brief delay after startup
-    while True:
-        try:
-            from app.booking.booking_email import run_followup_email_sweep
-            try:
-                result = await asyncio.to_thread(run_followup_email_sweep)
-                if result.get("sent", 0) or result.get("errors"):
-                    logger.info("📧 followup email sweep: %s", result)
-            except Exception as _se:
-                logger.error("Email sweep followup error: %s", _se)
-        except Exception as _fe:
-            logger.error("Email sweeps scheduler error: %s", _fe)
-        await asyncio.sleep(1800)  # re-check every 30 minutes
-
-
-async def _run_daily_summary_scheduler():
-    """Every morning at 08:00 Santiago time, send the day's booking summary to the operator."""
-    from zoneinfo import ZoneInfo
-    from datetime import datetime, timedelta, time as dtime
-    CHILE_TZ = ZoneInfo("America/Santiago")
-    SEND_HOUR = 8  # 08:00 Santiago
-
-    while True:
-        now = datetime.now(CHILE_TZ)
-        target = now.replace(hour=SEND_HOUR, minute=0, second=0, microsecond=0)
-        if now >= target:
-            target += timedelta(days=1)
-        wait_secs = (target - now).total_seconds()
-        logger.info("📅 Daily summary scheduled in %.0f min (at %s Santiago)", wait_secs / 60, target.strftime("%H:%M %d/%m"))
-        await asyncio.sleep(wait_secs)
-        try:
-            from app.booking.booking_email import send_daily_summary_email
-            result = await asyncio.to_thread(send_daily_summary_email)
-            logger.info("📅 Daily summary: %s", result)
-        except Exception as _e:
-            logger.error("Daily summary scheduler error: %s", _e)
-        await asyncio.sleep(60)  # safety gap to avoid double-fire
-
-
-async def _run_signature_summary_scheduler():
-    """Every morning at 09:00 Santiago, send T&C signature summary for today's bookings."""
-    from zoneinfo import ZoneInfo
-    from datetime import datetime, timedelta
-    CHILE_TZ = ZoneInfo("America/Santiago")
-    SEND_HOUR = 9  # 09:00 Santiago
-
-    while True:
-        now = datetime.now(CHILE_TZ)
-        target = now.replace(hour=SEND_HOUR, minute=0, second=0, microsecond=0)
-        if now >= target:
-            target += timedelta(days=1)
-        wait_secs = (target - now).total_seconds()
-        logger.info("✍️ Signature summary scheduled in %.0f min (at %s Santiago)", wait_secs / 60, target.strftime("%H:%M %d/%m"))
-        await asyncio.sleep(wait_secs)
-        try:
-            from app.booking.signatures_email import run_daily_signature_summary_sweep
-            result = await asyncio.to_thread(run_daily_signature_summary_sweep)
-            logger.info("✍️ Signature summary sweep: %s", result)
-        except Exception as _e:
-            logger.error("Signature summary scheduler error: %s", _e)
-        await asyncio.sleep(60)
-
-
-async def _run_pre_booking_notif_scheduler():
-    """Every 10 min: check for bookings starting in ~60 min and notify admin."""
-    POLL_SECONDS = 600  # 10 minutes
-    # Small initial delay so startup traffic settles before first check
-    await asyncio.sleep(30)
-    while True:
-        try:
-            from app.booking.signatures_email import run_pre_booking_notif_sweep
-            result = await asyncio.to_thread(run_pre_booking_notif_sweep)
-            if result.get("sent"):
-                logger.info("⏰ Pre-booking notif sweep: %s", result)
-        except Exception as _e:
-            logger.error("Pre-booking notif scheduler error: %s", _e)
-        await asyncio.sleep(POLL_SECONDS)
-
-
-async def _run_yesterday_weekly_scheduler():
-    """Every morning at 09:00 Santiago: send yesterday's bookings summary.
-    On Mondays also send the weekly summary."""
-    from zoneinfo import ZoneInfo
-    from datetime import datetime, timedelta
-    CHILE_TZ = ZoneInfo("America/Santiago")
-    SEND_HOUR = 9  # 09:00 Santiago
-
-    while True:
-        now = datetime.now(CHILE_TZ)
-        target = now.replace(hour=SEND_HOUR, minute=0, second=0, microsecond=0)
-        if now >= target:
-            target += timedelta(days=1)
-        wait_secs = (target - now).total_seconds()
-        logger.info("📬 Yesterday/weekly notif scheduled in %.0f min (at %s Santiago)", wait_secs / 60, target.strftime("%H:%M %d/%m"))
-        await asyncio.sleep(wait_secs)
-        try:
-            from app.booking.booking_email import send_yesterday_summary_email, send_weekly_summary_email
-            today = datetime.now(CHILE_TZ)
-            result_daily = await asyncio.to_thread(send_yesterday_summary_email)
-            logger.info("📬 Yesterday summary: %s", result_daily)
-            if today.weekday() == 0:  # Monday
-                result_weekly = await asyncio.to_thread(send_weekly_summary_email)
-                logger.info("📆 Weekly summary: %s", result_weekly)
-        except Exception as _e:
-            logger.error("Yesterday/weekly summary scheduler error: %s", _e)
-        await asyncio.sleep(60)
-
-
-async def _run_stock_consume_scheduler():
-    """
-    Stock scheduler (Santiago time):
-      • Every 15 min: consume stock for reservations that have already FINISHED
-        (date + time + trip duration in the past), so a tabla is discounted
-        shortly after that customer's reservation ends.
-      • 09:00 and 21:00: send low-stock alert email if any product is below
-        its minimum — twice a day avoids the inbox getting flooded every 15 min.
-      • Once daily at 09:00: also check today's tabla ingredient shortfalls.
-    Also runs once 45 s after startup to catch anything missed.
-    """
-    from zoneinfo import ZoneInfo
-    from datetime import datetime
-    CHILE_TZ = ZoneInfo("America/Santiago")
-
-    CONSUME_INTERVAL_SECONDS = 15 * 60
-    # Track the last (date, hour) pair for which each alert was sent
-    # so it fires at most once per window, even if the loop drifts.
-    last_morning_date = None   # 09:00 window
-    last_evening_date = None   # 21:00 window
-
-    # ── startup pass ──────────────────────────────────────────────────────────
-    await asyncio.sleep(45)
-    try:
-        from app.booking.stock_router import auto_consume_past_bookings
-        result = await asyncio.to_thread(auto_consume_past_bookings)
-        logger.info("📦 Stock auto-consume (startup): %s", result)
-    except Exception as _e:
-        logger.warning("Stock auto-consume startup skipped: %s", _e)
 
-    # ── periodic loop ─────────────────────────────────────────────────────────
-    while True:
-        # Consume finished reservations
-        try:
-            from app.booking.stock_router import auto_consume_past_bookings, _send_low_stock_alert
-            result = await asyncio.to_thread(auto_consume_past_bookings)
-            logger.info("📦 Stock auto-consume: %s", result)
-        except Exception as _e:
-            logger.error("Stock auto-consume scheduler error: %s", _e)
-            result = {}
-
-        now = datetime.now(CHILE_TZ)
-        today = now.date()
-
-        # ── Low-stock alert: 09:00 and 21:00 only ─────────────────────────────
-        is_morning = now.hour == 9  and last_morning_date != today
-        is_evening = now.hour == 21 and last_evening_date != today
-        if is_morning or is_evening:
-            low_alerts = result.get("low_stock_alerts", [])
-            if low_alerts:
-                try:
-                    await asyncio.to_thread(_send_low_stock_alert, low_alerts)
-                    logger.info("📧 Low-stock alert sent (%d productos) at %02d:xx",
-                                len(low_alerts), now.hour)
-                except Exception as _e:
-                    logger.error("Low-stock alert send failed: %s", _e)
-            if is_morning:
-                last_morning_date = today
-            if is_evening:
-                last_evening_date = today
-
-        # ── Morning tabla ingredient shortfall: 09:00 only ────────────────────
-        if is_morning:
-            try:
-                from app.booking.stock_router import check_and_alert_tabla_ingredients
-                await asyncio.to_thread(check_and_alert_tabla_ingredients)
-            except Exception as _e:
-                logger.error("Tabla ingredient check error: %s", _e)
+def _job_daily_summary():
+    """The day's booking summary for the operator."""
+    from app.booking.booking_email import send_daily_summary_email
+    return send_daily_summary_email()
 
-        await asyncio.sleep(CONSUME_INTERVAL_SECONDS)
 
+def _job_signature_summary():
+    """T&C signature summary for today's bookings."""
+    from app.booking.signatures_email import run_daily_signature_summary_sweep
+    return run_daily_signature_summary_sweep()
 
-def _ensure_web_push_table():
-    """Create web_push_subscriptions table if it doesn't exist."""
-    try:
-        from app.db.connection import get_connection
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS web_push_subscriptions (
-                        id           SERIAL PRIMARY KEY,
-                        endpoint     TEXT UNIQUE NOT NULL,
-                        p256dh       TEXT NOT NULL,
-                        auth         TEXT NOT NULL,
-                        created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                        last_used_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                    )
-                """)
-                conn.commit()
-        logger.info("✅ web_push_subscriptions table ready")
-    except Exception as e:
-        logger.warning(f"web_push_subscriptions table setup failed: {e}")
 
+def _job_pre_booking_notif():
+    """Notify the admin about bookings starting in ~60 min."""
+    from app.booking.signatures_email import run_pre_booking_notif_sweep
+    result = run_pre_booking_notif_sweep()
+    if result.get("sent"):
+        return result
 
-def _ensure_extras_visibility_table():
-    """Create extras_visibility table if it doesn't exist (survives Sheets re-sync)."""
-    try:
-        from app.db.connection import get_connection
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS extras_visibility (
-                        extra_name_lower TEXT PRIMARY KEY,
-                        show_in_booking  BOOLEAN NOT NULL DEFAULT FALSE,
-                        sort_order       INTEGER NOT NULL DEFAULT 999,
-                        description      TEXT,
-                        precio_venta     INTEGER,
-                        costo            INTEGER,
-                        icon             TEXT,
-                        updated_at       TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                    )
-                """)
-                for col, definition in [
-                    ("sort_order",      "INTEGER NOT NULL DEFAULT 999"),
-                    ("description",     "TEXT"),
-                    ("precio_venta",    "INTEGER"),
-                    ("costo",           "INTEGER"),
-                    ("icon",            "TEXT"),
-                    ("name",            "TEXT"),
-                    ("user_hidden",     "BOOLEAN NOT NULL DEFAULT FALSE"),
-                    ("stock_product_id","INTEGER"),
-                ]:
-                    cur.execute(f"ALTER TABLE extras_visibility ADD COLUMN IF NOT EXISTS {col} {definition}")
 
-                conn.commit()
-        logger.info("✅ extras_visibility table ready")
-    except Exception as e:
-        logger.error(f"extras_visibility table init error: {e}")
-
-
-_EXTRAS_SEED = [
-    # (extra_name_lower, display_name, precio_venta, costo, icon, sort_order)
-    ("tabla_4_personas",  "Tabla de Picoteo Grande (4 personas)",     25000,  0, "🍇",  1),
-    ("tabla_2_personas",  "Tabla de Picoteo Pequeña (2 personas)",    20000,  0, "🍇",  2),
-    ("jugo_natural",      "Jugo Natural 1L (piña o naranja)",         10000,  0, "🥤",  3),
-    ("lata_bebida",       "Lata Bebida (Coca-Cola o Fanta)",           2900,  0, "🥤",  4),
-    ("agua_mineral",      "Agua Mineral 1.5L",                         2500,  0, "💧",  5),
-    ("helado",            "Helado Individual",                          3500,  0, "🍦",  6),
-    ("modo_romantico",    "Modo Romántico (pétalos + decoración)",    25000,  0, "🌹",  7),
-    ("velas_led",         "Velas LED Decorativas",                    10000,  0, "🕯️",  8),
-    ("letras_luminosas",  "Letras Luminosas 'Te Amo' / 'Love'",       15000,  0, "✨",  9),
-    ("pack_velas_letras", "Pack Nocturno Completo (velas + letras)",  20000,  0, "🌙", 10),
-    ("video_15_seg",      "Video Personalizado 15s",                  30000,  0, "🎥", 11),
-    ("video_1_min",       "Video Personalizado 60s",                  40000,  0, "🎥", 12),
-    ("transporte",        "Transporte Ida y Vuelta desde Pucón",      50000,  0, "🚐", 13),
-    ("toalla_normal",     "Toalla Normal",                             9000,  0, "🧻", 14),
-    ("toalla_poncho",     "Toalla Poncho",                            10000,  0, "🧻", 15),
-    ("chalas",            "Chalas de Ducha",                          10000,  0, "🩴", 16),
-    ("reserva_flex",      "Reserva FLEX (+10%)",                          0,  0, "🔄", 17),
-]
+def _job_yesterday_summary():
+    from app.booking.booking_email import send_yesterday_summary_email
+    return send_yesterday_summary_email()
 
 
-def _seed_extras_visibility():
-    """Populate extras_visibility with the canonical catalog if still empty."""
-    try:
-        from app.db.connection import get_connection
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT COUNT(*) FROM extras_visibility")
-                if cur.fetchone()[0] > 0:
-                    return  # already seeded
-                for (key, name, price, cost, icon, sort) in _EXTRAS_SEED:
-                    cur.execute("""
-                        INSERT INTO extras_visibility
-                            (extra_name_lower, name, precio_venta, costo, icon,
-                             sort_order, show_in_booking)
-                        VALUES (%s, %s, %s, %s, %s, %s, TRUE)
-                        ON CONFLICT DO NOTHING
-                    """, (key, name, price, cost, icon, sort))
-                conn.commit()
-        logger.info("✅ extras_visibility seeded with %d items", len(_EXTRAS_SEED))
-    except Exception as e:
-        logger.warning("extras_visibility seed failed: %s", e)
-
-
-_CLOTHING_FLAT_SEED = [
-    # (slug, name, cost, price, icon, sort, stock)
-    # Polera Blanca — S/M/L/XL
-    ("polera_blanca_s",          "Polera Blanca S",          4141,  17990, "👕", 30, 2),
-    ("polera_blanca_m",          "Polera Blanca M",          4141,  17990, "👕", 31, 3),
-    ("polera_blanca_l",          "Polera Blanca L",          4141,  17990, "👕", 32, 3),
-    ("polera_blanca_xl",         "Polera Blanca XL",         4141,  17990, "👕", 33, 2),
-    # Polera Negra
-    ("polera_negra_s",           "Polera Negra S",           4141,  17990, "👕", 34, 2),
-    ("polera_negra_m",           "Polera Negra M",           4141,  17990, "👕", 35, 4),
-    ("polera_negra_l",           "Polera Negra L",           4141,  17990, "👕", 36, 4),
-    ("polera_negra_xl",          "Polera Negra XL",          4141,  17990, "👕", 37, 2),
-    # Polera Verde
-    ("polera_verde_s",           "Polera Verde S",           4141,  17990, "👕", 38, 1),
-    ("polera_verde_m",           "Polera Verde M",           4141,  17990, "👕", 39, 2),
-    ("polera_verde_l",           "Polera Verde L",           4141,  17990, "👕", 40, 2),
-    ("polera_verde_xl",          "Polera Verde XL",          4141,  17990, "👕", 41, 1),
-    # Polerón Negro
-    ("poleron_negro_s",          "Polerón Negro S",          8841,  29990, "🧥", 42, 1),
-    ("poleron_negro_m",          "Polerón Negro M",          8841,  29990, "🧥", 43, 2),
-    ("poleron_negro_l",          "Polerón Negro L",          8841,  29990, "🧥", 44, 2),
-    ("poleron_negro_xl",         "Polerón Negro XL",         8841,  29990, "🧥", 45, 1),
-    # Polerón Azul Marino
-    ("poleron_azul_marino_s",    "Polerón Azul Marino S",    8841,  29990, "🧥", 46, 1),
-    ("poleron_azul_marino_m",    "Polerón Azul Marino M",    8841,  29990, "🧥", 47, 2),
-    ("poleron_azul_marino_l",    "Polerón Azul Marino L",    8841,  29990, "🧥", 48, 2),
-    ("poleron_azul_marino_xl",   "Polerón Azul Marino XL",   8841,  29990, "🧥", 49, 1),
-    # Polerón Grueso Negro
-    ("poleron_grueso_negro_s",   "Polerón Grueso Negro S",   12841, 34990, "🧥", 50, 0),
-    ("poleron_grueso_negro_m",   "Polerón Grueso Negro M",   12841, 34990, "🧥", 51, 3),
-    ("poleron_grueso_negro_l",   "Polerón Grueso Negro L",   12841, 34990, "🧥", 52, 3),
-    ("poleron_grueso_negro_xl",  "Polerón Grueso Negro XL",  12841, 34990, "🧥", 53, 0),
-    # Gorros — sin talla
-    ("gorro_verde",              "Gorro Verde",              4304,  14990, "🧢", 54, 8),
-    ("gorro_blanco",             "Gorro Blanco",             4304,  14990, "🧢", 55, 8),
-    ("gorro_negro",              "Gorro Negro",              4304,  14990, "🧢", 56, 8),
-]
+def _job_weekly_summary():
+    from app.booking.booking_email import send_weekly_summary_email
+    return send_weekly_summary_email()
 
-# Slugs usados en intentos anteriores de seed (para limpiar si existen)
-_CLOTHING_LEGACY_SLUGS = [
-    "polera_blanca", "polera_negra", "polera_verde",
-    "poleron_negro", "poleron_azul_marino", "poleron_grueso_negro",
-    "gorro_verde", "gorro_blanco", "gorro_negro",
-]
 
+def _job_stock_consume():
+    """Consume stock for reservations that have already FINISHED (date +
+    time + trip duration in the past), so a tabla is discounted shortly
+    after that customer's reservation ends."""
+    from app.booking.stock_router import auto_consume_past_bookings
+    return auto_consume_past_bookings()
 
-def _seed_clothing_products():
-    """Un extra independiente por cada talla/color + gorros sin talla."""
-    try:
-        from app.db.connection import get_connection
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                # Already seeded correctly → nothing to do
-                cur.execute(
-                    "SELECT COUNT(*) FROM extras_visibility "
-                    "WHERE extra_name_lower = 'polera_blanca_s'"
-                )
-                if cur.fetchone()[0] > 0:
-                    return
-
-                # Limpiar intentos anteriores (slug sin talla o con variantes)
-                all_old = _CLOTHING_LEGACY_SLUGS + [r[0] for r in _CLOTHING_FLAT_SEED]
-                cur.execute(
-                    "DELETE FROM extras_bom WHERE extra_slug = ANY(%s)",
-                    (all_old,),
-                )
-                cur.execute(
-                    """
-                    DELETE FROM stock_products WHERE id IN (
-                        SELECT stock_product_id FROM extras_visibility
-                        WHERE extra_name_lower = ANY(%s)
-                          AND stock_product_id IS NOT NULL
-                    )
-                    """,
-                    (all_old,),
-                )
-                cur.execute(
-                    "DELETE FROM extras_visibility WHERE extra_name_lower = ANY(%s)",
-                    (all_old,),
-                )
 
-                for (slug, name, cost, price, icon, sort, stock) in _CLOTHING_FLAT_SEED:
-                    cur.execute(
-                        """
-                        INSERT INTO stock_products
-                            (name, category, unit, current_stock,
-                             min_stock, cost_per_unit, is_active)
-                        VALUES (%s, 'Ropa', 'unidad', %s, 0, %s, TRUE)
-                        RETURNING id
-                        """,
-                        (name, stock, cost),
-                    )
-                    pid = cur.fetchone()[0]
-                    cur.execute(
-                        """
-                        INSERT INTO extras_visibility
-                            (extra_name_lower, name, precio_venta, costo, icon,
-                             sort_order, show_in_booking, stock_product_id)
-                        VALUES (%s, %s, %s, %s, %s, %s, FALSE, %s)
-                        ON CONFLICT DO NOTHING
-                        """,
-                        (slug, name, price, cost, icon, sort, pid),
-                    )
-                    cur.execute(
-                        "INSERT INTO extras_bom (extra_slug, product_id, quantity) "
-                        "VALUES (%s, %s, 1)",
-                        (slug, pid),
-                    )
-
-                conn.commit()
-        logger.info("✅ Clothing products seeded (%d extras)", len(_CLOTHING_FLAT_SEED))
-    except Exception as e:
-        logger.warning("Clothing products seed failed: %s", e)
-
-
-_PACKS_CATALOG_SEED = [
-    {
-        "slug": "termas-angostura",
-        "name": "Pack Termas Angostura",
-        "icon": "♨️",
-        "description": (
-            "¿Te animas a una pausa?\n\n"
-            "Escápate a una cabaña rodeada de bosque nativo, donde el tiempo se detiene. "
-            "Durante dos noches disfrutarás de desayuno, almuerzo y cena en el restaurante "
-            "del complejo, y de acceso ilimitado a las piscinas de aguas termales al aire libre.\n\n"
-            "Y como broche de oro: la experiencia única e inigualable del HotBoat — una tinaja "
-            "flotante que navega en medio de la laguna, rodeada de volcanes y bosque nativo. "
-            "Una sensación que no encontrarás en ningún otro lugar del mundo."
-        ),
-        "personas": "2 personas",
-        "price_from": 399990,
-        "cost_from": 0,
-        "includes": [
-            "2 noches en Cabaña exclusiva Termas Angostura",
-            "Acceso ilimitado a Termas Angostura",
-            "Pensión completa (desayuno, almuerzo y cena)",
-            "Paseo en HotBoat (2 personas)",
-        ],
-        "display_order": 4,
-    },
+def _job_low_stock_alert():
+    """Low-stock alert email — only at 09:00 and 21:00, so the inbox isn't
+    flooded every 15 min. Only reads stock levels: consuming is the
+    stock_consume job's alone (every 15 min, so the numbers are current)."""
+    from app.db.connection import get_connection
+    from app.booking.stock_router import _check_low_stock, _send_low_stock_alert
+    with get_connection() as conn:
+        low_alerts = _check_low_stock(conn)
+    if low_alerts:
+        _send_low_stock_alert(low_alerts)
+        return f"alert sent ({len(low_alerts)} productos)"
+
+
+def _job_tabla_ingredient_check():
+    """Today's tabla ingredient shortfalls, early enough to restock."""
+    from app.booking.stock_router import check_and_alert_tabla_ingredients
+    return check_and_alert_tabla_ingredients()
+
+
+def _job_visitor_session_closer():
+    """Close visitor sessions after 5 min of inactivity."""
+    from app.booking.router import _close_stale_visitor_sessions
+    result = _close_stale_visitor_sessions()
+    if result.get("closed"):
+        return f"closed {result['closed']} session(s)"
+
+
+def _job_visitor_event_partitions():
+    """Upcoming partitions of booking_visitor_events; drop expired ones."""
+    from app.booking.visitor_tracking import maintain_visitor_event_partitions
+    result = maintain_visitor_event_partitions()
+    if result.get("created") or result.get("dropped"):
+        return result
+
+
+def _job_financial_facts():
+    """Keep the report fact tables current between report requests."""
+    from app.booking.financial_facts import refresh_financial_facts
+    result = refresh_financial_facts()
+    if result["bookings"] or result["removed"]:
+        return result
+
+
+def _job_financial_facts_rebuild():
+    """Full rebuild, for writers that change a booking without bumping updated_at."""
+    from app.booking.financial_facts import refresh_financial_facts
+    return refresh_financial_facts(full=True)
+
+
+def _job_dedup_cleanup():
+    from app.whatsapp.dedup import purge_expired_dedup
+    deleted = purge_expired_dedup()
+    if deleted:
+        return f"purged {deleted} expired message_id(s)"
+
+
+SCHEDULED_JOBS = [
+    Job("auto_sync", _do_auto_sync, interval_s=SYNC_INTERVAL_MINUTES * 60,
+        initial_delay_s=60, lease_s=SYNC_INTERVAL_MINUTES * 60),
+    Job("followup_email_sweep", _job_followup_email_sweep, interval_s=1800, initial_delay_s=120, jitter_s=60),
+    Job("daily_summary", _job_daily_summary, cron="0 8 * * *"),
+    Job("signature_summary", _job_signature_summary, cron="0 9 * * *"),
+    Job("pre_booking_notif", _job_pre_booking_notif, interval_s=600, initial_delay_s=30),
+    Job("yesterday_summary", _job_yesterday_summary, cron="0 9 * * *", jitter_s=60),
+    Job("weekly_summary", _job_weekly_summary, cron="0 9 * * 1", jitter_s=120),
+    Job("stock_consume", _job_stock_consume, interval_s=15 * 60, initial_delay_s=45),
+    Job("low_stock_alert", _job_low_stock_alert, cron="0 9,21 * * *", misfire_grace_s=3600),
+    Job("tabla_ingredient_check", _job_tabla_ingredient_check, cron="0 9 * * *", misfire_grace_s=3 * 3600),
+    Job("visitor_session_closer", _job_visitor_session_closer, interval_s=120, jitter_s=10),
+    Job("visitor_event_partitions", _job_visitor_event_partitions, interval_s=6 * 3600,
+        initial_delay_s=180, jitter_s=300),
+    Job("financial_facts", _job_financial_facts, interval_s=600, initial_delay_s=240, jitter_s=60),
+    Job("financial_facts_rebuild", _job_financial_facts_rebuild, cron="30 4 * * *", misfire_grace_s=3 * 3600),
+    Job("dedup_cleanup", _job_dedup_cleanup, interval_s=3600, initial_delay_s=300, jitter_s=300),
 ]
-
-
-def _seed_packs_catalog():
-    """Insert canonical packs that don't yet exist in DB (ON CONFLICT DO NOTHING)."""
-    import json as _json
-    try:
-        from app.db.connection import get_connection
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                for p in _PACKS_CATALOG_SEED:
-                    cur.execute(
-                        """
-                        INSERT INTO packs
-                          (slug, name, icon, description, personas,
-                           price_from, cost_from, includes,
-                           is_active, display_order)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, TRUE, %s)
-                        ON CONFLICT (slug) DO NOTHING
-                        """,
-                        (
-                            p["slug"], p["name"], p["icon"], p["description"],
-                            p["personas"], p["price_from"], p["cost_from"],
-                            _json.dumps(p["includes"], ensure_ascii=False),
-                            p["display_order"],
-                        ),
-                    )
-        logger.info("✅ Packs catalog seeded")
-    except Exception as _e:
-        logger.warning(f"Pack catalog seed skipped: {_e}")
+job_scheduler = JobScheduler(SCHEDULED_JOBS)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Start background tasks on startup, cancel on shutdown."""
-    from app.whatsapp.webhook import _ensure_dedup_table, _ensure_followup_table
-    from app.bot.conversation import ensure_conversation_state_table
-    _ensure_dedup_table()
-    _ensure_followup_table()
-    ensure_conversation_state_table()
-    _ensure_web_push_table()
-    _ensure_extras_visibility_table()
-    _seed_extras_visibility()
-    _seed_clothing_products()
-    _seed_packs_catalog()
+    from app.whatsapp.inbox import run_inbox_worker
+    # Schema: a single version probe when already at head; pending
+    # migrations (app/db/migrations/) are applied by whichever replica
+    # gets the migration lock first. A failure aborts startup: the rest of
+    # the app needs tables the migrations create (email_outbox, app_log,
+    # scheduler_jobs...), and a failed boot is what the deploy's health
+    # check catches.
+    from app.db.migrate import migrate_to_head
     try:
-        from app.bot.cart import CartManager
-        CartManager.refresh_prices_from_db()
+        t0 = _time.monotonic()
+        result = migrate_to_head()
+        logger.info(
+            f"🗄️ schema_version {result['to']} "
+            f"({len(result['applied'])} applied, {(_time.monotonic() - t0) * 1000:.0f} ms)"
+        )
     except Exception as _e:
-        logger.warning(f"Cart price refresh skipped: {_e}")
+        logger.error(f"Schema migration failed, not starting: {_e}")
+        raise
     try:
         from app.booking.db import load_prices_from_db
         load_prices_from_db()
     except Exception as _e:
         logger.warning(f"Booking prices refresh skipped: {_e}")
+    # Catalog snapshot: loaded once here, then kept current on every replica
+    # by the catalog_changed listener (admin edits made on any replica).
+    from app.booking.catalog import catalog
     try:
-        from app.booking.operator_settings import seed_email_workflow_defaults
-        seed_email_workflow_defaults()
-    except Exception as _e:
-        logger.warning(f"Email workflow seed skipped: {_e}")
-    # Apply any missing DB columns (idempotent migrations)
-    try:
-        from app.booking.db import ensure_db_columns
-        ensure_db_columns()
-        logger.info("✅ DB columns ensured (customer_language, pre_booking_notif_sent_at, extra_images)")
-    except Exception as _e:
-        logger.warning(f"ensure_db_columns skipped: {_e}")
-    # Ensure signatures table exists
-    try:
-        from app.booking.db import ensure_signatures_table
-        ensure_signatures_table()
-    except Exception as _e:
-        logger.warning(f"ensure_signatures_table skipped: {_e}")
-    # Ensure conversion-funnel analytics views exist
-    try:
-        from app.booking.db import ensure_analytics_views
-        ensure_analytics_views()
-    except Exception as _e:
-        logger.warning(f"ensure_analytics_views skipped: {_e}")
-    # Ensure direct-web visitor identity tables exist (session/visitor_id -> phone)
-    try:
-        from app.booking.db import ensure_visitor_identity_tables
-        ensure_visitor_identity_tables()
-    except Exception as _e:
-        logger.warning(f"ensure_visitor_identity_tables skipped: {_e}")
-    # Ensure dynamic-pricing audit columns exist (dp_multiplier, dp_factors)
-    try:
-        from app.booking.db import ensure_dynamic_pricing_columns
-        ensure_dynamic_pricing_columns()
-    except Exception as _e:
-        logger.warning(f"ensure_dynamic_pricing_columns skipped: {_e}")
-    # Ensure alojamientos table exists (self-heals if accidentally dropped —
-    # its absence previously broke /api/content/alojamientos with an
-    # uncaught 500, which cascaded into menu-visibility never loading)
-    try:
-        from app.booking.db import ensure_alojamientos_table
-        ensure_alojamientos_table()
+        catalog.refresh()
     except Exception as _e:
-        logger.warning(f"ensure_alojamientos_table skipped: {_e}")
-    try:
-        _ensure_bot_tables()
-        seed_bot_defaults()
-    except Exception as _e:
-        logger.warning(f"bot config setup skipped: {_e}")
-    try:
-        _ensure_gastos_tables()
-    except Exception as _e:
-        logger.warning(f"gastos tables setup skipped: {_e}")
-    try:
-        _ensure_tabla_table()
-        _seed_tabla_products()
-        _ensure_catalog_table()
-        _seed_catalog_defaults()
-    except Exception as _e:
-        logger.warning(f"tabla table setup skipped: {_e}")
-
-    # With multiple workers/replicas, each is a separate process sharing the
-    # same DB — without this lock, every one of them would start its own
-    # copy of the schedulers below and every automated email/WhatsApp
-    # message would go out once per process. Only the process that wins the
-    # advisory lock runs them; the rest just serve requests.
-    from app.db.connection import try_acquire_scheduler_lock
+        logger.warning(f"Catalog preload skipped: {_e}")
+
     scheduler_tasks = []
-    if try_acquire_scheduler_lock():
-        scheduler_tasks = [
-            asyncio.create_task(_run_auto_sync()),
-            asyncio.create_task(_run_email_sweeps_scheduler()),
-            asyncio.create_task(_run_daily_summary_scheduler()),
-            asyncio.create_task(_run_signature_summary_scheduler()),
-            asyncio.create_task(_run_pre_booking_notif_scheduler()),
-            asyncio.create_task(_run_yesterday_weekly_scheduler()),
-            asyncio.create_task(_run_stock_consume_scheduler()),
-            asyncio.create_task(_run_visitor_session_closer_scheduler()),
-            asyncio.create_task(run_followup_nudge_scheduler()),
-        ]
-        logger.info(f"🕐 Auto-sync iniciado: cada {SYNC_INTERVAL_MINUTES} minutos")
-        logger.info("📧 Email sweeps scheduler iniciado (followup, cada 30 min)")
-        logger.info("📧 Pending-payment email sweep iniciado (cada 3 min, delay 5 min)")
-        logger.info("📅 Daily summary scheduler iniciado (08:00 Santiago)")
-        logger.info("✍️ Signature summary scheduler iniciado (09:00 Santiago)")
-        logger.info("⏰ Pre-booking notif scheduler iniciado (cada 10 min, 60 min antes)")
-        logger.info("📬 Yesterday/weekly notif scheduler iniciado (09:00 Santiago, lunes también semanal)")
-        logger.info("💬 Follow-up nudge scheduler iniciado (cada 15s, envía a los 2 min sin respuesta)")
-        logger.info("🌐 Visitor session closer iniciado (cada 2 min, cierra sesiones tras 5 min de inactividad)")
-    else:
-        logger.info("⏭️ Schedulers ya corren en otro worker/réplica — este proceso solo atiende requests")
+    # Background workers run in the webhook/all roles only; a public or
+    # admin-only deployment just serves HTTP.
+    if runs_workers(APP_ROLE):
+        # Every replica runs the job scheduler: the claim on each job's
+        # delayed_jobs row (not a process-wide advisory lock) makes sure a
+        # given job runs on one replica at a time, while different jobs can
+        # run on different replicas.
+        scheduler_tasks.append(asyncio.create_task(job_scheduler.run()))
+        logger.info("🕐 Job scheduler iniciado: %s", ", ".join(f"{j.name} ({j.schedule})" for j in SCHEDULED_JOBS))
+        # The webhook inbox sweeper runs on every replica — SKIP LOCKED claims
+        # (not the scheduler lock) keep them from processing the same payload.
+        scheduler_tasks.append(asyncio.create_task(run_inbox_worker(conversation_manager)))
+        logger.info("📥 Webhook inbox worker iniciado (recupera payloads no procesados)")
+        # Same for the follow-up queue: due nudges are claimed with SKIP LOCKED.
+        scheduler_tasks.append(asyncio.create_task(run_followup_nudge_scheduler()))
+        logger.info("💬 Follow-up nudge queue iniciada (despierta al vencer o por NOTIFY, envía a los 2 min sin respuesta)")
+        # Email outbox: every replica delivers, SKIP LOCKED claims again.
+        from app.email.outbox import run_outbox_worker
+        scheduler_tasks.append(asyncio.create_task(run_outbox_worker()))
+        logger.info("📧 Email outbox worker iniciado (entrega a Resend con reintentos)")
+    scheduler_tasks.append(asyncio.create_task(catalog.run_listener()))
+    logger.info("📚 Catalog listener iniciado (recarga precios/catálogo por NOTIFY)")
+    from app.metrics import monitor_event_loop
+    scheduler_tasks.append(asyncio.create_task(monitor_event_loop()))
+    # Loop-stall detector: off unless switched on from the admin panel.
+    from app.diagnostics import detector as loop_detector
+    scheduler_tasks.append(asyncio.create_task(loop_detector.run()))
     yield
     for task in scheduler_tasks:
         task.cancel()
@@ -922,8 +517,15 @@ async def lifespan(app: FastAPI):
             await task
         except asyncio.CancelledError:
             pass
-    if scheduler_tasks:
-        logger.info("🛑 Background tasks detenidos")
+    # Visitor events still in the ingest buffer are written before exit.
+    from app.booking.visitor_ingest import visitor_events
+    await visitor_events.close()
+    # Push notifications still inside their burst window go out now.
+    from app.notifications import push_notifier
+    await push_notifier.flush()
+    logger.info("🛑 Background tasks detenidos")
+    from app.log_pipeline import shutdown as _shutdown_log_pipeline
+    _shutdown_log_pipeline()
 
 
 # Create FastAPI app
@@ -934,6 +536,14 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Request latency, DB time and outbound-call metrics (/metrics; see app/metrics.py)
+from app import metrics as _metrics
+_metrics.install_http_client_metrics()
+app.add_middleware(_metrics.MetricsMiddleware)
+# DB pool per traffic class: webhook → realtime, admin → admin, rest → web
+from app.db.connection import PoolRoutingMiddleware
+app.add_middleware(PoolRoutingMiddleware)
+
 # Add middleware to prevent caching of static files
 @app.middleware("http")
 async def add_no_cache_headers(request: Request, call_next):
@@ -944,7 +554,12 @@ async def add_no_cache_headers(request: Request, call_next):
     # custom domain caches these, admin changes never show up on the live
     # site until that cache happens to expire. Force no-store everywhere
     # dynamic, same as the existing /static/ rule below.
-    if path.startswith("/static/") or path.startswith("/api/") or path.startswith("/booking"):
+    # Catalog endpoints carry an ETag (the catalog snapshot version): those
+    # may be stored but must be revalidated on every use, which costs a 304
+    # instead of the full payload and still shows admin edits immediately.
+    if "etag" in response.headers and path.startswith("/api/content/"):
+        response.headers["Cache-Control"] = "no-cache, must-revalidate"
+    elif path.startswith("/static/") or path.startswith("/api/") or path.startswith("/booking"):
         response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
         response.headers["Pragma"] = "no-cache"
         response.headers["Expires"] = "0"
@@ -967,17 +582,11 @@ if os.path.exists(media_dir):
 
 # Initialize conversation manager
 conversation_manager = ConversationManager()
-app.include_router(booking_router)
-app.include_router(admin_router)
-app.include_router(content_router)
-app.include_router(signatures_router)
-app.include_router(stock_router)
-app.include_router(financial_router)
-app.include_router(bot_config_router)
-app.include_router(gastos_router)
-app.include_router(tabla_router)
-app.include_router(reserva_router)
-app.include_router(link_tracking_router)
+# Only the routers this deployment's role serves are imported (APP_ROLE,
+# see app/routers.py).
+APP_ROLE = resolve_role(settings.app_role)
+_mounted_routers = mount_routers(app, APP_ROLE)
+logger.info(f"🧭 APP_ROLE={APP_ROLE}: routers {', '.join(_mounted_routers) or '(none)'}")
 
 
 def _serve_chat_html() -> HTMLResponse:
@@ -1231,6 +840,17 @@ async def push_debug():
     }
 
 
+@app.get("/metrics")
+async def metrics_endpoint(authorization: str = Header("")):
+    """Prometheus text exposition of this replica's metrics (app/metrics.py).
+    With METRICS_TOKEN set, scrapes must send it as a Bearer token."""
+    from fastapi.responses import PlainTextResponse
+    token = settings.metrics_token
+    if token and not _hmac.compare_digest(authorization, f"Bearer {token}"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return PlainTextResponse(_metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
 async def health():
     """Detailed health check"""
@@ -1291,14 +911,30 @@ async def webhook_receive(request: Request):
     slow to respond — awaiting the full handler here (bot logic, DB writes,
     push notifications) made that timeout easy to hit and caused duplicate
     notifications/replies on every retry.
+
+    The payload is persisted to webhook_inbox before the ack, so a crash or
+    restart mid-processing no longer loses the message: the inbox worker on
+    any replica re-claims it (see app/whatsapp/inbox.py).
     """
     try:
         # Get the request body
         body = await request.json()
 
-        logger.info(f"📩 Received webhook: {body}")
+        # The full payload only at DEBUG: it is the largest line the app logs
+        # and arrives with every message, status update and read receipt.
+        logger.info("📩 Received webhook (%s)", body.get("object") if isinstance(body, dict) else type(body).__name__)
+        logger.debug("📩 Webhook body: %s", body)
 
-        asyncio.create_task(_process_webhook_in_background(body))
+        from app.whatsapp.inbox import enqueue_webhook, process_inbox_item
+        try:
+            inbox_id = await asyncio.to_thread(enqueue_webhook, body)
+        except Exception as e:
+            # DB unreachable — fall back to the old in-memory path rather
+            # than dropping the message outright.
+            logger.error(f"webhook_inbox enqueue failed, processing in-memory only: {e}")
+            asyncio.create_task(_process_webhook_in_background(body))
+        else:
+            asyncio.create_task(process_inbox_item(inbox_id, conversation_manager))
 
         # WhatsApp expects a 200 OK response quickly
         return JSONResponse(content={"status": "ok"}, status_code=200)
@@ -1491,16 +1127,12 @@ async def update_conversation_priority(phone_number: str, update: PriorityUpdate
 
 
 def _get_bot_response_content(response_key: str, lang: str = "es") -> Optional[str]:
-    """Return bot response content from DB for the given key and language, or None if not set."""
+    """Return bot response content for the given key and language, or None if not set."""
     try:
-        from app.db.connection import get_connection
-        col = {"es": "content_es", "en": "content_en", "pt": "content_pt"}.get(lang, "content_es")
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(f"SELECT {col}, content_es FROM bot_responses WHERE response_key = %s", (response_key,))
-                row = cur.fetchone()
+        from app.booking.catalog import catalog
+        row = catalog.snapshot().bot_responses.get(response_key)
         if row:
-            return row[0] or row[1]  # fallback to es if requested lang is empty
+            return row.get(lang) or row["es"]  # fallback to es if requested lang is empty
     except Exception:
         pass
     return None
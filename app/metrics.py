@@ -0,0 +1,412 @@
+"""
+In-process performance metrics, exposed as Prometheus text at /metrics.
+
+Each replica runs a single uvicorn process, so the numbers are per replica.
+Prometheus scrapes each one and sums across them. What is recorded:
+
+  • HTTP requests — MetricsMiddleware times every request. The route label
+    is the route's path template (unmatched paths share one label, so 404
+    scans can't blow up the series count). It also records the DB time
+    and query count of the request, and how long it waited for a pool
+    connection.
+  • Queries — app.db.connection's cursor class calls observe_query() for
+    every execute, attributed to the request it ran for (or
+    "<background>" for workers and jobs). A contextvar carries the
+    request, including into asyncio.to_thread.
+  • Pools — psycopg_pool's own counters (size, idle, waiting, timeouts...)
+    and saturation for each named pool (app.db.connection), read at
+    scrape time, plus the dedicated LISTEN connections.
+  • Outbound HTTP — every httpx and requests call, by service (Graph API,
+    Groq, Resend, Transbank, MercadoPago, other). It is timed to the
+    response headers, at the transport, so SDK-made calls count too.
+  • Event-loop lag — how late a periodic sleep wakes up
+    (monitor_event_loop).
+  • Scheduler — the duration of every job run, by job and outcome.
+
+A request sent with `X-Debug-Timing: 1` gets a Server-Timing header with
+its own breakdown (total, db with query count, pool wait, each outbound
+service). Browser dev tools show it under Timing.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+BACKGROUND = "<background>"
+UNMATCHED = "<unmatched>"
+
+# Host suffix → service label for outbound calls.
+SERVICES = (
+    ("graph.facebook.com", "graph"),
+    ("api.groq.com", "groq"),
+    ("resend.com", "resend"),
+    ("transbank.cl", "transbank"),
+    ("mercadopago.com", "mercadopago"),
+)
+
+
+# ── Metric types ──────────────────────────────────────────────────────────────
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {v:g}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}   # labels → [bucket counts..., sum, count]
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        out = self.header()
+        names = self.label_names + ("le",)
+        for labels, s in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, s):
+                cumulative += n
+                out.append(f"{self.name}_bucket{_labels(names, labels + (f'{bound:g}',))} {cumulative}")
+            out.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {s[-1]}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, labels)} {s[-2]:.6f}")
+            out.append(f"{self.name}_count{_labels(self.label_names, labels)} {s[-1]}")
+        return out
+
+
+REGISTRY: List[_Metric] = []
+
+http_requests = Histogram("http_request_duration_seconds", "HTTP request latency, to the end of the body.",
+                          ("method", "route", "status"))
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests being served.")
+http_db_seconds = Histogram("http_request_db_seconds", "DB time (query execution) per HTTP request.",
+                            ("route",), QUERY_BUCKETS + (2.5, 10.0))
+http_db_queries = Histogram("http_request_db_queries", "Queries per HTTP request.", ("route",), COUNT_BUCKETS)
+db_queries = Histogram("db_query_duration_seconds", "Query execution time, by the route it ran for.",
+                       ("route",), QUERY_BUCKETS)
+db_statements = Histogram("db_statement_duration_seconds",
+                          "Named hot statements (app/db/statements.py), by name.", ("statement",), QUERY_BUCKETS)
+db_pool_wait = Histogram("db_pool_acquire_seconds", "Time to get a connection from the pool.",
+                         ("pool",), QUERY_BUCKETS + (2.5, 10.0, 30.0))
+http_client = Histogram("http_client_request_duration_seconds",
+                        "Outbound HTTP calls, to the response headers.", ("service", "method", "status"))
+loop_lag = Histogram("event_loop_lag_seconds", "How late the event loop ran a timer.", (), LAG_BUCKETS)
+loop_lag_last = Gauge("event_loop_lag_last_seconds", "Most recent event-loop lag sample.")
+job_runs = Histogram("scheduler_job_duration_seconds", "Scheduled job run time.", ("job", "status"), JOB_BUCKETS)
+
+# psycopg_pool.get_stats() key → (metric, help). Counters are cumulative.
+_POOL_STATS = {
+    "pool_size": ("db_pool_size", "gauge", "Connections open (in use + idle)."),
+    "pool_available": ("db_pool_idle", "gauge", "Idle connections in the pool."),
+    "pool_max": ("db_pool_max", "gauge", "Pool max_size."),
+    "requests_waiting": ("db_pool_requests_waiting", "gauge", "Callers waiting for a connection now."),
+    "requests_num": ("db_pool_requests_total", "counter", "Connections requested from the pool."),
+    "requests_queued": ("db_pool_requests_queued_total", "counter", "Requests that had to wait."),
+    "requests_wait_ms": ("db_pool_requests_wait_ms_total", "counter", "Total time spent waiting, ms."),
+    "requests_errors": ("db_pool_timeouts_total", "counter", "Requests that timed out or failed."),
+    "connections_errors": ("db_pool_connection_errors_total", "counter", "Failed connection attempts."),
+    "connections_lost": ("db_pool_connections_lost_total", "counter", "Connections found broken."),
+}
+
+
+# ── Per-request accounting ────────────────────────────────────────────────────
+
+class RequestStats:
+    __slots__ = ("_scope", "_resolve", "_route", "db_time", "db_queries", "pool_wait", "http")
+
+    def __init__(self, scope=None, resolve=None):
+        self._scope, self._resolve, self._route = scope, resolve, None
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.pool_wait = 0.0
+        self.http: Dict[str, List[float]] = {}   # service → [calls, seconds]
+
+    @property
+    def route(self) -> str:
+        # Routing fills scope["endpoint"] in place before the endpoint runs,
+        # so by the first query the template is known.
+        if self._route is None:
+            route = self._resolve(self._scope) if self._resolve else UNMATCHED
+            if route == UNMATCHED:
+                return route
+            self._route = route
+        return self._route
+
+    def server_timing(self, total: float) -> str:
+        parts = [f"app;dur={total * 1000:.1f}",
+                 f'db;dur={self.db_time * 1000:.1f};desc="{self.db_queries} queries"',
+                 f"pool;dur={self.pool_wait * 1000:.1f}"]
+        parts += [f'{svc};dur={secs * 1000:.1f};desc="{int(n)} calls"' for svc, (n, secs) in self.http.items()]
+        return ", ".join(parts)
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def observe_query(seconds: float) -> None:
+    stats = _current.get()
+    if stats is None:
+        db_queries.observe(seconds, BACKGROUND)
+        return
+    stats.db_time += seconds
+    stats.db_queries += 1
+    db_queries.observe(seconds, stats.route)
+
+
+def observe_statement(name: str, seconds: float) -> None:
+    db_statements.observe(seconds, name)
+
+
+def observe_pool_wait(seconds: float, pool: str) -> None:
+    db_pool_wait.observe(seconds, pool)
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait += seconds
+
+
+def service_of(host: str) -> str:
+    host = (host or "").lower()
+    for suffix, name in SERVICES:
+        if host == suffix or host.endswith("." + suffix):
+            return name
+    return "other"
+
+
+def observe_http(host: str, method: str, status: str, seconds: float) -> None:
+    service = service_of(host)
+    http_client.observe(seconds, service, method, status)
+    stats = _current.get()
+    if stats is not None:
+        entry = stats.http.setdefault(service, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+def observe_job(name: str, status: str, seconds: float) -> None:
+    job_runs.observe(seconds, name, status)
+
+
+# ── ASGI middleware ───────────────────────────────────────────────────────────
+
+class MetricsMiddleware:
+    """Pure ASGI (not BaseHTTPMiddleware), so streamed bodies pass through
+    untouched and the latency covers the whole body."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Optional[Dict[int, str]] = None
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED
+        if self._routes is None:
+            app = scope.get("app")
+            routes = getattr(app, "routes", ())
+            self._routes = {id(getattr(r, "endpoint", None) or getattr(r, "app", None)): r.path
+                            for r in routes if hasattr(r, "path")}
+        return self._routes.get(id(endpoint), UNMATCHED)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(scope, self._route)
+        token = _current.set(stats)
+        debug = any(k == b"x-debug-timing" and v not in (b"", b"0") for k, v in scope.get("headers", ()))
+        t0 = time.perf_counter()
+        status = 500
+        http_in_flight.inc(amount=1)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if debug:
+                    timing = stats.server_timing(time.perf_counter() - t0)
+                    message["headers"] = list(message.get("headers", ())) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.inc(amount=-1)
+            _current.reset(token)
+            route = stats.route
+            http_requests.observe(time.perf_counter() - t0, scope["method"], route, str(status))
+            http_db_seconds.observe(stats.db_time, route)
+            http_db_queries.observe(stats.db_queries, route)
+
+
+# ── Outbound HTTP ─────────────────────────────────────────────────────────────
+
+_http_installed = False
+
+
+def install_http_client_metrics() -> None:
+    """Time every httpx and requests call at the transport (idempotent)."""
+    global _http_installed
+    if _http_installed:
+        return
+    _http_installed = True
+
+    import httpx
+
+    sync_send = httpx.HTTPTransport.handle_request
+    async_send = httpx.AsyncHTTPTransport.handle_async_request
+
+    def handle_request(self, request):
+        t0, status = time.perf_counter(), "error"
+        try:
+            response = sync_send(self, request)
+            status = str(response.status_code)
+            return response
+        finally:
+            observe_http(request.url.host, request.method, status, time.perf_counter() - t0)
+
+    async def handle_async_request(self, request):
+        t0, status = time.perf_counter(), "error"
+        try:
+            response = await async_send(self, request)
+            status = str(response.status_code)
+            return response
+        finally:
+            observe_http(request.url.host, request.method, status, time.perf_counter() - t0)
+
+    httpx.HTTPTransport.handle_request = handle_request
+    httpx.AsyncHTTPTransport.handle_async_request = handle_async_request
+
+    try:   # the MercadoPago, Transbank and Resend SDKs use requests
+        from urllib.parse import urlsplit
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        return
+    adapter_send = HTTPAdapter.send
+
+    def send(self, request, *args, **kwargs):
+        t0, status = time.perf_counter(), "error"
+        try:
+            response = adapter_send(self, request, *args, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            observe_http(urlsplit(request.url).hostname or "", request.method, status, time.perf_counter() - t0)
+
+    HTTPAdapter.send = send
+
+
+# ── Event loop ────────────────────────────────────────────────────────────────
+
+async def monitor_event_loop(interval: float = 0.5) -> None:
+    """Sleep `interval` in a loop; whatever it oversleeps is time the loop
+    spent running something else without yielding."""
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - t0 - interval)
+        loop_lag.observe(lag)
+        loop_lag_last.set(value=lag)
+
+
+# ── Exposition ────────────────────────────────────────────────────────────────
+
+def _pool_lines() -> List[str]:
+    from app.db.connection import connection_budget, dedicated_connections, pool_stats
+
+    stats = pool_stats()
+    out = []
+    for key, (name, kind, help) in _POOL_STATS.items():
+        out += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        out += [f'{name}{{pool="{pool}"}} {s.get(key, 0)}' for pool, s in sorted(stats.items())]
+    # Saturation: connections handed out over max_size (1 = every one busy;
+    # with requests_waiting > 0, callers are queueing).
+    out += ["# HELP db_pool_in_use Connections checked out now.", "# TYPE db_pool_in_use gauge"]
+    out += [f'db_pool_in_use{{pool="{pool}"}} {s.get("pool_size", 0) - s.get("pool_available", 0)}'
+            for pool, s in sorted(stats.items())]
+    out += ["# HELP db_pool_saturation Connections checked out / max_size.", "# TYPE db_pool_saturation gauge"]
+    out += [f'db_pool_saturation{{pool="{pool}"}} '
+            f'{(s.get("pool_size", 0) - s.get("pool_available", 0)) / (s.get("pool_max") or 1):.3f}'
+            for pool, s in sorted(stats.items())]
+    budget = connection_budget()
+    out += ["# HELP db_connection_budget Most connections this process can hold (pool maxima + dedicated).",
+            "# TYPE db_connection_budget gauge", f"db_connection_budget {budget['total']}"]
+    out += ["# HELP db_dedicated_connections Connections held outside the pools (LISTEN loops).",
+            "# TYPE db_dedicated_connections gauge"]
+    out += [f'db_dedicated_connections{{purpose="{_escape(p)}"}} {n}'
+            for p, n in sorted(dedicated_connections().items())]
+    return out
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    lines += _pool_lines()
+    return "\n".join(lines) + "\n"
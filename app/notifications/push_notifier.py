@@ -1,69 +1,36 @@
 """
 Web Push notification system using the W3C Push API + VAPID.
-Replaces the previous Expo-based system.
+Replaces the previous Expo-based system. Delivery (subscription cache,
+VAPID token cache, pooled sender, burst coalescing) lives in
+app/notifications/web_push.py.
 """
 import asyncio
 import json
 import logging
 from datetime import datetime
 from typing import Dict, List, Optional
-from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
 
 from app.config import get_settings
+from app.notifications.web_push import (
+    EXPIRED, VAPID_SUB, BurstCoalescer, SubscriptionRegistry, close_sender, get_sender, push_origin,
+)
 
 CHILE_TZ = ZoneInfo("America/Santiago")
 logger = logging.getLogger(__name__)
 
-VAPID_SUB = "mailto:hotboatnotification@gmail.com"
-
 
 def _vapid_claims_for(endpoint: str) -> dict:
     """Build VAPID claims with correct aud for the given push endpoint."""
-    url = urlparse(endpoint)
     return {
         "sub": VAPID_SUB,
-        "aud": f"{url.scheme}://{url.netloc}",
+        "aud": push_origin(endpoint),
     }
 
 
-_EXPIRED_SENTINEL = "__EXPIRED__"
-
-
-def _send_web_push_sync(subscription_info: dict, payload: dict, vapid_private_key: str):
-    """Blocking Web Push send — run inside asyncio.to_thread.
-
-    Returns True on success, _EXPIRED_SENTINEL if the subscription is gone
-    (HTTP 410/404 → must be deleted), or False on other transient errors.
-    """
-    try:
-        from pywebpush import webpush, WebPushException
-    except ImportError:
-        logger.error("pywebpush not installed — add pywebpush>=1.9.4,<2.0.0 to requirements.txt")
-        return False
-    try:
-        claims = _vapid_claims_for(subscription_info["endpoint"])
-        webpush(
-            subscription_info=subscription_info,
-            data=json.dumps(payload),
-            vapid_private_key=vapid_private_key,
-            vapid_claims=claims,
-        )
-        return True
-    except Exception as exc:
-        # 410 Gone / 404 Not Found → subscription is permanently invalid, must remove
-        status = getattr(getattr(exc, "response", None), "status_code", None)
-        if status in (404, 410):
-            logger.info("Web Push subscription expired/gone (HTTP %s) — will remove: %s...",
-                        status, subscription_info.get("endpoint", "")[:60])
-            return _EXPIRED_SENTINEL
-        logger.warning("Web Push send failed (endpoint: %s...): %s",
-                       subscription_info.get("endpoint", "")[:40], exc)
-        return False
-
-
 def _send_web_push_sync_verbose(subscription_info: dict, payload: dict, vapid_private_key: str) -> bool:
-    """Same as _send_web_push_sync but raises on error (for test endpoint)."""
+    """One blocking pywebpush send that raises on error — only the
+    /api/push/test diagnostics use it, for the exception text."""
     from pywebpush import webpush, WebPushException
     claims = _vapid_claims_for(subscription_info["endpoint"])
     webpush(
@@ -80,6 +47,8 @@ class PushNotifier:
 
     def __init__(self):
         self.settings = get_settings()
+        self.subscriptions = SubscriptionRegistry()
+        self._bursts = BurstCoalescer(self._send_message_burst)
 
     @property
     def _private_key(self) -> Optional[str]:
@@ -105,21 +74,22 @@ class PushNotifier:
             logger.warning("No Web Push subscriptions registered.")
             return False
 
+        try:
+            sender = get_sender()
+        except ImportError:
+            logger.error("pywebpush not installed — add pywebpush>=1.9.4,<2.0.0 to requirements.txt")
+            return False
         payload = {"title": title, "body": body, **(data or {})}
-        results = await asyncio.gather(
-            *[
-                asyncio.to_thread(_send_web_push_sync, sub, payload, self._private_key)
-                for sub in subscriptions
-            ],
-            return_exceptions=True,
-        )
+        results = await sender.send_many(
+            subscriptions, payload, urgency="high" if priority == "high" else "normal")
         # Clean up permanently expired subscriptions so they stop accumulating
         expired_endpoints = [
             sub["endpoint"]
             for sub, result in zip(subscriptions, results)
-            if result is _EXPIRED_SENTINEL
+            if result is EXPIRED
         ]
         if expired_endpoints:
+            self.subscriptions.discard(expired_endpoints)
             asyncio.create_task(self._delete_subscriptions(expired_endpoints))
 
         sent = sum(1 for r in results if r is True)
@@ -133,20 +103,47 @@ class PushNotifier:
         message_preview: str,
         ad_source: str = None,
     ) -> bool:
+        """Queue a new-message notification. Messages from the same phone
+        within COALESCE_WINDOW_S go out as one notification (see
+        _send_message_burst); returns False only when push is disabled."""
+        if not self.enabled:
+            return False
+        self._bursts.add(phone_number, {
+            "contact_name": contact_name,
+            "preview": message_preview,
+            "ad_source": ad_source,
+            "timestamp": datetime.now(CHILE_TZ).isoformat(),
+        })
+        return True
+
+    async def _send_message_burst(self, phone_number: str, messages: List[Dict]) -> None:
+        last = messages[-1]
+        contact_name = last["contact_name"]
+        ad_source = next((m["ad_source"] for m in messages if m.get("ad_source")), None)
         title = f"💬 {contact_name}"
         if ad_source:
             title = f"📢 {contact_name}  ·  {ad_source}"
+        body = last["preview"][:100]
+        if len(messages) > 1:
+            body = f"{len(messages)} mensajes nuevos · {body}"[:100]
 
         data = {
             "type": "new_message",
             "phone": phone_number,
             "contact_name": contact_name,
-            "timestamp": datetime.now(CHILE_TZ).isoformat(),
+            "timestamp": last["timestamp"],
+            "message_count": len(messages),
         }
         if ad_source:
             data["ad_source"] = ad_source
 
-        return await self.send_notification(title, message_preview[:100], data)
+        await self.send_notification(title, body, data)
+
+    async def flush(self) -> None:
+        """Send the notifications still inside their burst window and close
+        the HTTP pool (app shutdown)."""
+        await self._bursts.flush()
+        await close_sender()
 
     async def register_subscription(self, endpoint: str, p256dh: str, auth: str) -> bool:
         try:
@@ -162,6 +159,7 @@ class PushNotifier:
                             last_used_at = NOW()
                     """, (endpoint, p256dh, auth))
                     conn.commit()
+            self.subscriptions.invalidate()
             logger.info("Web Push subscription registered/updated")
             return True
         except Exception as exc:
@@ -190,6 +188,7 @@ class PushNotifier:
                 with conn.cursor() as cur:
                     cur.execute("DELETE FROM web_push_subscriptions WHERE endpoint = %s", (endpoint,))
                     conn.commit()
+            self.subscriptions.invalidate()
             return True
         except Exception as exc:
             logger.error("Error unregistering Web Push subscription: %s", exc)
@@ -197,18 +196,7 @@ class PushNotifier:
 
     async def _get_subscriptions(self) -> List[Dict]:
         try:
-            from app.db.connection import get_connection
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT endpoint, p256dh, auth FROM web_push_subscriptions
-                        WHERE last_used_at > NOW() - INTERVAL '90 days'
-                    """)
-                    rows = cur.fetchall()
-            return [
-                {"endpoint": r[0], "keys": {"p256dh": r[1], "auth": r[2]}}
-                for r in rows
-            ]
+            return await self.subscriptions.get()
         except Exception as exc:
             logger.error("Error fetching Web Push subscriptions: %s", exc)
             return []
@@ -0,0 +1,282 @@
+"""
+Web Push delivery: subscription registry, VAPID token cache, pooled sender
+and per-customer burst coalescing.
+
+Before this, every incoming customer message did the same work from
+scratch. It read web_push_subscriptions and then ran one
+pywebpush.webpush() per subscription in a worker thread. Each of those
+re-parsed the VAPID key, re-signed the JWT and opened a fresh TLS
+connection to the push service.
+
+  • SubscriptionRegistry keeps the active subscriptions in memory. It is
+    dropped on subscribe/unsubscribe and when a push service reports an
+    endpoint gone (404/410), and reloaded at least every
+    SUBSCRIPTIONS_MAX_AGE_S. The reload is what picks up a subscription
+    registered through another replica.
+  • VapidSigner signs one JWT per push-service origin (the JWT's aud) and
+    reuses it until VAPID_REFRESH_MARGIN_S before it expires.
+  • WebPushSender encrypts the payload for every subscription in a single
+    worker-thread hop (aes128gcm needs a fresh ECDH key per recipient, so
+    that part can't be shared). It then POSTs them concurrently from one
+    httpx.AsyncClient, which keeps a keep-alive pool per push-service host.
+  • BurstCoalescer collects a customer's messages for COALESCE_WINDOW_S
+    after the first one and sends one notification for the lot, e.g. five
+    messages in 3 s become one "5 mensajes nuevos". The service worker
+    already tags notifications by phone, so a later burst replaces the
+    earlier notification instead of stacking.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+VAPID_SUB = "mailto:hotboatnotification@gmail.com"
+# Push services accept at most 24 h; pywebpush used 12 h.
+VAPID_TOKEN_TTL_S = 12 * 3600
+VAPID_REFRESH_MARGIN_S = 3600
+SUBSCRIPTIONS_MAX_AGE_S = 60
+SUBSCRIPTION_ACTIVE_DAYS = 90
+# Same as pywebpush.webpush()'s default: deliver now or not at all.
+PUSH_TTL_S = 0
+HTTP_TIMEOUT_S = 10
+HTTP_MAX_CONNECTIONS = 20
+COALESCE_WINDOW_S = 3.0
+
+EXPIRED = "__EXPIRED__"
+
+
+def push_origin(endpoint: str) -> str:
+    """The VAPID audience for a push endpoint: its scheme://host."""
+    url = urlparse(endpoint)
+    return f"{url.scheme}://{url.netloc}"
+
+
+# ── Subscriptions ─────────────────────────────────────────────────────────────
+
+def _load_subscriptions() -> List[Dict]:
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT endpoint, p256dh, auth FROM web_push_subscriptions
+                WHERE last_used_at > NOW() - make_interval(days => %s)
+                """,
+                (SUBSCRIPTION_ACTIVE_DAYS,),
+            )
+            rows = cur.fetchall()
+    return [{"endpoint": r[0], "keys": {"p256dh": r[1], "auth": r[2]}} for r in rows]
+
+
+class SubscriptionRegistry:
+    def __init__(self, loader: Callable[[], List[Dict]] = _load_subscriptions,
+                 max_age_s: float = SUBSCRIPTIONS_MAX_AGE_S):
+        self._loader = loader
+        self.max_age_s = max_age_s
+        self._subs: Optional[List[Dict]] = None
+        self._loaded_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self.loads = 0
+
+    async def get(self) -> List[Dict]:
+        if self._subs is not None and time.monotonic() - self._loaded_at < self.max_age_s:
+            return self._subs
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # A burst of messages waits for one load instead of each running its own.
+            if self._subs is None or time.monotonic() - self._loaded_at >= self.max_age_s:
+                self._subs = await asyncio.to_thread(self._loader)
+                self._loaded_at = time.monotonic()
+                self.loads += 1
+        return self._subs
+
+    def invalidate(self) -> None:
+        self._subs = None
+
+    def discard(self, endpoints: List[str]) -> None:
+        if self._subs is not None:
+            gone = set(endpoints)
+            self._subs = [s for s in self._subs if s["endpoint"] not in gone]
+
+
+# ── VAPID ─────────────────────────────────────────────────────────────────────
+
+class VapidSigner:
+    """Authorization headers per push-service origin, signed once per
+    VAPID_TOKEN_TTL_S instead of once per message and subscription."""
+
+    def __init__(self, private_key: str, sub: str = VAPID_SUB):
+        from py_vapid import Vapid  # pywebpush dependency
+        self._vapid = Vapid.from_string(private_key=private_key)
+        self.sub = sub
+        self._tokens: Dict[str, Tuple[Dict[str, str], int]] = {}
+        self.signed = 0
+
+    def headers_for(self, endpoint: str) -> Dict[str, str]:
+        aud = push_origin(endpoint)
+        now = int(time.time())
+        cached = self._tokens.get(aud)
+        if cached and cached[1] - VAPID_REFRESH_MARGIN_S > now:
+            return cached[0]
+        exp = now + VAPID_TOKEN_TTL_S
+        headers = self._vapid.sign({"sub": self.sub, "aud": aud, "exp": exp})
+        self._tokens[aud] = (headers, exp)
+        self.signed += 1
+        return headers
+
+
+# ── Sender ────────────────────────────────────────────────────────────────────
+
+def _encrypt_all(subscriptions: List[Dict], data: bytes) -> List[Optional[bytes]]:
+    """aes128gcm body per subscription; None where the keys are unusable."""
+    from pywebpush import WebPusher
+    bodies = []
+    for sub in subscriptions:
+        try:
+            bodies.append(WebPusher(sub).encode(data, "aes128gcm")["body"])
+        except Exception as exc:
+            logger.warning("Web Push encrypt failed (endpoint: %s...): %s", sub.get("endpoint", "")[:40], exc)
+            bodies.append(None)
+    return bodies
+
+
+class WebPushSender:
+    def __init__(self, private_key: str, client_factory: Optional[Callable] = None):
+        self._signer = VapidSigner(private_key)
+        self._client_factory = client_factory
+        self._client = None
+
+    def _http(self):
+        if self._client is None:
+            if self._client_factory is not None:
+                self._client = self._client_factory()
+            else:
+                import httpx
+                self._client = httpx.AsyncClient(
+                    timeout=HTTP_TIMEOUT_S,
+                    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                        max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+                )
+        return self._client
+
+    async def _post(self, sub: Dict, body: bytes, urgency: str):
+        endpoint = sub["endpoint"]
+        headers = {
+            **self._signer.headers_for(endpoint),
+            "Content-Encoding": "aes128gcm",
+            "Content-Type": "application/octet-stream",
+            "TTL": str(PUSH_TTL_S),
+            "Urgency": urgency,
+        }
+        try:
+            resp = await self._http().post(endpoint, content=body, headers=headers)
+        except Exception as exc:
+            logger.warning("Web Push send failed (endpoint: %s...): %s", endpoint[:40], exc)
+            return False
+        if resp.status_code in (404, 410):
+            # Subscription permanently gone — the caller deletes it.
+            logger.info("Web Push subscription expired/gone (HTTP %s) — will remove: %s...",
+                        resp.status_code, endpoint[:60])
+            return EXPIRED
+        if resp.status_code >= 300:
+            logger.warning("Web Push send failed (endpoint: %s...): HTTP %s %s",
+                           endpoint[:40], resp.status_code, resp.text[:200])
+            return False
+        return True
+
+    async def send_many(self, subscriptions: List[Dict], payload: Dict, urgency: str = "high") -> List:
+        """Deliver one payload to every subscription. Returns, per
+        subscription, True, False (transient failure) or EXPIRED."""
+        if not subscriptions:
+            return []
+        data = json.dumps(payload).encode()
+        bodies = await asyncio.to_thread(_encrypt_all, subscriptions, data)
+        results = await asyncio.gather(*[
+            self._post(sub, body, urgency) if body is not None else _false()
+            for sub, body in zip(subscriptions, bodies)
+        ])
+        return list(results)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+async def _false() -> bool:
+    return False
+
+
+_sender: Optional[WebPushSender] = None
+
+
+def get_sender() -> WebPushSender:
+    global _sender
+    if _sender is None:
+        _sender = WebPushSender(get_settings().vapid_private_key)
+    return _sender
+
+
+async def close_sender() -> None:
+    global _sender
+    if _sender is not None:
+        await _sender.aclose()
+        _sender = None
+
+
+# ── Coalescing ────────────────────────────────────────────────────────────────
+
+class BurstCoalescer:
+    """Per-key (customer phone) burst window. The first message opens a
+    window of `window_s`; everything arriving for that key before it
+    closes is handed to `deliver` as one list."""
+
+    def __init__(self, deliver: Callable[[str, List[Dict]], Awaitable[None]],
+                 window_s: float = COALESCE_WINDOW_S):
+        self._deliver = deliver
+        self.window_s = window_s
+        self._pending: Dict[str, List[Dict]] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+
+    def add(self, key: str, item: Dict) -> int:
+        """Queue an item; returns how many are now waiting for this key."""
+        items = self._pending.setdefault(key, [])
+        items.append(item)
+        if key not in self._timers:
+            self._timers[key] = asyncio.create_task(self._fire_later(key))
+        return len(items)
+
+    async def _fire_later(self, key: str) -> None:
+        try:
+            await asyncio.sleep(self.window_s)
+        finally:
+            self._timers.pop(key, None)
+        await self._fire(key)
+
+    async def _fire(self, key: str) -> None:
+        items = self._pending.pop(key, None)
+        if not items:
+            return
+        try:
+            await self._deliver(key, items)
+        except Exception as exc:
+            logger.warning("Web Push coalesced delivery failed for %s: %s", key, exc)
+
+    async def flush(self) -> None:
+        """Deliver every open window now (shutdown)."""
+        for task in list(self._timers.values()):
+            task.cancel()
+        self._timers.clear()
+        for key in list(self._pending):
+            await self._fire(key)
+
+    @property
+    def pending(self) -> int:
+        return sum(len(v) for v in self._pending.values())
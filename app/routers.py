@@ -0,0 +1,83 @@
+"""
+Router registry and deployment roles
+
+main.py used to import every router module at import time, so a replica
+that only answers Meta's webhook still loaded the whole admin panel
+(admin_router alone is ~3,500 lines), the financial reports, stock, gastos
+and so on before it could accept its first request.
+
+Routers are now listed here by import path and only imported when the
+deployment's role mounts them. APP_ROLE picks the role:
+
+  webhook  WhatsApp webhook, chat UI and background workers — no booking
+           or admin routers
+  public   customer-facing booking site (booking, content, firma,
+           mireserva, tabla, tracked links)
+  admin    public + admin panel routers (the panel calls the public APIs
+           too)
+  all      everything (default; what a single service runs)
+
+The routes defined directly in main.py (webhook, Kia-Ai chat, leads, push)
+are mounted in every role. Background workers (job scheduler, inbox
+sweeper, follow-up queue) run in the ``webhook`` and ``all`` roles.
+"""
+import importlib
+import logging
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# name → "module:attribute"; order is include order (route precedence).
+ROUTERS = {
+    "booking": "app.booking.router:router",
+    "admin": "app.booking.admin_router:admin_router",
+    "content": "app.booking.content_router:content_router",
+    "signatures": "app.booking.signatures_router:signatures_router",
+    "stock": "app.booking.stock_router:stock_router",
+    "financial": "app.booking.financial_router:financial_router",
+    "bot_config": "app.booking.bot_config_router:bot_config_router",
+    "gastos": "app.booking.gastos_router:gastos_router",
+    "tabla": "app.booking.tabla_router:tabla_router",
+    "reserva": "app.booking.reserva_router:reserva_router",
+    "link_tracking": "app.booking.link_tracking_router:link_tracking_router",
+    "export": "app.booking.export_router:export_router",
+}
+
+_PUBLIC = ("booking", "content", "signatures", "tabla", "reserva", "link_tracking")
+_ADMIN = ("admin", "stock", "financial", "bot_config", "gastos", "export")
+
+ROLES = {
+    "webhook": (),
+    "public": _PUBLIC,
+    "admin": _PUBLIC + _ADMIN,
+    "all": tuple(ROUTERS),
+}
+_WORKER_ROLES = ("webhook", "all")
+
+
+def resolve_role(role: str) -> str:
+    role = (role or "all").strip().lower()
+    if role not in ROLES:
+        logger.warning(f"Unknown APP_ROLE {role!r} — falling back to 'all'")
+        return "all"
+    return role
+
+
+def runs_workers(role: str) -> bool:
+    return resolve_role(role) in _WORKER_ROLES
+
+
+def load_router(name: str):
+    module_name, attr = ROUTERS[name].split(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def mount_routers(app, role: str) -> List[str]:
+    """Import and include the routers ``role`` needs; returns their names."""
+    wanted = set(ROLES[resolve_role(role)])
+    mounted = []
+    for name in ROUTERS:
+        if name in wanted:
+            app.include_router(load_router(name))
+            mounted.append(name)
+    return mounted
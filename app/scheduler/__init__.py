@@ -0,0 +1,30 @@
+"""Background job scheduling"""
+from app.scheduler.delayed import (
+    DelayedJobQueue,
+    cancel_job,
+    ensure_delayed_jobs_table,
+    schedule_job,
+    seed_jobs,
+)
+from app.scheduler.jobs import (
+    CronSpec,
+    Job,
+    JobScheduler,
+    ensure_scheduler_table,
+    get_job_status,
+    trigger_job,
+)
+
+__all__ = [
+    "DelayedJobQueue",
+    "cancel_job",
+    "ensure_delayed_jobs_table",
+    "schedule_job",
+    "seed_jobs",
+    "CronSpec",
+    "Job",
+    "JobScheduler",
+    "ensure_scheduler_table",
+    "get_job_status",
+    "trigger_job",
+]
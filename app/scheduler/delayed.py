@@ -0,0 +1,358 @@
+"""
+Delayed-job engine backed by Postgres
+
+A queue is a named set of rows in delayed_jobs, each with a due time. The
+runner sleeps exactly until the earliest due row (no fixed polling
+interval), and is woken early via LISTEN/NOTIFY whenever schedule() or
+cancel() changes the queue — on any replica, since NOTIFY goes through the
+database. Due rows are claimed in batches with FOR UPDATE SKIP LOCKED, so
+the same queue can run on every replica without double-processing, and
+handlers run concurrently up to a bounded limit.
+
+A claim is a lease: if the process dies mid-job the row becomes claimable
+again after ``lease_s``. A handler may return a number of seconds to
+re-arm its own row; returning None completes the job. That is how periodic
+work runs on the engine: app/scheduler/jobs.py keeps one row per declared
+job in the "scheduler" queue (registered with seed_jobs()) and every run
+re-arms it for the next slot.
+
+A runner keeps claiming while fewer than ``concurrency`` rows are in
+flight, so one long handler doesn't hold up rows that fall due meanwhile.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "delayed_jobs"
+# Upper bound on how long a runner sleeps without re-checking the table,
+# in case a NOTIFY was missed (listener reconnecting, etc.).
+MAX_IDLE_S = 30
+LISTEN_RETRY_S = 5
+
+Handler = Callable[[str, dict], Awaitable[Optional[float]]]
+
+
+def ensure_delayed_jobs_table() -> None:
+    from app.db.connection import get_connection
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS delayed_jobs (
+                        queue      TEXT NOT NULL,
+                        job_key    TEXT NOT NULL,
+                        payload    JSONB NOT NULL DEFAULT '{}'::jsonb,
+                        due_at     TIMESTAMPTZ NOT NULL,
+                        claimed_at TIMESTAMPTZ,
+                        attempts   INTEGER NOT NULL DEFAULT 0,
+                        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                        PRIMARY KEY (queue, job_key)
+                    )
+                """)
+                cur.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_delayed_jobs_due ON delayed_jobs (queue, due_at)"
+                )
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"delayed_jobs table setup failed: {e}")
+        raise
+
+
+def schedule_job(queue: str, key: str, delay_s: float, payload: Optional[dict] = None, cur=None) -> None:
+    """Create or replace the job ``key`` in ``queue``, due ``delay_s`` from
+    now, and wake the queue's runners. Pass ``cur`` to enlist in an
+    existing transaction."""
+    sql = """
+        INSERT INTO delayed_jobs (queue, job_key, payload, due_at, claimed_at, attempts)
+        VALUES (%s, %s, %s, NOW() + make_interval(secs => %s), NULL, 0)
+        ON CONFLICT (queue, job_key) DO UPDATE SET
+            payload    = EXCLUDED.payload,
+            due_at     = EXCLUDED.due_at,
+            claimed_at = NULL,
+            attempts   = 0
+    """
+    params = (queue, key, json.dumps(payload or {}, default=str), float(delay_s))
+    if cur is not None:
+        cur.execute(sql, params)
+        cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, queue))
+        return
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as c:
+            c.execute(sql, params)
+            c.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, queue))
+        conn.commit()
+
+
+def seed_jobs(queue: str, jobs: Sequence[Tuple[str, dict, float]]) -> None:
+    """Register the recurring jobs of ``queue``: (key, payload, delay_s).
+    A missing job is created due ``delay_s`` from now. An existing one keeps
+    its due time (it survives restarts and deploys) unless its payload
+    changed, e.g. a new schedule, and it isn't running: then it is re-armed
+    with the new delay."""
+    from app.db.connection import get_connection
+    if not jobs:
+        return
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO delayed_jobs (queue, job_key, payload, due_at)
+                SELECT %s, t.k, t.p, NOW() + make_interval(secs => t.delay)
+                FROM unnest(%s::text[], %s::jsonb[], %s::float8[]) AS t(k, p, delay)
+                ON CONFLICT (queue, job_key) DO UPDATE SET
+                    payload = EXCLUDED.payload,
+                    due_at  = CASE
+                        WHEN delayed_jobs.payload IS DISTINCT FROM EXCLUDED.payload
+                         AND delayed_jobs.claimed_at IS NULL
+                        THEN EXCLUDED.due_at
+                        ELSE delayed_jobs.due_at END
+                """,
+                (
+                    queue,
+                    [k for k, _, _ in jobs],
+                    [json.dumps(p, default=str) for _, p, _ in jobs],
+                    [float(d) for _, _, d in jobs],
+                ),
+            )
+            cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, queue))
+        conn.commit()
+
+
+def cancel_job(queue: str, key: str) -> None:
+    """Drop a pending job. A job already claimed by a runner still finishes."""
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM delayed_jobs WHERE queue=%s AND job_key=%s AND claimed_at IS NULL",
+                (queue, key),
+            )
+            if cur.rowcount:
+                cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, queue))
+        conn.commit()
+
+
+class DelayedJobQueue:
+    """Runner for one named queue. Create one per queue at import time and
+    start ``run()`` as a background task on each replica that should
+    process it.
+
+    ``keys`` restricts the runner to those job keys (rows registered by
+    another version of the app are left to it). Subclasses that need a
+    row's due time override handle() instead of passing a handler."""
+
+    def __init__(
+        self,
+        name: str,
+        handler: Optional[Handler] = None,
+        concurrency: int = 8,
+        batch_size: int = 50,
+        max_attempts: int = 3,
+        lease_s: float = 300,
+        retry_base_s: int = 30,
+        keys: Optional[Sequence[str]] = None,
+    ):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease_s = lease_s
+        self.retry_base_s = retry_base_s
+        self.keys = list(keys) if keys is not None else None
+        self.stats: Dict[str, float] = {"claimed": 0, "completed": 0, "failed": 0, "retried": 0}
+        self._in_flight = 0
+
+    # ── public API ────────────────────────────────────────────────────────────
+
+    def schedule(self, key: str, delay_s: float, payload: Optional[dict] = None) -> None:
+        schedule_job(self.name, key, delay_s, payload)
+
+    def cancel(self, key: str) -> None:
+        cancel_job(self.name, key)
+
+    async def handle(self, key: str, payload: dict, due_at: datetime) -> Optional[float]:
+        """Run one claimed job; seconds to re-arm it, or None when done."""
+        return await self.handler(key, payload)
+
+    async def run(self) -> None:
+        from app.db.connection import use_pool
+        use_pool("batch")
+        wake = asyncio.Event()
+        listener = asyncio.create_task(self._listen(wake))
+        sem = asyncio.Semaphore(self.concurrency)
+        batches: set = set()
+
+        def finished(task: asyncio.Task, n: int) -> None:
+            batches.discard(task)
+            self._in_flight -= n
+            wake.set()  # room for more claims
+
+        try:
+            while True:
+                # Cleared before reading the table, so a NOTIFY that lands
+                # while we're querying still cuts the following sleep short.
+                wake.clear()
+                timeout = MAX_IDLE_S
+                try:
+                    # At capacity: wait for a batch to finish (it sets wake).
+                    if self._in_flight < self.concurrency:
+                        rows = await asyncio.to_thread(self._claim_due)
+                        if rows:
+                            self._in_flight += len(rows)
+                            task = asyncio.create_task(self._run_batch(rows, sem))
+                            batches.add(task)
+                            task.add_done_callback(lambda t, n=len(rows): finished(t, n))
+                            continue  # more may already be due
+                        next_due = await asyncio.to_thread(self._seconds_until_next)
+                        if next_due is not None:
+                            timeout = min(max(next_due, 0.05), MAX_IDLE_S)
+                except Exception as e:
+                    logger.warning(f"delayed queue {self.name} error: {e}")
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            listener.cancel()
+            for task in list(batches):
+                task.cancel()
+
+    # ── internals ─────────────────────────────────────────────────────────────
+
+    def _claim_due(self) -> list:
+        from app.db.connection import get_connection
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE delayed_jobs d
+                    SET claimed_at = NOW(), attempts = d.attempts + 1
+                    FROM (
+                        SELECT queue, job_key FROM delayed_jobs
+                        WHERE queue = %s
+                          AND (%s::text[] IS NULL OR job_key = ANY(%s::text[]))
+                          AND due_at <= NOW()
+                          AND (claimed_at IS NULL
+                               OR claimed_at < NOW() - make_interval(secs => %s))
+                        ORDER BY due_at
+                        FOR UPDATE SKIP LOCKED
+                        LIMIT %s
+                    ) due
+                    WHERE d.queue = due.queue AND d.job_key = due.job_key
+                    RETURNING d.job_key, d.payload, d.due_at, d.attempts
+                    """,
+                    (self.name, self.keys, self.keys, self.lease_s, self.batch_size),
+                )
+                rows = cur.fetchall()
+            conn.commit()
+        return rows
+
+    def _seconds_until_next(self) -> Optional[float]:
+        from app.db.connection import get_connection
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT EXTRACT(EPOCH FROM MIN(
+                        CASE WHEN claimed_at IS NULL THEN due_at
+                             ELSE claimed_at + make_interval(secs => %s) END
+                    ) - NOW())
+                    FROM delayed_jobs
+                    WHERE queue = %s AND (%s::text[] IS NULL OR job_key = ANY(%s::text[]))
+                    """,
+                    (self.lease_s, self.name, self.keys, self.keys),
+                )
+                row = cur.fetchone()
+        return float(row[0]) if row and row[0] is not None else None
+
+    async def _run_one(self, key: str, payload: dict, due_at: datetime, sem: asyncio.Semaphore):
+        async with sem:
+            try:
+                return True, await self.handle(key, payload or {}, due_at)
+            except Exception as e:
+                logger.error(f"delayed job {self.name}/{key} failed: {e}")
+                return False, None
+
+    async def _run_batch(self, rows: list, sem: asyncio.Semaphore) -> None:
+        try:
+            await self._run_claimed(rows, sem)
+        except Exception as e:
+            # The rows stay claimed; they are retried once the lease expires.
+            logger.warning(f"delayed queue {self.name} batch error: {e}")
+
+    async def _run_claimed(self, rows: list, sem: asyncio.Semaphore) -> None:
+        self.stats["claimed"] += len(rows)
+        results = await asyncio.gather(*(self._run_one(k, p, d, sem) for k, p, d, _ in rows))
+        done, rearm, retry = [], [], []
+        for (key, _, due_at, attempts), (ok, next_in) in zip(rows, results):
+            if ok and next_in is not None:
+                # Re-armed: a fresh run, so the attempt counter resets.
+                rearm.append((key, due_at, float(next_in), False))
+                self.stats["completed"] += 1
+            elif ok or attempts >= self.max_attempts:
+                done.append((key, due_at))
+                self.stats["completed" if ok else "failed"] += 1
+            else:
+                # Exponential backoff; attempts is kept so max_attempts holds.
+                retry.append((key, due_at, float(self.retry_base_s * (2 ** (attempts - 1))), True))
+                self.stats["retried"] += 1
+        await asyncio.to_thread(self._finish, done, rearm + retry)
+
+    def _finish(self, done: list, requeue: list) -> None:
+        """Complete and re-arm a whole batch in one transaction. Rows are
+        matched on (job_key, due_at): one that was re-scheduled while its
+        old version was running has a new due_at and is left alone."""
+        from app.db.connection import get_connection
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                if done:
+                    cur.execute(
+                        """
+                        DELETE FROM delayed_jobs d
+                        USING unnest(%s::text[], %s::timestamptz[]) AS t(k, due)
+                        WHERE d.queue = %s AND d.job_key = t.k AND d.due_at = t.due
+                        """,
+                        ([k for k, _ in done], [d for _, d in done], self.name),
+                    )
+                if requeue:
+                    cur.execute(
+                        """
+                        UPDATE delayed_jobs d
+                        SET due_at = NOW() + make_interval(secs => t.delay),
+                            claimed_at = NULL,
+                            attempts = CASE WHEN t.keep THEN d.attempts ELSE 0 END
+                        FROM unnest(%s::text[], %s::timestamptz[], %s::float8[], %s::bool[])
+                             AS t(k, due, delay, keep)
+                        WHERE d.queue = %s AND d.job_key = t.k AND d.due_at = t.due
+                        """,
+                        (
+                            [r[0] for r in requeue],
+                            [r[1] for r in requeue],
+                            [r[2] for r in requeue],
+                            [r[3] for r in requeue],
+                            self.name,
+                        ),
+                    )
+            conn.commit()
+
+    async def _listen(self, wake: asyncio.Event) -> None:
+        from app.db.connection import connect_dedicated
+        while True:
+            try:
+                async with connect_dedicated("listen:delayed", autocommit=True) as aconn:
+                    await aconn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    wake.set()  # re-read the table after every (re)connect
+                    async for notify in aconn.notifies():
+                        if notify.payload == self.name:
+                            wake.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"delayed queue {self.name} LISTEN error: {e}")
+            await asyncio.sleep(LISTEN_RETRY_S)
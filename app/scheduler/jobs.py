@@ -0,0 +1,344 @@
+"""
+Declarative periodic job scheduler
+
+Replaces the hand-rolled ``while True: ... asyncio.sleep(...)`` loops that
+used to live in app/main.py. Each of those did its own clock math, kept
+"already ran today" in local variables (lost on every restart/deploy), and
+all of them ran on whichever single process won the scheduler advisory
+lock.
+
+Jobs are declared as ``Job(...)`` with either an interval or a cron
+expression (Santiago time). They run on the delayed-job engine
+(app/scheduler/delayed.py) rather than on a scheduler of their own: each
+job is one row of the "scheduler" queue in delayed_jobs, keyed by its name,
+and every run re-arms that row for the job's next slot. Claiming, leases,
+SKIP LOCKED across replicas and the LISTEN/NOTIFY wake-up are the engine's,
+so two jobs can run on different replicas at once but one job never runs
+twice concurrently, and a replica that dies mid-run just lets the lease
+expire. scheduler_jobs only keeps the per-job history shown in the admin
+panel: last run, status, duration and failure counters.
+
+After downtime, a job whose row is overdue runs once (missed slots are
+coalesced, never replayed one by one) if it is still within its
+``misfire_grace_s``; otherwise that slot is skipped and the job moves on to
+its next one.
+"""
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from app import metrics
+from app.scheduler.delayed import NOTIFY_CHANNEL, DelayedJobQueue, seed_jobs
+
+logger = logging.getLogger(__name__)
+
+CHILE_TZ = ZoneInfo("America/Santiago")
+QUEUE = "scheduler"
+REGISTER_RETRY_S = 30
+
+
+# ── Cron ──────────────────────────────────────────────────────────────────────
+
+class CronSpec:
+    """Minimal 5-field cron (minute hour day-of-month month day-of-week).
+    Supports ``*``, numbers, lists (``9,21``), ranges (``1-5``) and steps
+    (``*/15``). Day-of-week: 0 = Sunday … 6 = Saturday (7 also Sunday)."""
+
+    _RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expr: str):
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+        self.expr = expr
+        fields = [self._parse(p, lo, hi) for p, (lo, hi) in zip(parts, self._RANGES)]
+        self.minutes, self.hours, self.days, self.months, dows = fields
+        self.dows = {d % 7 for d in dows}
+        self._dom_any = parts[2] == "*"
+        self._dow_any = parts[4] == "*"
+
+    @staticmethod
+    def _parse(part: str, lo: int, hi: int) -> List[int]:
+        values = set()
+        for chunk in part.split(","):
+            step = 1
+            if "/" in chunk:
+                chunk, step_s = chunk.split("/", 1)
+                step = int(step_s)
+            if chunk == "*":
+                start, end = lo, hi
+            elif "-" in chunk:
+                a, b = chunk.split("-", 1)
+                start, end = int(a), int(b)
+            else:
+                start = end = int(chunk)
+            if start < lo or end > hi:
+                raise ValueError(f"cron field {part!r} out of range {lo}-{hi}")
+            values.update(range(start, end + 1, step))
+        return sorted(values)
+
+    def _day_matches(self, d) -> bool:
+        if d.month not in self.months:
+            return False
+        dom = d.day in self.days
+        dow = (d.isoweekday() % 7) in self.dows
+        # Standard cron: when both day fields are restricted, either matches.
+        if not self._dom_any and not self._dow_any:
+            return dom or dow
+        return dom and dow
+
+    def next_after(self, after: datetime) -> datetime:
+        """First fire time strictly after ``after`` (aware datetime)."""
+        local = after.astimezone(CHILE_TZ)
+        day = local.date()
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                for h in self.hours:
+                    for m in self.minutes:
+                        candidate = datetime(day.year, day.month, day.day, h, m, tzinfo=CHILE_TZ)
+                        if candidate > local:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"cron expression never fires: {self.expr!r}")
+
+
+# ── Job declarations ─────────────────────────────────────────────────────────
+
+@dataclass
+class Job:
+    """A periodic job. Give exactly one of ``interval_s`` or ``cron``.
+
+    ``func`` may be sync (run in a worker thread) or async. Its return value
+    is logged when ``log_result`` is true."""
+    name: str
+    func: Callable
+    interval_s: Optional[float] = None
+    cron: Optional[str] = None
+    # Interval jobs: delay before the very first run after the row is created.
+    initial_delay_s: float = 0
+    # Random 0..jitter_s added to each next-run, spreading jobs that share a slot.
+    jitter_s: float = 0
+    # How late a missed run may still fire; older slots are skipped. None:
+    # interval jobs always catch up, cron jobs get 6 h.
+    misfire_grace_s: Optional[float] = None
+    # How long a claim is held before another replica may take the job over.
+    # The queue has one lease, so the longest of all jobs applies to each.
+    lease_s: float = 15 * 60
+    log_result: bool = True
+    _cron: Optional[CronSpec] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        if (self.interval_s is None) == (self.cron is None):
+            raise ValueError(f"job {self.name}: set exactly one of interval_s / cron")
+        if self.cron:
+            self._cron = CronSpec(self.cron)
+
+    @property
+    def schedule(self) -> str:
+        return f"cron:{self.cron}" if self.cron else f"every:{int(self.interval_s)}s"
+
+    def next_run(self, after: datetime) -> datetime:
+        if self._cron:
+            nxt = self._cron.next_after(after)
+        else:
+            nxt = after + timedelta(seconds=self.interval_s)
+        if self.jitter_s:
+            nxt += timedelta(seconds=random.uniform(0, self.jitter_s))
+        return nxt
+
+    def first_run(self, now: datetime) -> datetime:
+        if self._cron:
+            return self.next_run(now)
+        return now + timedelta(seconds=self.initial_delay_s)
+
+
+def ensure_scheduler_table() -> None:
+    from app.db.connection import get_connection
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS scheduler_jobs (
+                        name              TEXT PRIMARY KEY,
+                        schedule          TEXT NOT NULL,
+                        last_started_at   TIMESTAMPTZ,
+                        last_finished_at  TIMESTAMPTZ,
+                        last_status       TEXT,
+                        last_error        TEXT,
+                        last_duration_ms  INTEGER,
+                        run_count         INTEGER NOT NULL DEFAULT 0,
+                        failure_count     INTEGER NOT NULL DEFAULT 0,
+                        skipped_count     INTEGER NOT NULL DEFAULT 0,
+                        total_duration_ms BIGINT NOT NULL DEFAULT 0,
+                        max_duration_ms   INTEGER NOT NULL DEFAULT 0
+                    )
+                """)
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"scheduler_jobs table setup failed: {e}")
+        raise
+
+
+# ── Scheduler ────────────────────────────────────────────────────────────────
+
+class JobScheduler(DelayedJobQueue):
+    """Runs a set of declared jobs. Start ``run()`` on every replica."""
+
+    def __init__(self, jobs: List[Job]):
+        self.jobs: Dict[str, Job] = {j.name: j for j in jobs}
+        super().__init__(
+            QUEUE,
+            concurrency=max(len(jobs), 1),
+            batch_size=1,
+            # handle() never raises and always re-arms, so no retries.
+            max_attempts=1,
+            lease_s=max((j.lease_s for j in jobs), default=15 * 60),
+            keys=list(self.jobs),
+        )
+
+    def _register(self) -> None:
+        """Create the rows of new jobs; a job whose schedule changed gets its
+        next run recomputed, others keep their persisted due time."""
+        from app.db.connection import get_connection
+        now = datetime.now(CHILE_TZ)
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO scheduler_jobs (name, schedule)
+                    SELECT * FROM unnest(%s::text[], %s::text[])
+                    ON CONFLICT (name) DO UPDATE SET schedule = EXCLUDED.schedule
+                    """,
+                    ([j.name for j in self.jobs.values()], [j.schedule for j in self.jobs.values()]),
+                )
+            conn.commit()
+        seed_jobs(QUEUE, [
+            (job.name, {"schedule": job.schedule}, (job.first_run(now) - now).total_seconds())
+            for job in self.jobs.values()
+        ])
+
+    def _record(self, name: str, status: str, started: datetime, duration_ms: int,
+                error: Optional[str]) -> None:
+        from app.db.connection import get_connection
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE scheduler_jobs SET
+                        last_started_at   = %s,
+                        last_finished_at  = NOW(),
+                        last_status       = %s,
+                        last_error        = %s,
+                        last_duration_ms  = %s,
+                        run_count         = run_count + CASE WHEN %s = 'skipped' THEN 0 ELSE 1 END,
+                        failure_count     = failure_count + CASE WHEN %s = 'error' THEN 1 ELSE 0 END,
+                        skipped_count     = skipped_count + CASE WHEN %s = 'skipped' THEN 1 ELSE 0 END,
+                        total_duration_ms = total_duration_ms + %s,
+                        max_duration_ms   = GREATEST(max_duration_ms, %s)
+                    WHERE name = %s
+                    """,
+                    (started, status, error, duration_ms,
+                     status, status, status, duration_ms, duration_ms, name),
+                )
+            conn.commit()
+
+    async def handle(self, name: str, payload: dict, scheduled_for: datetime) -> float:
+        """Run one due job and return the delay to its next slot, which the
+        engine writes back as the row's due time."""
+        job = self.jobs[name]
+        started = datetime.now(CHILE_TZ)
+        lateness = (started - scheduled_for).total_seconds()
+        status, error, t0 = "ok", None, time.perf_counter()
+        grace = job.misfire_grace_s
+        if grace is None:
+            grace = 6 * 3600 if job.cron else float("inf")
+        if lateness > grace:
+            status = "skipped"
+            logger.info("⏭️ Job %s: missed its %s slot by %.0f min, skipping to next",
+                        name, scheduled_for.astimezone(CHILE_TZ).strftime("%H:%M %d/%m"), lateness / 60)
+        else:
+            try:
+                if asyncio.iscoroutinefunction(job.func):
+                    result = await job.func()
+                else:
+                    result = await asyncio.to_thread(job.func)
+                if job.log_result and result:
+                    logger.info("🕐 Job %s: %s", name, result)
+            except Exception as e:
+                status, error = "error", str(e)[:1000]
+                logger.error("Job %s failed: %s", name, e)
+        elapsed = time.perf_counter() - t0
+        duration_ms = int(elapsed * 1000)
+        metrics.observe_job(name, status, elapsed)
+        try:
+            await asyncio.to_thread(self._record, name, status, started, duration_ms, error)
+        except Exception as e:
+            logger.warning("Could not record run of job %s: %s", name, e)
+        # Next slot is computed from now, so missed slots collapse into this run.
+        now = datetime.now(CHILE_TZ)
+        return (job.next_run(now) - now).total_seconds()
+
+    async def run(self) -> None:
+        from app.db.connection import use_pool
+        use_pool("batch")
+        while True:
+            try:
+                await asyncio.to_thread(self._register)
+                break
+            except Exception as e:
+                logger.warning(f"scheduler registration failed, retrying: {e}")
+                await asyncio.sleep(REGISTER_RETRY_S)
+        await super().run()
+
+
+def get_job_status() -> List[dict]:
+    """Rows of scheduler_jobs with their queue row's due time, for the
+    admin endpoint."""
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT s.name, s.schedule, d.due_at AS next_run_at, d.claimed_at,
+                       s.last_started_at, s.last_finished_at, s.last_status, s.last_error,
+                       s.last_duration_ms, s.run_count, s.failure_count, s.skipped_count,
+                       s.total_duration_ms, s.max_duration_ms
+                FROM scheduler_jobs s
+                LEFT JOIN delayed_jobs d ON d.queue = %s AND d.job_key = s.name
+                ORDER BY s.name
+            """, (QUEUE,))
+            cols = [d.name for d in cur.description]
+            rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+    for r in rows:
+        r["running"] = r["claimed_at"] is not None
+        for k in ("next_run_at", "claimed_at", "last_started_at", "last_finished_at"):
+            if r[k] is not None:
+                r[k] = r[k].isoformat()
+        r["avg_duration_ms"] = int(r["total_duration_ms"] / r["run_count"]) if r["run_count"] else None
+    return rows
+
+
+def trigger_job(name: str) -> bool:
+    """Make a job due now and wake the schedulers. A job that is running
+    already is left alone (it re-arms itself when it finishes)."""
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE delayed_jobs SET due_at = NOW() "
+                "WHERE queue = %s AND job_key = %s AND claimed_at IS NULL",
+                (QUEUE, name),
+            )
+            cur.execute(
+                "SELECT EXISTS (SELECT 1 FROM delayed_jobs WHERE queue = %s AND job_key = %s)",
+                (QUEUE, name),
+            )
+            found = cur.fetchone()[0]
+            if found:
+                cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, QUEUE))
+        conn.commit()
+    return found
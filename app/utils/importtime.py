@@ -0,0 +1,100 @@
+"""
+Startup import profile
+
+Runs ``python -X importtime -c "import app.main"`` in a fresh interpreter
+(optionally under a given APP_ROLE) and turns CPython's raw report into
+something readable: the slowest modules by cumulative time, and self time
+summed per top-level package — which is what tells you whether a slow
+boot is our own routers or a third-party SDK.
+
+    python -m app.utils.importtime
+    python -m app.utils.importtime --role webhook --top 20
+    python -m app.utils.importtime --module app.bot.conversation
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)\s*$")
+
+
+class ImportRecord(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def profile(module: str = "app.main", role: Optional[str] = None) -> dict:
+    """Import ``module`` in a child interpreter and return
+    {"wall_s", "records", "returncode", "stderr_tail"}."""
+    env = dict(os.environ)
+    if role:
+        env["APP_ROLE"] = role
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=root, env=env, capture_output=True, text=True,
+    )
+    wall_s = time.perf_counter() - started
+    records: List[ImportRecord] = []
+    other = []
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            # CPython indents nested imports by two spaces per level.
+            depth = (len(m.group(3)) - 1) // 2
+            records.append(ImportRecord(m.group(4), int(m.group(1)), int(m.group(2)), depth))
+        elif not line.startswith("import time:"):
+            other.append(line)
+    return {
+        "wall_s": wall_s,
+        "records": records,
+        "returncode": proc.returncode,
+        "stderr_tail": "\n".join(other[-15:]),
+    }
+
+
+def by_package(records: List[ImportRecord]) -> Dict[str, int]:
+    totals: Dict[str, int] = defaultdict(int)
+    for r in records:
+        totals[r.module.split(".")[0]] += r.self_us
+    return dict(totals)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import-time profile of the app")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--role", default=None, help="APP_ROLE for the child process (webhook, public, admin, all)")
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    result = profile(args.module, args.role)
+    if result["returncode"] != 0:
+        print(f"❌ import {args.module} failed:\n{result['stderr_tail']}")
+        sys.exit(1)
+    records = result["records"]
+    total_us = sum(r.cumulative_us for r in records if r.depth == 0)
+
+    print(f"import {args.module}  role={args.role or os.environ.get('APP_ROLE', 'all')}")
+    print(f"  modules imported: {len(records)}   import time: {total_us / 1000:.1f} ms"
+          f"   wall (incl. interpreter start): {result['wall_s'] * 1000:.0f} ms\n")
+
+    print(f"Slowest modules (cumulative, top {args.top}):")
+    for r in sorted(records, key=lambda r: r.cumulative_us, reverse=True)[:args.top]:
+        print(f"  {r.cumulative_us / 1000:9.1f} ms  {r.module}")
+
+    print(f"\nSelf time per top-level package (top {args.top}):")
+    packages = sorted(by_package(records).items(), key=lambda kv: kv[1], reverse=True)
+    for name, us in packages[:args.top]:
+        print(f"  {us / 1000:9.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
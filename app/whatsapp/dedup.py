@@ -0,0 +1,109 @@
+"""
+Layered incoming-message dedup
+
+Meta redelivers webhook events at-least-once, so every incoming message_id
+has to be claimed exactly once before the bot acts on it. The authoritative
+claim is still the incoming_message_dedup row in Postgres (a redelivery can
+land on any replica), but it used to run synchronously on the event loop —
+plus an inline 24h cleanup DELETE on ~1% of calls — before mark-as-read.
+
+This module puts a bounded in-process LRU in front of that claim:
+  • a message_id this process already saw (Meta redelivering to the same
+    replica, or the same id reaching process_message() after the webhook
+    claimed it) is answered from memory, no round-trip;
+  • anything else goes to the DB claim, run in a worker thread so the event
+    loop keeps serving other customers meanwhile;
+  • TTL cleanup of the table runs as a scheduled job (purge_expired_dedup,
+    the "dedup_cleanup" job in app/main.py), never inline on the message path.
+
+It also replaces ConversationManager's per-conversation processed_message_ids
+set, which was persisted in the state blob and grew without bound.
+"""
+import asyncio
+import collections
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Meta's redelivery window is minutes, not days — 24h of history is generous.
+DEDUP_RETENTION_HOURS = 24
+# ~a day of traffic for this bot; each entry is a short string + tuple.
+DEDUP_LRU_MAX = 20000
+DEDUP_LRU_TTL_S = DEDUP_RETENTION_HOURS * 3600
+
+
+class IncomingDedup:
+    """Bounded in-memory front for the incoming_message_dedup claim.
+
+    Entries map message_id → (owned, inbox_id, seen_monotonic). ``owned``
+    is True when *this* process won the DB claim."""
+
+    def __init__(self, max_entries: int = DEDUP_LRU_MAX, ttl_s: float = DEDUP_LRU_TTL_S):
+        self._entries: "collections.OrderedDict[str, tuple]" = collections.OrderedDict()
+        self._max = max_entries
+        self._ttl = ttl_s
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, message_id: str) -> Optional[tuple]:
+        entry = self._entries.get(message_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[2] > self._ttl:
+            del self._entries[message_id]
+            return None
+        self._entries.move_to_end(message_id)
+        return entry
+
+    def _put(self, message_id: str, owned: bool, inbox_id: Optional[int]) -> None:
+        self._entries[message_id] = (owned, inbox_id, time.monotonic())
+        self._entries.move_to_end(message_id)
+        while len(self._entries) > self._max:
+            self._entries.popitem(last=False)
+
+    def owned(self, message_id: Optional[str]) -> bool:
+        """True if this process already holds the claim for message_id."""
+        if not message_id:
+            return False
+        entry = self._get(message_id)
+        return bool(entry and entry[0])
+
+    async def is_duplicate(self, message_id: Optional[str], inbox_id: Optional[int] = None) -> bool:
+        """Claim message_id; True means someone (this process or another
+        replica) already claimed it and the caller must not act on it.
+        Re-running the same webhook_inbox item (same non-None inbox_id) is
+        not a duplicate. Fails open on DB errors, like the DB claim itself."""
+        if not message_id:
+            return False
+        entry = self._get(message_id)
+        if entry is not None:
+            self.hits += 1
+            owned, prev_inbox_id, _ = entry
+            return not (owned and inbox_id is not None and prev_inbox_id == inbox_id)
+        self.misses += 1
+        from app.whatsapp.webhook import _is_duplicate_incoming
+        duplicate = await asyncio.to_thread(_is_duplicate_incoming, message_id, inbox_id)
+        self._put(message_id, not duplicate, inbox_id)
+        return duplicate
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+incoming_dedup = IncomingDedup()
+
+
+def purge_expired_dedup() -> int:
+    """Delete dedup rows older than the retention window (hourly job)."""
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM incoming_message_dedup WHERE seen_at < NOW() - make_interval(hours => %s)",
+                (DEDUP_RETENTION_HOURS,),
+            )
+            deleted = cur.rowcount
+        conn.commit()
+    return deleted
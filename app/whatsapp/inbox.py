@@ -0,0 +1,255 @@
+"""
+Durable inbound webhook inbox
+
+The webhook endpoint used to ack Meta and then hand the payload to an
+in-memory asyncio.create_task. If the replica restarted or crashed while
+that task was running, the customer's message was simply gone: Meta never
+redelivers an event it already got a 200 for, and even if it did, the
+incoming_message_dedup row had already been claimed.
+
+Now the raw payload is written to webhook_inbox *before* the ack. The
+receiving replica still processes it right away (fast path), but if that
+process dies mid-way the row stays 'processing' and, once its visibility
+timeout expires, any replica's inbox worker re-claims it. Claims use
+FOR UPDATE SKIP LOCKED so several replicas can sweep the table at once
+without ever handing the same row to two of them. Net result: at-least-once
+processing for every webhook Meta delivered.
+"""
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# A row claimed longer ago than this and still not 'done' is assumed to
+# belong to a crashed/restarted process and becomes claimable again. Bot
+# processing (LLM call + several Graph API sends) normally finishes well
+# under a minute; 5 min leaves plenty of room for slow Groq responses.
+INBOX_VISIBILITY_TIMEOUT_S = 300
+# Pending rows younger than this are left to the replica that received them
+# (fast path) — the sweeper only picks up what that replica failed to claim.
+INBOX_PENDING_GRACE_S = 10
+INBOX_POLL_S = 5
+INBOX_BATCH_SIZE = 20
+# After this many claims a payload is parked as 'failed' instead of being
+# retried forever (e.g. a payload that reliably crashes the process).
+INBOX_MAX_ATTEMPTS = 5
+# Processed rows are kept for a few days for debugging, then purged.
+INBOX_RETENTION_DAYS = 3
+INBOX_PURGE_EVERY_S = 3600
+
+
+def _ensure_inbox_table() -> None:
+    from app.db.connection import get_connection
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS webhook_inbox (
+                        id          BIGSERIAL PRIMARY KEY,
+                        payload     JSONB NOT NULL,
+                        status      TEXT NOT NULL DEFAULT 'pending',
+                        attempts    INTEGER NOT NULL DEFAULT 0,
+                        received_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                        claimed_at  TIMESTAMPTZ,
+                        done_at     TIMESTAMPTZ,
+                        last_error  TEXT
+                    )
+                """)
+                # The sweeper only ever looks at unfinished rows — keep that
+                # index tiny instead of indexing every row ever received.
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_webhook_inbox_open
+                    ON webhook_inbox (id) WHERE status IN ('pending', 'processing')
+                """)
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"webhook_inbox table setup failed: {e}")
+        raise
+
+
+def enqueue_webhooks(bodies: List[dict]) -> List[int]:
+    """Persist one or more raw webhook payloads in a single round-trip and
+    return their inbox ids (same order as ``bodies``).
+
+    One multi-row INSERT over unnest() with no secondary unique index to
+    check — cheaper than the per-message INSERT ... ON CONFLICT the dedup
+    table does, and it runs once per POST rather than once per message."""
+    if not bodies:
+        return []
+    from psycopg.types.json import Jsonb
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO webhook_inbox (payload)
+                SELECT p FROM unnest(%s::jsonb[]) WITH ORDINALITY AS t(p, ord)
+                ORDER BY ord
+                RETURNING id
+                """,
+                ([Jsonb(b) for b in bodies],),
+            )
+            ids = [r[0] for r in cur.fetchall()]
+        conn.commit()
+    return ids
+
+
+def enqueue_webhook(body: dict) -> int:
+    """Persist a single raw webhook payload; returns its inbox id."""
+    return enqueue_webhooks([body])[0]
+
+
+def _claim_item(inbox_id: int) -> Optional[dict]:
+    """Claim a specific pending row (fast path). Returns its payload, or None
+    if another worker already has it."""
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE webhook_inbox
+                SET status = 'processing', claimed_at = NOW(), attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM webhook_inbox
+                    WHERE id = %s AND status = 'pending'
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING payload
+                """,
+                (inbox_id,),
+            )
+            row = cur.fetchone()
+        conn.commit()
+    return row[0] if row else None
+
+
+def _claim_batch(limit: int = INBOX_BATCH_SIZE) -> List[tuple]:
+    """Claim up to ``limit`` rows the fast path didn't get to, plus rows
+    whose visibility timeout expired. Rows past INBOX_MAX_ATTEMPTS are
+    parked as 'failed' in the same transaction."""
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE webhook_inbox
+                SET status = 'failed', done_at = NOW(),
+                    last_error = COALESCE(last_error, 'max attempts exceeded')
+                WHERE status = 'processing'
+                  AND attempts >= %s
+                  AND claimed_at < NOW() - make_interval(secs => %s)
+                """,
+                (INBOX_MAX_ATTEMPTS, INBOX_VISIBILITY_TIMEOUT_S),
+            )
+            if cur.rowcount:
+                logger.error(f"📥 webhook_inbox: {cur.rowcount} payload(s) parked as failed after {INBOX_MAX_ATTEMPTS} attempts")
+            cur.execute(
+                """
+                UPDATE webhook_inbox
+                SET status = 'processing', claimed_at = NOW(), attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM webhook_inbox
+                    WHERE (status = 'pending'
+                           AND received_at < NOW() - make_interval(secs => %s))
+                       OR (status = 'processing'
+                           AND claimed_at < NOW() - make_interval(secs => %s))
+                    ORDER BY id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT %s
+                )
+                RETURNING id, payload, attempts
+                """,
+                (INBOX_PENDING_GRACE_S, INBOX_VISIBILITY_TIMEOUT_S, limit),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    # RETURNING order isn't guaranteed — keep delivery order for a customer
+    # who sent several messages in a row.
+    return sorted(rows, key=lambda r: r[0])
+
+
+def _mark_done(inbox_id: int, error: Optional[str] = None) -> None:
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE webhook_inbox SET status='done', done_at=NOW(), last_error=%s WHERE id=%s",
+                (error, inbox_id),
+            )
+        conn.commit()
+
+
+def _purge_done() -> int:
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM webhook_inbox
+                WHERE status IN ('done', 'failed')
+                  AND done_at < NOW() - make_interval(days => %s)
+                """,
+                (INBOX_RETENTION_DAYS,),
+            )
+            deleted = cur.rowcount
+        conn.commit()
+    return deleted
+
+
+async def _run_item(inbox_id: int, payload: dict, conversation_manager) -> None:
+    from app.whatsapp.webhook import handle_webhook
+    error = None
+    try:
+        result = await handle_webhook(payload, conversation_manager, inbox_id=inbox_id)
+        if (result or {}).get("status") == "error":
+            error = str(result.get("message", ""))[:500]
+    except Exception as e:
+        logger.error(f"Error processing inbox item {inbox_id}: {e}")
+        error = str(e)[:500]
+    # handle_webhook already logs and swallows per-message failures; a row
+    # is only left 'processing' (and retried) when the process itself dies.
+    try:
+        await asyncio.to_thread(_mark_done, inbox_id, error)
+    except Exception as e:
+        logger.warning(f"Could not mark inbox item {inbox_id} done: {e}")
+
+
+async def process_inbox_item(inbox_id: int, conversation_manager) -> None:
+    """Fast path: the replica that received the webhook processes it right
+    away. No-op if a sweeper on another replica got there first."""
+    try:
+        payload = await asyncio.to_thread(_claim_item, inbox_id)
+    except Exception as e:
+        # Leave it 'pending' — the sweeper picks it up after the grace period.
+        logger.warning(f"Could not claim inbox item {inbox_id}: {e}")
+        return
+    if payload is None:
+        return
+    await _run_item(inbox_id, payload, conversation_manager)
+
+
+async def run_inbox_worker(conversation_manager) -> None:
+    """Sweeper running on every replica (not gated by the scheduler lock —
+    SKIP LOCKED is what keeps replicas from stepping on each other). Picks
+    up payloads whose fast path never ran (enqueue succeeded but the process
+    died before claiming) and ones stuck 'processing' past the visibility
+    timeout."""
+    from app.db.connection import use_pool
+    use_pool("realtime")
+    last_purge = 0.0
+    while True:
+        try:
+            rows = await asyncio.to_thread(_claim_batch)
+            for inbox_id, payload, attempts in rows:
+                logger.warning(f"📥 Recovering webhook_inbox item {inbox_id} (attempt {attempts})")
+                await _run_item(inbox_id, payload, conversation_manager)
+            if time.monotonic() - last_purge > INBOX_PURGE_EVERY_S:
+                last_purge = time.monotonic()
+                deleted = await asyncio.to_thread(_purge_done)
+                if deleted:
+                    logger.info(f"🧹 webhook_inbox: purged {deleted} processed payload(s)")
+        except Exception as e:
+            logger.warning(f"inbox worker error: {e}")
+        await asyncio.sleep(INBOX_POLL_S)
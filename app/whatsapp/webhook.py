@@ -10,6 +10,7 @@ from typing import Dict, Any, Optional
 from app.whatsapp.client import whatsapp_client
 from app.db.queries import save_conversation
 from app.db.leads import increment_unread_count
+from app.scheduler import DelayedJobQueue
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +19,7 @@ logger = logging.getLogger(__name__)
 # cancellation both work correctly across replicas — the message that
 # schedules a follow-up and the reply that should cancel it can land on
 # different processes, which an in-memory dict has no way to know about.
+# Stored as the "followup_nudge" queue of app/scheduler/delayed.py.
 FOLLOWUP_DELAY_S = 120  # 2 minutes
 FOLLOWUP_MSG_1 = "¿Todo bien? 😊"
 FOLLOWUP_MSG_2 = "¿Quieres que te ayude con algo? 🙌"
@@ -40,6 +42,15 @@ _OUTGOING_WAMID_MAX = 2000
 # multiple uvicorn replicas — a redelivered webhook can land on a different
 # process than the one that handled the original, and an in-memory dict on
 # that process would have no idea it was already seen.
+#
+# Each claim also records the webhook_inbox row it came from (see
+# app/whatsapp/inbox.py): when an inbox item is re-run after a crash, the
+# same inbox_id is allowed to re-claim its own messages, while a genuine
+# redelivery from Meta (a different inbox row) is still rejected.
+#
+# Callers go through app/whatsapp/dedup.py (incoming_dedup), which answers
+# repeats from an in-process LRU and runs this claim off the event loop;
+# TTL cleanup of the table is a scheduled job there as well.
 
 
 def _ensure_dedup_table() -> None:
@@ -53,36 +64,31 @@ def _ensure_dedup_table() -> None:
                         seen_at    TIMESTAMPTZ NOT NULL DEFAULT NOW()
                     )
                 """)
+                cur.execute(
+                    "ALTER TABLE incoming_message_dedup ADD COLUMN IF NOT EXISTS inbox_id BIGINT"
+                )
             conn.commit()
     except Exception as e:
         logger.warning(f"incoming_message_dedup table setup failed: {e}")
+        raise
 
 
-def _is_duplicate_incoming(message_id: Optional[str]) -> bool:
-    """Atomically claims message_id via INSERT ... ON CONFLICT DO NOTHING.
+def _is_duplicate_incoming(message_id: Optional[str], inbox_id: Optional[int] = None) -> bool:
+    """Atomically claims message_id via INSERT ... ON CONFLICT.
     Returns True (duplicate) only when another process already claimed it
-    first — the DB, not process memory, is the single source of truth.
+    first — the DB, not process memory, is the single source of truth. A
+    retry of the same webhook_inbox item (same inbox_id) is not a duplicate.
     Fails open (returns False) on any DB error: a rare double-process is far
     better than silently dropping a real customer message."""
     if not message_id:
         return False
-    import random
+    from app.db import statements
     from app.db.connection import get_connection
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO incoming_message_dedup (message_id) VALUES (%s) ON CONFLICT DO NOTHING",
-                    (message_id,),
-                )
+                statements.execute(cur, "webhook.dedup_claim", (message_id, inbox_id))
                 inserted = cur.rowcount > 0
-                # Opportunistic cleanup — Meta's redelivery window is minutes,
-                # not days, so 24h of history is generous. ~1% of calls avoids
-                # needing a dedicated scheduler for such a small table.
-                if random.random() < 0.01:
-                    cur.execute(
-                        "DELETE FROM incoming_message_dedup WHERE seen_at < NOW() - INTERVAL '24 hours'"
-                    )
             conn.commit()
         return not inserted
     except Exception as e:
@@ -114,119 +120,67 @@ def _register_outgoing(result: dict, text: str, conversation_manager=None, phone
         pass
 
 
-def _ensure_followup_table() -> None:
-    from app.db.connection import get_connection
-    try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS pending_followups (
-                        phone_number TEXT PRIMARY KEY,
-                        contact_name TEXT,
-                        due_at       TIMESTAMPTZ NOT NULL,
-                        cancelled    BOOLEAN NOT NULL DEFAULT FALSE,
-                        sent_at      TIMESTAMPTZ
-                    )
-                """)
-            conn.commit()
-    except Exception as e:
-        logger.warning(f"pending_followups table setup failed: {e}")
-
-
 def _cancel_followup(phone_number: str) -> None:
     """Cancel any pending follow-up for this user (they replied)."""
-    from app.db.connection import get_connection
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "UPDATE pending_followups SET cancelled=TRUE WHERE phone_number=%s AND sent_at IS NULL",
-                    (phone_number,),
-                )
-            conn.commit()
+        followup_queue.cancel(phone_number)
     except Exception as e:
         logger.warning(f"cancel_followup failed for {phone_number}: {e}")
 
 
 def _schedule_followup(phone_number: str, contact_name: str) -> None:
     """Schedule a menu follow-up ~FOLLOWUP_DELAY_S from now, replacing any
-    existing one for this phone. A periodic job (run_followup_nudge_scheduler,
-    gated by the scheduler advisory lock so only one replica runs it) sends
-    it — nothing here schedules an in-process timer."""
-    from app.db.connection import get_connection
+    existing one for this phone. The row lives in delayed_jobs and the
+    NOTIFY it emits wakes the followup queue runner on whichever replica —
+    nothing here schedules an in-process timer."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO pending_followups (phone_number, contact_name, due_at, cancelled, sent_at)
-                    VALUES (%s, %s, NOW() + (%s || ' seconds')::interval, FALSE, NULL)
-                    ON CONFLICT (phone_number) DO UPDATE SET
-                        contact_name = EXCLUDED.contact_name,
-                        due_at       = EXCLUDED.due_at,
-                        cancelled    = FALSE,
-                        sent_at      = NULL
-                    """,
-                    (phone_number, contact_name, FOLLOWUP_DELAY_S),
-                )
-            conn.commit()
+        followup_queue.schedule(phone_number, FOLLOWUP_DELAY_S, {"contact_name": contact_name})
     except Exception as e:
         logger.warning(f"schedule_followup failed for {phone_number}: {e}")
 
 
-async def run_followup_nudge_scheduler() -> None:
-    """Periodic job replacing the old in-memory 5-min-style debounce: polls
-    pending_followups for rows that are due, not cancelled, and not yet sent,
-    sends the two-message nudge, and marks them sent. Runs on whichever
-    process holds the scheduler advisory lock (see try_acquire_scheduler_lock
-    in app/db/connection.py) — same pattern as the visitor-session closer."""
-    from app.db.connection import get_connection
-    while True:
-        try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT phone_number, contact_name FROM pending_followups
-                        WHERE NOT cancelled AND sent_at IS NULL AND due_at <= NOW()
-                    """)
-                    due = cur.fetchall()
+async def _send_followup_nudge(phone_number: str, payload: dict) -> None:
+    """Send the two-message nudge to one phone. Failures are logged and the
+    job completes anyway — a permanently-failing send (bad number, etc.)
+    shouldn't retry forever."""
+    contact_name = payload.get("contact_name")
+    try:
+        logger.info(f"⏰ Sending menu follow-up to {phone_number}")
+        await whatsapp_client.send_text_message(phone_number, FOLLOWUP_MSG_1)
+        await asyncio.sleep(1.5)
+        await whatsapp_client.send_text_message(phone_number, FOLLOWUP_MSG_2)
+        for msg in (FOLLOWUP_MSG_1, FOLLOWUP_MSG_2):
+            try:
+                await save_conversation(
+                    phone_number=phone_number,
+                    customer_name=contact_name,
+                    message_text="",
+                    response_text=msg,
+                    message_type="text",
+                    direction="outgoing",
+                )
+            except Exception:
+                pass
+    except Exception as e:
+        logger.error(f"Error sending follow-up to {phone_number}: {e}")
 
-            for phone_number, contact_name in due:
-                try:
-                    logger.info(f"⏰ Sending menu follow-up to {phone_number}")
-                    await whatsapp_client.send_text_message(phone_number, FOLLOWUP_MSG_1)
-                    await asyncio.sleep(1.5)
-                    await whatsapp_client.send_text_message(phone_number, FOLLOWUP_MSG_2)
-                    for msg in (FOLLOWUP_MSG_1, FOLLOWUP_MSG_2):
-                        try:
-                            await save_conversation(
-                                phone_number=phone_number,
-                                customer_name=contact_name,
-                                message_text="",
-                                response_text=msg,
-                                message_type="text",
-                                direction="outgoing",
-                            )
-                        except Exception:
-                            pass
-                except Exception as e:
-                    logger.error(f"Error sending follow-up to {phone_number}: {e}")
-                finally:
-                    # Mark done either way — a permanently-failing send (bad
-                    # number, etc.) shouldn't retry forever.
-                    try:
-                        with get_connection() as conn:
-                            with conn.cursor() as cur:
-                                cur.execute(
-                                    "UPDATE pending_followups SET sent_at=NOW() WHERE phone_number=%s",
-                                    (phone_number,),
-                                )
-                            conn.commit()
-                    except Exception as e:
-                        logger.warning(f"failed to mark follow-up sent for {phone_number}: {e}")
-        except Exception as e:
-            logger.warning(f"followup_nudge_scheduler error: {e}")
-        await asyncio.sleep(15)
+
+# The 1.5 s pause between the two messages is per phone; with the bounded
+# pool several customers' nudges go out side by side instead of serially.
+followup_queue = DelayedJobQueue(
+    "followup_nudge",
+    _send_followup_nudge,
+    concurrency=8,
+    max_attempts=1,
+)
+
+
+async def run_followup_nudge_scheduler() -> None:
+    """Run the follow-up queue: sleeps until the next nudge is due (or a
+    NOTIFY from _schedule_followup/_cancel_followup changes that), claims
+    due rows with SKIP LOCKED and sends them concurrently. Safe to run on
+    every replica."""
+    await followup_queue.run()
 
 
 def _resolve_quoted_message(message: dict, conversation_manager, from_number: str) -> Optional[str]:
@@ -295,13 +249,14 @@ def verify_webhook(mode: Optional[str], token: Optional[str], expected_token: st
     return False
 
 
-async def handle_webhook(body: Dict[str, Any], conversation_manager) -> Dict[str, Any]:
+async def handle_webhook(body: Dict[str, Any], conversation_manager, inbox_id: Optional[int] = None) -> Dict[str, Any]:
     """
     Process incoming webhook from WhatsApp
     
     Args:
         body: Webhook payload from Meta
         conversation_manager: ConversationManager instance
+        inbox_id: webhook_inbox row this payload was claimed from, if any
     
     Returns:
         Processing result
@@ -324,7 +279,7 @@ async def handle_webhook(body: Dict[str, Any], conversation_manager) -> Dict[str
                 messages = value.get("messages", [])
                 
                 for message in messages:
-                    await process_message(message, value, conversation_manager)
+                    await process_message(message, value, conversation_manager, inbox_id=inbox_id)
         
         return {"status": "processed"}
         
@@ -335,7 +290,7 @@ async def handle_webhook(body: Dict[str, Any], conversation_manager) -> Dict[str
         return {"status": "error", "message": str(e)}
 
 
-async def process_message(message: Dict[str, Any], value: Dict[str, Any], conversation_manager):
+async def process_message(message: Dict[str, Any], value: Dict[str, Any], conversation_manager, inbox_id: Optional[int] = None):
     """
     Process a single message
     
@@ -343,6 +298,7 @@ async def process_message(message: Dict[str, Any], value: Dict[str, Any], conver
         message: Message data
         value: Value data from webhook
         conversation_manager: ConversationManager instance
+        inbox_id: webhook_inbox row this message came from, if any
     """
     try:
         # Extract message info
@@ -357,11 +313,12 @@ async def process_message(message: Dict[str, Any], value: Dict[str, Any], conver
 
         # Meta may redeliver the same webhook event (e.g. if we ack slowly) —
         # bail out before mark-as-read / push notification / bot processing.
-        if _is_duplicate_incoming(message_id):
-            logger.info(f"⏭️ Duplicate webhook delivery for message_id {message_id}, ignoring")
+        from app.whatsapp.dedup import incoming_dedup
+        if await incoming_dedup.is_duplicate(message_id, inbox_id):
+            logger.info("⏭️ Duplicate webhook delivery for message_id %s, ignoring", message_id)
             return
 
-        logger.info(f"📩 New message from {contact_name} ({from_number}): type={message_type}")
+        logger.info("📩 New message from %s (%s): type=%s", contact_name, from_number, message_type)
 
         # Mark as read
         try:
@@ -372,13 +329,13 @@ async def process_message(message: Dict[str, Any], value: Dict[str, Any], conver
         # Handle different message types
         if message_type == "text":
             text_body = message.get("text", {}).get("body", "")
-            logger.info(f"💬 Message text: {text_body}")
+            logger.info("💬 Message text: %s", text_body)
 
             # Resolve quoted/replied-to message text so the bot knows which
             # specific bot message the user is replying to.
             quoted_text = _resolve_quoted_message(message, conversation_manager, from_number)
             if quoted_text:
-                logger.info(f"↩️ Reply to quoted message: {quoted_text[:80]}")
+                logger.info("↩️ Reply to quoted message: %.80s", quoted_text)
 
             # Ensure lead exists before saving ad referral
             from app.db.leads import get_or_create_lead
@@ -388,7 +345,7 @@ async def process_message(message: Dict[str, Any], value: Dict[str, Any], conver
             referral = message.get("referral")
             ad_source = None
             if referral:
-                logger.info(f"📢 Ad referral detected: {referral}")
+                logger.info("📢 Ad referral detected: %s", referral)
                 try:
                     from app.db.leads import save_lead_ad_source
                     ad_source = await save_lead_ad_source(from_number, referral)
@@ -754,7 +711,7 @@ async def process_message(message: Dict[str, Any], value: Dict[str, Any], conver
             button_reply = interactive.get("button_reply", {})
             list_reply = interactive.get("list_reply", {})
             
-            logger.info(f"🔘 Interactive message: button={button_reply}, list={list_reply}")
+            logger.info("🔘 Interactive message: button=%s, list=%s", button_reply, list_reply)
             
             # Send push for interactive (button/list) responses
             reply_text = (button_reply.get("title") or list_reply.get("title") or "Respuesta interactiva")
@@ -779,7 +736,7 @@ async def process_message(message: Dict[str, Any], value: Dict[str, Any], conver
             image_obj = message.get("image", {}) or {}
             caption = (image_obj.get("caption") or "").strip()
             media_id = image_obj.get("id")
-            logger.info(f"🖼️ Image message received (media_id={media_id}) caption='{caption}'")
+            logger.info("🖼️ Image message received (media_id=%s) caption='%s'", media_id, caption)
             media_url = None
             local_image_path = None
             
@@ -1009,7 +966,7 @@ async def process_message(message: Dict[str, Any], value: Dict[str, Any], conver
             audio_obj = message.get("audio", {}) or {}
             media_id = audio_obj.get("id")
             mime_type = audio_obj.get("mime_type", "audio/ogg")
-            logger.info(f"🎤 Audio message received (media_id={media_id}) mime_type='{mime_type}'")
+            logger.info("🎤 Audio message received (media_id=%s) mime_type='%s'", media_id, mime_type)
             
             media_url = None
             local_audio_path = None
@@ -0,0 +1,68 @@
+"""
+Cold-start benchmark per deployment role.
+
+For each APP_ROLE, imports app.main in a fresh interpreter several times
+and reports the median import time, the number of modules loaded and the
+peak RSS of the child — i.e. how long a new replica of that role takes
+before uvicorn can start serving, and what it costs in memory.
+
+Importing app.main does not touch the database (the pool and migrations
+only run in lifespan), but Settings() still needs the required env vars —
+a .env like the one used for local runs is enough.
+
+Usage:
+    python benchmarks/bench_cold_start.py [--runs 5] [--roles webhook,public,admin,all]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+_CHILD = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - t0
+print(json.dumps({
+    "import_ms": elapsed * 1000,
+    "modules": len(sys.modules),
+    "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "routers": app.main._mounted_routers,
+}))
+"""
+
+
+def run_once(role: str) -> dict:
+    env = dict(os.environ, APP_ROLE=role)
+    proc = subprocess.run([sys.executable, "-c", _CHILD], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"role {role}: import failed\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--roles", default="webhook,public,admin,all")
+    args = parser.parse_args()
+
+    print(f"{'role':<8} {'import ms (median)':>18} {'min':>8} {'modules':>8} {'rss MB':>7}  routers")
+    for role in args.roles.split(","):
+        samples = [run_once(role) for _ in range(args.runs)]
+        times = [s["import_ms"] for s in samples]
+        last = samples[-1]
+        print(f"{role:<8} {statistics.median(times):18.0f} {min(times):8.0f} {last['modules']:8d} "
+              f"{last['maxrss_kb'] / 1024:7.0f}  {', '.join(last['routers']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
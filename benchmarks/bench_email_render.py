@@ -0,0 +1,102 @@
+"""
+Email rendering benchmark — 1,000 booking confirmation emails.
+
+Compares, for the same 1,000 synthetic bookings (mixed es/en/pt):
+  • builder:  the f-string builder run per email (what every send did);
+  • compiled: render_emails(), i.e. the template compiled once per
+    language and filled per email;
+  • custom:   an operator-edited body (the built-in HTML with {{key}}
+    placeholders) through the old regex substitution vs its compiled form.
+
+Everything runs in-process with the built-in templates, so no database or
+Resend key is needed — only the env vars Settings() requires (a local .env).
+
+Usage:
+    python benchmarks/bench_email_render.py [--n 1000] [--runs 5]
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv()
+
+
+def _bookings(n: int) -> list:
+    langs = ("es", "en", "pt")
+    return [
+        {
+            "booking_ref": f"HB-2026-{i:05d}",
+            "customer_name": f"Cliente {i}",
+            "customer_email": f"cliente{i}@example.com",
+            "customer_phone": f"+56 9 {10000000 + i}",
+            "booking_date": "2026-02-14",
+            "booking_time": "18:00",
+            "num_people": 2 + i % 6,
+            "total_price": 79990 * (2 + i % 6),
+            "subtotal": 79990 * (2 + i % 6),
+            "extras_total": 0,
+            "status": "confirmed",
+            "customer_language": langs[i % 3],
+            "extras": [{"name": "Tabla de picoteo", "quantity": 1, "price": 24990}] if i % 4 == 0 else [],
+        }
+        for i in range(n)
+    ]
+
+
+def _timed(fn, runs: int) -> list:
+    out = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    from app.booking import booking_email as be
+    from app.email.templates import compile_template, _SentinelCtx
+
+    ctxs = [be._template_ctx(be._booking_ctx(b)) for b in _bookings(args.n)]
+    builder = be._DEFAULT_TEMPLATES["booking_confirmed"]
+    by_lang = {lang: be._compiled_default("booking_confirmed", lang) for lang in ("es", "en", "pt")}
+
+    # Same output both ways, or the comparison is meaningless.
+    for ctx in ctxs[:30]:
+        assert by_lang[ctx["customer_language"]].render(ctx) == builder(ctx)
+
+    custom_src = builder(_SentinelCtx("es"))
+    custom_tpl = compile_template(custom_src)
+
+    rows = [
+        ("builder", _timed(lambda: [builder(c) for c in ctxs], args.runs)),
+        ("compiled", _timed(lambda: [by_lang[c["customer_language"]].render(c) for c in ctxs], args.runs)),
+        ("custom/regex", _timed(lambda: [be._apply_template(custom_src, c) for c in ctxs], args.runs)),
+        ("custom/compiled", _timed(lambda: [custom_tpl.render(c) for c in ctxs], args.runs)),
+    ]
+
+    size_kb = len(builder(ctxs[0]).encode()) / 1024
+    print(f"{args.n} booking_confirmed emails (~{size_kb:.1f} KB each), {args.runs} runs\n")
+    for label, samples in rows:
+        med = statistics.median(samples)
+        print(f"{label:<16} median {med:8.1f} ms   {med * 1000 / args.n:7.1f} µs/email")
+    base, fast = statistics.median(rows[0][1]), statistics.median(rows[1][1])
+    print(f"\nbuilt-in: ×{base / fast:.1f}   custom: ×{statistics.median(rows[2][1]) / statistics.median(rows[3][1]):.1f}")
+
+
+if __name__ == "__main__":
+    main()
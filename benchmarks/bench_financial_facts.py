@@ -0,0 +1,231 @@
+"""
+Financial reports benchmark — /api/admin/financial/pnl, /cashflow,
+/inflows-by-method and /forecast-table over a 3-year range, before and
+after the financial_*_facts tables (migration 0106).
+
+Needs a database: DATABASE_URL with the migrations applied. Seeds
+--per-day synthetic confirmed bookings per day for --years years before
+today (source 'bench-facts', plus two bench catalog entries), all deleted
+afterwards, then times:
+
+  • recompute: the per-booking work every report request used to repeat
+    for its range. That is reading each booking, decoding pagos /
+    descuentos / extras_json, running split_booking_financials and pricing
+    the payments. It is measured as financial_facts.booking_facts() over the
+    range without writing anything, so it is a lower bound on the old
+    request (which then also built its day dicts);
+  • refresh: full rebuild, an incremental refresh with nothing changed,
+    one after editing --touch bookings and one after changing a bench
+    extra's cost in extras_visibility;
+  • each endpoint over the range, with the facts already fresh.
+
+Usage:
+    python benchmarks/bench_financial_facts.py [--years 3] [--per-day 6]
+        [--touch 20] [--repeat 5]
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv()
+
+from app.db.connection import get_connection  # noqa: E402
+
+SOURCE = "bench-facts"
+EXTRA_KEY = "bench_tabla_quesos"
+EXP_KEY = "experiencia_bench_kayak"
+ALOJ_SLUG = "bench-cabana-rio"
+METHODS = ("transbank_credito", "transbank_debito", "mercadopago", "efectivo",
+           "transferencia", "tbk", None)
+
+
+def _booking(rng: random.Random, day: date) -> tuple:
+    extras = {}
+    if rng.random() < 0.4:
+        extras[f"aloj__{ALOJ_SLUG}"] = {"qty": rng.randint(1, 3), "unit_price": 60000}
+    if rng.random() < 0.5:
+        extras[EXP_KEY] = {"qty": 2, "unit_price": 15000}
+    if rng.random() < 0.6:
+        extras[EXTRA_KEY] = rng.choice([12000, {"qty": 2, "unit_price": 9000}])
+    ing_res = float(rng.choice([90000, 120000, 135000, 180000]))
+    ing_ext = 0.0
+    for val in extras.values():
+        ing_ext += val if isinstance(val, (int, float)) else val["qty"] * val["unit_price"]
+    ing_ext += rng.choice([0, 0, 5000])  # lines missing from extras_json
+    total = ing_res + ing_ext
+    descuentos = rng.choice([[], [], [{"amount": 10000, "type": "manual"}], [{"amount": 2500.5}]])
+    pagos = []
+    for _ in range(rng.choice([0, 1, 1, 2])):
+        pago = {"amount": round(total / 2), "method": rng.choice(METHODS)}
+        when = rng.choice([0, 0, -3, -20, None])
+        if when is not None:
+            pago["date"] = (day + timedelta(days=when)).isoformat()
+        pagos.append(pago)
+    return (SOURCE, day, f"Bench {rng.randint(1, 9999)}", ing_res, ing_ext, total, 18000.0,
+            rng.choice(("confirmed", "paid", "aprobado")), json.dumps(extras),
+            json.dumps(pagos), json.dumps(descuentos))
+
+
+def seed(years: int, per_day: int, today: date) -> int:
+    rng = random.Random(41)
+    first = today - timedelta(days=365 * years)
+    rows = []
+    day = first
+    while day <= today:
+        rows.extend(_booking(rng, day) for _ in range(per_day))
+        day += timedelta(days=1)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            with cur.copy("""
+                COPY all_appointments (source, fecha, nombre_cliente, ingreso_reserva,
+                    ingreso_extras, ingreso_total, costo_operativo_total, status,
+                    extras_json, pagos, descuentos) FROM STDIN
+            """) as copy:
+                for row in rows:
+                    copy.write_row(row)
+            cur.execute("""
+                INSERT INTO extras_visibility (extra_name_lower, costo) VALUES (%s, 4000), (%s, 6000)
+                ON CONFLICT (extra_name_lower) DO UPDATE SET costo = EXCLUDED.costo
+            """, (EXTRA_KEY, EXP_KEY))
+            cur.execute("""
+                INSERT INTO alojamientos (slug, name, cost_from) VALUES (%s, 'Bench', 35000)
+                ON CONFLICT (slug) DO UPDATE SET cost_from = EXCLUDED.cost_from
+            """, (ALOJ_SLUG,))
+        conn.commit()
+    return len(rows)
+
+
+def cleanup() -> None:
+    from app.booking.financial_facts import refresh_financial_facts
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM all_appointments WHERE source = %s", (SOURCE,))
+            cur.execute("DELETE FROM extras_visibility WHERE extra_name_lower IN (%s, %s)",
+                        (EXTRA_KEY, EXP_KEY))
+            cur.execute("DELETE FROM alojamientos WHERE slug = %s", (ALOJ_SLUG,))
+        conn.commit()
+    refresh_financial_facts()
+
+
+def recompute(d_from: date, d_to: date) -> int:
+    """The old per-request work for a range, without the write."""
+    from app.booking.financial_breakdown import (
+        get_financial_structure, load_aloj_cost_catalog, load_extra_cost_catalog,
+    )
+    from app.booking.financial_facts import _fetch_bookings, booking_facts
+    from app.booking.financial_router import CONFIRMED_STATUSES, _get_commissions
+
+    wl = set(get_financial_structure().get("experience_slug_whitelist") or [])
+    commissions = _get_commissions()
+    cc, ac = load_extra_cost_catalog(), load_aloj_cost_catalog()
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM all_appointments WHERE fecha BETWEEN %s AND %s AND status = ANY(%s)",
+                        (d_from, d_to, list(CONFIRMED_STATUSES)))
+            ids = [r[0] for r in cur.fetchall()]
+            bookings = _fetch_bookings(cur, ids, list(CONFIRMED_STATUSES))
+    for b in bookings:
+        booking_facts(b, commissions, cc, wl, ac)
+    return len(bookings)
+
+
+def _time(fn, repeat: int):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--per-day", type=int, default=6)
+    parser.add_argument("--touch", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    from app.booking import financial_router as fr
+    from app.booking.financial_facts import refresh_financial_facts
+
+    today = date.today()
+    d_from, d_to = today - timedelta(days=365 * args.years), today
+    f, t = d_from.isoformat(), d_to.isoformat()
+    n = seed(args.years, args.per_day, today)
+    print(f"{n} bench bookings, {f} → {t}\n")
+
+    def report(label, seconds, extra=""):
+        print(f"{label:<34} {seconds * 1000:9.1f} ms{extra}")
+
+    try:
+        secs, count = _time(lambda: recompute(d_from, d_to), args.repeat)
+        report("recompute per request (before)", secs, f"   {count} bookings")
+
+        secs, out = _time(lambda: refresh_financial_facts(full=True), 1)
+        report("refresh: full rebuild", secs, f"   {out}")
+        secs, out = _time(refresh_financial_facts, args.repeat)
+        report("refresh: nothing changed", secs, f"   {out}")
+
+        def touch():
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE all_appointments SET descuentos = '[{"amount": 1000}]'::jsonb, updated_at = NOW()
+                        WHERE id IN (SELECT id FROM all_appointments WHERE source = %s
+                                     ORDER BY random() LIMIT %s)
+                    """, (SOURCE, args.touch))
+                conn.commit()
+            return refresh_financial_facts()
+
+        secs, out = _time(touch, 1)
+        report(f"refresh: {args.touch} bookings edited", secs, f"   {out}")
+
+        def recost():
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE extras_visibility SET costo = costo + 100 WHERE extra_name_lower = %s",
+                                (EXTRA_KEY,))
+                conn.commit()
+            return refresh_financial_facts()
+
+        secs, out = _time(recost, 1)
+        report("refresh: one extra's cost edited", secs, f"   {out}")
+        print()
+
+        endpoints = [
+            ("pnl daily", lambda: fr.get_pnl(date_from=f, date_to=t, view="daily", x_admin_key="")),
+            ("pnl monthly", lambda: fr.get_pnl(date_from=f, date_to=t, view="monthly", x_admin_key="")),
+            ("cashflow monthly", lambda: fr.get_cashflow(date_from=f, date_to=t, view="monthly",
+                                                         opening_balance=0, x_admin_key="")),
+            ("inflows-by-method", lambda: fr.get_inflows_by_method(date_from=f, date_to=t, x_admin_key="")),
+            ("forecast-table monthly", lambda: fr.get_forecast_table(
+                months_back=3, months_ahead=9, view="monthly", weeks_back=4, weeks_ahead=34,
+                date_from=f, date_to=t, x_admin_key="")),
+            ("forecast-table weekly", lambda: fr.get_forecast_table(
+                months_back=3, months_ahead=9, view="weekly", weeks_back=4, weeks_ahead=34,
+                date_from=None, date_to=None, x_admin_key="")),
+        ]
+        for label, call in endpoints:
+            secs, _ = _time(lambda: asyncio.run(call()), args.repeat)
+            report(f"GET {label}", secs)
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Financial report assembly benchmark — the dict-per-day builders the P&L and
+cash-flow endpoints used, vs the DayFrame columns (app/booking/financial_frame.py),
+over --years of synthetic fact rows; and the what-if P&L for --scenarios
+parameter sets, one at a time vs evaluate_pnl_scenarios().
+
+No database: fact rows are generated in memory and get_financial_structure
+is pinned, so only the Python assembly is timed (the endpoints' queries are
+the same either way). The "old" functions below are the previous loops,
+kept here as the reference; the script checks both produce equal output.
+
+Usage:
+    python benchmarks/bench_financial_frame.py [--years 3] [--per-day 6]
+        [--scenarios 50] [--repeat 5]
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+import numpy as np  # noqa: E402
+
+from app.booking import financial_router as fr  # noqa: E402
+from app.booking.financial_breakdown import (  # noqa: E402
+    aggregate_breakdown_into_week_month, apply_structural_to_days, finalize_pnl_day,
+    iso_dates_inclusive, new_empty_day,
+)
+
+STRUCTURE = {"costo_fijo_diario_prorrateado": 21700, "costo_operativo_por_reserva": 18000}
+METHODS = ("transbank_credito", "transbank_debito", "mercadopago", "efectivo", "transferencia", None)
+
+
+def synth(years: int, per_day: int):
+    rng = random.Random(42)
+    d_to = date.today()
+    d_from = d_to - timedelta(days=365 * years)
+    day_facts, bookings, pagos, marketing = [], [], [], []
+    bid = 0
+    for ds in iso_dates_inclusive(d_from, d_to):
+        n = rng.randint(0, per_day * 2)
+        if n:
+            day = {"fecha": ds, "n_reservas": n}
+            for k in fr._DAY_FACT_FIELDS[1:]:
+                day[k] = 0
+            for _ in range(n):
+                bid += 1
+                total = float(rng.choice([90000, 120000, 150000.5]))
+                b = {"id": bid, "fecha": ds, "nombre_cliente": f"C{bid}", "pagos": [],
+                     "gross_f": total, "disc_applied": 0}
+                comm = 0.0
+                for _ in range(rng.choice([0, 1, 2])):
+                    p = (bid, total / 2, rng.choice(METHODS))
+                    pagos.append(p)
+                    comm += p[1] - fr._net_amount(p[1], p[2], fr.DEFAULT_COMMISSIONS)
+                b.update(gross=int(total), commission_deduction=int(comm), net_income=int(total - comm),
+                         ingreso_reserva=int(total * .7), ingreso_aloj=0, ingreso_exp=int(total * .1),
+                         ingreso_extra=int(total * .2), cv_aloj=0, cv_exp=3000, cv_extra=4000)
+                for k in fr._DAY_FACT_FIELDS[1:]:
+                    day[k] += b.get(k, 0)
+                bookings.append(b)
+            day_facts.append(day)
+        if rng.random() < .3:
+            marketing.append({"fecha": ds, "amount": rng.random() * 50000})
+    return d_from, d_to, day_facts, bookings, pagos, marketing
+
+
+# ── The previous dict-per-day implementation ─────────────────────────────────
+
+def old_pnl(day_facts, bookings, marketing, d_from, d_to, view):
+    cpr = fr._fmt_int(float(STRUCTURE["costo_operativo_por_reserva"]))
+    mkt_by_day = defaultdict(float)
+    for m in marketing:
+        mkt_by_day[m["fecha"]] += m["amount"]
+    days = {}
+    for f in day_facts:
+        d = new_empty_day(f["fecha"])
+        for k in fr._DAY_FACT_FIELDS:
+            d[k] = f[k]
+        d["costo_operacional"] = f["n_reservas"] * cpr
+        days[f["fecha"]] = d
+    for b in bookings:
+        days[b["fecha"]]["bookings"].append({
+            "id": b["id"], "nombre_cliente": b["nombre_cliente"], "ingreso_total": b["gross"],
+            "commission": b["commission_deduction"], "net_income": b["net_income"], "costo": cpr,
+            "pagos": b["pagos"], "ingreso_reserva": b["ingreso_reserva"],
+            "ingreso_aloj": b["ingreso_aloj"], "ingreso_exp": b["ingreso_exp"],
+            "ingreso_extra": b["ingreso_extra"], "descuentos_aplicados": b["disc_applied"],
+            "cv_aloj": b["cv_aloj"], "cv_exp": b["cv_exp"], "cv_extra": b["cv_extra"],
+        })
+    s_from, s_to = fr._structural_range(d_from, d_to)
+    apply_structural_to_days(days, s_from, s_to, STRUCTURE["costo_fijo_diario_prorrateado"])
+    for day in set(days) | set(mkt_by_day):
+        if day not in days:
+            days[day] = new_empty_day(day)
+        days[day]["marketing"] = fr._fmt_int(mkt_by_day.get(day, 0))
+        finalize_pnl_day(days[day])
+    totals = {k: sum(d[k] for d in days.values()) for k in fr._PNL_DAY_COLUMNS}
+    if view == "daily":
+        return totals, sorted(days.values(), key=lambda x: x["fecha"])
+    groups = {}
+    for day_str, d in sorted(days.items()):
+        if view == "weekly":
+            key = date.fromisoformat(day_str).strftime("%G-W%V")
+        else:
+            key = day_str[:7]
+        g = groups.setdefault(key, {"key": key, "n_reservas": 0, "gross": 0, "commission_deduction": 0,
+                                    "net_income": 0, "costo_operacional": 0, "marketing": 0,
+                                    "resultado": 0, "days": []})
+        for k in ("n_reservas", "gross", "commission_deduction", "net_income",
+                  "costo_operacional", "marketing", "resultado"):
+            g[k] += d[k]
+        aggregate_breakdown_into_week_month(g, d)
+        g["days"].append(d)
+    return totals, list(groups.values())
+
+
+def new_pnl(day_cols, bookings, marketing, d_from, d_to, view):
+    frame, days = fr._build_pnl_days(day_cols, bookings, marketing, d_from, d_to)
+    totals = frame.totals(fr._PNL_DAY_COLUMNS)
+    if view == "weekly":
+        return totals, fr._aggregate_weeks(frame, days)
+    if view == "monthly":
+        return totals, fr._aggregate_months(frame, days)
+    return totals, days
+
+
+def old_scenario(bookings, pagos_by_booking, day_facts, marketing, d_from, d_to, p):
+    """One what-if P&L the dict way: per booking commission, per day totals."""
+    days = defaultdict(lambda: defaultdict(int))
+    for b in bookings:
+        comm = 0.0
+        for _, amt, method in pagos_by_booking.get(b["id"], ()):
+            comm += amt - fr._net_amount(amt, method, p["commissions"])
+        d = days[b["fecha"]]
+        d["commission_deduction"] += fr._fmt_int(comm)
+        d["net_income"] += fr._fmt_int(b["gross_f"] - comm)
+    totals = defaultdict(int)
+    for f in day_facts:
+        totals["costo_operacional"] += f["n_reservas"] * p["costo_operativo_por_reserva"]
+    for d in days.values():
+        for k, v in d.items():
+            totals[k] += v
+    return dict(totals)
+
+
+def _time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--per-day", type=int, default=6)
+    parser.add_argument("--scenarios", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    fr.get_financial_structure = lambda: dict(STRUCTURE)
+    d_from, d_to, day_facts, bookings, pagos, marketing = synth(args.years, args.per_day)
+    print(f"{len(day_facts)} booking days, {len(bookings)} bookings, {len(pagos)} pagos, "
+          f"{len(marketing)} marketing rows\n")
+
+    # The endpoints get day facts as columns straight from the cursor.
+    day_cols = fr._columns([tuple(d[k] for k in ("fecha",) + fr._DAY_FACT_FIELDS) for d in day_facts],
+                           ("fecha",) + fr._DAY_FACT_FIELDS)
+
+    for view in ("daily", "weekly", "monthly"):
+        t_old, (tot_old, data_old) = _time(
+            lambda: old_pnl(day_facts, bookings, marketing, d_from, d_to, view), args.repeat)
+        t_new, (tot_new, data_new) = _time(
+            lambda: new_pnl(day_cols, bookings, marketing, d_from, d_to, view), args.repeat)
+        assert tot_old == tot_new and len(data_old) == len(data_new)
+        print(f"P&L {view:<8} old {t_old * 1000:7.1f} ms   new {t_new * 1000:7.1f} ms")
+
+    rng = random.Random(7)
+    params = [fr._resolve_scenario({
+        "costo_operativo_por_reserva": rng.choice([15000, 18000, 22000]),
+        "marketing_factor": rng.choice([0.5, 1.0, 1.5]),
+        "commissions": {"transbank_credito": {"rate": rng.choice([0.02, 0.028, 0.035])}},
+    }, STRUCTURE, fr.DEFAULT_COMMISSIONS) for _ in range(args.scenarios)]
+    pagos_by_booking = defaultdict(list)
+    for p in pagos:
+        pagos_by_booking[p[0]].append(p)
+
+    t_old, old_out = _time(lambda: [old_scenario(bookings, pagos_by_booking, day_facts, marketing,
+                                                 d_from, d_to, p) for p in params], 1)
+
+    def batch():
+        s_from, s_to = fr._structural_range(d_from, d_to)
+        struct_days = iso_dates_inclusive(s_from, s_to)
+        mkt_days = [m["fecha"] for m in marketing]
+        frame = fr.DayFrame(fr.chain(day_cols["fecha"], struct_days, mkt_days))
+        for k in ("n_reservas", "gross", "cv_aloj", "cv_exp", "cv_extra"):
+            frame[k] = frame.put(day_cols["fecha"], day_cols[k])
+        frame["in_struct"] = frame.put(struct_days, 1)
+        frame["marketing_raw"] = frame.sum_by_day(mkt_days, [m["amount"] for m in marketing])
+        pos = {b["id"]: i for i, b in enumerate(bookings)}
+        return fr.evaluate_pnl_scenarios(
+            frame, frame.positions([b["fecha"] for b in bookings]),
+            np.array([b["gross_f"] for b in bookings]),
+            np.array([pos[p[0]] for p in pagos], dtype=np.intp),
+            np.array([p[1] for p in pagos]), [p[2] for p in pagos], params, fr.IVA_RATE)
+
+    t_new, new_out = _time(batch, args.repeat)
+    for o, n in zip(old_out, new_out):
+        for k, v in o.items():
+            assert n["totals"][k] == v, (k, n["totals"][k], v)
+    print(f"\nwhat-if × {args.scenarios:<4} old {t_old * 1000:7.1f} ms   new {t_new * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Per-message DB time — the queries one inbound WhatsApp message runs, with
+the statements of app/db/statements.py prepared on first use vs psycopg's
+default (prepared after the 5th run on a connection) vs not prepared at
+all (DB_PREPARE_STATEMENTS=false).
+
+Needs a database: DATABASE_URL with the migrations applied. Seeds --phones
+leads (phones +56990000xxx) with a cart, a saved bot state and
+MAX_CONVERSATION_ROWS_PER_PHONE history rows each, all deleted afterwards.
+
+One message is what the webhook → bot path does against the DB, through
+the app's own functions: dedup claim, lead upsert (cache bypassed), bot
+state read, cart read, history read, booked slots for the next 30 days,
+two save_conversation calls (in and out), cart save and bot state save.
+
+Each mode gets a fresh pool (the realtime class's size), so prepared
+statements start from nothing, and runs --messages messages round-robin
+over the phones. Reported per message: DB time (time inside execute, as
+/metrics counts it) and wall time; "first" is the mean over the first
+--warm messages, when a connection hasn't prepared anything yet.
+
+Usage:
+    python benchmarks/bench_message_db.py [--messages 600] [--phones 40]
+        [--warm 20]
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv()
+
+from psycopg_pool import ConnectionPool  # noqa: E402
+
+from app import metrics  # noqa: E402
+from app.db import connection, statements  # noqa: E402
+from app.db.connection import get_connection  # noqa: E402
+
+PHONE_PREFIX = "+56990000"
+# (label, prepare= passed by statements.execute, pool prepare_threshold)
+MODES = (
+    ("not prepared", False, None),
+    ("psycopg default", None, 5),
+    ("prepared on first use", True, 5),
+)
+
+
+def seed(phones: list) -> None:
+    from app.db.queries import MAX_CONVERSATION_ROWS_PER_PHONE
+    now = datetime.now()
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            for i, phone in enumerate(phones):
+                cur.execute("""
+                    INSERT INTO whatsapp_leads (phone_number, customer_name, lead_status,
+                                                last_interaction_at, created_at, updated_at)
+                    VALUES (%s, %s, 'unknown', NOW(), NOW(), NOW())
+                """, (phone, f"Bench {i}"))
+                cur.execute("INSERT INTO whatsapp_carts (phone_number, customer_name, cart_data, updated_at) "
+                            "VALUES (%s, %s, '[]', NOW())", (phone, f"Bench {i}"))
+                state = {"messages": [{"role": "user", "content": "hola " * 20}] * 40, "stage": "menu"}
+                cur.execute("INSERT INTO bot_conversation_state (phone_number, state, updated_at) "
+                            "VALUES (%s, %s, NOW())", (phone, json.dumps(state)))
+                with cur.copy("""
+                    COPY whatsapp_conversations (phone_number, customer_name, message_text, response_text,
+                                                 message_type, message_id, direction, created_at) FROM STDIN
+                """) as copy:
+                    for n in range(MAX_CONVERSATION_ROWS_PER_PHONE):
+                        copy.write_row((phone, f"Bench {i}", "quiero reservar para el sábado", "",
+                                        "text", f"wamid.bench.{uuid.uuid4().hex}",
+                                        "incoming" if n % 2 else "outgoing",
+                                        now - timedelta(minutes=MAX_CONVERSATION_ROWS_PER_PHONE - n)))
+        conn.commit()
+
+
+def cleanup(phones: list) -> None:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            for table in ("whatsapp_conversations", "whatsapp_carts", "bot_conversation_state", "whatsapp_leads"):
+                cur.execute(f"DELETE FROM {table} WHERE phone_number = ANY(%s)", (phones,))
+            cur.execute("DELETE FROM incoming_message_dedup WHERE message_id LIKE 'wamid.bench.%%'")
+        conn.commit()
+
+
+class _StateHolder:
+    """Just enough of ConversationManager for its state load/persist methods."""
+
+    def __init__(self):
+        self.conversations = {}
+
+
+async def one_message(phone: str, holder: _StateHolder, cart) -> None:
+    from app.bot.conversation import ConversationManager
+    from app.db.leads import get_conversation_history, get_or_create_lead, invalidate_lead
+    from app.db.queries import CHILE_TZ, get_booked_slots, save_conversation
+    from app.whatsapp.webhook import _is_duplicate_incoming
+
+    wamid = f"wamid.bench.{uuid.uuid4().hex}"
+    _is_duplicate_incoming(wamid, None)
+    invalidate_lead(phone)
+    await get_or_create_lead(phone, "Bench")
+    state = await ConversationManager._load_persisted_conversation_state(holder, phone)
+    items = await cart.get_cart(phone)
+    await get_conversation_history(phone, limit=50)
+    now = datetime.now(CHILE_TZ)
+    await get_booked_slots(now, now + timedelta(days=30))
+    await save_conversation(phone, "Bench", "¿tienen disponibilidad el sábado?", "", message_id=wamid)
+    await save_conversation(phone, "Bench", "", "Sí, tenemos a las 15:00", direction="outgoing")
+    await cart.save_cart(phone, "Bench", items)
+    holder.conversations[phone] = state or {"messages": []}
+    await ConversationManager._persist_conversation_state(holder, phone)
+
+
+def run_mode(label: str, prepare, threshold, phones: list, messages: int, warm: int) -> dict:
+    from app.bot.cart import CartManager
+
+    spec = connection.pool_specs()["realtime"]
+    pool = ConnectionPool(connection.settings.database_url, min_size=spec.min_size, max_size=spec.max_size,
+                          kwargs={"cursor_factory": connection.TimedCursor, "prepare_threshold": threshold},
+                          name=f"bench-{label}")
+    pool.wait()
+    connection._pools["realtime"] = pool
+    statements.settings.db_prepare_statements = prepare
+    holder, cart = _StateHolder(), CartManager()
+    db, wall, queries = [], [], []
+
+    async def drive():
+        for i in range(messages):
+            stats = metrics.RequestStats()
+            token = metrics._current.set(stats)
+            t0 = time.perf_counter()
+            try:
+                await one_message(phones[i % len(phones)], holder, cart)
+            finally:
+                metrics._current.reset(token)
+            wall.append(time.perf_counter() - t0)
+            db.append(stats.db_time)
+            queries.append(stats.db_queries)
+
+    try:
+        with connection.db_pool("realtime"):
+            asyncio.run(drive())
+    finally:
+        connection._pools.pop("realtime", None)
+        pool.close()
+    return {"db": db, "wall": wall, "queries": queries, "warm": warm}
+
+
+def show(label: str, r: dict) -> None:
+    def ms(values):
+        return [v * 1000 for v in values]
+
+    db, wall, warm = ms(r["db"]), ms(r["wall"]), r["warm"]
+    steady = sorted(db[warm:]) or sorted(db)
+
+    def pct(values, q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    print(f"{label:<24} DB/msg mean {statistics.mean(db):6.2f}  p50 {pct(steady, .5):6.2f}"
+          f"  p95 {pct(steady, .95):6.2f} ms   first {warm} {statistics.mean(db[:warm]):6.2f} ms"
+          f"   wall mean {statistics.mean(wall):6.2f} ms   {statistics.mean(r['queries']):.0f} queries/msg")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=600)
+    parser.add_argument("--phones", type=int, default=40)
+    parser.add_argument("--warm", type=int, default=20)
+    args = parser.parse_args()
+
+    phones = [f"{PHONE_PREFIX}{i:03d}" for i in range(args.phones)]
+    cleanup(phones)
+    seed(phones)
+    print(f"{args.phones} bench leads, {args.messages} messages per mode\n")
+    try:
+        for label, prepare, threshold in MODES:
+            show(label, run_mode(label, prepare, threshold, phones, args.messages, args.warm))
+    finally:
+        cleanup(phones)
+
+
+if __name__ == "__main__":
+    main()
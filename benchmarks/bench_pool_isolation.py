@@ -0,0 +1,228 @@
+"""
+Pool isolation load test — WhatsApp webhook latency while admins pull
+3-year reports, with one shared pool (the old setup: min 2, max 10,
+30 s timeout for everything) vs the per-class pools of
+app/db/connection.py.
+
+Needs a database: DATABASE_URL with the migrations applied. Seeds
+--per-day bookings per day for the last --years years (source
+'bench-pools'), deleted afterwards along with the probe's inbox rows.
+
+Each phase runs for --seconds:
+
+  • a webhook probe on the realtime class persists a payload with
+    enqueue_webhook() --rate times a second, i.e. what POST /webhook does
+    before it acks Meta, recording its latency and how much of it was
+    spent waiting for a connection;
+  • --reports admin workers (threads, like the endpoint threadpool) on the
+    admin class, each looping over the 3-year reports: the reservations
+    CSV export drained to the end (one connection held for the whole
+    stream), P&L and cash flow.
+
+Phases: the probe alone, then probe + reports on the shared pool, then
+probe + reports on the isolated pools. Webhook latency should hold in
+the last one.
+
+Usage:
+    python benchmarks/bench_pool_isolation.py [--seconds 20] [--reports 12]
+        [--rate 20] [--years 3] [--per-day 8]
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv()
+
+from psycopg_pool import ConnectionPool  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+from app import metrics  # noqa: E402
+from app.db import connection  # noqa: E402
+from app.db.connection import db_pool, get_connection  # noqa: E402
+
+SOURCE = "bench-pools"
+PROBE_OBJECT = "bench-pools-probe"
+
+
+def seed(years: int, per_day: int, today: date) -> int:
+    rng = random.Random(49)
+    rows = []
+    day = today - timedelta(days=365 * years)
+    while day <= today:
+        for _ in range(per_day):
+            total = float(rng.choice([90000, 120000, 135000, 180000]))
+            pagos = [{"amount": round(total / 2), "method": rng.choice(["mercadopago", "transferencia"]),
+                      "date": day.isoformat()}] if rng.random() < 0.8 else []
+            rows.append((SOURCE, day, f"{rng.randint(10, 20)}:00", f"Bench {rng.randint(1, 9999)}",
+                         f"+569{rng.randint(10000000, 99999999)}", total, 0.0, total,
+                         rng.choice(("confirmed", "paid")), "{}", json.dumps(pagos), "[]"))
+        day += timedelta(days=1)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            with cur.copy("""
+                COPY all_appointments (source, fecha, hora, nombre_cliente, telefono, ingreso_reserva,
+                    ingreso_extras, ingreso_total, status, extras_json, pagos, descuentos) FROM STDIN
+            """) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        conn.commit()
+    return len(rows)
+
+
+def cleanup() -> None:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM all_appointments WHERE source = %s", (SOURCE,))
+            cur.execute("DELETE FROM webhook_inbox WHERE payload->>'object' = %s", (PROBE_OBJECT,))
+        conn.commit()
+    try:
+        from app.booking.financial_facts import refresh_financial_facts
+        refresh_financial_facts()
+    except Exception:
+        pass
+
+
+# ── Pool setups ───────────────────────────────────────────────────────────────
+
+def use_shared_pool() -> ConnectionPool:
+    """Every class on one pool, as before the split."""
+    shared = ConnectionPool(connection.settings.database_url, min_size=2, max_size=10, timeout=30,
+                            kwargs={"cursor_factory": connection.TimedCursor}, name="shared")
+    shared.wait()
+    for name in connection.POOLS:
+        connection._pools[name] = shared
+    return shared
+
+
+def use_isolated_pools(shared: ConnectionPool) -> None:
+    connection._pools.clear()
+    shared.close()
+    for name in connection.POOLS:
+        connection.get_pool(name).wait()
+
+
+# ── Load ──────────────────────────────────────────────────────────────────────
+
+def probe(stop: threading.Event, rate: float, out: list) -> None:
+    from app.whatsapp.inbox import enqueue_webhook
+    with db_pool("realtime"):
+        while not stop.is_set():
+            stats = metrics.RequestStats()
+            token = metrics._current.set(stats)
+            t0 = time.perf_counter()
+            try:
+                enqueue_webhook({"object": PROBE_OBJECT, "entry": [{"id": "bench", "changes": []}]})
+                out.append((time.perf_counter() - t0, stats.pool_wait, None))
+            except Exception as e:
+                out.append((time.perf_counter() - t0, stats.pool_wait, type(e).__name__))
+            finally:
+                metrics._current.reset(token)
+            stop.wait(max(0.0, 1 / rate - (time.perf_counter() - t0)))
+
+
+def report_worker(stop: threading.Event, d_from: str, d_to: str, done: list, errors: list) -> None:
+    from app.booking import export_router as er
+    from app.booking import financial_router as fr
+
+    request = Request({"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": []})
+
+    async def export():
+        resp = await er.export_reservas(request, fmt="csv", desde=d_from, hasta=d_to, status=None,
+                                        search=None, source=None, fields=None, x_admin_key="")
+        async for _ in resp.body_iterator:
+            pass
+
+    reports = [
+        ("export", export),
+        ("pnl", lambda: fr.get_pnl(date_from=d_from, date_to=d_to, view="monthly", x_admin_key="")),
+        ("cashflow", lambda: fr.get_cashflow(date_from=d_from, date_to=d_to, view="monthly",
+                                             opening_balance=0, x_admin_key="")),
+    ]
+    with db_pool("admin"):
+        i = random.randrange(len(reports))
+        while not stop.is_set():
+            name, call = reports[i % len(reports)]
+            i += 1
+            try:
+                asyncio.run(call())
+                done.append(name)
+            except Exception as e:
+                errors.append(f"{name}: {type(e).__name__}: {e}")
+
+
+def phase(label: str, seconds: float, rate: float, reports: int, d_from: str, d_to: str) -> None:
+    stop = threading.Event()
+    samples, done, errors = [], [], []
+    threads = [threading.Thread(target=probe, args=(stop, rate, samples))]
+    threads += [threading.Thread(target=report_worker, args=(stop, d_from, d_to, done, errors))
+                for _ in range(reports)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    ok = sorted(s[0] * 1000 for s in samples if s[2] is None)
+    waits = sorted(s[1] * 1000 for s in samples)
+    failed = [s[2] for s in samples if s[2] is not None]
+
+    def pct(values, q):
+        return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+    print(f"{label:<26} webhook p50 {pct(ok, .5):7.1f}  p95 {pct(ok, .95):7.1f}  p99 {pct(ok, .99):7.1f}"
+          f"  max {max(ok, default=float('nan')):7.1f} ms   pool wait p95 {pct(waits, .95):7.1f} ms"
+          f"   {len(samples)} probes, {len(failed)} failed   {len(done)} reports")
+    for err in sorted(set(errors))[:3] + sorted(set(failed))[:3]:
+        print(f"{'':<26} ! {err[:140]}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--reports", type=int, default=12)
+    parser.add_argument("--rate", type=float, default=20)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--per-day", type=int, default=8)
+    args = parser.parse_args()
+
+    today = date.today()
+    d_from, d_to = (today - timedelta(days=365 * args.years)).isoformat(), today.isoformat()
+    n = seed(args.years, args.per_day, today)
+    print(f"{n} bench bookings, {d_from} → {d_to}; {args.reports} report workers, "
+          f"webhook probe at {args.rate:g}/s, {args.seconds:g} s per phase\n")
+    try:
+        from app.booking.financial_facts import refresh_financial_facts
+        refresh_financial_facts()          # reports below start from fresh facts
+
+        shared = use_shared_pool()
+        phase("probe alone", args.seconds, args.rate, 0, d_from, d_to)
+        phase("shared pool (max 10)", args.seconds, args.rate, args.reports, d_from, d_to)
+        use_isolated_pools(shared)
+        sizes = ", ".join(f"{k} {v.max_size}" for k, v in connection.pool_specs().items())
+        phase("isolated pools", args.seconds, args.rate, args.reports, d_from, d_to)
+        print(f"\nisolated: {sizes}")
+        for name, s in connection.pool_stats().items():
+            print(f"  {name:<9} requests {s.get('requests_num', 0):6}  queued {s.get('requests_queued', 0):6}"
+                  f"  waited {s.get('requests_wait_ms', 0) / 1000:7.1f} s  timeouts {s.get('requests_errors', 0)}")
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+/api/admin/reservas benchmark: response size and time, full rows vs a
+fields= projection, and the whole table in keyset pages vs one streamed
+export.
+
+Needs a database: DATABASE_URL with the migrations applied. Seeds --rows
+synthetic bookings (source 'bench-reservas') with realistic extras_json,
+pagos and descuentos blobs, all deleted afterwards, then times, going
+through the endpoint function and FastAPI's JSON encoding as a request
+would:
+
+  • one 2,000-row page with every column (what the calendar and list
+    loaded before) vs with the calendar's and the list's fields=;
+  • the whole table: every column in one response (the shape a plain
+    "limit = everything" would have) vs keyset pages of --page rows vs
+    stream=true, with the peak Python memory of each (tracemalloc).
+
+Usage:
+    python benchmarks/bench_reservas_list.py [--rows 20000] [--page 2000] [--repeat 3]
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv()
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from app.db.connection import get_connection  # noqa: E402
+
+SOURCE = "bench-reservas"
+CAL_FIELDS = "id,fecha,hora,nombre_cliente,num_personas,ingreso_total,status,pagos,extras_json"
+LISTA_FIELDS = ("id,fecha,hora,nombre_cliente,telefono,num_personas,ingreso_total,pagos,status,"
+                "source,has_flex,created_at")
+EXTRAS = ("tabla_quesos", "espumante", "decoracion_cumpleanos", "aloj__cabana-rio",
+          "experiencia_kayak", "toallas", "fotos_drone")
+
+
+def _row(rng: random.Random, day: date, hour: int) -> tuple:
+    extras = {k: {"qty": rng.randint(1, 3), "unit_price": rng.choice([9000, 12000, 35000]),
+                  "label": k.replace("_", " ").title()}
+              for k in rng.sample(EXTRAS, rng.randint(0, 4))}
+    pagos = [{"amount": rng.choice([40000, 60000, 85000]), "method": rng.choice(["transferencia", "mercadopago"]),
+              "date": (day - timedelta(days=rng.randint(0, 20))).isoformat(), "note": "abono"}
+             for _ in range(rng.randint(0, 3))]
+    descuentos = [{"amount": 10000, "type": "manual", "reason": "cliente frecuente"}] if rng.random() < .2 else []
+    return (SOURCE, day, f"{hour:02d}:30", f"Bench Cliente {rng.randint(1, 99999)}",
+            f"bench{rng.randint(1, 9999)}@example.com", f"+569{rng.randint(10000000, 99999999)}",
+            str(rng.randint(2, 7)), float(rng.choice([120000, 150000, 180000])),
+            rng.choice(["confirmed", "paid", "cancelled", "solicitud"]),
+            "Observación de prueba " * rng.randint(0, 6),
+            json.dumps(extras), json.dumps(pagos), json.dumps(descuentos))
+
+
+def seed(rows: int) -> None:
+    rng = random.Random(44)
+    day = date.today() - timedelta(days=rows // 6)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            with cur.copy("""
+                COPY all_appointments (source, fecha, hora, nombre_cliente, email, telefono,
+                    num_personas, ingreso_total, status, observaciones, extras_json, pagos, descuentos)
+                FROM STDIN
+            """) as copy:
+                for i in range(rows):
+                    copy.write_row(_row(rng, day + timedelta(days=i // 6), 10 + i % 6))
+        conn.commit()
+
+
+def cleanup() -> None:
+    with get_connection() as conn:
+        conn.execute("DELETE FROM all_appointments WHERE source = %s", (SOURCE,))
+        conn.commit()
+
+
+def _measure(fn, repeat: int):
+    """Median seconds, response bytes and peak traced memory (last run)."""
+    times = []
+    for _ in range(repeat):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        size = fn()
+        times.append(time.perf_counter() - t0)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return statistics.median(times), size, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--page", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from app.booking import admin_analytics
+    from app.booking import admin_router as ar
+
+    params = dict(desde=None, hasta=None, status=None, search=None, source=SOURCE,
+                  fields=None, cursor=None, stream=False, x_admin_key="")
+
+    def get(**kw) -> dict:
+        return asyncio.run(ar.list_reservas(**{**params, **kw}))
+
+    def encoded(result: dict) -> int:
+        # What FastAPI does with a returned dict.
+        return len(JSONResponse(jsonable_encoder(result)).body)
+
+    def page(fields=None):
+        return lambda: encoded(get(limit=args.page, fields=fields))
+
+    def whole_table():
+        rows, _ = admin_analytics.list_reservas(args.rows, source=SOURCE)
+        return encoded({"reservas": ar._reservas_json(rows), "total": len(rows)})
+
+    def paged(fields=None):
+        def run():
+            size, cursor = 0, None
+            while True:
+                out = get(limit=args.page, fields=fields, cursor=cursor)
+                size += encoded(out)
+                cursor = out["next_cursor"]
+                if not cursor:
+                    return size
+        return run
+
+    def streamed(fields=None):
+        def run():
+            resp = get(limit=args.page, fields=fields, stream=True)
+
+            async def drain():
+                n = 0
+                async for chunk in resp.body_iterator:
+                    n += len(chunk.encode() if isinstance(chunk, str) else chunk)
+                return n
+            return asyncio.run(drain())
+        return run
+
+    seed(args.rows)
+    print(f"{args.rows} bench bookings, pages of {args.page}\n")
+    print(f"{'':<40} {'time':>10} {'bytes':>12} {'peak mem':>10}")
+
+    def report(label, fn):
+        secs, size, peak = _measure(fn, args.repeat)
+        print(f"{label:<40} {secs * 1000:8.1f} ms {size:>12,} {peak / 2**20:8.1f} MB")
+
+    try:
+        report("page: every column", page())
+        report("page: calendar fields=", page(CAL_FIELDS))
+        report("page: list fields=", page(LISTA_FIELDS))
+        print()
+        report("table: every column, one response", whole_table)
+        report("table: every column, keyset pages", paged())
+        report("table: every column, stream=true", streamed())
+        report("table: list fields=, stream=true", streamed(LISTA_FIELDS))
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Startup benchmark — schema work done before a replica starts serving.
+
+Compares, against the database in DATABASE_URL:
+  • legacy: the serial ensure/seed chain lifespan() ran on every boot
+    (now the body of migration 0100_baseline — idempotent, so re-running
+    it is safe and is exactly what each boot used to cost);
+  • probe:  migrate_to_head() on a database already at head, which is
+    what every boot costs now (one SELECT MAX(version)).
+
+The database must already be migrated (run `python -m app.db.migrate`
+first). Nothing is created or modified beyond what the baseline itself
+would (re)apply idempotently.
+
+Usage:
+    python benchmarks/bench_startup.py [--legacy-runs 3] [--probe-runs 50]
+"""
+import argparse
+import io
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv()
+if not os.getenv("DATABASE_URL"):
+    print("❌ DATABASE_URL not set (check .env)")
+    sys.exit(1)
+
+
+def _timed(fn, runs: int) -> list:
+    out = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def _report(label: str, samples: list) -> None:
+    print(f"{label:<8} n={len(samples):<3} median {statistics.median(samples):8.1f} ms"
+          f"   min {min(samples):8.1f} ms   max {max(samples):8.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--legacy-runs", type=int, default=3)
+    parser.add_argument("--probe-runs", type=int, default=50)
+    args = parser.parse_args()
+
+    # The ensure helpers log one line each; keep the output readable.
+    logging.basicConfig(level=logging.WARNING)
+
+    import importlib.util
+    from app.db import migrate
+    from app.db.connection import get_connection, get_pool
+
+    get_pool().wait()  # don't bill pool warm-up to the first sample
+
+    current, head = migrate.current_version(), migrate.head_version()
+    if current < head:
+        print(f"❌ database at schema_version {current}, head is {head} — run `python -m app.db.migrate` first")
+        sys.exit(1)
+
+    baseline = next(m for m in migrate.discover() if m.name == "baseline")
+    spec = importlib.util.spec_from_file_location("_baseline", baseline.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    def legacy():
+        with get_connection() as conn:
+            module.upgrade(conn)
+
+    probe = _timed(migrate.migrate_to_head, args.probe_runs)
+    legacy_samples = _timed(legacy, args.legacy_runs)
+
+    print(f"schema_version {current} (head {head})")
+    _report("legacy", legacy_samples)
+    _report("probe", probe)
+    print(f"speedup  ×{statistics.median(legacy_samples) / statistics.median(probe):.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Visitor-event ingestion benchmark — events/second through /api/booking/track's
+write path.
+
+Compares, for the same stream of events fired by --concurrency concurrent
+"requests":
+  • direct:   one INSERT + commit per event (the old path), in a worker
+    thread as the endpoint would need to;
+  • buffered: VisitorEventBuffer.put() per request, flushed with COPY
+    every FLUSH_BATCH_EVENTS events / FLUSH_INTERVAL_MS;
+  • buffered with --per-request events per request (the pages' batched
+    payload).
+
+By default the database is simulated: every write costs --rtt-ms twice
+(statement + commit) plus --row-us per row, which is roughly what a
+Railway-internal Postgres costs. With --db the real writers run against
+DATABASE_URL; rows use a "bench-" session id and are deleted afterwards.
+
+Usage:
+    python benchmarks/bench_visitor_ingest.py [--events 20000] [--concurrency 64]
+        [--per-request 5] [--rtt-ms 1.0] [--row-us 5] [--db]
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv()
+
+from app.booking.visitor_ingest import VisitorEventBuffer  # noqa: E402
+
+SESSION_PREFIX = "bench-"
+
+
+def _row(i: int, run: str) -> tuple:
+    # Same column order as visitor_tracking.VISITOR_EVENT_COLUMNS.
+    return (
+        f"{SESSION_PREFIX}{run}-{i // 8}", ("page_visit", "select_date", "select_time")[i % 3],
+        None, "18:00", "es", "https://l.facebook.com/", False, datetime.now(), None, None,
+        "facebook", "paid", "verano", None, "fbclid-x" if i % 8 == 0 else None, None,
+    )
+
+
+def _simulated_writer(rtt_ms: float, row_us: float):
+    def write(rows):
+        time.sleep((2 * rtt_ms / 1000) + len(rows) * row_us / 1e6)
+    return write
+
+
+async def _load(fire, n_requests: int, concurrency: int) -> float:
+    """Run ``fire(i)`` for i in range(n_requests) with at most
+    ``concurrency`` in flight; returns elapsed seconds."""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await fire(i)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_requests)))
+    return time.perf_counter() - t0
+
+
+async def bench_direct(writer, events: int, concurrency: int, run: str) -> float:
+    return await _load(lambda i: asyncio.to_thread(writer, [_row(i, run)]), events, concurrency)
+
+
+async def bench_buffered(writer, events: int, concurrency: int, per_request: int, run: str) -> tuple:
+    buf = VisitorEventBuffer(writer=writer)
+    n_requests = (events + per_request - 1) // per_request
+
+    async def fire(i):
+        await buf.put([_row(i * per_request + k, run)
+                       for k in range(min(per_request, events - i * per_request))])
+
+    t0 = time.perf_counter()
+    await _load(fire, n_requests, concurrency)
+    accept_s = time.perf_counter() - t0
+    await buf.close()  # everything written, as on shutdown
+    total_s = time.perf_counter() - t0
+    return accept_s, total_s, buf.stats()
+
+
+def _cleanup(run: str) -> None:
+    from app.db.connection import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM booking_visitor_events WHERE session_id LIKE %s",
+                        (f"{SESSION_PREFIX}{run}-%",))
+            deleted = cur.rowcount
+            # The events trigger opened a session-state row per bench session;
+            # left behind, the closer would summarise (and email) them.
+            cur.execute("DELETE FROM booking_visitor_session_state WHERE session_id LIKE %s",
+                        (f"{SESSION_PREFIX}{run}-%",))
+        conn.commit()
+    print(f"\ncleanup: {deleted} bench rows deleted")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--per-request", type=int, default=5)
+    parser.add_argument("--rtt-ms", type=float, default=1.0)
+    parser.add_argument("--row-us", type=float, default=5.0)
+    parser.add_argument("--db", action="store_true", help="write to DATABASE_URL instead of simulating")
+    args = parser.parse_args()
+
+    run = uuid.uuid4().hex[:8]
+    if args.db:
+        from app.booking.visitor_tracking import persist_booking_visitor_events
+        writer = persist_booking_visitor_events
+        target = "Postgres (DATABASE_URL)"
+    else:
+        writer = _simulated_writer(args.rtt_ms, args.row_us)
+        target = f"simulated DB: {args.rtt_ms} ms RTT, {args.row_us} µs/row"
+
+    print(f"{args.events} events, {args.concurrency} concurrent requests — {target}\n")
+    try:
+        direct_s = await bench_direct(writer, args.events, args.concurrency, run)
+        print(f"{'direct (INSERT/event)':<28} {args.events / direct_s:>10,.0f} ev/s   ({direct_s:.2f} s)")
+        for per_request in sorted({1, args.per_request}):
+            accept_s, total_s, stats = await bench_buffered(
+                writer, args.events, args.concurrency, per_request, run)
+            label = f"buffered, {per_request}/request"
+            print(f"{label:<28} {args.events / total_s:>10,.0f} ev/s   ({total_s:.2f} s, "
+                  f"accepted in {accept_s:.2f} s, {stats['batches']} COPY batches, "
+                  f"{stats['backpressure_waits']} backpressure waits)")
+    finally:
+        if args.db:
+            _cleanup(run)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
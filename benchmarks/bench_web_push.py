@@ -0,0 +1,213 @@
+"""
+Web Push fan-out benchmark — one incoming customer message notifying
+--subs subscriptions (default 50), old path vs app/notifications/web_push.py.
+
+A local HTTP server, in its own process, stands in for the push services.
+It answers 201 after --latency-ms, charges --handshake-ms per new
+connection (the TCP + TLS setup plain localhost HTTP doesn't have), and
+counts requests and connections. The subscriptions
+are real P-256 keys, so encryption and VAPID signing cost what they cost
+in production.
+
+  • old:  a web_push_subscriptions query per message (simulated,
+    --db-ms), then one pywebpush.webpush() per subscription in a worker
+    thread. That means one VAPID signature and one new connection per
+    subscription.
+  • new:  cached subscription set, one VAPID token per origin, one
+    encryption hop, POSTs over a pooled httpx client.
+  • burst: --burst messages from one customer inside the coalescing
+    window; pushes actually sent by each path.
+
+Needs pywebpush and httpx (requirements.txt); no database.
+
+Usage:
+    python benchmarks/bench_web_push.py [--subs 50] [--messages 20]
+        [--latency-ms 20] [--handshake-ms 60] [--db-ms 2] [--burst 5]
+"""
+import argparse
+import asyncio
+import base64
+import io
+import multiprocessing as mp
+import os
+import statistics
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ec  # noqa: E402
+
+
+def _serve(port_out, requests, connections, latency_s, handshake_s):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive for clients that pool
+
+        def setup(self):
+            super().setup()
+            time.sleep(handshake_s)  # TCP + TLS setup of a real push service
+            with connections.get_lock():
+                connections.value += 1
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            time.sleep(latency_s)
+            with requests.get_lock():
+                requests.value += 1
+            self.send_response(201)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 256  # the default 5 drops concurrent SYNs
+
+    server = Server(("127.0.0.1", 0), Handler)
+    port_out.value = server.server_address[1]
+    server.serve_forever()
+
+
+class FakePushService:
+    """Runs in its own process, so its threads don't compete with the
+    client being measured for the GIL."""
+
+    def __init__(self, latency_ms: float, handshake_ms: float):
+        self._requests = mp.Value("i", 0)
+        self._connections = mp.Value("i", 0)
+        port = mp.Value("i", 0)
+        self._proc = mp.Process(target=_serve, daemon=True,
+                                args=(port, self._requests, self._connections,
+                                      latency_ms / 1000, handshake_ms / 1000))
+        self._proc.start()
+        while not port.value:
+            time.sleep(0.01)
+        self.url = f"http://127.0.0.1:{port.value}"
+
+    @property
+    def requests(self) -> int:
+        return self._requests.value
+
+    @property
+    def connections(self) -> int:
+        return self._connections.value
+
+    def reset(self):
+        self._requests.value = self._connections.value = 0
+
+    def stop(self):
+        self._proc.terminate()
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _vapid_private_key() -> str:
+    key = ec.generate_private_key(ec.SECP256R1())
+    return _b64(key.private_numbers().private_value.to_bytes(32, "big"))
+
+
+def _subscriptions(n: int, base_url: str) -> list:
+    subs = []
+    for i in range(n):
+        pub = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+        subs.append({"endpoint": f"{base_url}/push/{i}",
+                     "keys": {"p256dh": _b64(pub), "auth": _b64(os.urandom(16))}})
+    return subs
+
+
+async def _old_send(subs, payload, private_key, db_ms):
+    """The pre-web_push.py path: query + one blocking webpush() per subscription."""
+    from app.notifications.push_notifier import _send_web_push_sync_verbose
+    await asyncio.to_thread(time.sleep, db_ms / 1000)
+    results = await asyncio.gather(*[
+        asyncio.to_thread(_send_web_push_sync_verbose, sub, payload, private_key) for sub in subs
+    ], return_exceptions=True)
+    return sum(1 for r in results if r is True)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subs", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--handshake-ms", type=float, default=60.0)
+    parser.add_argument("--db-ms", type=float, default=2.0)
+    parser.add_argument("--burst", type=int, default=5)
+    args = parser.parse_args()
+
+    from app.notifications.web_push import (
+        BurstCoalescer, COALESCE_WINDOW_S, SubscriptionRegistry, WebPushSender,
+    )
+
+    svc = FakePushService(args.latency_ms, args.handshake_ms)
+    subs = _subscriptions(args.subs, svc.url)
+    private_key = _vapid_private_key()
+    payload = {"title": "💬 Bench", "body": "hola", "type": "new_message", "phone": "56900000000"}
+    print(f"{args.subs} subscriptions, {args.messages} messages, push service "
+          f"{args.latency_ms} ms + {args.handshake_ms} ms per new connection, "
+          f"subscription query {args.db_ms} ms\n")
+
+    def report(label, times, pushes, connections, extra=""):
+        print(f"{label:<6} p50 {statistics.median(times) * 1000:7.1f} ms   "
+              f"max {max(times) * 1000:7.1f} ms   {pushes} pushes, {connections} connections{extra}")
+
+    svc.reset()
+    times = []
+    for _ in range(args.messages):
+        t0 = time.perf_counter()
+        await _old_send(subs, payload, private_key, args.db_ms)
+        times.append(time.perf_counter() - t0)
+    report("old", times, svc.requests, svc.connections, f", {svc.requests} VAPID signatures")
+
+    def load():
+        time.sleep(args.db_ms / 1000)
+        return subs
+
+    registry = SubscriptionRegistry(loader=load)
+    sender = WebPushSender(private_key)
+    svc.reset()
+    times = []
+    for _ in range(args.messages):
+        t0 = time.perf_counter()
+        await sender.send_many(await registry.get(), payload)
+        times.append(time.perf_counter() - t0)
+    report("new", times, svc.requests, svc.connections,
+           f", {sender._signer.signed} VAPID signature(s), {registry.loads} subscription load(s)")
+
+    # A burst from one customer: old sends every message, new coalesces.
+    svc.reset()
+    for _ in range(args.burst):
+        await _old_send(subs, payload, private_key, args.db_ms)
+    old_pushes = svc.requests
+
+    svc.reset()
+    delivered = []
+
+    async def deliver(phone, messages):
+        delivered.append(len(messages))
+        await sender.send_many(await registry.get(), {**payload, "body": f"{len(messages)} mensajes nuevos"})
+
+    coalescer = BurstCoalescer(deliver)
+    for _ in range(args.burst):
+        coalescer.add("56900000000", {"preview": "hola"})
+        await asyncio.sleep(COALESCE_WINDOW_S / (args.burst * 2))
+    await asyncio.sleep(COALESCE_WINDOW_S)
+    print(f"\nburst of {args.burst} messages in {COALESCE_WINDOW_S:.0f} s: old {old_pushes} pushes, "
+          f"new {svc.requests} pushes ({len(delivered)} notification(s) carrying {sum(delivered)} message(s))")
+
+    await sender.aclose()
+    svc.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
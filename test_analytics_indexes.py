@@ -0,0 +1,204 @@
+"""
+Analytics index test — the admin analytics queries (app/booking/admin_analytics.py)
+must stay answerable from the index pack of migration 0107.
+
+EXPLAINs the exact SQL each endpoint runs, with sequential scans disabled
+for the transaction. On a small database the planner would otherwise
+happily seq-scan everything, and that would hide the regression this
+guards against. A predicate the index can't serve (EXTRACT(YEAR FROM
+fecha), a function around recorded_at, a view that groups every event)
+gets no Index Cond even then: the plan reads the table, or a whole index
+end to end. So the checks look for the index being searched, not just
+named in the plan.
+
+  1. /stats — range on fecha through idx_aa_fecha_cover, no other read of
+     all_appointments.
+  2. /reservas — a date range through idx_aa_fecha_cover; a search through
+     the trigram indexes.
+  3. /clients — grouping off idx_aa_telefono_cover; a search through the
+     trigram indexes.
+  4. /analytics/funnel — sessions by idx_bvss_first_seen, no scan of the
+     visitor events outside an index.
+  5. /analytics/activity — newest events off the recorded_at index,
+     read backwards.
+  6. Per-day active bookings — idx_aa_active_fecha.
+
+The trigram checks are skipped, with a note, where pg_trgm isn't
+installed. Needs DATABASE_URL (migrations are applied first). Read-only:
+nothing is written, so it is safe against a live database.
+
+Usage:
+    python test_analytics_indexes.py
+Exit code is 0 if every check passed, 1 otherwise.
+"""
+import io
+import os
+import sys
+import traceback
+from datetime import date
+
+from dotenv import load_dotenv
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+load_dotenv()
+if not os.getenv("DATABASE_URL"):
+    print("❌ DATABASE_URL not set (check .env)")
+    sys.exit(1)
+
+from app.booking import admin_analytics as aa  # noqa: E402
+from app.db.connection import get_connection  # noqa: E402
+from app.db.migrate import migrate_to_head  # noqa: E402
+
+TRIGRAM_INDEXES = {"idx_aa_nombre_trgm", "idx_aa_telefono_trgm", "idx_aa_email_trgm"}
+
+results = []
+
+
+def check(name: str, ok: bool, detail: str = ""):
+    results.append((name, ok, detail))
+    mark = "✅" if ok else "❌"
+    print(f"{mark} {name}" + (f" — {detail}" if detail else ""))
+
+
+def skip(name: str, why: str):
+    print(f"⏭️  {name} — skipped: {why}")
+
+
+def plan_nodes(sql: str, params) -> list:
+    """Every node of the plan, flattened, with seq scans disabled."""
+    with get_connection() as conn:
+        try:
+            conn.execute("SET LOCAL enable_seqscan = off")
+            (plan,) = conn.execute("EXPLAIN (FORMAT JSON) " + sql, params).fetchone()
+        finally:
+            conn.rollback()
+    nodes, stack = [], [plan[0]["Plan"]]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.get("Plans", ()))
+    return nodes
+
+
+def seq_scans(nodes: list, *tables: str) -> list:
+    return [n["Relation Name"] for n in nodes
+            if n["Node Type"] == "Seq Scan" and n.get("Relation Name", "").startswith(tables)]
+
+
+def indexes_used(nodes: list) -> set:
+    return {n["Index Name"] for n in nodes if "Index Name" in n}
+
+
+def index_searches(nodes: list) -> set:
+    """Indexes searched with a condition, as opposed to read end to end
+    (which enable_seqscan = off also produces for an unusable predicate)."""
+    return {n["Index Name"] for n in nodes if "Index Name" in n and "Index Cond" in n}
+
+
+def _describe(nodes: list) -> str:
+    return ", ".join(sorted(indexes_used(nodes))) or "no index"
+
+
+def has_trigram() -> bool:
+    with get_connection() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM pg_indexes WHERE indexname = ANY(%s)", (list(TRIGRAM_INDEXES),)
+        ).fetchone()[0] == len(TRIGRAM_INDEXES)
+
+
+def test_stats():
+    nodes = plan_nodes(aa.STATS_QUERY, (date(2026, 1, 1), date(2027, 1, 1)))
+    check("stats: range scan on idx_aa_fecha_cover",
+          "idx_aa_fecha_cover" in index_searches(nodes) and not seq_scans(nodes, "all_appointments"),
+          _describe(nodes))
+
+
+def test_reservas(trigram: bool):
+    sql, params = aa.reservas_query(desde="2026-01-01", hasta="2026-12-31")
+    nodes = plan_nodes(sql, params + [2000])
+    check("reservas: date range on idx_aa_fecha_cover",
+          "idx_aa_fecha_cover" in index_searches(nodes) and not seq_scans(nodes, "all_appointments"),
+          _describe(nodes))
+
+    if not trigram:
+        skip("reservas: search on trigram indexes", "pg_trgm indexes not installed")
+        return
+    sql, params = aa.reservas_query(search="gonzalez")
+    nodes = plan_nodes(sql, params + [500])
+    check("reservas: search on trigram indexes",
+          TRIGRAM_INDEXES <= index_searches(nodes) and not seq_scans(nodes, "all_appointments"),
+          _describe(nodes))
+
+
+def test_clients(trigram: bool):
+    sql, params = aa.clients_query()
+    nodes = plan_nodes(sql, params + [200])
+    check("clients: grouped off idx_aa_telefono_cover",
+          "idx_aa_telefono_cover" in indexes_used(nodes) and not seq_scans(nodes, "all_appointments"),
+          _describe(nodes))
+
+    if not trigram:
+        skip("clients: search on trigram indexes", "pg_trgm indexes not installed")
+        return
+    sql, params = aa.clients_query(search="56912")
+    nodes = plan_nodes(sql, params + [200])
+    check("clients: search on trigram indexes",
+          TRIGRAM_INDEXES <= index_searches(nodes) and not seq_scans(nodes, "all_appointments"),
+          _describe(nodes))
+
+
+def test_funnel():
+    nodes = plan_nodes(aa.FUNNEL_QUERY, (30,))
+    scans = seq_scans(nodes, "booking_visitor_events", "booking_visitor_session_state")
+    check("funnel: sessions by idx_bvss_first_seen, events only through indexes",
+          "idx_bvss_first_seen" in index_searches(nodes) and not scans,
+          f"{_describe(nodes)}" + (f"; seq scans: {', '.join(scans)}" if scans else ""))
+
+
+def test_activity():
+    sql, params = aa.activity_query()
+    nodes = plan_nodes(sql, [7] + params + [200])
+    backward = [n["Index Name"] for n in nodes
+                if "recorded" in n.get("Index Name", "") and "Index Cond" in n
+                and n.get("Scan Direction") == "Backward"]
+    check("activity: newest events off the recorded_at index",
+          bool(backward) and not seq_scans(nodes, "booking_visitor_events"),
+          _describe(nodes))
+
+
+def test_active_day():
+    nodes = plan_nodes(
+        "SELECT hora FROM all_appointments WHERE fecha = %s AND status NOT IN ('cancelled','rejected','solicitud')",
+        (date.today(),),
+    )
+    check("per-day active bookings: idx_aa_active_fecha",
+          "idx_aa_active_fecha" in index_searches(nodes), _describe(nodes))
+
+
+def main():
+    migrate_to_head()
+    try:
+        trigram = has_trigram()
+        test_stats()
+        test_reservas(trigram)
+        test_clients(trigram)
+        test_funnel()
+        test_activity()
+        test_active_day()
+    except Exception as e:
+        check("Unexpected error", False, str(e))
+        traceback.print_exc()
+
+    print("\n" + "=" * 60)
+    failed = [name for name, ok, _ in results if not ok]
+    if failed:
+        print(f"❌ {len(failed)}/{len(results)} check(s) failed: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"✅ All {len(results)} checks passed")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Email outbox test — app/email/outbox.py against a local fake Resend server.
+
+Starts a throwaway HTTP server on 127.0.0.1 that speaks just enough of the
+Resend API (POST /emails → {"id": ...}) and can be told to fail, points
+RESEND_API_URL at it, and drives the outbox directly:
+
+  1. Dedup — a second enqueue with the same (trigger, booking_ref) key is
+     a no-op.
+  2. Retry — a 500 from Resend leaves the row pending with backoff; once
+     due again it is delivered, both attempts carrying the same
+     Idempotency-Key and the API key as a Bearer token.
+  3. Dead letter — a 422 parks the row as 'dead' without retrying.
+  4. Status — email_delivery_status reports the test trigger's counts.
+  5. Concurrency — never more than `concurrency` requests in flight.
+
+Needs DATABASE_URL (migrations are applied first). Only rows with the test
+trigger are delivered or touched, and they are deleted again in a
+`finally` block, so it is safe to run against a live database — no real
+email is sent.
+
+Usage:
+    python test_email_outbox.py
+Exit code is 0 if every check passed, 1 otherwise.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+load_dotenv()
+if not os.getenv("DATABASE_URL"):
+    print("❌ DATABASE_URL not set (check .env)")
+    sys.exit(1)
+
+TRIGGER = "test_outbox"
+API_KEY = "re_test_outbox"
+TO = "outbox-test@example.com"
+
+
+class FakeResend:
+    """Records every request; answers with the next scripted status code
+    (200 once the script runs out)."""
+
+    def __init__(self):
+        self.requests = []
+        self.script = []
+        self.delay_s = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with fake._lock:
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                    status = fake.script.pop(0) if fake.script else 200
+                    fake.requests.append({
+                        "path": self.path,
+                        "auth": self.headers.get("Authorization"),
+                        "idempotency_key": self.headers.get("Idempotency-Key"),
+                        "body": json.loads(body or b"{}"),
+                        "status": status,
+                    })
+                time.sleep(fake.delay_s)
+                out = {"id": str(uuid.uuid4())} if status < 300 else {"message": f"fake error {status}"}
+                data = json.dumps(out).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                with fake._lock:
+                    fake.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reset(self, script=(), delay_s=0.0):
+        self.requests, self.script, self.delay_s = [], list(script), delay_s
+        self.max_in_flight = 0
+
+
+fake = FakeResend()
+# Settings() is cached on first use — configure it before any app import.
+os.environ["RESEND_API_URL"] = fake.url
+os.environ["RESEND_API_KEY"] = API_KEY
+
+from app.db.connection import get_connection  # noqa: E402
+from app.db.migrate import migrate_to_head  # noqa: E402
+from app.email import outbox  # noqa: E402
+
+results = []
+
+
+def check(name: str, ok: bool, detail: str = ""):
+    results.append((name, ok, detail))
+    mark = "✅" if ok else "❌"
+    print(f"{mark} {name}" + (f" — {detail}" if detail else ""))
+
+
+def _row(outbox_id: int) -> dict:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT status, attempts, last_error, provider_id, next_attempt_at > NOW() "
+                "FROM email_outbox WHERE id=%s",
+                (outbox_id,),
+            )
+            status, attempts, error, provider_id, backing_off = cur.fetchone()
+    return {"status": status, "attempts": attempts, "error": error,
+            "provider_id": provider_id, "backing_off": backing_off}
+
+
+def _make_due(outbox_id: int) -> None:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE email_outbox SET next_attempt_at = NOW() WHERE id=%s", (outbox_id,))
+        conn.commit()
+
+
+def _deliver(concurrency=None) -> int:
+    return asyncio.run(outbox.deliver_due(concurrency=concurrency, triggers=[TRIGGER]))
+
+
+def _enqueue(ref: str, dedup: bool = True):
+    return outbox.enqueue_email(
+        TRIGGER, TO, f"Outbox test {ref}", f"<p>{ref}</p>", "test@example.com",
+        booking_ref=ref, dedup_key=outbox.dedup_key(TRIGGER, ref) if dedup else None,
+    )
+
+
+def test_dedup_and_retry():
+    ref = f"TEST-{uuid.uuid4().hex[:8]}"
+    first = _enqueue(ref)
+    second = _enqueue(ref)
+    check("Dedup: first enqueue returns an id", isinstance(first, int), str(first))
+    check("Dedup: same (trigger, booking_ref) is not queued twice", second is None, str(second))
+
+    fake.reset(script=[500])
+    _deliver()
+    row = _row(first)
+    check("Retry: 500 leaves the row pending with backoff",
+          row["status"] == "pending" and row["attempts"] == 1 and row["backing_off"],
+          f"{row['status']} attempts={row['attempts']} error={(row['error'] or '')[:60]}")
+
+    _deliver()
+    check("Retry: not re-sent before the backoff expires", len(fake.requests) == 1,
+          f"{len(fake.requests)} request(s)")
+
+    _make_due(first)
+    _deliver()
+    row = _row(first)
+    check("Retry: delivered on the next attempt",
+          row["status"] == "sent" and row["attempts"] == 2 and bool(row["provider_id"]),
+          f"{row['status']} attempts={row['attempts']}")
+    keys = {r["idempotency_key"] for r in fake.requests}
+    check("Retry: both attempts share one Idempotency-Key", keys == {f"outbox-{first}"}, str(keys))
+    check("Request: Bearer API key and /emails path",
+          all(r["auth"] == f"Bearer {API_KEY}" and r["path"] == "/emails" for r in fake.requests))
+    check("Request: payload has to/subject/html",
+          fake.requests[-1]["body"].get("to") == [TO] and "html" in fake.requests[-1]["body"])
+
+
+def test_dead_letter():
+    ref = f"TEST-{uuid.uuid4().hex[:8]}"
+    oid = _enqueue(ref)
+    fake.reset(script=[422])
+    _deliver()
+    row = _row(oid)
+    check("Dead letter: 422 is not retried", row["status"] == "dead" and row["attempts"] == 1,
+          f"{row['status']} attempts={row['attempts']}")
+
+
+def test_status_view():
+    status = {r["trigger"]: r for r in outbox.delivery_status()}.get(TRIGGER) or {}
+    check("Status: per-trigger counts", status.get("sent") == 1 and status.get("dead") == 1,
+          f"sent={status.get('sent')} dead={status.get('dead')}")
+
+
+def test_concurrency():
+    for _ in range(8):
+        _enqueue(f"TEST-{uuid.uuid4().hex[:8]}", dedup=False)
+    fake.reset(delay_s=0.2)
+    sent = _deliver(concurrency=3)
+    check("Concurrency: all 8 delivered", sent == 8 and len(fake.requests) == 8, f"{len(fake.requests)} request(s)")
+    check("Concurrency: at most 3 in flight", 1 < fake.max_in_flight <= 3, f"max {fake.max_in_flight}")
+
+
+def cleanup():
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM email_outbox WHERE trigger=%s", (TRIGGER,))
+            conn.commit()
+    except Exception as e:
+        print(f"⚠️  cleanup failed: {e}")
+
+
+def main():
+    migrate_to_head()
+    cleanup()
+    try:
+        test_dedup_and_retry()
+        test_dead_letter()
+        test_status_view()
+        test_concurrency()
+    except Exception as e:
+        check("Unexpected error", False, str(e))
+        traceback.print_exc()
+    finally:
+        cleanup()
+        fake.server.shutdown()
+
+    print("\n" + "=" * 60)
+    failed = [name for name, ok, _ in results if not ok]
+    if failed:
+        print(f"❌ {len(failed)}/{len(results)} check(s) failed: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"✅ All {len(results)} checks passed")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Export memory test — streamed CSV / XLSX exports (app/booking/tabular_export.py)
+must run in constant memory however many rows they carry.
+
+Seeds --rows WhatsApp messages (500,000 by default, generated inside
+Postgres so the test itself holds none of them) dated in 1990, then drains
+GET /api/admin/export/conversations for that range through the endpoint's
+StreamingResponse, sampling this process's RSS after every chunk:
+
+  1. CSV, gzip-encoded — every row arrives (header + one line per message)
+     and RSS never grows by more than --max-growth-mb, while the
+     uncompressed body is many times that (a fetchall() of the same rows
+     alone would be several hundred MB).
+  2. XLSX — written to a temp file; a valid workbook whose sheet has the
+     header plus every row, again with RSS flat.
+  3. Reservations — fields= picks and orders the CSV columns (id, fecha,
+     hora always included); an unknown field is a 400.
+
+Needs DATABASE_URL (migrations are applied first). The seeded messages
+carry the phone prefix 000EXP and are deleted in a `finally` block.
+
+Usage:
+    python test_export_memory.py [--rows 500000] [--max-growth-mb 48]
+Exit code is 0 if every check passed, 1 otherwise.
+"""
+import argparse
+import asyncio
+import io
+import os
+import resource
+import sys
+import tempfile
+import traceback
+import zipfile
+import zlib
+from xml.etree.ElementTree import iterparse
+
+from dotenv import load_dotenv
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+load_dotenv()
+if not os.getenv("DATABASE_URL"):
+    print("❌ DATABASE_URL not set (check .env)")
+    sys.exit(1)
+
+from fastapi import HTTPException  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+from app.booking import export_router as er  # noqa: E402
+from app.db.connection import get_connection  # noqa: E402
+from app.db.migrate import migrate_to_head  # noqa: E402
+
+PHONE_PREFIX = "000EXP"
+RANGE = dict(desde="1990-01-01", hasta="1990-12-31")
+
+results = []
+
+
+def check(name: str, ok: bool, detail: str = ""):
+    results.append((name, ok, detail))
+    mark = "✅" if ok else "❌"
+    print(f"{mark} {name}" + (f" — {detail}" if detail else ""))
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed(rows: int) -> None:
+    with get_connection() as conn:
+        conn.execute("""
+            INSERT INTO whatsapp_conversations
+                (phone_number, customer_name, message_text, response_text, message_type, direction, created_at)
+            SELECT %s || lpad((i %% 5000)::text, 5, '0'),
+                   'Cliente Export ' || (i %% 5000),
+                   'Hola, quería consultar disponibilidad para el sábado, somos ' || (i %% 7 + 2)
+                       || ' personas. ¿Tienen horario a las 15:00? ' || repeat('ñ', i %% 40),
+                   CASE WHEN i %% 2 = 0 THEN 'Claro, tenemos cupos a las 15:00 y 17:30 — "reserva" <aquí>' END,
+                   'text',
+                   CASE WHEN i %% 2 = 0 THEN 'outbound' ELSE 'inbound' END,
+                   TIMESTAMP '1990-01-01' + i * INTERVAL '1 second'
+            FROM generate_series(1, %s) AS i
+        """, (PHONE_PREFIX, rows))
+        conn.commit()
+
+
+def cleanup() -> None:
+    with get_connection() as conn:
+        conn.execute("DELETE FROM whatsapp_conversations WHERE phone_number LIKE %s", (PHONE_PREFIX + "%",))
+        conn.commit()
+
+
+def request(accept_encoding: str = "") -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"",
+                    "headers": [(b"accept-encoding", accept_encoding.encode())]})
+
+
+def drain(response, sink) -> tuple:
+    """Feed every body chunk to sink(); returns (bytes, peak RSS growth in
+    MB over the whole download, query included)."""
+    async def run():
+        total, base = 0, rss_mb()
+        peak = base
+        async for chunk in response.body_iterator:
+            sink(chunk)
+            total += len(chunk)
+            peak = max(peak, rss_mb())
+        return total, peak - base
+    return asyncio.run(run())
+
+
+def export_conversations(fmt: str, accept_encoding: str = ""):
+    return asyncio.run(er.export_conversations(request(accept_encoding), fmt=fmt, phone=None,
+                                               x_admin_key="", **RANGE))
+
+
+def test_csv(rows: int, max_growth: float):
+    resp = export_conversations("csv", accept_encoding="gzip, deflate")
+    check("csv: gzip-encoded when accepted", resp.headers.get("content-encoding") == "gzip",
+          resp.headers.get("content-encoding", "no Content-Encoding"))
+
+    unzip = zlib.decompressobj(31)
+    counts = {"lines": 0, "plain": 0}
+    head = bytearray()
+
+    def sink(chunk):
+        data = unzip.decompress(chunk)
+        counts["lines"] += data.count(b"\n")
+        counts["plain"] += len(data)
+        if len(head) < 200:
+            head.extend(data[:200])
+
+    sent, growth = drain(resp, sink)
+    header = bytes(head).decode("utf-8").lstrip("\ufeff").splitlines()[0]
+    check("csv: header + every row", counts["lines"] == rows + 1 and header == ",".join(er.CONVERSATION_COLUMNS),
+          f"{counts['lines']:,} lines for {rows:,} rows")
+    check(f"csv: RSS growth under {max_growth:.0f} MB", growth < max_growth,
+          f"+{growth:.1f} MB while streaming {counts['plain'] / 2**20:.0f} MB "
+          f"({sent / 2**20:.0f} MB gzipped)")
+
+
+def test_xlsx(rows: int, max_growth: float):
+    resp = export_conversations("xlsx", accept_encoding="gzip")
+    check("xlsx: not gzipped again", "content-encoding" not in resp.headers)
+    with tempfile.TemporaryFile() as f:
+        size, growth = drain(resp, f.write)
+        check(f"xlsx: RSS growth under {max_growth:.0f} MB", growth < max_growth,
+              f"+{growth:.1f} MB while streaming {size / 2**20:.0f} MB")
+        f.seek(0)
+        with zipfile.ZipFile(f) as zf:
+            names = set(zf.namelist())
+            parts = {"[Content_Types].xml", "_rels/.rels", "xl/workbook.xml",
+                     "xl/_rels/workbook.xml.rels", "xl/worksheets/sheet1.xml"}
+            n = 0
+            with zf.open("xl/worksheets/sheet1.xml") as sheet:
+                for _, el in iterparse(sheet):
+                    if el.tag.endswith("}row"):
+                        n += 1
+                        el.clear()
+    check("xlsx: workbook parts present", parts <= names, ", ".join(sorted(parts - names)) or "")
+    check("xlsx: header + every row", n == rows + 1, f"{n:,} rows for {rows:,}")
+
+
+def test_reservas_fields():
+    resp = asyncio.run(er.export_reservas(
+        request(), fmt="csv", desde=None, hasta=None, status=None, search=None,
+        source="__export_test__", fields="telefono,nombre_cliente", x_admin_key=""))
+    body = bytearray()
+    drain(resp, body.extend)
+    header = bytes(body).decode("utf-8").lstrip("\ufeff").strip()
+    check("reservas: fields= picks and orders the columns", header == "id,fecha,hora,nombre_cliente,telefono",
+          header)
+    try:
+        asyncio.run(er.export_reservas(
+            request(), fmt="csv", desde=None, hasta=None, status=None, search=None,
+            source=None, fields="nope", x_admin_key=""))
+        check("reservas: unknown field is a 400", False, "no error")
+    except HTTPException as e:
+        check("reservas: unknown field is a 400", e.status_code == 400, e.detail)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--max-growth-mb", type=float, default=48)
+    args = parser.parse_args()
+
+    migrate_to_head()
+    cleanup()
+    try:
+        seed(args.rows)
+        test_csv(args.rows, args.max_growth_mb)
+        test_xlsx(args.rows, args.max_growth_mb)
+        test_reservas_fields()
+    except Exception as e:
+        check("Unexpected error", False, str(e))
+        traceback.print_exc()
+    finally:
+        cleanup()
+
+    print("\n" + "=" * 60)
+    failed = [name for name, ok, _ in results if not ok]
+    if failed:
+        print(f"❌ {len(failed)}/{len(results)} check(s) failed: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"✅ All {len(results)} checks passed")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Loop diagnostics test — the blocking detector and the sampling profiler
+(app/diagnostics.py). No database needed.
+
+  1. A coroutine that blocks the loop (time.sleep inside async code) is
+     reported once per stall, under its own call site, with its stack and
+     a duration close to the real one.
+  2. Plain awaits, and blocking shorter than the threshold, are not.
+  3. Switching the detector off stops the heartbeat and the watchdog.
+  4. profile() on a thread busy in a known function finds it in most
+     samples; folded output and the SVG flame graph are well formed.
+
+Usage:
+    python test_loop_diagnostics.py
+Exit code is 0 if every check passed, 1 otherwise.
+"""
+import asyncio
+import io
+import sys
+import threading
+import time
+import traceback
+from xml.etree import ElementTree
+
+if sys.stdout.encoding is None or sys.stdout.encoding.lower() != "utf-8":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+from app import diagnostics  # noqa: E402
+
+results = []
+
+
+def check(name: str, ok: bool, detail: str = ""):
+    results.append((name, ok, detail))
+    mark = "✅" if ok else "❌"
+    print(f"{mark} {name}" + (f" — {detail}" if detail else ""))
+
+
+async def blocking_handler(seconds: float):
+    time.sleep(seconds)  # the kind of call the detector is for
+
+
+async def polite_handler(seconds: float):
+    await asyncio.sleep(seconds)
+
+
+async def test_detector():
+    d = diagnostics.BlockingDetector()
+    d.configure(True, threshold_ms=50)
+    await asyncio.sleep(0.1)
+
+    await polite_handler(0.3)
+    await blocking_handler(0.02)       # under the threshold
+    await asyncio.sleep(0.1)
+    r = d.report()
+    check("no stalls from awaits or short blocking", r["stalls"] == 0, f"{r['stalls']} stalls")
+
+    for _ in range(3):
+        await asyncio.create_task(blocking_handler(0.25), name="slow-handler")
+        await asyncio.sleep(0.05)
+    r = d.report()
+    site = r["sites"][0] if r["sites"] else {}
+    check("each stall counted once", r["stalls"] == 3, f"{r['stalls']} stalls")
+    check("call site is the blocking coroutine",
+          "test_loop_diagnostics.py" in site.get("site", "") and "blocking_handler" in site.get("site", ""),
+          site.get("site", "no sites"))
+    check("stack and task captured",
+          any("blocking_handler" in f for f in site.get("stack", [])) and site.get("task") == "slow-handler",
+          f"task={site.get('task')!r}, {len(site.get('stack', []))} frames")
+    check("duration close to the real one", 200 <= site.get("max_ms", 0) <= 400, f"max {site.get('max_ms')} ms")
+    check("lag percentiles reported", r["lag_ms"]["samples"] > 0 and r["lag_ms"]["max"] >= 200, str(r["lag_ms"]))
+
+    watchdog = d._watchdog
+    d.configure(False)
+    await asyncio.sleep(0.1)
+    check("off stops heartbeat and watchdog",
+          not d.enabled and d._heartbeat_task is None and watchdog is not None and not watchdog.is_alive())
+    await blocking_handler(0.2)
+    await asyncio.sleep(0.05)
+    check("no stalls recorded while off", d.report()["stalls"] == 3)
+
+    d.reset()
+    check("reset clears the report", d.report()["stalls"] == 0)
+
+
+def busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+def test_profiler():
+    stop = threading.Event()
+    t = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    t.start()
+    try:
+        samples = diagnostics.profile(1.0, interval=0.005, thread_id=t.ident)
+    finally:
+        stop.set()
+        t.join()
+    total = sum(samples.values())
+    hits = sum(n for stack, n in samples.items() if any(f.endswith(":busy_loop") for f in stack))
+    check("profiler finds the busy function", total > 20 and hits / total > 0.9, f"{hits}/{total} samples")
+
+    folded = diagnostics.folded(samples)
+    lines = folded.splitlines()
+    check("folded stacks: 'a;b;c count' per line",
+          lines and all(l.rsplit(" ", 1)[1].isdigit() for l in lines)
+          and sum(int(l.rsplit(" ", 1)[1]) for l in lines) == total, f"{len(lines)} stacks")
+
+    svg = diagnostics.flamegraph_svg(samples, "busy <thread>")
+    try:
+        root = ElementTree.fromstring(svg)
+        titles = [el.text for el in root.iter("{http://www.w3.org/2000/svg}title")]
+        check("flame graph is valid SVG with a box per frame",
+              any(t and "busy_loop" in t for t in titles), f"{len(titles)} boxes")
+    except ElementTree.ParseError as e:
+        check("flame graph is valid SVG with a box per frame", False, str(e))
+
+    stop = threading.Event()
+    t = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    t.start()
+    try:
+        all_threads = diagnostics.profile(0.2, interval=0.01)
+    finally:
+        stop.set()
+        t.join()
+    check("all-threads profile is keyed by thread",
+          all_threads and all(stack[0].startswith("thread:") for stack in all_threads)
+          and any(stack[0] == "thread:busy" for stack in all_threads),
+          ", ".join(sorted({stack[0] for stack in all_threads})))
+
+
+def test_single_profile():
+    t = threading.Thread(target=diagnostics.profile, args=(0.5,))
+    t.start()
+    time.sleep(0.1)
+    try:
+        diagnostics.profile(0.1)
+        check("second concurrent profile refused", False, "no error")
+    except RuntimeError:
+        check("second concurrent profile refused", True)
+    t.join()
+
+
+def main():
+    try:
+        asyncio.run(test_detector())
+        test_profiler()
+        test_single_profile()
+    except Exception as e:
+        check("Unexpected error", False, str(e))
+        traceback.print_exc()
+
+    print("\n" + "=" * 60)
+    failed = [name for name, ok, _ in results if not ok]
+    if failed:
+        print(f"❌ {len(failed)}/{len(results)} check(s) failed: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"✅ All {len(results)} checks passed")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()